@@ -1,25 +1,113 @@
 """Labelling Programs backend API service."""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from config import UPLOAD_DIR
 
 
+@asynccontextmanager
+async def app_lifespan(app):
+    from services.bulk_jobs import resume_bulk_jobs, stop_bulk_jobs
+    from services.utils.endpoints import start_endpoint_health_checks, stop_endpoint_health_checks
+    from services.utils.residency import model_residency
+    from services.utils.upstream import close_upstream_clients
+    from utils.documents import document_rasterizer
+    from utils.image_preprocess import image_preprocessor
+    from utils.metrics import start_event_loop_monitor, start_metrics_sync, stop_event_loop_monitor, stop_metrics_sync
+    from utils.ocr_result_files import raw_response_archive
+    from utils.result_store import labeling_result_store
+    from utils.template_index import keyvalue_template_index
+
+    await resume_bulk_jobs()
+    start_endpoint_health_checks()
+    start_event_loop_monitor()
+    start_metrics_sync()
+    yield
+    await stop_bulk_jobs()
+    await stop_endpoint_health_checks()
+    await stop_event_loop_monitor()
+    await stop_metrics_sync()
+    await model_residency.release_all()
+    await close_upstream_clients()
+    image_preprocessor.close()
+    document_rasterizer.close()
+    raw_response_archive.close()
+    labeling_result_store.close()
+    keyvalue_template_index.close()
+
+
 def create_app():
     app = FastAPI(
         title='Labelling Programs API',
         description='Backend APIs for OCR and layout labeling workflows.',
-        version='0.1.0'
+        version='0.1.0',
+        lifespan=app_lifespan
     )
 
     UPLOAD_DIR.mkdir(exist_ok=True)
 
+    from utils.metrics import MetricsMiddleware
+    from utils.request_deadline import RequestCancellationMiddleware
+
+    # 나중에 추가한 middleware가 바깥에서 돌므로, metrics는 끊긴 요청의 단계 시간까지 기록한다.
+    app.add_middleware(RequestCancellationMiddleware)
+    app.add_middleware(MetricsMiddleware)
+
+    from services.utils.admission import AdmissionRejectedError
+    from services.utils.upstream import UpstreamConnectionError, UpstreamDeadlineError
+    from utils.documents import DocumentError
+    from utils.image_probe import ImageProbeError
+    from utils.responses import json_response
+    from utils.uploads import UploadRejectedError
+
+    @app.exception_handler(ImageProbeError)
+    async def image_probe_error_handler(request, error):
+        return json_response({'success': False, 'error': str(error)}, status_code=error.status_code)
+
+    @app.exception_handler(UploadRejectedError)
+    async def upload_rejected_error_handler(request, error):
+        return json_response({'success': False, 'error': str(error)}, status_code=error.status_code)
+
+    @app.exception_handler(DocumentError)
+    async def document_error_handler(request, error):
+        return json_response({'success': False, 'error': str(error)}, status_code=error.status_code)
+
+    @app.exception_handler(AdmissionRejectedError)
+    async def admission_rejected_error_handler(request, error):
+        return json_response(
+            {
+                'success': False,
+                'error': str(error),
+                'retryAfter': error.retry_after,
+                'queueLength': error.queue_length
+            },
+            status_code=429,
+            headers={'Retry-After': str(error.retry_after)}
+        )
+
+    # route에서 따로 처리하지 않은 모델 연결 실패는 500 대신 error.status_code(502, deadline은 504)로 돌려준다.
+    @app.exception_handler(UpstreamDeadlineError)
+    async def upstream_deadline_error_handler(request, error):
+        return json_response({'success': False, 'error': '요청 deadline이 지났습니다.'}, status_code=error.status_code)
+
+    @app.exception_handler(UpstreamConnectionError)
+    async def upstream_connection_error_handler(request, error):
+        return json_response({'success': False, 'error': f'모델 연결 실패: {error.reason}'}, status_code=error.status_code)
+
+    from routes.analysis import analysis_router
+    from routes.documents import document_router
     from routes.keyvalue import keyvalue_router
     from routes.layout import layout_router
     from routes.ocr import ocr_router
+    from routes.results import result_router
 
     app.include_router(ocr_router)
     app.include_router(layout_router)
     app.include_router(keyvalue_router)
+    app.include_router(analysis_router)
+    app.include_router(document_router)
+    app.include_router(result_router)
 
     @app.get('/')
     def service_index():
@@ -29,11 +117,15 @@ def create_app():
             'status': 'ok',
             'docs': '/docs',
             'health': '/health',
+            'metrics': '/metrics',
             'groups': {
                 'paddle-ocr': ['/api/labeling/paddle_ocr'],
                 'deepseek-ocr': ['/api/labeling/deepseek_ocr'],
                 'layout': ['/api/labeling/layout'],
-                'keyvalue': ['/api/labeling/keyvalue']
+                'keyvalue': ['/api/labeling/keyvalue'],
+                'analysis': ['/api/labeling/analyze'],
+                'document': ['/api/labeling/document'],
+                'results': ['/api/labeling/results/search']
             }
         }
 
@@ -46,6 +138,79 @@ def create_app():
             'status': 'ok'
         }
 
+    @app.get('/metrics')
+    def metrics_status():
+        from fastapi.responses import Response
+
+        from utils.metrics import PROMETHEUS_CONTENT_TYPE, render_metrics
+
+        return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.get('/api/labeling/cache')
+    def result_cache_status():
+        from utils.result_cache import result_cache
+
+        return result_cache.read_stats()
+
+    @app.get('/api/labeling/keyvalue/templates')
+    def keyvalue_template_status():
+        from utils.template_index import keyvalue_template_index
+
+        return keyvalue_template_index.read_stats()
+
+    @app.get('/api/labeling/residency')
+    def model_residency_status():
+        from services.utils.residency import model_residency
+
+        return model_residency.read_stats()
+
+    @app.get('/api/labeling/batching')
+    def micro_batch_status():
+        from services.utils.batching import read_micro_batch_stats
+
+        return read_micro_batch_stats()
+
+    @app.get('/api/labeling/admission')
+    def admission_status():
+        from services.utils.admission import read_admission_stats
+
+        return read_admission_stats()
+
+    @app.get('/api/labeling/endpoints')
+    def endpoint_pool_status():
+        from services.utils.endpoints import read_endpoint_pool_stats
+
+        return read_endpoint_pool_stats()
+
+    @app.get('/api/labeling/preprocess')
+    def image_preprocess_status():
+        from utils.image_preprocess import image_preprocessor
+
+        return image_preprocessor.read_stats()
+
+    @app.get('/api/labeling/document/render')
+    def document_render_status():
+        from utils.documents import document_rasterizer
+
+        return document_rasterizer.read_stats()
+
+    @app.get('/api/labeling/transport')
+    def upstream_transport_status():
+        from services.utils.transport import read_upstream_transport_stats
+
+        return read_upstream_transport_stats()
+
+    @app.get('/api/labeling/workers')
+    def shared_state_status():
+        import os
+
+        from utils.shared_state import shared_state
+
+        # 다른 stats는 요청을 받은 worker 하나의 값이고, 이 값만 worker 전체가 함께 쓰는 상태다.
+        if shared_state is None:
+            return {'enabled': False, 'pid': os.getpid()}
+        return shared_state.read_stats()
+
     return app
 
 
@@ -0,0 +1 @@
+"""Local stand-in model servers and benchmarks for the labeling gateway."""
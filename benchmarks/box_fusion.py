@@ -0,0 +1,173 @@
+"""Compare the grid-indexed box fusion against the client-side O(n*m) overlap loops.
+
+Builds dense synthetic pages (multi-column layout regions, OCR lines and a second
+OCR model that re-detects some of the same lines), checks that region assignment and
+cross-model deduplication match the naive loops, then times both:
+
+    python -m benchmarks.box_fusion
+    python -m benchmarks.box_fusion --lines 2000,10000 --regions 120 --naive-limit 5000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from utils.box_fusion import (
+    assign_boxes_to_regions,
+    compute_box_areas,
+    fuse_labeling_boxes,
+    suppress_duplicate_boxes,
+)
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+
+
+def build_page(line_count, region_count, duplicate_share, seed):
+    page_random = random.Random(seed)
+    columns = 2 if region_count > 1 else 1
+    rows = max(1, region_count // columns)
+    region_width = PAGE_WIDTH / columns
+    region_height = PAGE_HEIGHT / rows
+    region_boxes = []
+    for region_index in range(rows * columns):
+        left = (region_index % columns) * region_width + 10
+        top = (region_index // columns) * region_height + 10
+        region_boxes.append({
+            'id': f'layout-{region_index + 1}',
+            'type': 'plain text',
+            'bbox': [left, top, left + region_width - 20, top + region_height - 20]
+        })
+
+    line_boxes = []
+    lines_per_region = max(1, line_count // len(region_boxes))
+    line_height = max(2.0, (region_height - 40) / lines_per_region)
+    for line_index in range(line_count):
+        region_bbox = region_boxes[(line_index // lines_per_region) % len(region_boxes)]['bbox']
+        top = region_bbox[1] + 10 + (line_index % lines_per_region) * line_height
+        left = region_bbox[0] + page_random.uniform(0, 40)
+        right = region_bbox[2] - page_random.uniform(0, region_width / 2)
+        line_boxes.append({
+            'id': f'paddle-{line_index + 1}',
+            'type': 'text',
+            'confidence': round(page_random.uniform(0.6, 1.0), 3),
+            'bbox': [left, top, right, top + line_height * 0.8]
+        })
+
+    second_boxes = []
+    for line_box in page_random.sample(line_boxes, int(line_count * duplicate_share)):
+        x1, y1, x2, y2 = line_box['bbox']
+        shift = page_random.uniform(-2, 2)
+        second_boxes.append({
+            'id': f'deepseek-{len(second_boxes) + 1}',
+            'type': 'text',
+            'confidence': 1.0,
+            'bbox': [x1 + shift, y1 + shift, x2 + shift, y2 + shift]
+        })
+
+    return region_boxes, line_boxes, second_boxes
+
+
+def naive_assign(line_boxes, region_boxes, min_coverage):
+    # 프론트엔드가 하던 방식: 글자 줄마다 모든 region과 겹침을 계산한다.
+    assigned = []
+    for line_box in line_boxes:
+        lx1, ly1, lx2, ly2 = line_box['bbox']
+        line_area = (lx2 - lx1) * (ly2 - ly1)
+        best = (-1.0, 0.0, -1)
+        for region_index, region_box in enumerate(region_boxes):
+            rx1, ry1, rx2, ry2 = region_box['bbox']
+            overlap = max(0.0, min(lx2, rx2) - max(lx1, rx1)) * max(0.0, min(ly2, ry2) - max(ly1, ry1))
+            coverage = overlap / line_area if line_area > 0 else 0.0
+            region_area = (rx2 - rx1) * (ry2 - ry1)
+            if coverage > best[0] or (coverage == best[0] and region_area < best[1]):
+                best = (coverage, region_area, region_index)
+        assigned.append(best[2] if best[0] >= min_coverage and best[0] > 0 else -1)
+
+    return assigned
+
+
+def naive_duplicates(first_boxes, second_boxes, iou_threshold):
+    duplicates = set()
+    for second_index, second_box in enumerate(second_boxes):
+        sx1, sy1, sx2, sy2 = second_box['bbox']
+        for first_box in first_boxes:
+            fx1, fy1, fx2, fy2 = first_box['bbox']
+            overlap = max(0.0, min(fx2, sx2) - max(fx1, sx1)) * max(0.0, min(fy2, sy2) - max(fy1, sy1))
+            union = (fx2 - fx1) * (fy2 - fy1) + (sx2 - sx1) * (sy2 - sy1) - overlap
+            if union > 0 and overlap / union >= iou_threshold:
+                duplicates.add(second_index)
+                break
+
+    return duplicates
+
+
+def measure(function, repeat):
+    best_seconds = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = function()
+        elapsed_seconds = time.perf_counter() - started_at
+        best_seconds = elapsed_seconds if best_seconds is None else min(best_seconds, elapsed_seconds)
+
+    return result, best_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', default='1000,5000,10000', help='comma separated OCR line counts per page')
+    parser.add_argument('--regions', type=int, default=60, help='layout regions per page')
+    parser.add_argument('--duplicate-share', type=float, default=0.5, help='share of lines the second model re-detects')
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--coverage', type=float, default=0.5)
+    parser.add_argument('--naive-limit', type=int, default=5000, help='skip the naive loops above this many lines')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'lines':>7}{'regions':>9}{'naive ms':>11}{'grid ms':>10}{'speedup':>9}{'fuse ms':>10}  check")
+    for line_count in [int(line_count) for line_count in args.lines.split(',')]:
+        region_boxes, line_boxes, second_boxes = build_page(line_count, args.regions, args.duplicate_share, args.seed)
+        line_array = np.asarray([line_box['bbox'] for line_box in line_boxes])
+        second_array = np.asarray([second_box['bbox'] for second_box in second_boxes])
+        region_array = np.asarray([region_box['bbox'] for region_box in region_boxes])
+        all_array = np.concatenate([line_array, second_array])
+        source_ids = np.asarray([0] * len(line_boxes) + [1] * len(second_boxes))
+        scores = np.asarray([line_box['confidence'] for line_box in line_boxes + second_boxes])
+
+        def run_grid():
+            kept_mask, _ = suppress_duplicate_boxes(all_array, source_ids, scores, args.iou)
+            return kept_mask, assign_boxes_to_regions(line_array, region_array, args.coverage)
+
+        (kept_mask, grid_assigned), grid_seconds = measure(run_grid, args.repeat)
+        fusion_result, fuse_seconds = measure(
+            lambda: fuse_labeling_boxes(region_boxes, [('paddle_ocr', line_boxes), ('deepseek_ocr', second_boxes)], args.iou),
+            args.repeat
+        )
+        assert len(fusion_result['readingOrder']) == fusion_result['lineCount']
+
+        if line_count > args.naive_limit:
+            print(f"{line_count:>7}{len(region_boxes):>9}{'-':>11}{grid_seconds * 1000:>10.1f}{'-':>9}{fuse_seconds * 1000:>10.1f}  naive skipped")
+            continue
+
+        def run_naive():
+            return naive_duplicates(line_boxes, second_boxes, args.iou), naive_assign(line_boxes, region_boxes, args.coverage)
+
+        (naive_duplicate_set, naive_assigned), naive_seconds = measure(run_naive, 1)
+        grid_duplicate_set = set((np.flatnonzero(~kept_mask[len(line_boxes):])).tolist())
+        assignment_matches = naive_assigned == grid_assigned.tolist()
+        duplicates_match = naive_duplicate_set == grid_duplicate_set
+        if not (assignment_matches and duplicates_match):
+            raise SystemExit(f'mismatch at {line_count} lines: assignment={assignment_matches} duplicates={duplicates_match}')
+
+        print(
+            f'{line_count:>7}{len(region_boxes):>9}{naive_seconds * 1000:>11.1f}{grid_seconds * 1000:>10.1f}'
+            f'{naive_seconds / grid_seconds:>8.1f}x{fuse_seconds * 1000:>10.1f}  ok '
+            f'({len(grid_duplicate_set)} duplicates, {int(compute_box_areas(region_array).size)} regions)'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Compare the DeepSeek grounding parser against the previous regex implementation.
+
+Checks that both produce identical boxes, then times them on dense pages:
+
+    python -m benchmarks.deepseek_parser
+    python -m benchmarks.deepseek_parser --archive uploads/raw_responses --regions 400
+
+``--archive`` reads ``deepseek_ocr_*.jsonl.gz`` files written by the raw response
+archive (RAW_RESPONSE_ARCHIVE_ENABLED=true) so real responses join the corpus.
+"""
+
+import argparse
+import ast
+import gzip
+import html
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.fake_models import build_deepseek_text
+from services.deepseek_ocr import DeepSeekStreamParser, extract_deepseek_boxes, scale_deepseek_bbox
+from utils.labeling_boxes import build_labeling_boxes
+
+LEGACY_REF_DET_PATTERN = re.compile(r'<\|ref\|>(.*?)<\|/ref\|>\s*<\|det\|>(.*?)<\|/det\|>', re.DOTALL)
+LEGACY_TABLE_PATTERN = re.compile(r'<table\b.*?</table>', re.DOTALL | re.IGNORECASE)
+LEGACY_HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+FUZZ_FRAGMENTS = [
+    '<|ref|>', '<|/ref|>', '<|det|>', '<|/det|>', '<|ref|>text<|/ref|><|det|>', '<|ref|>table<|/ref|> \n<|det|>',
+    '[[40, 20, 950, 140]]', '[[1, 2, 3, 4], [5, 6, 7, 8]]', '[1.5, -2, 3e2, 4]', '(1, 2, 3, 4)', '[1, 2, 3, 4,]',
+    '[[0, 0, 999, 999]]', '[01, 2, 3, 4]', '[true, 1, 2, 3]', '[1, 2]', '[[1000, 0, 1, 1]]', '[1 2 3 4]', '',
+    '<table>', '</table>', '<TABLE border=1>', '<tr>', '</tr>', '</TR>', '<td>', '</td>', '</th>', '<br>', '<BR/>',
+    '<br />', '<p>', '<', '>', '<a ', '![img](x.png)', '![', '](', ')', '&amp;', '&lt;b&gt;', '&#39;', '&',
+    '#', '## ', '   ### ', '####### ', '\n', '\n\n\n', ' ', '   ', '\t', '\r\n', '　', '\xa0', 'text', '표 제목',
+    'Sample line', 'value', '|', '<|', '|>'
+]
+
+
+def legacy_extract_deepseek_boxes(deepseek_ocr_response, image_width, image_height):
+    generated_text = deepseek_ocr_response.get('text', '') if isinstance(deepseek_ocr_response, dict) else ''
+    deepseek_boxes = []
+    ref_matches = list(LEGACY_REF_DET_PATTERN.finditer(generated_text))
+
+    for match_index, ref_match in enumerate(ref_matches):
+        content_start = ref_matches[match_index].end()
+        content_end = ref_matches[match_index + 1].start() if match_index + 1 < len(ref_matches) else len(generated_text)
+        rec_content = generated_text[content_start:content_end].strip()
+        deepseek_boxes.extend(legacy_build_deepseek_ref_boxes(
+            ref_match,
+            rec_content,
+            image_width,
+            image_height,
+            len(deepseek_boxes)
+        ))
+
+    return deepseek_boxes
+
+
+def legacy_build_deepseek_ref_boxes(ref_match, rec_content, image_width, image_height, box_offset=0):
+    box_label = re.sub(r'\s+', ' ', str(ref_match.group(1) or '')).strip() or 'bbox'
+    coordinate_boxes = legacy_parse_deepseek_coordinate_text(ref_match.group(2))
+    rec_text = legacy_normalize_deepseek_rec_text(rec_content)
+    rec_html = ''
+    if box_label == 'table':
+        table_match = LEGACY_TABLE_PATTERN.search(rec_content or '')
+        rec_html = table_match.group(0).strip() if table_match else ''
+    deepseek_boxes = []
+
+    for coordinate_box in coordinate_boxes:
+        pixel_bbox = scale_deepseek_bbox(coordinate_box, image_width, image_height)
+        if not pixel_bbox:
+            continue
+
+        deepseek_box = {
+            'id': f"deepseek-{box_offset + len(deepseek_boxes) + 1}",
+            'type': box_label,
+            'text': rec_text,
+            'confidence': 1.0,
+            'bbox': pixel_bbox
+        }
+
+        if rec_html:
+            deepseek_box['html'] = rec_html
+
+        deepseek_boxes.append(deepseek_box)
+
+    return deepseek_boxes
+
+
+def legacy_normalize_deepseek_rec_text(rec_content):
+    rec_text = str(rec_content or '').strip()
+    if not rec_text:
+        return ''
+
+    rec_text = re.sub(r'!\[[^\]]*\]\([^)]+\)', ' ', rec_text)
+    rec_text = re.sub(r'<br\s*/?>', '\n', rec_text, flags=re.IGNORECASE)
+    rec_text = re.sub(r'</(td|th)>', ' ', rec_text, flags=re.IGNORECASE)
+    rec_text = re.sub(r'</tr>', '\n', rec_text, flags=re.IGNORECASE)
+    rec_text = LEGACY_HTML_TAG_PATTERN.sub(' ', rec_text)
+    rec_text = html.unescape(rec_text)
+    rec_text = re.sub(r'^\s{0,3}#{1,6}\s*', '', rec_text, flags=re.MULTILINE)
+    rec_text = re.sub(r'[ \t]+', ' ', rec_text)
+    rec_text = re.sub(r'\n\s+', '\n', rec_text)
+    rec_text = re.sub(r'\n{3,}', '\n\n', rec_text)
+    return rec_text.strip()
+
+
+def legacy_parse_deepseek_coordinate_text(coordinate_text):
+    try:
+        coordinates = ast.literal_eval(coordinate_text.strip())
+    except (SyntaxError, ValueError):
+        return []
+
+    return legacy_flatten_coordinate_boxes(coordinates)
+
+
+def legacy_flatten_coordinate_boxes(coordinates):
+    if (
+        isinstance(coordinates, (list, tuple))
+        and len(coordinates) == 4
+        and all(isinstance(coordinate, (int, float)) for coordinate in coordinates)
+    ):
+        return [coordinates]
+
+    if not isinstance(coordinates, (list, tuple)):
+        return []
+
+    coordinate_boxes = []
+    for coordinate_group in coordinates:
+        coordinate_boxes.extend(legacy_flatten_coordinate_boxes(coordinate_group))
+
+    return coordinate_boxes
+
+
+def legacy_stream_boxes(text_deltas, image_width, image_height):
+    generated_text = ''
+    scan_position = 0
+    pending_match = None
+    box_count = 0
+    stream_boxes = []
+
+    def close_pending_match(ref_match, content_end):
+        nonlocal box_count
+        rec_content = generated_text[ref_match.end():content_end].strip()
+        deepseek_boxes = legacy_build_deepseek_ref_boxes(ref_match, rec_content, image_width, image_height, box_count)
+        box_count += len(deepseek_boxes)
+        return build_labeling_boxes(deepseek_boxes, image_width, image_height, 'deepseek')
+
+    for text_delta in text_deltas:
+        generated_text += text_delta
+        for ref_match in LEGACY_REF_DET_PATTERN.finditer(generated_text, scan_position):
+            if pending_match is not None:
+                stream_boxes.extend(close_pending_match(pending_match, ref_match.start()))
+            pending_match = ref_match
+            scan_position = ref_match.end()
+
+    if pending_match is not None:
+        stream_boxes.extend(close_pending_match(pending_match, len(generated_text)))
+
+    return stream_boxes
+
+
+def current_stream_boxes(text_deltas, image_width, image_height):
+    stream_parser = DeepSeekStreamParser(image_width, image_height)
+    stream_boxes = []
+    for text_delta in text_deltas:
+        stream_boxes.extend(stream_parser.feed(text_delta))
+    stream_boxes.extend(stream_parser.finish())
+    return stream_boxes
+
+
+def build_dense_page(region_count, seed):
+    page_random = random.Random(seed)
+    text_blocks = []
+    for region_index in range(region_count):
+        top = page_random.randint(0, 900)
+        left = page_random.randint(0, 800)
+        coordinates = f'[[{left}, {top}, {left + page_random.randint(20, 199)}, {top + page_random.randint(10, 99)}]]'
+        if region_index % 7 == 3:
+            rows = ''.join(
+                f'<tr><td>항목 {row_index}</td><td>{page_random.randint(1, 9999)} &amp; 원</td></tr>'
+                for row_index in range(page_random.randint(2, 8))
+            )
+            text_blocks.append(f'<|ref|>table<|/ref|><|det|>{coordinates}<|/det|>\n<table>{rows}</table>\n\n')
+        elif region_index % 5 == 1:
+            text_blocks.append(f'<|ref|>title<|/ref|><|det|>{coordinates}<|/det|>\n## 제목 {region_index}\n\n')
+        else:
+            text_blocks.append(
+                f'<|ref|>text<|/ref|><|det|>{coordinates}<|/det|>\n'
+                f'본문 {region_index} line with  extra   spaces<br>다음 줄 &lt;note&gt;\n\n'
+            )
+
+    return ''.join(text_blocks)
+
+
+def build_fuzz_text(fuzz_random):
+    return ''.join(fuzz_random.choice(FUZZ_FRAGMENTS) for _ in range(fuzz_random.randint(1, 60)))
+
+
+def read_archived_texts(archive_dir):
+    archived_texts = []
+    for archive_path in sorted(Path(archive_dir).glob('deepseek_ocr_*.jsonl.gz')):
+        with gzip.open(archive_path, 'rt', encoding='utf-8') as archive_file:
+            for archive_line in archive_file:
+                try:
+                    archive_record = json.loads(archive_line)
+                except json.JSONDecodeError:
+                    continue
+                response = archive_record.get('response')
+                if isinstance(response, dict) and isinstance(response.get('text'), str):
+                    archived_texts.append(response['text'])
+
+    return archived_texts
+
+
+def split_text_deltas(generated_text, chunk_size):
+    return [generated_text[index:index + chunk_size] for index in range(0, len(generated_text), chunk_size)]
+
+
+def find_mismatches(corpus_texts, image_width, image_height):
+    mismatches = []
+    for corpus_index, generated_text in enumerate(corpus_texts):
+        deepseek_response = {'text': generated_text}
+        if legacy_extract_deepseek_boxes(deepseek_response, image_width, image_height) != extract_deepseek_boxes(
+            deepseek_response, image_width, image_height
+        ):
+            mismatches.append((corpus_index, 'extract'))
+            continue
+
+        text_deltas = split_text_deltas(generated_text, 1 + corpus_index % 23)
+        if legacy_stream_boxes(text_deltas, image_width, image_height) != current_stream_boxes(
+            text_deltas, image_width, image_height
+        ):
+            mismatches.append((corpus_index, 'stream'))
+
+    return mismatches
+
+
+def measure_seconds(parse_text, page_texts, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for page_text in page_texts:
+            parse_text({'text': page_text}, 1240, 1754)
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DeepSeek grounding parser equality check and benchmark')
+    parser.add_argument('--archive', default='', help='raw response archive directory to add real responses')
+    parser.add_argument('--regions', type=int, default=300, help='regions per synthetic dense page')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fuzz', type=int, default=20000, help='random markup fragments to compare')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    archived_texts = read_archived_texts(args.archive) if args.archive else []
+    page_texts = [build_dense_page(args.regions, args.seed + page_index) for page_index in range(args.pages)]
+    fuzz_random = random.Random(args.seed)
+    corpus_texts = [
+        *archived_texts,
+        *page_texts,
+        build_deepseek_text(b'', 12),
+        *[build_fuzz_text(fuzz_random) for _ in range(args.fuzz)]
+    ]
+
+    mismatches = find_mismatches(corpus_texts, 1240, 1754)
+    print(f'corpus: {len(corpus_texts)} texts ({len(archived_texts)} archived), mismatches: {len(mismatches)}')
+    for corpus_index, mismatch_kind in mismatches[:10]:
+        print(f'  {mismatch_kind} mismatch: {corpus_texts[corpus_index]!r}')
+
+    timed_texts = archived_texts or page_texts
+    legacy_seconds = measure_seconds(legacy_extract_deepseek_boxes, timed_texts, args.repeat)
+    current_seconds = measure_seconds(extract_deepseek_boxes, timed_texts, args.repeat)
+    parsed_pages = len(timed_texts) * args.repeat
+    print(f'legacy : {legacy_seconds * 1000 / parsed_pages:.2f} ms/page')
+    print(f'current: {current_seconds * 1000 / parsed_pages:.2f} ms/page')
+    print(f'speedup: {legacy_seconds / current_seconds:.2f}x')
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""Stand-in model containers that speak the gateway's upstream contracts.
+
+Run locally and point the gateway at it:
+
+    python -m benchmarks.fake_models --port 8100
+    PADDLE_OCR_API_URL=http://127.0.0.1:8100/paddle-ocr/inference \
+    DEEPSEEK_OCR_API_URL=http://127.0.0.1:8100/deepseek-ocr/inference \
+    DOCLAYOUT_API_URL=http://127.0.0.1:8100/doclayout/inference \
+    AWESOMI_KEYVALUE_API_URL=http://127.0.0.1:8100/keyvalue/inference python app.py
+
+``--latency``/``--jitter`` shape the response time, ``--boxes`` the output size and
+``--error-rate`` the share of requests that fail with HTTP 500. Images whose bytes start
+with ``corrupt`` fail with HTTP 500 like an undecodable upload, taking a batch with them.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_CORRUPT_IMAGE_PREFIX = b'corrupt'
+
+
+def create_fake_model_app(
+    latency_seconds=0.05,
+    batch_latency_seconds=0.01,
+    accept_batch=True,
+    batch_reject_status=422,
+    accept_binary=True,
+    jitter=0.0,
+    box_count=None,
+    error_rate=0.0,
+    seed=None
+):
+    fake_app = FastAPI(title='Fake model containers')
+    fake_app.state.request_counts = {}
+    fake_random = random.Random(seed)
+
+    def read_latency(extra_seconds=0.0):
+        # jitter 0.2이면 지연 시간이 ±20% 안에서 흔들린다.
+        return max(0.0, (latency_seconds + extra_seconds) * fake_random.uniform(1.0 - jitter, 1.0 + jitter))
+
+    def inject_failure(model_name):
+        if error_rate <= 0 or fake_random.random() >= error_rate:
+            return None
+        count_request(f'{model_name}/failure')
+        return JSONResponse({'detail': 'injected failure'}, status_code=500)
+
+    def count_request(model_name):
+        fake_app.state.request_counts[model_name] = fake_app.state.request_counts.get(model_name, 0) + 1
+
+    async def read_images(request):
+        content_type = request.headers.get('content-type', '')
+        count_request(f"body:{content_type.split(';')[0]}")
+
+        if content_type.startswith('multipart/form-data'):
+            form = await request.form()
+            payload = json.loads(form.get('options') or '{}')
+            if 'images' in form:
+                return payload, [await image.read() for image in form.getlist('images')], True
+            return payload, [await form['image'].read()], False
+
+        if content_type.startswith('application/octet-stream'):
+            return json.loads(request.headers.get('x-inference-options') or '{}'), [await request.body()], False
+
+        payload = await request.json()
+        if 'byte_imgs' in payload:
+            return payload, [base64.b64decode(byte_img) for byte_img in payload['byte_imgs']], True
+
+        return payload, [base64.b64decode(payload['byte_img'])], False
+
+    def reject_binary(request):
+        if accept_binary or request.headers.get('content-type', '').startswith('application/json'):
+            return None
+        return JSONResponse({'detail': 'application/json body is required'}, status_code=415)
+
+    async def run_inference(model_name, request, build_result):
+        rejected_response = reject_binary(request)
+        if rejected_response is not None:
+            return rejected_response
+
+        payload, images, is_batch = await read_images(request)
+        count_request(model_name)
+
+        if is_batch and not accept_batch:
+            return JSONResponse({'detail': 'byte_img is required'}, status_code=batch_reject_status)
+
+        await asyncio.sleep(read_latency(batch_latency_seconds * (len(images) - 1)))
+        failed_response = inject_failure(model_name)
+        if failed_response is not None:
+            return failed_response
+        if any(image_bytes.startswith(FAKE_CORRUPT_IMAGE_PREFIX) for image_bytes in images):
+            count_request(f'{model_name}/corrupt')
+            return JSONResponse({'detail': 'cannot decode image'}, status_code=500)
+
+        results = [build_result(image_bytes, box_count) for image_bytes in images]
+        if is_batch:
+            return {'results': results}
+
+        return results[0]
+
+    @fake_app.post('/paddle-ocr/inference')
+    async def paddle_inference(request: Request):
+        return await run_inference('paddle-ocr', request, build_paddle_result)
+
+    @fake_app.post('/doclayout/inference')
+    async def doclayout_inference(request: Request):
+        return await run_inference('doclayout-yolo', request, build_doclayout_result)
+
+    @fake_app.post('/deepseek-ocr/inference')
+    async def deepseek_inference(request: Request):
+        rejected_response = reject_binary(request)
+        if rejected_response is not None:
+            return rejected_response
+
+        payload, images, _ = await read_images(request)
+        count_request('deepseek-ocr')
+        generated_text = build_deepseek_text(images[0], box_count or 6)
+        failed_response = inject_failure('deepseek-ocr')
+        if failed_response is not None:
+            return failed_response
+
+        if not payload.get('stream'):
+            await asyncio.sleep(read_latency())
+            return {'model': 'deepseek-ocr2', 'text': generated_text}
+
+        async def stream_tokens():
+            token_size = 16
+            token_delay = read_latency() / max(1, len(generated_text) // token_size)
+            for token_start in range(0, len(generated_text), token_size):
+                await asyncio.sleep(token_delay)
+                yield json.dumps({'text': generated_text[token_start:token_start + token_size]}) + '\n'
+            yield json.dumps({'model': 'deepseek-ocr2', 'done': True}) + '\n'
+
+        return StreamingResponse(stream_tokens(), media_type='application/x-ndjson')
+
+    @fake_app.post('/keyvalue/inference')
+    async def keyvalue_inference(request: Request):
+        form = await request.form()
+        await form['image'].read()
+        count_request('keyvalue')
+
+        await asyncio.sleep(read_latency())
+        failed_response = inject_failure('keyvalue')
+        if failed_response is not None:
+            return failed_response
+
+        return build_keyvalue_result(form.get('model'), box_count, form.get('include_raw') == 'true')
+
+    @fake_app.get('/{model_name}/health')
+    async def model_health(model_name: str):
+        # binary 전송을 받는 컨테이너는 health 응답으로 알려 준다.
+        return {'status': 'ok', 'transports': ['multipart', 'raw', 'json'] if accept_binary else ['json']}
+
+    @fake_app.post('/{model_name}/release')
+    async def release_model(model_name: str):
+        count_request(f'{model_name}/release')
+        return {'released': True}
+
+    @fake_app.get('/stats')
+    async def read_stats():
+        return fake_app.state.request_counts
+
+    return fake_app
+
+
+def build_paddle_result(image_bytes, box_count=None):
+    if not box_count:
+        return [{
+            'res': {
+                'rec_texts': ['sample', 'text'],
+                'rec_scores': [0.99, 0.95],
+                'rec_boxes': [[10, 10, 120, 40], [10, 50, 200, 80]]
+            }
+        }]
+
+    return [{
+        'res': {
+            'rec_texts': [f'sample text {box_index}' for box_index in range(box_count)],
+            'rec_scores': [round(0.99 - (box_index % 10) * 0.01, 2) for box_index in range(box_count)],
+            'rec_boxes': [build_grid_bbox(box_index) for box_index in range(box_count)]
+        }
+    }]
+
+
+def build_grid_bbox(box_index, columns=4):
+    # box가 많아도 겹치지 않게 A4 크기 안에 격자로 놓는다.
+    left = 10 + (box_index % columns) * 400
+    top = 10 + ((box_index // columns) * 40) % 2300
+    return [left, top, left + 380, top + 30]
+
+
+def build_deepseek_text(image_bytes, region_count=6):
+    text_blocks = []
+    for region_index in range(region_count):
+        top = 20 + region_index * 150
+        if region_index % 3 == 2:
+            text_blocks.append(
+                f'<|ref|>table<|/ref|><|det|>[[40, {top}, 950, {top + 120}]]<|/det|>\n'
+                f'<table><tr><td>cell {region_index}</td><td>value &amp; more</td></tr></table>\n'
+            )
+        else:
+            text_blocks.append(
+                f'<|ref|>text<|/ref|><|det|>[[40, {top}, 950, {top + 120}]]<|/det|>\n'
+                f'## Heading {region_index}\nSample line {region_index}<br>second line\n\n'
+            )
+
+    return ''.join(text_blocks)
+
+
+def build_doclayout_result(image_bytes, box_count=None):
+    if not box_count:
+        return {
+            'model': 'DocLayout-YOLO',
+            'boxes': [{'bbox': [5, 5, 300, 90], 'label': 'title', 'kind': 'title', 'confidence': 0.92}]
+        }
+
+    layout_labels = ['title', 'plain text', 'table', 'figure']
+    return {
+        'model': 'DocLayout-YOLO',
+        'boxes': [
+            {
+                'bbox': build_grid_bbox(box_index),
+                'label': layout_labels[box_index % len(layout_labels)],
+                'kind': layout_labels[box_index % len(layout_labels)],
+                'confidence': 0.9
+            }
+            for box_index in range(box_count)
+        ]
+    }
+
+
+def build_keyvalue_result(selected_model, key_count=None, include_raw=False):
+    keys = [f'field_{key_index}' for key_index in range(key_count or 8)]
+    keyvalue_result = {'model': selected_model or 'qwen', 'keys': keys}
+    if include_raw:
+        keyvalue_result['raw'] = json.dumps({key: f'value {key}' for key in keys})
+
+    return keyvalue_result
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--batch-latency', type=float, default=0.01, help='extra seconds per additional batch image')
+    parser.add_argument('--no-batch', action='store_true', help='reject multi-image requests like a single-image container')
+    parser.add_argument('--batch-reject-status', type=int, default=422, help='status for rejected multi-image requests, e.g. 500')
+    parser.add_argument('--json-only', action='store_true', help='reject multipart/raw bodies like a byte_img-only container')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency spread as a fraction, e.g. 0.3 for +/-30%%')
+    parser.add_argument('--boxes', type=int, default=None, help='boxes/regions/keys per response (default: small fixed output)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for jitter and injected failures')
+    args = parser.parse_args()
+
+    fake_app = create_fake_model_app(
+        args.latency,
+        args.batch_latency,
+        accept_batch=not args.no_batch,
+        batch_reject_status=args.batch_reject_status,
+        accept_binary=not args.json_only,
+        jitter=args.jitter,
+        box_count=args.boxes,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    uvicorn.run(fake_app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
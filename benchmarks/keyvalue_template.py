@@ -0,0 +1,137 @@
+"""Measure how well the key-value template fingerprint separates form templates.
+
+Draws synthetic form templates (ruled tables, labelled boxes, header bands), fills
+each with different handwriting-like text per document and adds scan noise (small
+shift, scale, rotation, brightness, JPEG). Prints the similarity distribution for
+same-template and different-template pairs, the false match / missed match rates at
+the configured threshold, and the time to fingerprint one full-page scan:
+
+    python -m benchmarks.keyvalue_template
+    python -m benchmarks.keyvalue_template --templates 20 --documents 10 --threshold 0.88
+"""
+
+import argparse
+import itertools
+import random
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import KEYVALUE_TEMPLATE_SIMILARITY
+from utils.template_index import compute_template_fingerprint
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+
+
+def build_template(seed):
+    template_random = random.Random(seed)
+    rows = template_random.randint(6, 18)
+    columns = template_random.randint(2, 5)
+    top = template_random.randint(250, 700)
+    bottom = PAGE_HEIGHT - template_random.randint(200, 900)
+    row_height = (bottom - top) / rows
+    row_edges = [round(top + row_index * row_height + template_random.uniform(-0.3, 0.3) * row_height) for row_index in range(1, rows)]
+    column_width = (PAGE_WIDTH - 240) / columns
+    column_edges = [round(120 + column_index * column_width + template_random.uniform(-0.3, 0.3) * column_width) for column_index in range(1, columns)]
+    header_height = template_random.randint(80, 220)
+    return {
+        'rows': [top, *row_edges, bottom],
+        'columns': [120, *column_edges, PAGE_WIDTH - 120],
+        'header': (120, 100, PAGE_WIDTH - 120, 100 + header_height),
+        'header_fill': template_random.randint(120, 220),
+        'label_share': template_random.uniform(0.2, 0.45)
+    }
+
+
+def draw_document(template, seed):
+    document_random = random.Random(seed)
+    page = Image.new('L', (PAGE_WIDTH, PAGE_HEIGHT), 255)
+    draw = ImageDraw.Draw(page)
+    draw.rectangle(template['header'], fill=template['header_fill'])
+
+    row_edges, column_edges = template['rows'], template['columns']
+    for row_edge in row_edges:
+        draw.line([(column_edges[0], row_edge), (column_edges[-1], row_edge)], fill=0, width=4)
+    for column_edge in column_edges:
+        draw.line([(column_edge, row_edges[0]), (column_edge, row_edges[-1])], fill=0, width=4)
+
+    # 양식에 적힌 label 칸 말고 값 칸에만 문서마다 다른 글자를 채운다.
+    for top, bottom in zip(row_edges, row_edges[1:]):
+        for column_index, (left, right) in enumerate(zip(column_edges, column_edges[1:])):
+            label_right = left + (right - left) * template['label_share']
+            draw.rectangle([left + 6, top + 6, label_right, bottom - 6], fill=225)
+            if column_index and document_random.random() < 0.2:
+                continue
+            text_left = label_right + 20
+            while text_left < right - 60:
+                word_width = document_random.randint(30, 160)
+                draw.rectangle(
+                    [text_left, top + (bottom - top) * 0.35, min(right - 20, text_left + word_width), top + (bottom - top) * 0.65],
+                    fill=document_random.randint(0, 90)
+                )
+                text_left += word_width + document_random.randint(15, 40)
+
+    return add_scan_noise(page, document_random)
+
+
+def add_scan_noise(page, document_random):
+    scale = document_random.uniform(0.97, 1.03)
+    page = page.rotate(document_random.uniform(-0.8, 0.8), resample=Image.BILINEAR, fillcolor=255)
+    page = page.resize((int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), Image.BILINEAR)
+    shifted_page = Image.new('L', (PAGE_WIDTH, PAGE_HEIGHT), 255)
+    shifted_page.paste(page, (document_random.randint(-25, 25), document_random.randint(-25, 25)))
+
+    pixels = np.asarray(shifted_page, dtype=np.float32) * document_random.uniform(0.9, 1.0)
+    pixels += np.random.default_rng(document_random.randint(0, 2 ** 31)).normal(0, 6, pixels.shape)
+    output = BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(output, 'JPEG', quality=80)
+    return output.getvalue()
+
+
+def summarize(similarities):
+    values = np.array(similarities)
+    return f'min {values.min():.3f}  p5 {np.percentile(values, 5):.3f}  median {np.median(values):.3f}  max {values.max():.3f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--templates', type=int, default=12)
+    parser.add_argument('--documents', type=int, default=6, help='filled documents per template')
+    parser.add_argument('--threshold', type=float, default=KEYVALUE_TEMPLATE_SIMILARITY)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    documents = []
+    for template_index in range(args.templates):
+        template = build_template(args.seed * 1000 + template_index)
+        for document_index in range(args.documents):
+            documents.append((template_index, draw_document(template, args.seed * 100000 + template_index * 100 + document_index)))
+
+    fingerprint_seconds = []
+    fingerprints = []
+    for template_index, image_bytes in documents:
+        started_at = time.perf_counter()
+        fingerprints.append((template_index, compute_template_fingerprint(image_bytes)))
+        fingerprint_seconds.append(time.perf_counter() - started_at)
+
+    same_similarities, other_similarities = [], []
+    for (left_template, left_print), (right_template, right_print) in itertools.combinations(fingerprints, 2):
+        if not left_print.has_close_aspect(right_print):
+            continue
+        similarity = left_print.similarity(right_print)
+        (same_similarities if left_template == right_template else other_similarities).append(similarity)
+
+    print(f'{len(documents)} documents, {args.templates} templates, {PAGE_WIDTH}x{PAGE_HEIGHT} JPEG scans')
+    print(f'same template      {summarize(same_similarities)}')
+    print(f'different template {summarize(other_similarities)}')
+    missed = sum(similarity < args.threshold for similarity in same_similarities) / len(same_similarities)
+    false_matches = sum(similarity >= args.threshold for similarity in other_similarities) / len(other_similarities)
+    print(f'threshold {args.threshold}: missed same-template pairs {missed:.2%}, false matches {false_matches:.2%}')
+    print(f'fingerprint per page: median {np.median(fingerprint_seconds) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
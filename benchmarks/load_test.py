@@ -0,0 +1,459 @@
+"""Drive the gateway's labeling routes at fixed concurrency levels and save the results.
+
+Start stand-in models and a gateway as child processes and sweep concurrency:
+
+    python -m benchmarks.load_test --spawn --concurrency 1,8,32 --duration 15
+
+Or drive a gateway that is already running (GPU containers or fake models):
+
+    python -m benchmarks.load_test --url http://127.0.0.1:5001 --routes paddle_ocr,layout
+
+Every run is written as JSON to ``uploads/benchmarks/``; ``--compare`` prints the
+change in throughput and p50/p99 against an earlier run. Memory and event-loop lag
+come from the gateway's ``/metrics`` (``process_resident_memory_bytes`` and
+``labeling_event_loop_lag_seconds``), so they describe the gateway, not this client.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+from PIL import Image as PILImage
+from PIL import ImageDraw
+
+from config import BASE_DIR, UPLOAD_DIR
+
+LOAD_TEST_ROUTES = {
+    'paddle_ocr': '/api/labeling/paddle_ocr',
+    'deepseek_ocr': '/api/labeling/deepseek_ocr',
+    'layout': '/api/labeling/layout',
+    'keyvalue': '/api/labeling/keyvalue'
+}
+FAKE_MODEL_PATHS = {
+    'PADDLE_OCR_API_URL': '/paddle-ocr/inference',
+    'DEEPSEEK_OCR_API_URL': '/deepseek-ocr/inference',
+    'DOCLAYOUT_API_URL': '/doclayout/inference',
+    'AWESOMI_KEYVALUE_API_URL': '/keyvalue/inference'
+}
+LOAD_TEST_OUTPUT_DIR = UPLOAD_DIR / 'benchmarks'
+METRICS_SAMPLE_INTERVAL = 1.0
+STARTUP_TIMEOUT = 30.0
+
+
+def build_sample_image(width, height):
+    # 글자 줄처럼 보이는 회색 막대를 그려 PNG 압축률이 실제 문서와 비슷하게 한다.
+    image = PILImage.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, height // 80)
+    for line_index, top in enumerate(range(line_height * 2, height - line_height * 2, line_height * 2)):
+        right = width - line_height * 2 - (line_index * 37 % (width // 3))
+        draw.rectangle([line_height * 2, top, right, top + line_height], fill=(40, 40, 40))
+
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+
+def read_image_bytes(args):
+    if args.image:
+        return Path(args.image).read_bytes(), Path(args.image).name
+
+    width, height = [int(size) for size in args.image_size.lower().split('x')]
+    return build_sample_image(width, height), 'load-test.png'
+
+
+def read_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def parse_metrics_text(metrics_text):
+    metric_values = {}
+    for metric_line in metrics_text.splitlines():
+        if not metric_line or metric_line.startswith('#'):
+            continue
+
+        metric_key, _, metric_value = metric_line.rpartition(' ')
+        try:
+            metric_values[metric_key] = float(metric_value)
+        except ValueError:
+            continue
+
+    return metric_values
+
+
+def read_lag_buckets(metric_values):
+    lag_buckets = []
+    for metric_key, metric_value in metric_values.items():
+        if metric_key.startswith('labeling_event_loop_lag_seconds_bucket{le="'):
+            bucket_bound = metric_key.split('"')[1]
+            lag_buckets.append((math.inf if bucket_bound == '+Inf' else float(bucket_bound), metric_value))
+
+    return sorted(lag_buckets)
+
+
+def estimate_lag_percentile(before_buckets, after_buckets, percentile):
+    # 두 scrape 사이에 늘어난 누적 bucket 값으로 구간 안의 lag 분포를 만든다.
+    before_counts = dict(before_buckets)
+    bucket_deltas = [(bucket_bound, count - before_counts.get(bucket_bound, 0.0)) for bucket_bound, count in after_buckets]
+    total_count = bucket_deltas[-1][1] if bucket_deltas else 0.0
+    if total_count <= 0:
+        return None
+
+    for bucket_bound, cumulative_count in bucket_deltas:
+        if cumulative_count >= total_count * percentile / 100:
+            return bucket_bound
+
+    return math.inf
+
+
+async def read_gateway_metrics(client, base_url):
+    try:
+        response = await client.get(f'{base_url}/metrics')
+    except httpx.HTTPError:
+        return {}
+
+    if response.status_code != 200:
+        return {}
+
+    return parse_metrics_text(response.text)
+
+
+async def sample_gateway_memory(client, base_url, memory_samples, stop_event):
+    while not stop_event.is_set():
+        metric_values = await read_gateway_metrics(client, base_url)
+        if 'process_resident_memory_bytes' in metric_values:
+            memory_samples.append(metric_values['process_resident_memory_bytes'])
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), METRICS_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def send_labeling_request(client, request_url, image_bytes, image_filename, use_cache):
+    form_data = {} if use_cache else {'noCache': 'true'}
+    started_at = time.perf_counter()
+    try:
+        response = await client.post(
+            request_url,
+            files={'image': (image_filename, image_bytes, 'image/png')},
+            data=form_data
+        )
+        await response.aread()
+        status = response.status_code
+    except httpx.HTTPError as error:
+        status = type(error).__name__
+
+    return time.perf_counter() - started_at, status
+
+
+async def run_load_level(client, base_url, route_name, concurrency, args, image_bytes, image_filename):
+    request_url = f'{base_url}{LOAD_TEST_ROUTES[route_name]}'
+    await asyncio.gather(*[
+        send_labeling_request(client, request_url, image_bytes, image_filename, args.use_cache)
+        for _ in range(min(concurrency, args.warmup))
+    ])
+
+    latencies = []
+    status_counts = {}
+    memory_samples = []
+    stop_event = asyncio.Event()
+    metrics_before = await read_gateway_metrics(client, base_url)
+    memory_task = asyncio.create_task(sample_gateway_memory(client, base_url, memory_samples, stop_event))
+    started_at = time.perf_counter()
+    deadline = started_at + args.duration
+
+    async def run_worker():
+        while time.perf_counter() < deadline:
+            elapsed_seconds, status = await send_labeling_request(
+                client,
+                request_url,
+                image_bytes,
+                image_filename,
+                args.use_cache
+            )
+            status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed_seconds)
+
+    await asyncio.gather(*[run_worker() for _ in range(concurrency)])
+    wall_seconds = time.perf_counter() - started_at
+    stop_event.set()
+    await memory_task
+    metrics_after = await read_gateway_metrics(client, base_url)
+
+    latencies.sort()
+    lag_before = read_lag_buckets(metrics_before)
+    lag_after = read_lag_buckets(metrics_after)
+    request_count = sum(status_counts.values())
+    return {
+        'route': route_name,
+        'concurrency': concurrency,
+        'requests': request_count,
+        'succeeded': len(latencies),
+        'statusCounts': status_counts,
+        'seconds': round(wall_seconds, 3),
+        'throughput': round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+        'errorRate': round(1 - len(latencies) / request_count, 4) if request_count else 0.0,
+        'latency': {
+            'p50': read_percentile(latencies, 50),
+            'p90': read_percentile(latencies, 90),
+            'p99': read_percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+            'mean': sum(latencies) / len(latencies) if latencies else None
+        },
+        'eventLoopLag': {
+            'p50': estimate_lag_percentile(lag_before, lag_after, 50),
+            'p99': estimate_lag_percentile(lag_before, lag_after, 99)
+        },
+        'memory': {
+            'rssPeakBytes': max(memory_samples) if memory_samples else None,
+            'rssEndBytes': metrics_after.get('process_resident_memory_bytes')
+        }
+    }
+
+
+def format_milliseconds(seconds):
+    if seconds is None:
+        return '-'
+    if math.isinf(seconds):
+        return '>max'
+    return f'{seconds * 1000:.1f}'
+
+
+def format_megabytes(byte_count):
+    return '-' if byte_count is None else f'{byte_count / 1024 / 1024:.0f}'
+
+
+def print_result_header():
+    print(f"{'route':<14}{'conc':>5}{'req':>7}{'rps':>9}{'p50 ms':>10}{'p99 ms':>10}{'err%':>7}{'lag99 ms':>10}{'rss MB':>8}")
+
+
+def print_result_rows(load_results):
+    for load_result in load_results:
+        print(
+            f"{load_result['route']:<14}{load_result['concurrency']:>5}{load_result['requests']:>7}"
+            f"{load_result['throughput']:>9.1f}"
+            f"{format_milliseconds(load_result['latency']['p50']):>10}"
+            f"{format_milliseconds(load_result['latency']['p99']):>10}"
+            f"{load_result['errorRate'] * 100:>7.1f}"
+            f"{format_milliseconds(load_result['eventLoopLag']['p99']):>10}"
+            f"{format_megabytes(load_result['memory']['rssPeakBytes']):>8}"
+        )
+
+
+def print_comparison(load_results, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+    baseline_results = {
+        (load_result['route'], load_result['concurrency']): load_result
+        for load_result in baseline.get('results', [])
+    }
+
+    def format_change(current_value, baseline_value):
+        if not current_value or not baseline_value:
+            return '-'
+        return f'{(current_value / baseline_value - 1) * 100:+.1f}%'
+
+    print(f'\ncompared with {baseline_path} ({baseline.get("startedAt")}, {baseline.get("gitCommit") or "unknown commit"})')
+    print(f"{'route':<14}{'conc':>5}{'rps':>10}{'p50':>10}{'p99':>10}")
+    for load_result in load_results:
+        baseline_result = baseline_results.get((load_result['route'], load_result['concurrency']))
+        if baseline_result is None:
+            continue
+
+        print(
+            f"{load_result['route']:<14}{load_result['concurrency']:>5}"
+            f"{format_change(load_result['throughput'], baseline_result['throughput']):>10}"
+            f"{format_change(load_result['latency']['p50'], baseline_result['latency']['p50']):>10}"
+            f"{format_change(load_result['latency']['p99'], baseline_result['latency']['p99']):>10}"
+        )
+
+
+def read_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_load_results(load_report, output_path):
+    if output_path is None:
+        LOAD_TEST_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        output_path = LOAD_TEST_OUTPUT_DIR / f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+
+    Path(output_path).write_text(json.dumps(load_report, ensure_ascii=False, indent=2), encoding='utf-8')
+    return output_path
+
+
+def find_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        return free_socket.getsockname()[1]
+
+
+def start_child_process(command, env=None):
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env)
+
+
+def spawn_test_servers(args):
+    fake_port = find_free_port()
+    gateway_port = find_free_port()
+    fake_command = [
+        sys.executable, '-m', 'benchmarks.fake_models',
+        '--port', str(fake_port),
+        '--latency', str(args.model_latency),
+        '--jitter', str(args.model_jitter),
+        '--error-rate', str(args.model_error_rate)
+    ]
+    if args.model_boxes:
+        fake_command += ['--boxes', str(args.model_boxes)]
+
+    gateway_env = {
+        **os.environ,
+        **{
+            env_name: f'http://127.0.0.1:{fake_port}{model_path}'
+            for env_name, model_path in FAKE_MODEL_PATHS.items()
+        }
+    }
+    for env_assignment in args.gateway_env:
+        env_name, _, env_value = env_assignment.partition('=')
+        gateway_env[env_name] = env_value
+
+    child_processes = [start_child_process(fake_command)]
+    child_processes.append(start_child_process(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(gateway_port), '--log-level', 'warning'],
+        env=gateway_env
+    ))
+    return f'http://127.0.0.1:{gateway_port}', child_processes
+
+
+async def wait_for_gateway(client, base_url):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f'{base_url}/health')).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+
+    raise RuntimeError(f'gateway did not start within {STARTUP_TIMEOUT:.0f}s: {base_url}')
+
+
+def stop_child_processes(child_processes):
+    for child_process in child_processes:
+        child_process.terminate()
+    for child_process in child_processes:
+        try:
+            child_process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            child_process.kill()
+
+
+async def run_load_test(args, base_url):
+    image_bytes, image_filename = read_image_bytes(args)
+    route_names = [route_name.strip() for route_name in args.routes.split(',') if route_name.strip()]
+    concurrency_levels = [int(concurrency) for concurrency in args.concurrency.split(',')]
+    unknown_routes = set(route_names) - set(LOAD_TEST_ROUTES)
+    if unknown_routes:
+        raise SystemExit(f'unknown routes: {", ".join(sorted(unknown_routes))} (choose from {", ".join(LOAD_TEST_ROUTES)})')
+
+    limits = httpx.Limits(max_connections=max(concurrency_levels) + 4, max_keepalive_connections=max(concurrency_levels) + 4)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        await wait_for_gateway(client, base_url)
+        load_results = []
+        print_result_header()
+        for route_name in route_names:
+            for concurrency in concurrency_levels:
+                load_result = await run_load_level(client, base_url, route_name, concurrency, args, image_bytes, image_filename)
+                load_results.append(load_result)
+                print_result_rows([load_result])
+
+    return {
+        'startedAt': datetime.now(timezone.utc).isoformat(),
+        'gitCommit': read_git_commit(),
+        'baseUrl': base_url,
+        'spawned': args.spawn,
+        'options': {
+            'routes': route_names,
+            'concurrency': concurrency_levels,
+            'duration': args.duration,
+            'imageBytes': len(image_bytes),
+            'imageSize': None if args.image else args.image_size,
+            'useCache': args.use_cache,
+            'modelLatency': args.model_latency if args.spawn else None,
+            'modelJitter': args.model_jitter if args.spawn else None,
+            'modelBoxes': args.model_boxes if args.spawn else None,
+            'modelErrorRate': args.model_error_rate if args.spawn else None,
+            'gatewayEnv': args.gateway_env
+        },
+        'results': load_results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='gateway base URL (ignored with --spawn)')
+    parser.add_argument('--spawn', action='store_true', help='start fake models and a gateway as child processes')
+    parser.add_argument('--routes', default=','.join(LOAD_TEST_ROUTES), help='comma separated: ' + ', '.join(LOAD_TEST_ROUTES))
+    parser.add_argument('--concurrency', default='1,8,32', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per route and concurrency level')
+    parser.add_argument('--warmup', type=int, default=4, help='requests sent before each level and not recorded')
+    parser.add_argument('--timeout', type=float, default=120.0, help='client timeout seconds per request')
+    parser.add_argument('--image', help='image file to upload (default: generated page)')
+    parser.add_argument('--image-size', default='1654x2339', help='generated page size, WIDTHxHEIGHT')
+    parser.add_argument('--use-cache', action='store_true', help='allow result cache hits (default sends noCache=true)')
+    parser.add_argument('--model-latency', type=float, default=0.05, help='fake model latency seconds (--spawn)')
+    parser.add_argument('--model-jitter', type=float, default=0.2, help='fake model latency spread (--spawn)')
+    parser.add_argument('--model-boxes', type=int, default=None, help='boxes per fake model response (--spawn)')
+    parser.add_argument('--model-error-rate', type=float, default=0.0, help='fake model HTTP 500 share (--spawn)')
+    parser.add_argument(
+        '--gateway-env',
+        action='append',
+        default=[],
+        metavar='NAME=VALUE',
+        help='extra environment for the spawned gateway, repeatable'
+    )
+    parser.add_argument('--output', help='result JSON path (default: uploads/benchmarks/load-<time>.json)')
+    parser.add_argument('--compare', help='earlier result JSON to compare against')
+    args = parser.parse_args()
+
+    child_processes = []
+    base_url = args.url.rstrip('/')
+    if args.spawn:
+        base_url, child_processes = spawn_test_servers(args)
+
+    try:
+        load_report = asyncio.run(run_load_test(args, base_url))
+    finally:
+        stop_child_processes(child_processes)
+
+    output_path = save_load_results(load_report, args.output)
+    print(f'\nsaved {output_path}')
+
+    if args.compare:
+        print_comparison(load_report['results'], args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Measure labeling result store write throughput and search latency.
+
+Fills a temporary store with synthetic OCR/layout pages (Korean and English words,
+random boxes) through the same write path the gateway uses, then times full-text,
+type, region and combined searches against it:
+
+    python -m benchmarks.result_store
+    python -m benchmarks.result_store --pages 20000 --boxes 100 --store /tmp/result-store
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from utils.result_store import LabelingResultStore
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+WORDS = (
+    '서울특별시 부산광역시 대한민국 주소 성명 생년월일 전화번호 합계 금액 공급가액 세액 청구서 신청서 영수증 '
+    '사업자등록번호 대표자 계좌번호 은행 지점 발행일 납부기한 비고 수량 단가 품목 invoice total amount date '
+    'name address phone account bank tax receipt number signature'
+).split()
+LAYOUT_TYPES = ('title', 'text', 'table', 'figure', 'header', 'footer')
+
+
+def build_page(page_random, page_index, box_count):
+    boxes = []
+    for box_index in range(box_count):
+        left = page_random.uniform(0, PAGE_WIDTH - 400)
+        top = page_random.uniform(0, PAGE_HEIGHT - 80)
+        boxes.append({
+            'id': f'paddle-{box_index + 1}',
+            'type': page_random.choice(LAYOUT_TYPES) if box_index % 10 == 0 else 'text',
+            'text': ' '.join(page_random.choice(WORDS) for _ in range(page_random.randint(1, 4))) + f' {page_random.randint(0, 99999)}',
+            'confidence': round(page_random.uniform(0.6, 1.0), 4),
+            'bbox': [left, top, left + page_random.uniform(40, 400), top + page_random.uniform(20, 80)]
+        })
+
+    return {
+        'displayType': 'bbox_overlay',
+        'image': {'filename': f'page-{page_index:07d}.png', 'width': PAGE_WIDTH, 'height': PAGE_HEIGHT},
+        'boxes': boxes
+    }
+
+
+def time_search(result_store, repeat, **search_options):
+    seconds = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        search_result = result_store.search(**search_options)
+        seconds.append(time.perf_counter() - started_at)
+    return statistics.median(seconds) * 1000, max(seconds) * 1000, len(search_result['boxes'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--boxes', type=int, default=100, help='boxes per page')
+    parser.add_argument('--batch', type=int, default=64, help='pages per write transaction')
+    parser.add_argument('--store', default=None, help='store directory (default: temporary directory)')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    store_dir = args.store or tempfile.mkdtemp(prefix='result-store-')
+    result_store = LabelingResultStore(store_dir, retention_days=0, queue_size=1)
+    page_random = random.Random(args.seed)
+    connection = result_store.connect()
+
+    started_at = time.perf_counter()
+    for batch_start in range(0, args.pages, args.batch):
+        stored_records = [
+            ('paddle-ocr', None, f'{page_index:064x}', None, build_page(page_random, page_index, args.boxes))
+            for page_index in range(batch_start, min(args.pages, batch_start + args.batch))
+        ]
+        result_store.write_records(connection, stored_records)
+    write_seconds = time.perf_counter() - started_at
+    box_total = args.pages * args.boxes
+    print(f'{args.pages} pages, {box_total} boxes in {store_dir}')
+    print(f'write: {write_seconds:.1f} s ({box_total / write_seconds:,.0f} boxes/s), failed {result_store.stats["failed"]}')
+    print(f'store size: {result_store.read_stats()["storeBytes"] / 1024 / 1024:.0f} MiB')
+
+    first_page = result_store.search(text='청구서', limit=50)
+    searches = [
+        ('text 청구서', {'text': '청구서'}),
+        ('text prefix 사업자', {'text': '사업자'}),
+        ('text 2 words', {'text': '서울특별시 금액'}),
+        ('text rare number', {'text': '12345'}),
+        ('text + type table', {'text': '합계', 'box_type': 'table'}),
+        ('text + region', {'text': 'invoice', 'region': (0.0, 0.0, 0.5, 0.1)}),
+        ('type table', {'box_type': 'table'}),
+        ('region top-left 5%', {'region': (0.0, 0.0, 0.05, 0.05)}),
+        ('region + type title', {'region': (0.0, 0.0, 0.2, 0.2), 'box_type': 'title'}),
+        ('next page (cursor)', {'text': '청구서', 'before': first_page['nextCursor']}),
+        ('no match', {'text': 'zzzzzz'}),
+    ]
+    for search_label, search_options in searches:
+        median_ms, max_ms, hit_count = time_search(result_store, args.repeat, limit=50, **search_options)
+        print(f'{search_label:<24} median {median_ms:7.2f} ms  max {max_ms:7.2f} ms  hits {hit_count}')
+
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
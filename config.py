@@ -5,27 +5,134 @@ import os
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_DIR = BASE_DIR / 'uploads'
 
+APP_WORKERS = int(os.environ.get('APP_WORKERS', '1'))
+SHARED_STATE_ENABLED = os.environ.get('SHARED_STATE_ENABLED', str(APP_WORKERS > 1)).lower() == 'true'
+SHARED_STATE_DIR = Path(os.environ.get('SHARED_STATE_DIR', str(UPLOAD_DIR / 'shared_state')))
+SHARED_STATE_SYNC_INTERVAL = float(os.environ.get('SHARED_STATE_SYNC_INTERVAL', '2'))
+
+SERVER_FOLDER_ROOT = os.environ.get('SERVER_FOLDER_ROOT', '/mnt/h')
+SERVER_BULK_OUTPUT_ROOT = os.environ.get('SERVER_BULK_OUTPUT_ROOT', '/mnt/h')
+BULK_JOB_STATE_DIR = Path(os.environ.get('BULK_JOB_STATE_DIR', str(UPLOAD_DIR / 'bulk_jobs')))
+BULK_JOB_CONCURRENCY = int(os.environ.get('BULK_JOB_CONCURRENCY', '4'))
+BULK_JOB_MAX_CONCURRENCY = int(os.environ.get('BULK_JOB_MAX_CONCURRENCY', '16'))
+
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', '178956970'))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(100 * 1024 * 1024)))
+UPLOAD_MAX_FIELD_BYTES = int(os.environ.get('UPLOAD_MAX_FIELD_BYTES', str(64 * 1024)))
+DOCUMENT_MAX_BYTES = int(os.environ.get('DOCUMENT_MAX_BYTES', str(512 * 1024 * 1024)))
+DOCUMENT_MAX_PAGES = int(os.environ.get('DOCUMENT_MAX_PAGES', '500'))
+DOCUMENT_RENDER_DPI = float(os.environ.get('DOCUMENT_RENDER_DPI', '200'))
+DOCUMENT_RENDER_MAX_SIDE = int(os.environ.get('DOCUMENT_RENDER_MAX_SIDE', '4000'))
+DOCUMENT_RENDER_WORKERS = int(os.environ.get('DOCUMENT_RENDER_WORKERS', str(min(4, os.cpu_count() or 1))))
+DOCUMENT_PAGE_WINDOW = int(os.environ.get('DOCUMENT_PAGE_WINDOW', '3'))
+IMAGE_PREPROCESS_ENABLED = os.environ.get('IMAGE_PREPROCESS_ENABLED', 'false').lower() == 'true'
+IMAGE_PREPROCESS_WORKERS = int(os.environ.get('IMAGE_PREPROCESS_WORKERS', str(min(4, os.cpu_count() or 1))))
+IMAGE_PREPROCESS_JPEG_QUALITY = int(os.environ.get('IMAGE_PREPROCESS_JPEG_QUALITY', '90'))
+IMAGE_PREPROCESS_GRAYSCALE = os.environ.get('IMAGE_PREPROCESS_GRAYSCALE', 'false').lower() == 'true'
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', '32'))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_KEEPALIVE_CONNECTIONS', '8'))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get('UPSTREAM_KEEPALIVE_EXPIRY', '60'))
+UPSTREAM_HEALTH_INTERVAL = float(os.environ.get('UPSTREAM_HEALTH_INTERVAL', '10'))
+UPSTREAM_HEALTH_TIMEOUT = float(os.environ.get('UPSTREAM_HEALTH_TIMEOUT', '2'))
+UPSTREAM_EJECT_FAILURES = int(os.environ.get('UPSTREAM_EJECT_FAILURES', '3'))
+UPSTREAM_EJECT_SECONDS = float(os.environ.get('UPSTREAM_EJECT_SECONDS', '30'))
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get('REQUEST_DEADLINE_SECONDS', '0'))
+CLIENT_DISCONNECT_CANCEL_ENABLED = os.environ.get('CLIENT_DISCONNECT_CANCEL_ENABLED', 'true').lower() == 'true'
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_DIR = Path(os.environ.get('RESULT_CACHE_DIR', str(UPLOAD_DIR / 'result_cache')))
+RESULT_CACHE_MEMORY_ENTRIES = int(os.environ.get('RESULT_CACHE_MEMORY_ENTRIES', '256'))
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_DISK_BYTES = int(os.environ.get('RESULT_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', str(7 * 24 * 60 * 60)))
+
+RAW_RESPONSE_ARCHIVE_ENABLED = os.environ.get('RAW_RESPONSE_ARCHIVE_ENABLED', 'false').lower() == 'true'
+RAW_RESPONSE_ARCHIVE_DIR = Path(os.environ.get('RAW_RESPONSE_ARCHIVE_DIR', str(UPLOAD_DIR / 'raw_responses')))
+RAW_RESPONSE_ARCHIVE_RETENTION_DAYS = int(os.environ.get('RAW_RESPONSE_ARCHIVE_RETENTION_DAYS', '14'))
+RAW_RESPONSE_ARCHIVE_MAX_BYTES = int(os.environ.get('RAW_RESPONSE_ARCHIVE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+RAW_RESPONSE_ARCHIVE_QUEUE_SIZE = int(os.environ.get('RAW_RESPONSE_ARCHIVE_QUEUE_SIZE', '256'))
+
+RESULT_STORE_ENABLED = os.environ.get('RESULT_STORE_ENABLED', 'true').lower() == 'true'
+RESULT_STORE_DIR = Path(os.environ.get('RESULT_STORE_DIR', str(UPLOAD_DIR / 'result_store')))
+RESULT_STORE_RETENTION_DAYS = int(os.environ.get('RESULT_STORE_RETENTION_DAYS', '0'))
+RESULT_STORE_QUEUE_SIZE = int(os.environ.get('RESULT_STORE_QUEUE_SIZE', '1024'))
+
+ANALYSIS_MODEL_TIMEOUT = float(os.environ.get('ANALYSIS_MODEL_TIMEOUT', '120'))
+BOX_FUSION_IOU_THRESHOLD = float(os.environ.get('BOX_FUSION_IOU_THRESHOLD', '0.5'))
+BOX_FUSION_REGION_COVERAGE = float(os.environ.get('BOX_FUSION_REGION_COVERAGE', '0.5'))
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+
+GPU_RESIDENCY_ENABLED = os.environ.get('GPU_RESIDENCY_ENABLED', 'true').lower() == 'true'
+GPU_RESIDENCY_MAX_CONSECUTIVE = int(os.environ.get('GPU_RESIDENCY_MAX_CONSECUTIVE', '16'))
+MODEL_IDLE_TTL = float(os.environ.get('MODEL_IDLE_TTL', '120'))
+
 PADDLE_OCR_API_URL = os.environ.get('PADDLE_OCR_API_URL', 'http://paddle-ocr:8001/inference')
-PADDLE_OCR_RELEASE_URL = os.environ.get('PADDLE_OCR_RELEASE_URL', PADDLE_OCR_API_URL.rsplit('/', 1)[0] + '/release')
+PADDLE_OCR_RELEASE_URL = os.environ.get('PADDLE_OCR_RELEASE_URL', '')
 PADDLE_OCR_API_TIMEOUT = int(os.environ.get('PADDLE_OCR_API_TIMEOUT', '120'))
+PADDLE_OCR_GPU = os.environ.get('PADDLE_OCR_GPU', '0')
+PADDLE_OCR_IDLE_TTL = float(os.environ.get('PADDLE_OCR_IDLE_TTL', str(MODEL_IDLE_TTL)))
+PADDLE_OCR_BATCH_SIZE = int(os.environ.get('PADDLE_OCR_BATCH_SIZE', '8'))
+PADDLE_OCR_BATCH_WAIT_MS = float(os.environ.get('PADDLE_OCR_BATCH_WAIT_MS', '15'))
+PADDLE_OCR_BATCH_MODE = os.environ.get('PADDLE_OCR_BATCH_MODE', 'auto')
+PADDLE_OCR_TRANSPORT = os.environ.get('PADDLE_OCR_TRANSPORT', 'auto')
+PADDLE_OCR_CONCURRENCY = int(os.environ.get('PADDLE_OCR_CONCURRENCY', '8'))
+PADDLE_OCR_MAX_QUEUE = int(os.environ.get('PADDLE_OCR_MAX_QUEUE', '64'))
+PADDLE_OCR_PREPROCESS_MAX_SIDE = int(os.environ.get('PADDLE_OCR_PREPROCESS_MAX_SIDE', '2560'))
 
 DEEPSEEK_OCR_API_URL = os.environ.get('DEEPSEEK_OCR_API_URL', 'http://deepseek-ocr:8002/inference')
-DEEPSEEK_OCR_RELEASE_URL = os.environ.get('DEEPSEEK_OCR_RELEASE_URL', DEEPSEEK_OCR_API_URL.rsplit('/', 1)[0] + '/release')
+DEEPSEEK_OCR_RELEASE_URL = os.environ.get('DEEPSEEK_OCR_RELEASE_URL', '')
 DEEPSEEK_OCR_API_TIMEOUT = int(os.environ.get('DEEPSEEK_OCR_API_TIMEOUT', '600'))
+DEEPSEEK_OCR_GPU = os.environ.get('DEEPSEEK_OCR_GPU', '0')
+DEEPSEEK_OCR_IDLE_TTL = float(os.environ.get('DEEPSEEK_OCR_IDLE_TTL', str(MODEL_IDLE_TTL)))
+DEEPSEEK_OCR_TRANSPORT = os.environ.get('DEEPSEEK_OCR_TRANSPORT', 'auto')
+DEEPSEEK_OCR_CONCURRENCY = int(os.environ.get('DEEPSEEK_OCR_CONCURRENCY', '1'))
+DEEPSEEK_OCR_MAX_QUEUE = int(os.environ.get('DEEPSEEK_OCR_MAX_QUEUE', '16'))
 DEEPSEEK_OCR_PROMPT = os.environ.get('DEEPSEEK_OCR_PROMPT', '<image>\n<|grounding|>Convert the document to markdown. ')
 DEEPSEEK_OCR_BASE_SIZE = int(os.environ.get('DEEPSEEK_OCR_BASE_SIZE', '1024'))
 DEEPSEEK_OCR_IMAGE_SIZE = int(os.environ.get('DEEPSEEK_OCR_IMAGE_SIZE', '768'))
 DEEPSEEK_OCR_CROP_MODE = os.environ.get('DEEPSEEK_OCR_CROP_MODE', 'true').lower() == 'true'
 DEEPSEEK_OCR_MAX_NEW_TOKENS = int(os.environ.get('DEEPSEEK_OCR_MAX_NEW_TOKENS', '8192'))
 DEEPSEEK_OCR_USE_CACHE = os.environ.get('DEEPSEEK_OCR_USE_CACHE', 'true').lower() == 'true'
+DEEPSEEK_OCR_PREPROCESS_MAX_SIDE = int(os.environ.get('DEEPSEEK_OCR_PREPROCESS_MAX_SIDE', '0' if DEEPSEEK_OCR_CROP_MODE else str(DEEPSEEK_OCR_BASE_SIZE)))
 
 DOCLAYOUT_API_URL = os.environ.get('DOCLAYOUT_API_URL', 'http://doclayout:8003/inference')
-DOCLAYOUT_RELEASE_URL = os.environ.get('DOCLAYOUT_RELEASE_URL', DOCLAYOUT_API_URL.rsplit('/', 1)[0] + '/release')
+DOCLAYOUT_RELEASE_URL = os.environ.get('DOCLAYOUT_RELEASE_URL', '')
 DOCLAYOUT_API_TIMEOUT = int(os.environ.get('DOCLAYOUT_API_TIMEOUT', '180'))
+DOCLAYOUT_GPU = os.environ.get('DOCLAYOUT_GPU', '0')
+DOCLAYOUT_IDLE_TTL = float(os.environ.get('DOCLAYOUT_IDLE_TTL', str(MODEL_IDLE_TTL)))
+DOCLAYOUT_BATCH_SIZE = int(os.environ.get('DOCLAYOUT_BATCH_SIZE', '8'))
+DOCLAYOUT_BATCH_WAIT_MS = float(os.environ.get('DOCLAYOUT_BATCH_WAIT_MS', '15'))
+DOCLAYOUT_BATCH_MODE = os.environ.get('DOCLAYOUT_BATCH_MODE', 'auto')
+DOCLAYOUT_TRANSPORT = os.environ.get('DOCLAYOUT_TRANSPORT', 'auto')
+DOCLAYOUT_CONCURRENCY = int(os.environ.get('DOCLAYOUT_CONCURRENCY', '8'))
+DOCLAYOUT_MAX_QUEUE = int(os.environ.get('DOCLAYOUT_MAX_QUEUE', '64'))
 DOCLAYOUT_IMAGE_SIZE = int(os.environ.get('DOCLAYOUT_IMAGE_SIZE', '1024'))
 DOCLAYOUT_CONFIDENCE = float(os.environ.get('DOCLAYOUT_CONFIDENCE', '0.2'))
 DOCLAYOUT_IOU = float(os.environ.get('DOCLAYOUT_IOU', '0.45'))
 DOCLAYOUT_MAX_DET = int(os.environ.get('DOCLAYOUT_MAX_DET', '300'))
+DOCLAYOUT_PREPROCESS_MAX_SIDE = int(os.environ.get('DOCLAYOUT_PREPROCESS_MAX_SIDE', str(DOCLAYOUT_IMAGE_SIZE)))
 
 AWESOMI_KEYVALUE_API_URL = os.environ.get('AWESOMI_KEYVALUE_API_URL', 'http://awesomi-api:8080/api/awesomi/keyvalue').strip()
 AWESOMI_KEYVALUE_API_TIMEOUT = int(os.environ.get('AWESOMI_KEYVALUE_API_TIMEOUT', '180'))
+AWESOMI_KEYVALUE_CONCURRENCY = int(os.environ.get('AWESOMI_KEYVALUE_CONCURRENCY', '2'))
+AWESOMI_KEYVALUE_MAX_QUEUE = int(os.environ.get('AWESOMI_KEYVALUE_MAX_QUEUE', '16'))
+KEYVALUE_TEMPLATE_ENABLED = os.environ.get('KEYVALUE_TEMPLATE_ENABLED', 'true').lower() == 'true'
+KEYVALUE_TEMPLATE_DIR = Path(os.environ.get('KEYVALUE_TEMPLATE_DIR', str(UPLOAD_DIR / 'keyvalue_templates')))
+KEYVALUE_TEMPLATE_SIMILARITY = float(os.environ.get('KEYVALUE_TEMPLATE_SIMILARITY', '0.85'))
+KEYVALUE_TEMPLATE_MIN_SAMPLES = int(os.environ.get('KEYVALUE_TEMPLATE_MIN_SAMPLES', '2'))
+KEYVALUE_TEMPLATE_VERIFY_INTERVAL = int(os.environ.get('KEYVALUE_TEMPLATE_VERIFY_INTERVAL', '50'))
+KEYVALUE_TEMPLATE_MAX_TEMPLATES = int(os.environ.get('KEYVALUE_TEMPLATE_MAX_TEMPLATES', '1000'))
+
+# 종료 신호를 받은 worker가 진행 중인 모델 호출을 끝낼 때까지 기다리는 시간. 가장 긴 모델 timeout보다 길게 잡는다.
+APP_GRACEFUL_TIMEOUT = int(os.environ.get('APP_GRACEFUL_TIMEOUT', str(
+    max(PADDLE_OCR_API_TIMEOUT, DEEPSEEK_OCR_API_TIMEOUT, DOCLAYOUT_API_TIMEOUT, AWESOMI_KEYVALUE_API_TIMEOUT) + 30
+)))
+# 종료할 때 배치 작업은 새 이미지를 읽지 않고 이미 보낸 모델 호출이 끝날 때까지만 기다린다.
+BULK_JOB_DRAIN_TIMEOUT = float(os.environ.get('BULK_JOB_DRAIN_TIMEOUT', str(max(0.0, APP_GRACEFUL_TIMEOUT - 30))))
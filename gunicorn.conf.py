@@ -0,0 +1,37 @@
+"""gunicorn 운영 실행 설정 (`gunicorn -c gunicorn.conf.py app:app`)."""
+
+import os
+
+from config import APP_GRACEFUL_TIMEOUT, APP_WORKERS
+
+debug_mode = os.environ.get('APP_DEBUG', '0') == '1'
+
+bind = f"0.0.0.0:{os.environ.get('APP_PORT', '5001')}"
+worker_class = 'uvicorn_worker.UvicornWorker'
+# 개발 모드는 코드 변경을 다시 읽어야 하므로 worker 하나로 reload만 켠다.
+workers = 1 if debug_mode else max(1, APP_WORKERS)
+reload = debug_mode
+# app import(FastAPI, PIL, numpy, route 등록)를 master에서 한 번만 하고 worker는 fork로 바로 뜬다.
+preload_app = not debug_mode
+# 종료 신호를 받으면 새 요청은 받지 않고, 진행 중인 모델 호출이 끝날 때까지 이 시간만큼 기다린다.
+graceful_timeout = APP_GRACEFUL_TIMEOUT
+keepalive = 5
+accesslog = '-'
+
+
+def on_starting(server):
+    # 이전 실행에서 남은 worker 상태(자리, GPU 주인, metrics)를 지우고 시작한다.
+    from utils.shared_state import shared_state
+
+    if shared_state is not None:
+        shared_state.reset()
+
+
+def child_exit(server, worker):
+    # 죽거나 재시작된 worker가 잡고 있던 대기열 자리와 GPU 사용 기록을 바로 돌려준다.
+    from utils.shared_state import shared_state
+
+    if shared_state is not None:
+        shared_state.clear_process(worker.pid)
+        # 다음에 fork되는 worker가 master의 SQLite connection을 물려받지 않도록 바로 닫는다.
+        shared_state.close()
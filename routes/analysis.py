@@ -0,0 +1,212 @@
+import asyncio
+import math
+import time
+
+from fastapi import APIRouter, Request
+
+from config import ANALYSIS_MODEL_TIMEOUT
+from routes.keyvalue import (
+    extract_keyvalue_labeling_result,
+    get_keyvalue_model_label,
+    normalize_keyvalue_model,
+)
+from routes.layout import (
+    extract_layout_labeling_result,
+    get_layout_model_label,
+    normalize_layout_model,
+    read_layout_error,
+)
+from services.deepseek_ocr import (
+    extract_deepseek_labeling_result,
+    get_deepseek_error_status_code,
+    read_deepseek_error,
+)
+from services.paddle_ocr import extract_paddle_labeling_result
+from services.utils.admission import AdmissionRejectedError
+from services.utils.keyvalue import read_keyvalue_http_error
+from services.utils.upstream import UpstreamConnectionError, UpstreamHTTPError
+from utils.box_fusion import fuse_labeling_boxes
+from utils.metrics import measure_stage
+from utils.responses import json_response
+from utils.result_cache import is_cache_bypass_requested
+from utils.uploads import read_labeling_upload
+
+analysis_router = APIRouter()
+
+ANALYSIS_MODEL_LABELS = {
+    'layout': 'DocLayout-YOLO',
+    'paddle_ocr': 'Paddle OCR',
+    'deepseek_ocr': 'DeepSeek OCR',
+    'keyvalue': 'Key-Value'
+}
+DEFAULT_ANALYSIS_MODELS = ['layout', 'paddle_ocr', 'keyvalue']
+
+
+@analysis_router.post('/api/labeling/analyze')
+async def analyze_image_for_labeling(request: Request):
+    uploaded_image = await read_labeling_upload(request)
+    form = uploaded_image.fields
+    selected_models = read_analysis_models(form.get('models'))
+    if not selected_models:
+        return json_response({
+            'success': False,
+            'error': f"models에는 {', '.join(ANALYSIS_MODEL_LABELS)} 중 하나 이상이 필요합니다."
+        }, status_code=400)
+
+    image_filename = uploaded_image.filename
+    image_bytes = uploaded_image.image_bytes
+    image_width, image_height = uploaded_image.image_probe.display_size
+    analysis_options = {
+        'image_probe': uploaded_image.image_probe,
+        'image_hash': uploaded_image.image_hash,
+        'bypass_cache': is_cache_bypass_requested(form)
+    }
+    model_timeout = read_analysis_timeout(form.get('timeout'))
+    if model_timeout is None:
+        return json_response({'success': False, 'error': 'timeout은 유한한 숫자여야 합니다.'}, status_code=400)
+    keyvalue_model = normalize_keyvalue_model(form.get('keyvalueModel'))
+    include_raw = str(form.get('includeRaw', '')).lower() == 'true'
+    layout_model = normalize_layout_model(form.get('layoutModel'))
+    fusion_requested = str(form.get('fusion', '')).lower() == 'true'
+
+    model_requests = {
+        'layout': lambda: extract_layout_labeling_result(
+            image_filename,
+            image_bytes,
+            layout_model,
+            **analysis_options
+        ),
+        'paddle_ocr': lambda: extract_paddle_labeling_result(image_filename, image_bytes, **analysis_options),
+        'deepseek_ocr': lambda: extract_deepseek_labeling_result(image_filename, image_bytes, **analysis_options),
+        'keyvalue': lambda: extract_keyvalue_labeling_result(
+            image_filename,
+            image_bytes,
+            keyvalue_model,
+            include_raw,
+            bypass_cache=analysis_options['bypass_cache'],
+            image_hash=analysis_options['image_hash']
+        )
+    }
+    error_readers = {
+        'layout': lambda error: read_layout_error(error, get_layout_model_label(layout_model)),
+        'deepseek_ocr': read_deepseek_error,
+        'keyvalue': lambda error: read_keyvalue_http_error(error, get_keyvalue_model_label(keyvalue_model))
+    }
+
+    model_sections = await asyncio.gather(*[
+        run_analysis_model(model_key, model_requests[model_key], model_timeout, error_readers.get(model_key))
+        for model_key in selected_models
+    ])
+    model_results = dict(zip(selected_models, model_sections))
+    failed_models = [model_key for model_key, model_section in model_results.items() if not model_section['success']]
+
+    analysis_result = {
+        'success': len(failed_models) < len(selected_models),
+        'partial': 0 < len(failed_models) < len(selected_models),
+        'displayType': 'bbox_overlay',
+        'image': {
+            'filename': image_filename,
+            'width': image_width,
+            'height': image_height
+        },
+        'models': model_results,
+        'failedModels': failed_models,
+        'timings': {model_key: model_section['seconds'] for model_key, model_section in model_results.items()}
+    }
+
+    if fusion_requested:
+        fusion_result = build_analysis_fusion(model_results)
+        if fusion_result is not None:
+            analysis_result['fusion'] = fusion_result
+
+    # 모든 모델이 실패했을 때만 첫 실패의 status code를 그대로 돌려준다.
+    if not analysis_result['success']:
+        return json_response(analysis_result, status_code=model_results[failed_models[0]]['status'])
+
+    return json_response(analysis_result)
+
+
+async def run_analysis_model(model_key, request_model, model_timeout, read_http_error=None):
+    model_label = ANALYSIS_MODEL_LABELS[model_key]
+    started_at = time.perf_counter()
+    try:
+        with measure_stage(model_key):
+            if model_timeout > 0:
+                model_result = await asyncio.wait_for(request_model(), model_timeout)
+            else:
+                model_result = await request_model()
+    except asyncio.TimeoutError:
+        model_section = build_analysis_error(504, f'{model_label} 응답 시간 초과 ({model_timeout:g}초)')
+    except AdmissionRejectedError as error:
+        model_section = {**build_analysis_error(429, str(error)), 'retryAfter': error.retry_after}
+    except UpstreamHTTPError as error:
+        error_message = read_http_error(error) if read_http_error else f'{model_label} 오류: HTTP {error.status_code}'
+        model_section = build_analysis_error(error.status_code, error_message)
+    except UpstreamConnectionError as error:
+        model_section = build_analysis_error(error.status_code, f'{model_label} 연결 실패: {error.reason}')
+    except RuntimeError as error:
+        model_section = build_analysis_error(get_deepseek_error_status_code(error), f'{model_label} 오류: {error}')
+    except Exception as error:
+        # 한 모델의 예상하지 못한 실패가 다른 모델 결과까지 버리지 않도록 여기서 멈춘다.
+        model_section = build_analysis_error(500, f'{model_label} 오류: {type(error).__name__}: {error}')
+    else:
+        model_section = {'success': True, **model_result}
+
+    model_section['seconds'] = round(time.perf_counter() - started_at, 4)
+    return model_section
+
+
+def build_analysis_fusion(model_results):
+    # layout region 안에 OCR 글자 줄을 넣고, 두 OCR 모델이 같은 줄을 찾았으면 Paddle 쪽을 남긴다.
+    layout_section = model_results.get('layout') or {}
+    region_boxes = layout_section.get('boxes', []) if layout_section.get('success') else []
+    line_box_groups = [
+        (model_key, model_results[model_key].get('boxes', []))
+        for model_key in ('paddle_ocr', 'deepseek_ocr')
+        if model_results.get(model_key, {}).get('success')
+    ]
+    if not region_boxes and not any(line_boxes for _, line_boxes in line_box_groups):
+        return None
+
+    return fuse_labeling_boxes(region_boxes, line_box_groups)
+
+
+def build_analysis_error(status_code, error_message):
+    return {
+        'success': False,
+        'status': status_code,
+        'error': error_message
+    }
+
+
+def read_analysis_models(raw_models):
+    if raw_models is None or not str(raw_models).strip():
+        return list(DEFAULT_ANALYSIS_MODELS)
+
+    selected_models = []
+    for raw_model in str(raw_models).split(','):
+        model_key = raw_model.strip().lower().replace('-', '_')
+        if model_key not in ANALYSIS_MODEL_LABELS:
+            return []
+        if model_key not in selected_models:
+            selected_models.append(model_key)
+
+    return selected_models
+
+
+def read_analysis_timeout(raw_timeout):
+    # 요청에서 더 짧은 timeout만 줄 수 있고, 설정값보다 길게 기다리지는 않는다.
+    try:
+        requested_timeout = float(raw_timeout)
+    except (TypeError, ValueError):
+        return ANALYSIS_MODEL_TIMEOUT
+
+    # nan은 모든 비교가 False라 아래 검사를 통과해 버리므로 따로 거른다.
+    if not math.isfinite(requested_timeout):
+        return None
+    if requested_timeout <= 0:
+        return ANALYSIS_MODEL_TIMEOUT
+    if ANALYSIS_MODEL_TIMEOUT <= 0:
+        return requested_timeout
+
+    return min(requested_timeout, ANALYSIS_MODEL_TIMEOUT)
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from pathlib import Path
+
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from config import DOCUMENT_MAX_BYTES, DOCUMENT_PAGE_WINDOW
+from routes.analysis import build_analysis_error, read_analysis_timeout, run_analysis_model
+from routes.layout import (
+    extract_layout_labeling_result,
+    get_layout_model_label,
+    normalize_layout_model,
+    read_layout_error,
+)
+from services.deepseek_ocr import extract_deepseek_labeling_result, read_deepseek_error
+from services.paddle_ocr import extract_paddle_labeling_result
+from services.utils.admission import ADMISSION_PRIORITY_BULK
+from utils.documents import DocumentError, document_rasterizer, read_page_indexes
+from utils.image_probe import ImageProbeError
+from utils.metrics import record_box_count
+from utils.responses import format_labeling_stream_events, json_response
+from utils.result_cache import is_cache_bypass_requested
+from utils.uploads import read_labeling_upload
+
+document_router = APIRouter()
+DOCUMENT_MODELS = ['paddle_ocr', 'deepseek_ocr', 'layout']
+
+
+@document_router.post('/api/labeling/document')
+async def stream_document_for_labeling(request: Request):
+    uploaded_document = await read_labeling_upload(request, max_bytes=DOCUMENT_MAX_BYTES, probe=False)
+    form = uploaded_document.fields
+    model_key = read_document_model(form.get('model'))
+    use_event_stream = 'text/event-stream' in request.headers.get('accept', '')
+    model_timeout = read_analysis_timeout(form.get('timeout'))
+    if model_timeout is None:
+        return json_response({'success': False, 'error': 'timeout은 유한한 숫자여야 합니다.'}, status_code=400)
+
+    # stream이 시작된 뒤에는 status code를 바꿀 수 없으므로 문서 형식과 page 범위는 먼저 확인한다.
+    opened_document = await document_rasterizer.open_document(uploaded_document.image_bytes, uploaded_document.filename)
+    try:
+        page_indexes = read_page_indexes(form.get('pages'), opened_document.page_count)
+    except DocumentError:
+        opened_document.close()
+        raise
+
+    document_events = stream_document_labeling_events(
+        opened_document,
+        page_indexes,
+        model_key,
+        layout_model=normalize_layout_model(form.get('layoutModel')),
+        bypass_cache=is_cache_bypass_requested(form),
+        model_timeout=model_timeout
+    )
+
+    return DocumentStreamingResponse(
+        opened_document,
+        format_labeling_stream_events(document_events, use_event_stream),
+        media_type='text/event-stream' if use_event_stream else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+class DocumentStreamingResponse(StreamingResponse):
+    # generator의 finally는 body를 한 번이라도 읽어야 실행되므로, 첫 event 전에 client가 끊겨도
+    # 임시 파일이 남지 않게 응답이 끝나면 항상 문서를 닫는다. close는 여러 번 불러도 된다.
+    def __init__(self, opened_document, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened_document = opened_document
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.opened_document.close()
+
+
+async def stream_document_labeling_events(opened_document, page_indexes, model_key, layout_model, bypass_cache, model_timeout):
+    yield {
+        'event': 'start',
+        'displayType': 'bbox_overlay',
+        'filename': opened_document.document_filename,
+        'format': opened_document.document_kind.upper(),
+        'model': model_key,
+        'pageCount': opened_document.page_count,
+        'pages': [page_index + 1 for page_index in page_indexes]
+    }
+
+    # page마다 render와 추론을 한 task로 묶고, 동시에 DOCUMENT_PAGE_WINDOW개까지만 띄운다.
+    # 앞 page가 모델을 기다리는 동안 뒤 page가 process pool에서 그려지고, 문서가 길어도 메모리에는 window만큼만 남는다.
+    pending_indexes = iter(page_indexes)
+    page_tasks = set()
+    failed_pages = []
+    box_count = 0
+
+    def start_next_page():
+        page_index = next(pending_indexes, None)
+        if page_index is not None:
+            page_tasks.add(asyncio.ensure_future(
+                run_document_page(opened_document, page_index, model_key, layout_model, bypass_cache, model_timeout)
+            ))
+
+    try:
+        for _ in range(max(1, DOCUMENT_PAGE_WINDOW)):
+            start_next_page()
+
+        while page_tasks:
+            finished_tasks, page_tasks = await asyncio.wait(page_tasks, return_when=asyncio.FIRST_COMPLETED)
+            for finished_task in sorted(finished_tasks, key=lambda page_task: page_task.result()['page']):
+                start_next_page()
+                page_event = finished_task.result()
+                if page_event['success']:
+                    box_count += len(page_event.get('boxes', []))
+                else:
+                    failed_pages.append(page_event['page'])
+                yield page_event
+    finally:
+        # client가 연결을 끊으면 아직 남은 page의 render와 모델 호출을 멈추고 임시 파일을 지운다.
+        # 취소된 뒤에는 await마다 다시 취소될 수 있으므로 임시 파일은 기다리기 전에 지운다.
+        for page_task in page_tasks:
+            page_task.cancel()
+        opened_document.close()
+        await asyncio.gather(*page_tasks, return_exceptions=True)
+
+    record_box_count(box_count)
+    yield {
+        'event': 'done',
+        'pageCount': len(page_indexes),
+        'failedPages': sorted(failed_pages),
+        'boxCount': box_count
+    }
+
+
+async def run_document_page(opened_document, page_index, model_key, layout_model, bypass_cache, model_timeout):
+    page_number = page_index + 1
+    started_at = time.perf_counter()
+    try:
+        document_page = await opened_document.render_page(page_index)
+    except ImageProbeError as error:
+        page_section = build_analysis_error(error.status_code, str(error))
+        page_section['renderSeconds'] = round(time.perf_counter() - started_at, 4)
+    except Exception as error:
+        page_section = build_analysis_error(422, f'{page_number} page를 그릴 수 없습니다: {type(error).__name__}: {error}')
+        page_section['renderSeconds'] = round(time.perf_counter() - started_at, 4)
+    else:
+        page_filename = f'{Path(opened_document.document_filename).stem}-p{page_number:04d}.png'
+        page_section = await run_analysis_model(
+            model_key,
+            build_page_request(model_key, page_filename, document_page, layout_model, bypass_cache),
+            model_timeout,
+            build_page_error_reader(model_key, layout_model)
+        )
+        page_section['renderSeconds'] = round(document_page.render_seconds, 4)
+
+    return {'event': 'page', 'page': page_number, **page_section}
+
+
+def build_page_request(model_key, page_filename, document_page, layout_model, bypass_cache):
+    # 문서 한 건이 page를 수백 개 보낼 수 있으므로 단일 이미지 요청보다 뒤로 줄을 세운다.
+    page_options = {
+        'bypass_cache': bypass_cache,
+        'priority': ADMISSION_PRIORITY_BULK,
+        'image_probe': document_page.image_probe
+    }
+    if model_key == 'layout':
+        return lambda: extract_layout_labeling_result(page_filename, document_page.image_bytes, layout_model, **page_options)
+    if model_key == 'deepseek_ocr':
+        return lambda: extract_deepseek_labeling_result(page_filename, document_page.image_bytes, **page_options)
+
+    return lambda: extract_paddle_labeling_result(page_filename, document_page.image_bytes, **page_options)
+
+
+def build_page_error_reader(model_key, layout_model):
+    if model_key == 'layout':
+        return lambda error: read_layout_error(error, get_layout_model_label(layout_model))
+    if model_key == 'deepseek_ocr':
+        return read_deepseek_error
+
+    return None
+
+
+def read_document_model(raw_model):
+    model_key = str(raw_model or 'paddle_ocr').strip().lower().replace('-', '_')
+    if model_key not in DOCUMENT_MODELS:
+        raise DocumentError(f"model에는 {', '.join(DOCUMENT_MODELS)} 중 하나가 필요합니다.")
+
+    return model_key
@@ -1,60 +1,111 @@
-import urllib.error
-from pathlib import Path
-
 from fastapi import APIRouter, Request
 
-from config import AWESOMI_KEYVALUE_API_TIMEOUT, AWESOMI_KEYVALUE_API_URL
+from config import (
+    AWESOMI_KEYVALUE_API_TIMEOUT,
+    AWESOMI_KEYVALUE_API_URL,
+    AWESOMI_KEYVALUE_CONCURRENCY,
+    AWESOMI_KEYVALUE_MAX_QUEUE,
+)
+from services.utils.admission import register_admission_queue
+from services.utils.endpoints import register_endpoint_pool
 from services.utils.keyvalue import read_keyvalue_http_error
 from services.utils.keyvalue import request_keyvalue_model
+from services.utils.upstream import UpstreamConnectionError, UpstreamHTTPError
 from utils.responses import json_response
+from utils.result_cache import hash_image_bytes, is_cache_bypass_requested, read_cached_model_response
+from utils.result_store import record_labeling_result
+from utils.template_index import keyvalue_template_index
+from utils.uploads import read_labeling_upload
 
 
 keyvalue_router = APIRouter()
 QWEN_KEYVALUE_MODEL = 'qwen-vlm'
 GPT_KEYVALUE_MODEL = 'gpt'
 DEFAULT_KEYVALUE_MODEL = QWEN_KEYVALUE_MODEL
+keyvalue_endpoints = register_endpoint_pool('keyvalue', AWESOMI_KEYVALUE_API_URL, use_release=False)
+register_admission_queue(
+    'keyvalue',
+    AWESOMI_KEYVALUE_CONCURRENCY * max(1, len(keyvalue_endpoints.endpoints)),
+    AWESOMI_KEYVALUE_MAX_QUEUE
+)
 
 
 @keyvalue_router.post('/api/labeling/keyvalue')
 async def extract_keyvalue_for_labeling(request: Request):
-    form = await request.form()
+    uploaded_image = await read_labeling_upload(request)
+    include_raw = str(uploaded_image.fields.get('includeRaw', '')).lower() == 'true'
+    selected_model = normalize_keyvalue_model(uploaded_image.fields.get('model'))
 
-    if 'image' not in form:
-        return json_response({'success': False, 'error': '이미지가 필요합니다.'}, status_code=400)
+    try:
+        keyvalue_labeling_result = await extract_keyvalue_labeling_result(
+            uploaded_image.filename,
+            uploaded_image.image_bytes,
+            selected_model,
+            include_raw,
+            bypass_cache=is_cache_bypass_requested(uploaded_image.fields),
+            image_hash=uploaded_image.image_hash
+        )
+    except UpstreamHTTPError as error:
+        api_name = get_keyvalue_model_label(selected_model)
+        return json_response({'success': False, 'error': read_keyvalue_http_error(error, api_name)}, status_code=error.status_code)
+    except UpstreamConnectionError as error:
+        api_name = get_keyvalue_model_label(selected_model)
+        return json_response({'success': False, 'error': f'{api_name} 연결 실패: {error.reason}'}, status_code=error.status_code)
 
-    uploaded_image = form['image']
-    if uploaded_image.filename == '':
-        return json_response({'success': False, 'error': '이미지가 선택되지 않았습니다.'}, status_code=400)
+    return json_response({
+        'success': True,
+        **keyvalue_labeling_result
+    })
 
-    image_bytes = await uploaded_image.read()
-    if not image_bytes:
-        return json_response({'success': False, 'error': '빈 이미지 파일입니다.'}, status_code=400)
 
-    image_filename = Path(uploaded_image.filename).name
-    include_raw = str(form.get('includeRaw', '')).lower() == 'true'
-    selected_model = normalize_keyvalue_model(form.get('model'))
+async def extract_keyvalue_labeling_result(
+    image_filename,
+    image_bytes,
+    selected_model=DEFAULT_KEYVALUE_MODEL,
+    include_raw=False,
+    bypass_cache=False,
+    image_hash=None
+):
+    image_hash = image_hash or hash_image_bytes(image_bytes)
 
-    try:
-        keyvalue_response = request_keyvalue_model(
-            AWESOMI_KEYVALUE_API_URL,
+    def request_model():
+        return request_keyvalue_model(
+            keyvalue_endpoints,
             AWESOMI_KEYVALUE_API_TIMEOUT,
             image_filename,
             image_bytes,
             selected_model,
             include_raw
         )
-    except urllib.error.HTTPError as error:
-        api_name = get_keyvalue_model_label(selected_model)
-        return json_response({'success': False, 'error': read_keyvalue_http_error(error, api_name)}, status_code=error.code)
-    except urllib.error.URLError as error:
-        api_name = get_keyvalue_model_label(selected_model)
-        return json_response({'success': False, 'error': f'{api_name} 연결 실패: {error.reason}'}, status_code=502)
 
-    return json_response({
-        'success': True,
+    async def request_template_or_model():
+        # raw 값은 문서마다 다르므로 key 목록만 필요할 때만 이미 아는 양식으로 모델 호출을 건너뛴다.
+        if include_raw:
+            return await request_model()
+
+        return await keyvalue_template_index.get_or_extract(
+            f'keyvalue-{selected_model}',
+            image_bytes,
+            request_model,
+            bypass_template=bypass_cache
+        )
+
+    keyvalue_response = await read_cached_model_response(
+        f'keyvalue-{selected_model}',
+        image_bytes,
+        {'include_raw': include_raw},
+        request_template_or_model,
+        bypass_cache=bypass_cache,
+        image_hash=image_hash
+    )
+
+    keyvalue_labeling_result = {
         'selectedModel': selected_model,
         **keyvalue_response
-    })
+    }
+
+    record_labeling_result(f'keyvalue-{selected_model}', image_filename, image_bytes, keyvalue_labeling_result, image_hash=image_hash)
+    return keyvalue_labeling_result
 
 
 def normalize_keyvalue_model(selected_model):
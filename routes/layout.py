@@ -1,10 +1,16 @@
 import json
-import urllib.error
-from pathlib import Path
 from fastapi import APIRouter, Request
-from services.doclayout import request_doclayout
-from utils.labeling_boxes import build_labeling_boxes, read_image_size
+from config import DOCLAYOUT_PREPROCESS_MAX_SIDE
+from services.doclayout import DOCLAYOUT_MODEL_NAME, read_doclayout_predict_options, request_doclayout
+from services.utils.admission import ADMISSION_PRIORITY_INTERACTIVE, admit
+from services.utils.upstream import UpstreamConnectionError, UpstreamHTTPError
+from utils.image_preprocess import image_preprocessor, plan_image_preprocess
+from utils.image_probe import probe_image
+from utils.labeling_boxes import build_labeling_boxes
 from utils.responses import json_response
+from utils.result_cache import hash_image_bytes, is_cache_bypass_requested, read_cached_model_response
+from utils.result_store import record_labeling_result
+from utils.uploads import read_labeling_upload
 
 layout_router = APIRouter()
 
@@ -13,34 +19,28 @@ DEFAULT_LAYOUT_MODEL = 'doclayout-yolo'
 
 @layout_router.post('/api/labeling/layout')
 async def extract_layout_for_labeling(request: Request):
-    form = await request.form()
-
-    if 'image' not in form:
-        return json_response({'success': False, 'error': '이미지가 필요합니다.'}, status_code=400)
-
-    uploaded_image = form['image']
-    if uploaded_image.filename == '':
-        return json_response({'success': False, 'error': '이미지가 선택되지 않았습니다.'}, status_code=400)
-
-    image_bytes = await uploaded_image.read()
-    if not image_bytes:
-        return json_response({'success': False, 'error': '빈 이미지 파일입니다.'}, status_code=400)
-
-    image_filename = Path(uploaded_image.filename).name
-    selected_model = normalize_layout_model(form.get('model'))
+    uploaded_image = await read_labeling_upload(request)
+    selected_model = normalize_layout_model(uploaded_image.fields.get('model'))
 
     try:
-        layout_labeling_result = extract_layout_labeling_result(image_filename, image_bytes, selected_model)
-    except urllib.error.HTTPError as error:
+        layout_labeling_result = await extract_layout_labeling_result(
+            uploaded_image.filename,
+            uploaded_image.image_bytes,
+            selected_model,
+            bypass_cache=is_cache_bypass_requested(uploaded_image.fields),
+            image_probe=uploaded_image.image_probe,
+            image_hash=uploaded_image.image_hash
+        )
+    except UpstreamHTTPError as error:
         return json_response({
             'success': False,
             'error': read_layout_error(error, get_layout_model_label(selected_model))
-        }, status_code=error.code)
-    except urllib.error.URLError as error:
+        }, status_code=error.status_code)
+    except UpstreamConnectionError as error:
         return json_response({
             'success': False,
             'error': f'{get_layout_model_label(selected_model)} 연결 실패: {error.reason}'
-        }, status_code=502)
+        }, status_code=error.status_code)
 
     return json_response({
         'success': True,
@@ -48,13 +48,31 @@ async def extract_layout_for_labeling(request: Request):
     })
 
 
-def extract_layout_labeling_result(image_filename, image_bytes, selected_model=DEFAULT_LAYOUT_MODEL, release_after_inference=True):
-    image_width, image_height = read_image_size(image_bytes)
-    layout_response = request_layout_model(selected_model, image_bytes, release_after_inference)
+async def extract_layout_labeling_result(
+    image_filename,
+    image_bytes,
+    selected_model=DEFAULT_LAYOUT_MODEL,
+    release_after_inference=None,
+    bypass_cache=False,
+    priority=ADMISSION_PRIORITY_INTERACTIVE,
+    image_probe=None,
+    image_hash=None
+):
+    image_probe = image_probe or probe_image(image_bytes)
+    image_hash = image_hash or hash_image_bytes(image_bytes)
+    image_width, image_height = image_probe.display_size
+    preprocess_plan = plan_image_preprocess(image_probe, read_layout_preprocess_max_side(selected_model))
+    layout_response = await read_cached_model_response(
+        selected_model,
+        image_bytes,
+        preprocess_plan.build_model_options(read_layout_predict_options(selected_model)),
+        lambda: request_preprocessed_layout_model(selected_model, image_bytes, preprocess_plan, release_after_inference, priority),
+        bypass_cache=bypass_cache,
+        image_hash=image_hash
+    )
     layout_boxes = read_layout_boxes(selected_model, layout_response)
-    labeling_boxes = build_labeling_boxes(layout_boxes, image_width, image_height, 'layout')
-
-    return {
+    labeling_boxes = build_labeling_boxes(layout_boxes, image_width, image_height, 'layout', preprocess_plan.bbox_scale)
+    layout_labeling_result = {
         'model': layout_response.get('model', get_layout_model_label(selected_model)),
         'selectedModel': selected_model,
         'displayType': 'bbox_overlay',
@@ -66,6 +84,9 @@ def extract_layout_labeling_result(image_filename, image_bytes, selected_model=D
         'boxes': labeling_boxes
     }
 
+    record_labeling_result(selected_model, image_filename, image_bytes, layout_labeling_result, image_hash=image_hash)
+    return layout_labeling_result
+
 
 def normalize_layout_model(selected_model):
     return DEFAULT_LAYOUT_MODEL
@@ -75,8 +96,28 @@ def get_layout_model_label(selected_model):
     return 'DocLayout-YOLO'
 
 
-def request_layout_model(selected_model, image_bytes, release_after_inference=True):
-    return request_doclayout(image_bytes, release_after_inference)
+def read_layout_predict_options(selected_model):
+    return read_doclayout_predict_options()
+
+
+def read_layout_preprocess_max_side(selected_model):
+    return DOCLAYOUT_PREPROCESS_MAX_SIDE
+
+
+async def request_preprocessed_layout_model(
+    selected_model,
+    image_bytes,
+    preprocess_plan,
+    release_after_inference=None,
+    priority=ADMISSION_PRIORITY_INTERACTIVE
+):
+    async with admit(DOCLAYOUT_MODEL_NAME, priority):
+        model_image_bytes = await image_preprocessor.preprocess(image_bytes, preprocess_plan)
+        return await request_layout_model(selected_model, model_image_bytes, release_after_inference)
+
+
+async def request_layout_model(selected_model, image_bytes, release_after_inference=None):
+    return await request_doclayout(image_bytes, release_after_inference)
 
 
 def read_layout_boxes(selected_model, layout_response):
@@ -85,13 +126,13 @@ def read_layout_boxes(selected_model, layout_response):
 
 def read_layout_error(error, api_name='DocLayout-YOLO'):
     try:
-        error_payload = json.loads(error.read().decode('utf-8'))
+        error_payload = json.loads(error.body.decode('utf-8'))
     except (json.JSONDecodeError, UnicodeDecodeError):
-        return f'{api_name} API 오류: HTTP {error.code}'
+        return f'{api_name} API 오류: HTTP {error.status_code}'
 
     if isinstance(error_payload, dict):
         detail = error_payload.get('detail') or error_payload.get('error')
         if detail:
             return str(detail)
 
-    return f'{api_name} API 오류: HTTP {error.code}'
+    return f'{api_name} API 오류: HTTP {error.status_code}'
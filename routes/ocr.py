@@ -1,9 +1,12 @@
 from fastapi import APIRouter
 
-from services.deepseek_ocr import deepseek_ocr_router
-from services.paddle_ocr import paddle_ocr_router
+from services.bulk_jobs import create_bulk_job_router
+from services.deepseek_ocr import deepseek_ocr_router, extract_deepseek_labeling_result
+from services.paddle_ocr import extract_paddle_labeling_result, paddle_ocr_router
 
 
 ocr_router = APIRouter()
 ocr_router.include_router(deepseek_ocr_router)
 ocr_router.include_router(paddle_ocr_router)
+ocr_router.include_router(create_bulk_job_router('deepseek_ocr', extract_deepseek_labeling_result))
+ocr_router.include_router(create_bulk_job_router('paddle_ocr', extract_paddle_labeling_result))
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Query
+
+from utils.responses import json_response
+from utils.result_store import RESULT_SEARCH_MAX_LIMIT, ResultSearchError, labeling_result_store
+
+result_router = APIRouter()
+DEFAULT_RESULT_SEARCH_LIMIT = 50
+
+
+@result_router.get('/api/labeling/results')
+def result_store_status():
+    return labeling_result_store.read_stats()
+
+
+@result_router.get('/api/labeling/results/search')
+def search_labeling_results(
+    q: str = '',
+    box_type: str = Query('', alias='type'),
+    model: str = '',
+    region: str = '',
+    cursor: int | None = None,
+    limit: int = DEFAULT_RESULT_SEARCH_LIMIT
+):
+    if not labeling_result_store.enabled:
+        return json_response({'success': False, 'error': '결과 저장소가 꺼져 있습니다.'}, status_code=503)
+
+    try:
+        search_result = labeling_result_store.search(
+            text=q.strip() or None,
+            box_type=box_type.strip() or None,
+            model_name=model.strip() or None,
+            region=read_search_region(region),
+            before=cursor,
+            limit=min(max(1, limit), RESULT_SEARCH_MAX_LIMIT)
+        )
+    except ResultSearchError as error:
+        return json_response({'success': False, 'error': str(error)}, status_code=error.status_code)
+
+    return json_response({'success': True, **search_result})
+
+
+@result_router.get('/api/labeling/results/{image_hash}')
+def read_labeling_results(image_hash: str, model: str = ''):
+    if not labeling_result_store.enabled:
+        return json_response({'success': False, 'error': '결과 저장소가 꺼져 있습니다.'}, status_code=503)
+
+    stored_results = labeling_result_store.read_results(image_hash.lower(), model.strip() or None)
+    if not stored_results:
+        return json_response({'success': False, 'error': '저장된 결과를 찾을 수 없습니다.'}, status_code=404)
+
+    return json_response({'success': True, 'imageHash': image_hash.lower(), 'results': stored_results})
+
+
+def read_search_region(raw_region):
+    if not raw_region.strip():
+        return None
+
+    try:
+        region = [float(coordinate) for coordinate in raw_region.split(',')]
+    except ValueError:
+        region = []
+
+    if len(region) != 4 or not all(0.0 <= coordinate <= 1.0 for coordinate in region) or region[0] > region[2] or region[1] > region[3]:
+        raise ResultSearchError('region은 0~1 사이의 left,top,right,bottom 네 값이어야 합니다.')
+
+    return region
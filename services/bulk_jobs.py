@@ -0,0 +1,514 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse
+
+from config import (
+    BULK_JOB_CONCURRENCY,
+    BULK_JOB_DRAIN_TIMEOUT,
+    BULK_JOB_MAX_CONCURRENCY,
+    BULK_JOB_STATE_DIR,
+    SERVER_BULK_OUTPUT_ROOT,
+    SERVER_FOLDER_ROOT,
+)
+from services.utils.admission import ADMISSION_PRIORITY_BULK
+from utils.responses import dump_json_bytes, json_response
+from utils.result_cache import hash_image_bytes
+from utils.shared_state import shared_state
+
+BULK_IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp'}
+BULK_JOB_CHECKPOINT_INTERVAL = 2.0
+BULK_JOB_MAX_RECORDED_FAILURES = 100
+BULK_JOB_RUNNING = 'running'
+BULK_JOB_STOPPING = 'stopping'
+BULK_JOB_STOPPED = 'stopped'
+BULK_JOB_COMPLETED = 'completed'
+BULK_JOB_FAILED = 'failed'
+
+bulk_jobs = {}
+bulk_job_extractors = {}
+
+
+class BulkJob:
+    def __init__(self, job_id, model_key, input_folder, output_folder, image_paths, concurrency, recursive=False):
+        self.job_id = job_id
+        self.model_key = model_key
+        self.input_folder = Path(input_folder)
+        self.output_folder = Path(output_folder)
+        self.image_paths = image_paths
+        self.concurrency = concurrency
+        self.recursive = recursive
+        self.status = BULK_JOB_RUNNING
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.finished_at = None
+        self.error = None
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.failures = []
+        self.session_started_at = None
+        self.session_processed = 0
+        self.last_checkpoint_at = 0.0
+        self.draining = False
+        self.task = None
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint):
+        bulk_job = cls(
+            checkpoint['jobId'],
+            checkpoint['model'],
+            checkpoint['inputFolder'],
+            checkpoint['outputFolder'],
+            checkpoint['images'],
+            checkpoint['concurrency'],
+            checkpoint.get('recursive', False)
+        )
+        bulk_job.status = checkpoint.get('status', BULK_JOB_STOPPED)
+        bulk_job.created_at = checkpoint.get('createdAt', bulk_job.created_at)
+        bulk_job.finished_at = checkpoint.get('finishedAt')
+        bulk_job.error = checkpoint.get('error')
+        bulk_job.succeeded = checkpoint.get('succeeded', 0)
+        bulk_job.failed = checkpoint.get('failed', 0)
+        bulk_job.skipped = checkpoint.get('skipped', 0)
+        bulk_job.failures = checkpoint.get('failures', [])
+        return bulk_job
+
+    @property
+    def total(self):
+        return len(self.image_paths)
+
+    @property
+    def processed(self):
+        return self.succeeded + self.failed + self.skipped
+
+    def read_output_path(self, image_path):
+        return self.output_folder / f'{image_path}.json'
+
+    def read_checkpoint_path(self):
+        return Path(BULK_JOB_STATE_DIR) / f'{self.job_id}.json'
+
+    @property
+    def claim_name(self):
+        return f'bulk-job:{self.job_id}'
+
+    @property
+    def stop_signal_name(self):
+        return f'{self.claim_name}:stop'
+
+    def is_running_here(self):
+        return self.task is not None and not self.task.done()
+
+    def is_owned_elsewhere(self):
+        # worker 여러 개로 띄우면 배치 작업은 시작한 worker 하나만 실행하고, 다른 worker는 checkpoint로 상태를 본다.
+        return shared_state is not None and not self.is_running_here() and shared_state.read_claim_owner(self.claim_name) is not None
+
+    def to_checkpoint(self):
+        return {
+            'jobId': self.job_id,
+            'model': self.model_key,
+            'inputFolder': str(self.input_folder),
+            'outputFolder': str(self.output_folder),
+            'recursive': self.recursive,
+            'concurrency': self.concurrency,
+            'status': self.status,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at,
+            'error': self.error,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'failures': self.failures[-BULK_JOB_MAX_RECORDED_FAILURES:],
+            'images': self.image_paths
+        }
+
+    def write_checkpoint(self):
+        checkpoint_path = self.read_checkpoint_path()
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = checkpoint_path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps(self.to_checkpoint(), ensure_ascii=False), encoding='utf-8')
+        os.replace(temporary_path, checkpoint_path)
+        self.last_checkpoint_at = time.monotonic()
+
+    async def checkpoint(self, force=False):
+        if force or time.monotonic() - self.last_checkpoint_at >= BULK_JOB_CHECKPOINT_INTERVAL:
+            if shared_state is not None and await shared_state.run(shared_state.consume_signal, self.stop_signal_name):
+                await self.stop()
+            await asyncio.to_thread(self.write_checkpoint)
+
+    def to_status(self):
+        elapsed_seconds = time.monotonic() - self.session_started_at if self.session_started_at else 0.0
+        images_per_second = self.session_processed / elapsed_seconds if elapsed_seconds > 0 else 0.0
+        remaining = max(0, self.total - self.processed)
+        eta_seconds = remaining / images_per_second if images_per_second > 0 and self.status == BULK_JOB_RUNNING else None
+
+        return {
+            'jobId': self.job_id,
+            'model': self.model_key,
+            'status': self.status,
+            'inputFolder': str(self.input_folder),
+            'outputFolder': str(self.output_folder),
+            'concurrency': self.concurrency,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at,
+            'error': self.error,
+            'total': self.total,
+            'processed': self.processed,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'remaining': remaining,
+            'progress': self.processed / self.total if self.total else 1.0,
+            'imagesPerSecond': images_per_second,
+            'etaSeconds': eta_seconds,
+            'recentFailures': self.failures[-10:]
+        }
+
+    async def start(self):
+        if shared_state is not None:
+            claim_name = self.claim_name
+            if not await shared_state.run(
+                shared_state.claim,
+                claim_name,
+                undo=lambda is_claimed: is_claimed and shared_state.release_claim(claim_name)
+            ):
+                return None
+            # 이전 실행이 끝난 뒤에 도착한 멈춤 요청은 이번 실행에 적용하지 않는다.
+            await shared_state.run(shared_state.consume_signal, self.stop_signal_name)
+
+        self.status = BULK_JOB_RUNNING
+        self.finished_at = None
+        self.error = None
+        self.draining = False
+        # 시작 요청이 끝난 뒤에도 오래 돌기 때문에 그 요청의 deadline과 metrics를 물려받지 않는다.
+        self.task = asyncio.get_running_loop().create_task(self.run(), context=contextvars.Context())
+        return self.task
+
+    async def stop(self):
+        if (
+            shared_state is not None
+            and not self.is_running_here()
+            and await shared_state.run(shared_state.read_claim_owner, self.claim_name) is not None
+        ):
+            await shared_state.run(shared_state.send_signal, self.stop_signal_name)
+            self.status = BULK_JOB_STOPPING
+        elif self.status == BULK_JOB_RUNNING:
+            self.status = BULK_JOB_STOPPING
+
+    def drain(self):
+        # 서버 종료 중에는 새 이미지를 읽지 않고, 이미 모델에 보낸 이미지만 끝낸다.
+        self.draining = True
+
+    async def run(self):
+        extract_labeling_result = bulk_job_extractors[self.model_key]
+        # 결과 파일이 있는 이미지는 skipped로 다시 세고 실패한 이미지는 다시 처리하므로, 이전 실행의 실패 목록도 비운다.
+        self.succeeded = self.failed = self.skipped = 0
+        self.failures = []
+        self.session_started_at = time.monotonic()
+        self.session_processed = 0
+        pipeline_tasks = []
+
+        try:
+            await asyncio.to_thread(self.output_folder.mkdir, parents=True, exist_ok=True)
+            await self.checkpoint(force=True)
+
+            image_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+            reader_task = asyncio.create_task(self.read_images(image_queue))
+            worker_tasks = [
+                asyncio.create_task(self.process_images(image_queue, extract_labeling_result))
+                for _ in range(self.concurrency)
+            ]
+            pipeline_tasks = [reader_task, *worker_tasks]
+
+            await reader_task
+            for _ in worker_tasks:
+                await image_queue.put(None)
+            await asyncio.gather(*worker_tasks)
+
+            if self.status == BULK_JOB_STOPPING:
+                self.status = BULK_JOB_STOPPED
+            elif not self.draining or self.processed >= self.total:
+                self.status = BULK_JOB_COMPLETED
+            # drain으로 멈춘 작업은 running으로 남겨 다음 기동 때 이어서 처리한다.
+        except Exception as error:
+            self.status = BULK_JOB_FAILED
+            self.error = str(error)
+        finally:
+            for pipeline_task in pipeline_tasks:
+                pipeline_task.cancel()
+
+            if self.status in [BULK_JOB_COMPLETED, BULK_JOB_STOPPED, BULK_JOB_FAILED]:
+                self.finished_at = datetime.now(timezone.utc).isoformat()
+            try:
+                await self.checkpoint(force=True)
+            finally:
+                if shared_state is not None:
+                    await shared_state.run(shared_state.release_claim, self.claim_name)
+
+    async def read_images(self, image_queue):
+        for image_path in self.image_paths:
+            if self.status != BULK_JOB_RUNNING or self.draining:
+                return
+
+            try:
+                pending_image = await asyncio.to_thread(self.read_pending_image, image_path)
+            except OSError as error:
+                self.record_failure(image_path, error)
+                continue
+
+            if pending_image is None:
+                self.skipped += 1
+                continue
+
+            await image_queue.put((image_path, *pending_image))
+
+    def read_pending_image(self, image_path):
+        # 이미 결과 파일이 있는 이미지는 재시작 시 다시 처리하지 않는다.
+        if self.read_output_path(image_path).exists():
+            return None
+
+        # 파일을 읽는 thread에서 hash까지 구해 cache key와 결과 저장소가 같이 쓴다.
+        image_bytes = (self.input_folder / image_path).read_bytes()
+        return image_bytes, hash_image_bytes(image_bytes)
+
+    async def process_images(self, image_queue, extract_labeling_result):
+        while True:
+            queued_image = await image_queue.get()
+            if queued_image is None:
+                return
+
+            image_path, image_bytes, image_hash = queued_image
+            if self.status != BULK_JOB_RUNNING or self.draining:
+                continue
+
+            try:
+                labeling_result = await extract_labeling_result(
+                    Path(image_path).name,
+                    image_bytes,
+                    priority=ADMISSION_PRIORITY_BULK,
+                    image_hash=image_hash
+                )
+                await asyncio.to_thread(self.write_result, image_path, labeling_result)
+                self.succeeded += 1
+            except Exception as error:
+                self.record_failure(image_path, error)
+
+            self.session_processed += 1
+            await self.checkpoint()
+
+    def record_failure(self, image_path, error):
+        self.failed += 1
+        self.failures.append({'image': image_path, 'error': str(error) or type(error).__name__})
+        del self.failures[:-BULK_JOB_MAX_RECORDED_FAILURES]
+
+    def write_result(self, image_path, labeling_result):
+        output_path = self.read_output_path(image_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = output_path.with_suffix('.tmp')
+        temporary_path.write_bytes(dump_json_bytes({'success': True, **labeling_result}))
+        os.replace(temporary_path, output_path)
+
+
+def resolve_server_path(raw_path, root_path):
+    root_path = Path(root_path).resolve()
+    requested_path = Path(str(raw_path or '')).expanduser()
+    if not requested_path.is_absolute():
+        requested_path = root_path / requested_path
+
+    resolved_path = requested_path.resolve()
+    if resolved_path != root_path and root_path not in resolved_path.parents:
+        raise ValueError(f'{root_path} 밖의 경로는 사용할 수 없습니다.')
+
+    return resolved_path
+
+
+def list_bulk_images(input_folder, recursive=False):
+    image_files = input_folder.rglob('*') if recursive else input_folder.iterdir()
+    return sorted(
+        str(image_file.relative_to(input_folder))
+        for image_file in image_files
+        if image_file.is_file() and image_file.suffix.lower() in BULK_IMAGE_EXTENSIONS
+    )
+
+
+def read_bulk_concurrency(raw_concurrency):
+    try:
+        concurrency = int(raw_concurrency or BULK_JOB_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrency = BULK_JOB_CONCURRENCY
+
+    return max(1, min(BULK_JOB_MAX_CONCURRENCY, concurrency))
+
+
+async def create_bulk_job(model_key, job_options):
+    input_folder = resolve_server_path(job_options.get('inputFolder') or job_options.get('folder'), SERVER_FOLDER_ROOT)
+    if not await asyncio.to_thread(input_folder.is_dir):
+        raise ValueError(f'폴더를 찾을 수 없습니다: {input_folder}')
+
+    job_id = uuid.uuid4().hex
+    output_folder = job_options.get('outputFolder') or Path(SERVER_BULK_OUTPUT_ROOT) / 'labeling_results' / f'{model_key}_{job_id}'
+    output_folder = resolve_server_path(output_folder, SERVER_BULK_OUTPUT_ROOT)
+    recursive = str(job_options.get('recursive', '')).lower() == 'true'
+    image_paths = await asyncio.to_thread(list_bulk_images, input_folder, recursive)
+    if not image_paths:
+        raise ValueError('처리할 이미지가 없습니다.')
+
+    bulk_job = BulkJob(
+        job_id,
+        model_key,
+        input_folder,
+        output_folder,
+        image_paths,
+        read_bulk_concurrency(job_options.get('concurrency')),
+        recursive
+    )
+    bulk_jobs[job_id] = bulk_job
+    await bulk_job.start()
+    return bulk_job
+
+
+def read_bulk_job(model_key, bulk_job_id):
+    bulk_job = bulk_jobs.get(bulk_job_id)
+    # 다른 worker가 이어서 실행했을 수 있으므로 여기서 돌고 있지 않은 작업은 checkpoint를 다시 읽는다.
+    if bulk_job is None or (shared_state is not None and not bulk_job.is_running_here()):
+        checkpoint_path = Path(BULK_JOB_STATE_DIR) / f'{Path(bulk_job_id).name}.json'
+        if checkpoint_path.is_file():
+            bulk_job = BulkJob.from_checkpoint(json.loads(checkpoint_path.read_text(encoding='utf-8')))
+            if bulk_job.is_owned_elsewhere():
+                # 실행 중인 worker의 상태를 그대로 보여 주고, 이 worker의 종료 처리에서 덮어쓰지 않도록 담아 두지 않는다.
+                return bulk_job if bulk_job.model_key == model_key else None
+            if bulk_job.status in [BULK_JOB_RUNNING, BULK_JOB_STOPPING]:
+                bulk_job.status = BULK_JOB_STOPPED
+            bulk_jobs[bulk_job.job_id] = bulk_job
+
+    if bulk_job is None or bulk_job.model_key != model_key:
+        return None
+
+    return bulk_job
+
+
+async def resume_bulk_jobs():
+    state_dir = Path(BULK_JOB_STATE_DIR)
+    if not state_dir.is_dir():
+        return []
+
+    resumed_jobs = []
+    for checkpoint_path in state_dir.glob('*.json'):
+        try:
+            checkpoint = json.loads(checkpoint_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+
+        if checkpoint.get('status') != BULK_JOB_RUNNING or checkpoint.get('model') not in bulk_job_extractors:
+            continue
+
+        bulk_job = BulkJob.from_checkpoint(checkpoint)
+        # worker마다 이 함수를 부르므로 claim을 먼저 잡은 worker 하나만 이어서 실행한다.
+        if await bulk_job.start() is None:
+            continue
+        bulk_jobs[bulk_job.job_id] = bulk_job
+        resumed_jobs.append(bulk_job)
+
+    return resumed_jobs
+
+
+async def stop_bulk_jobs(drain_timeout=BULK_JOB_DRAIN_TIMEOUT):
+    running_tasks = []
+    for bulk_job in bulk_jobs.values():
+        if bulk_job.is_running_here():
+            bulk_job.drain()
+            running_tasks.append(bulk_job.task)
+
+    # 이미 모델에 보낸 이미지는 drain_timeout까지 끝내고, 그래도 남은 작업만 취소한다.
+    if running_tasks and drain_timeout > 0:
+        await asyncio.wait(running_tasks, timeout=drain_timeout)
+    for running_task in running_tasks:
+        running_task.cancel()
+
+    # 종료 시에는 checkpoint 상태를 running으로 남겨서 다음 기동 때 이어서 처리한다.
+    await asyncio.gather(*running_tasks, return_exceptions=True)
+    for bulk_job in bulk_jobs.values():
+        if bulk_job.task is not None and bulk_job.status == BULK_JOB_RUNNING:
+            await asyncio.to_thread(bulk_job.write_checkpoint)
+
+
+def create_bulk_job_router(model_key, extract_labeling_result):
+    bulk_job_extractors[model_key] = extract_labeling_result
+    bulk_job_router = APIRouter()
+    route_prefix = f'/api/labeling/{model_key}/bulk/jobs'
+
+    @bulk_job_router.post(route_prefix)
+    async def start_bulk_job(request: Request):
+        try:
+            job_options = await request.json()
+        except ValueError:
+            job_options = dict(await request.form())
+
+        if job_options is None:
+            job_options = {}
+        if not isinstance(job_options, dict):
+            return json_response({'success': False, 'error': '요청 본문은 JSON 객체여야 합니다.'}, status_code=400)
+
+        try:
+            bulk_job = await create_bulk_job(model_key, job_options)
+        except ValueError as error:
+            return json_response({'success': False, 'error': str(error)}, status_code=400)
+
+        return json_response({'success': True, **bulk_job.to_status()}, status_code=202)
+
+    @bulk_job_router.get(route_prefix + '/{bulk_job_id}')
+    async def read_bulk_job_status(bulk_job_id: str):
+        bulk_job = await asyncio.to_thread(read_bulk_job, model_key, bulk_job_id)
+        if bulk_job is None:
+            return json_response({'success': False, 'error': '배치 작업을 찾을 수 없습니다.'}, status_code=404)
+
+        return json_response({'success': True, **bulk_job.to_status()})
+
+    @bulk_job_router.post(route_prefix + '/{bulk_job_id}/stop')
+    async def stop_bulk_job(bulk_job_id: str):
+        bulk_job = await asyncio.to_thread(read_bulk_job, model_key, bulk_job_id)
+        if bulk_job is None:
+            return json_response({'success': False, 'error': '배치 작업을 찾을 수 없습니다.'}, status_code=404)
+
+        await bulk_job.stop()
+        return json_response({'success': True, **bulk_job.to_status()})
+
+    @bulk_job_router.post(route_prefix + '/{bulk_job_id}/resume')
+    async def resume_bulk_job(bulk_job_id: str):
+        bulk_job = await asyncio.to_thread(read_bulk_job, model_key, bulk_job_id)
+        if bulk_job is None:
+            return json_response({'success': False, 'error': '배치 작업을 찾을 수 없습니다.'}, status_code=404)
+
+        if bulk_job.is_running_here() or await bulk_job.start() is None:
+            return json_response({'success': False, 'error': '이미 실행 중인 배치 작업입니다.'}, status_code=409)
+
+        bulk_jobs[bulk_job.job_id] = bulk_job
+        return json_response({'success': True, **bulk_job.to_status()}, status_code=202)
+
+    @bulk_job_router.get(route_prefix + '/{bulk_job_id}/images/{image_index}')
+    async def read_bulk_job_image(bulk_job_id: str, image_index: int):
+        bulk_job = await asyncio.to_thread(read_bulk_job, model_key, bulk_job_id)
+        if bulk_job is None or not 0 <= image_index < bulk_job.total:
+            return json_response({'success': False, 'error': '이미지를 찾을 수 없습니다.'}, status_code=404)
+
+        return FileResponse(bulk_job.input_folder / bulk_job.image_paths[image_index])
+
+    @bulk_job_router.get(route_prefix + '/{bulk_job_id}/results/{image_index}')
+    async def read_bulk_job_result(bulk_job_id: str, image_index: int):
+        bulk_job = await asyncio.to_thread(read_bulk_job, model_key, bulk_job_id)
+        if bulk_job is None or not 0 <= image_index < bulk_job.total:
+            return json_response({'success': False, 'error': '결과를 찾을 수 없습니다.'}, status_code=404)
+
+        output_path = bulk_job.read_output_path(bulk_job.image_paths[image_index])
+        if not await asyncio.to_thread(output_path.is_file):
+            return json_response({'success': False, 'error': '아직 처리되지 않은 이미지입니다.'}, status_code=404)
+
+        return FileResponse(output_path, media_type='application/json')
+
+    return bulk_job_router
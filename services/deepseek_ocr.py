@@ -1,62 +1,89 @@
-import ast
-import base64
-import html
 import json
 import re
-import urllib.error
-import urllib.request
-from pathlib import Path
 
 from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 
 from config import (
     DEEPSEEK_OCR_API_TIMEOUT,
     DEEPSEEK_OCR_API_URL,
     DEEPSEEK_OCR_BASE_SIZE,
+    DEEPSEEK_OCR_CONCURRENCY,
     DEEPSEEK_OCR_CROP_MODE,
+    DEEPSEEK_OCR_GPU,
+    DEEPSEEK_OCR_IDLE_TTL,
     DEEPSEEK_OCR_IMAGE_SIZE,
     DEEPSEEK_OCR_MAX_NEW_TOKENS,
+    DEEPSEEK_OCR_MAX_QUEUE,
+    DEEPSEEK_OCR_PREPROCESS_MAX_SIDE,
     DEEPSEEK_OCR_PROMPT,
     DEEPSEEK_OCR_RELEASE_URL,
+    DEEPSEEK_OCR_TRANSPORT,
     DEEPSEEK_OCR_USE_CACHE,
-    UPLOAD_DIR,
 )
-from utils.labeling_boxes import build_labeling_boxes, read_image_size
-from utils.ocr_result_files import read_raw_ocr_response, saved_temporary_raw_ocr_response
-from utils.responses import json_response
+from services.utils.admission import (
+    ADMISSION_PRIORITY_INTERACTIVE,
+    AdmissionRejectedError,
+    admit,
+    check_admission,
+    enqueue_admission,
+    register_admission_queue,
+    wait_admission,
+)
+from services.utils.deepseek_markup import (
+    DEEPSEEK_DET_CLOSE,
+    is_coordinate_box,
+    iter_deepseek_ref_blocks,
+    parse_deepseek_ref_block,
+)
+from services.utils.endpoints import register_endpoint_pool
+from services.utils.residency import model_residency
+from services.utils.transport import register_upstream_transport
+from services.utils.upstream import (
+    UpstreamConnectionError,
+    UpstreamDeadlineError,
+    UpstreamHTTPError,
+    iter_upstream_lines,
+)
+from utils.image_preprocess import image_preprocessor, plan_image_preprocess
+from utils.image_probe import probe_image
+from utils.labeling_boxes import build_labeling_boxes, convert_labeling_boxes
+from utils.metrics import measure_stage, record_box_count
+from utils.ocr_result_files import archive_raw_ocr_response
+from utils.responses import format_labeling_stream_events, json_response
+from utils.result_cache import (
+    hash_image_bytes,
+    is_cache_bypass_requested,
+    read_cached_model_response,
+    read_stored_model_response,
+    store_model_response,
+)
+from utils.result_store import record_labeling_result
+from utils.uploads import read_labeling_upload
 
 deepseek_ocr_router = APIRouter()
-DEEPSEEK_REF_DET_PATTERN = re.compile(r'<\|ref\|>(.*?)<\|/ref\|>\s*<\|det\|>(.*?)<\|/det\|>', re.DOTALL)
-DEEPSEEK_TABLE_PATTERN = re.compile(r'<table\b.*?</table>', re.DOTALL | re.IGNORECASE)
-DEEPSEEK_HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+DEEPSEEK_OCR_MODEL_NAME = 'deepseek-ocr'
 DEEPSEEK_COORDINATE_MAX = 999.0
 
 
 @deepseek_ocr_router.post('/api/labeling/deepseek_ocr')
 async def extract_deepseek_ocr_for_labeling(request: Request):
-    form = await request.form()
-
-    if 'image' not in form:
-        return json_response({'success': False, 'error': '이미지가 필요합니다.'}, status_code=400)
-
-    uploaded_image = form['image']
-    if uploaded_image.filename == '':
-        return json_response({'success': False, 'error': '이미지가 선택되지 않았습니다.'}, status_code=400)
-
-    image_bytes = await uploaded_image.read()
-    if not image_bytes:
-        return json_response({'success': False, 'error': '빈 이미지 파일입니다.'}, status_code=400)
-
-    image_filename = Path(uploaded_image.filename).name
+    uploaded_image = await read_labeling_upload(request)
 
     try:
-        deepseek_labeling_result = extract_deepseek_labeling_result(image_filename, image_bytes)
-    except urllib.error.HTTPError as error:
-        return json_response({'success': False, 'error': read_deepseek_error(error)}, status_code=error.code)
+        deepseek_labeling_result = await extract_deepseek_labeling_result(
+            uploaded_image.filename,
+            uploaded_image.image_bytes,
+            bypass_cache=is_cache_bypass_requested(uploaded_image.fields),
+            image_probe=uploaded_image.image_probe,
+            image_hash=uploaded_image.image_hash
+        )
+    except UpstreamHTTPError as error:
+        return json_response({'success': False, 'error': read_deepseek_error(error)}, status_code=error.status_code)
     except RuntimeError as error:
         return json_response({'success': False, 'error': str(error)}, status_code=get_deepseek_error_status_code(error))
-    except urllib.error.URLError as error:
-        return json_response({'success': False, 'error': f'DeepSeek OCR 연결 실패: {error.reason}'}, status_code=502)
+    except UpstreamConnectionError as error:
+        return json_response({'success': False, 'error': f'DeepSeek OCR 연결 실패: {error.reason}'}, status_code=error.status_code)
 
     return json_response({
         'success': True,
@@ -64,17 +91,155 @@ async def extract_deepseek_ocr_for_labeling(request: Request):
     })
 
 
-def extract_deepseek_labeling_result(image_filename, image_bytes, release_after_inference=True):
-    image_width, image_height = read_image_size(image_bytes)
-    deepseek_ocr_response = request_deepseek_ocr(image_bytes, release_after_inference=release_after_inference)
+@deepseek_ocr_router.post('/api/labeling/deepseek_ocr/stream')
+async def stream_deepseek_ocr_for_labeling(request: Request):
+    # stream이 시작된 뒤에는 status code를 바꿀 수 없으므로 이미지 header와 대기열은 먼저 확인한다.
+    uploaded_image = await read_labeling_upload(request)
+    use_event_stream = 'text/event-stream' in request.headers.get('accept', '')
+    check_admission(DEEPSEEK_OCR_MODEL_NAME)
+    labeling_events = stream_deepseek_labeling_events(
+        uploaded_image.filename,
+        uploaded_image.image_bytes,
+        bypass_cache=is_cache_bypass_requested(uploaded_image.fields),
+        image_probe=uploaded_image.image_probe,
+        image_hash=uploaded_image.image_hash
+    )
+
+    return StreamingResponse(
+        format_labeling_stream_events(labeling_events, use_event_stream),
+        media_type='text/event-stream' if use_event_stream else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 
-    with saved_temporary_raw_ocr_response(UPLOAD_DIR, 'deepseek_ocr_', deepseek_ocr_response) as raw_response_path:
-        return build_deepseek_labeling_result_from_raw_file(image_filename, image_width, image_height, raw_response_path)
+async def stream_deepseek_labeling_events(
+    image_filename,
+    image_bytes,
+    release_after_inference=None,
+    bypass_cache=False,
+    priority=ADMISSION_PRIORITY_INTERACTIVE,
+    image_probe=None,
+    image_hash=None
+):
+    image_probe = image_probe or probe_image(image_bytes)
+    image_hash = image_hash or hash_image_bytes(image_bytes)
+    image_width, image_height = image_probe.display_size
+    preprocess_plan = plan_image_preprocess(image_probe, DEEPSEEK_OCR_PREPROCESS_MAX_SIDE)
+    stream_parser = DeepSeekStreamParser(image_width, image_height)
+    predict_options = preprocess_plan.build_model_options(read_deepseek_predict_options())
+    deepseek_model = 'deepseek-ocr2'
+    image_info = {
+        'filename': image_filename,
+        'width': image_width,
+        'height': image_height
+    }
+    # 끝까지 보낸 뒤 결과 저장소에 한 번에 남기려고 보낸 box를 모아 둔다.
+    streamed_boxes = []
+
+    yield {
+        'event': 'start',
+        'displayType': 'bbox_overlay',
+        'image': image_info
+    }
 
+    try:
+        deepseek_ocr_response = None
+        if not bypass_cache:
+            deepseek_ocr_response = await read_stored_model_response(
+                DEEPSEEK_OCR_MODEL_NAME,
+                image_bytes,
+                predict_options,
+                image_hash=image_hash
+            )
+
+        if deepseek_ocr_response is not None:
+            deepseek_model = deepseek_ocr_response.get('model', deepseek_model)
+            for labeling_box in stream_parser.feed(deepseek_ocr_response.get('text', '')):
+                streamed_boxes.append(labeling_box)
+                yield {'event': 'box', 'box': labeling_box}
+        else:
+            admission_ticket = enqueue_admission(DEEPSEEK_OCR_MODEL_NAME, priority)
+            try:
+                if admission_ticket is not None and not admission_ticket.is_granted:
+                    yield {'event': 'queued', **admission_ticket.read_position()}
+                    await wait_admission(admission_ticket)
+
+                model_image_bytes = await image_preprocessor.preprocess(image_bytes, preprocess_plan)
+                async for stream_chunk in stream_deepseek_ocr(model_image_bytes, release_after_inference=release_after_inference):
+                    deepseek_model = stream_chunk.get('model') or deepseek_model
+                    for labeling_box in stream_parser.feed(stream_chunk.get('text', '')):
+                        streamed_boxes.append(labeling_box)
+                        yield {'event': 'box', 'box': labeling_box}
+            finally:
+                if admission_ticket is not None:
+                    admission_ticket.release()
+
+            deepseek_ocr_response = {'model': deepseek_model, 'text': stream_parser.generated_text}
+            archive_raw_ocr_response('deepseek_ocr', image_filename, deepseek_ocr_response)
+            await store_model_response(
+                DEEPSEEK_OCR_MODEL_NAME,
+                image_bytes,
+                predict_options,
+                deepseek_ocr_response,
+                image_hash=image_hash
+            )
+
+        for labeling_box in stream_parser.finish():
+            streamed_boxes.append(labeling_box)
+            yield {'event': 'box', 'box': labeling_box}
+    except UpstreamHTTPError as error:
+        yield {'event': 'error', 'status': error.status_code, 'error': read_deepseek_error(error)}
+        return
+    except RuntimeError as error:
+        yield {'event': 'error', 'status': get_deepseek_error_status_code(error), 'error': str(error)}
+        return
+    except UpstreamDeadlineError as error:
+        yield {'event': 'error', 'status': error.status_code, 'error': '요청 deadline이 지났습니다.'}
+        return
+    except UpstreamConnectionError as error:
+        yield {'event': 'error', 'status': error.status_code, 'error': f'DeepSeek OCR 연결 실패: {error.reason}'}
+        return
+    except AdmissionRejectedError as error:
+        yield {'event': 'error', 'status': 429, 'error': str(error), 'retryAfter': error.retry_after}
+        return
+
+    record_box_count(stream_parser.box_count)
+    record_labeling_result(
+        DEEPSEEK_OCR_MODEL_NAME,
+        image_filename,
+        image_bytes,
+        {'model': deepseek_model, 'displayType': 'bbox_overlay', 'image': image_info, 'boxes': streamed_boxes},
+        image_hash=image_hash
+    )
+    yield {'event': 'done', 'model': deepseek_model, 'boxCount': stream_parser.box_count}
+
+
+async def extract_deepseek_labeling_result(
+    image_filename,
+    image_bytes,
+    release_after_inference=None,
+    bypass_cache=False,
+    priority=ADMISSION_PRIORITY_INTERACTIVE,
+    image_probe=None,
+    image_hash=None
+):
+    image_probe = image_probe or probe_image(image_bytes)
+    image_hash = image_hash or hash_image_bytes(image_bytes)
+    image_width, image_height = image_probe.display_size
+    preprocess_plan = plan_image_preprocess(image_probe, DEEPSEEK_OCR_PREPROCESS_MAX_SIDE)
+    deepseek_ocr_response = await read_cached_model_response(
+        DEEPSEEK_OCR_MODEL_NAME,
+        image_bytes,
+        preprocess_plan.build_model_options(read_deepseek_predict_options()),
+        lambda: request_preprocessed_deepseek_ocr(image_bytes, preprocess_plan, release_after_inference, priority),
+        bypass_cache=bypass_cache,
+        image_hash=image_hash
+    )
 
-def build_deepseek_labeling_result_from_raw_file(image_filename, image_width, image_height, raw_response_path):
-    deepseek_ocr_response = read_raw_ocr_response(raw_response_path)
-    return build_deepseek_labeling_result(image_filename, image_width, image_height, deepseek_ocr_response)
+    archive_raw_ocr_response('deepseek_ocr', image_filename, deepseek_ocr_response)
+    deepseek_labeling_result = build_deepseek_labeling_result(image_filename, image_width, image_height, deepseek_ocr_response)
+    record_labeling_result(DEEPSEEK_OCR_MODEL_NAME, image_filename, image_bytes, deepseek_labeling_result, image_hash=image_hash)
+    return deepseek_labeling_result
 
 
 def build_deepseek_labeling_result(image_filename, image_width, image_height, deepseek_ocr_response):
@@ -93,34 +258,102 @@ def build_deepseek_labeling_result(image_filename, image_width, image_height, de
     }
 
 
-def request_deepseek_ocr(image_bytes, release_after_inference=True):
-    byte_img = base64.b64encode(image_bytes).decode('utf-8')
-    payload = json.dumps({
-        'byte_img': byte_img,
-        'release_after_inference': release_after_inference,
-        'predict_options': {
-            'prompt': DEEPSEEK_OCR_PROMPT,
-            'base_size': DEEPSEEK_OCR_BASE_SIZE,
-            'image_size': DEEPSEEK_OCR_IMAGE_SIZE,
-            'crop_mode': DEEPSEEK_OCR_CROP_MODE,
-            'max_new_tokens': DEEPSEEK_OCR_MAX_NEW_TOKENS,
-            'use_cache': DEEPSEEK_OCR_USE_CACHE,
-            'save_results': False,
-            'keep_results': False
+def read_deepseek_predict_options():
+    return {
+        'prompt': DEEPSEEK_OCR_PROMPT,
+        'base_size': DEEPSEEK_OCR_BASE_SIZE,
+        'image_size': DEEPSEEK_OCR_IMAGE_SIZE,
+        'crop_mode': DEEPSEEK_OCR_CROP_MODE,
+        'max_new_tokens': DEEPSEEK_OCR_MAX_NEW_TOKENS,
+        'use_cache': DEEPSEEK_OCR_USE_CACHE,
+        'save_results': False,
+        'keep_results': False
+    }
+
+
+async def request_preprocessed_deepseek_ocr(
+    image_bytes,
+    preprocess_plan,
+    release_after_inference=None,
+    priority=ADMISSION_PRIORITY_INTERACTIVE
+):
+    # DeepSeek 좌표는 0~999 비율이라 줄인 이미지의 응답도 원본 크기로 그대로 환산된다.
+    async with admit(DEEPSEEK_OCR_MODEL_NAME, priority):
+        model_image_bytes = await image_preprocessor.preprocess(image_bytes, preprocess_plan)
+        return await request_deepseek_ocr(model_image_bytes, release_after_inference=release_after_inference)
+
+
+async def request_deepseek_ocr(image_bytes, release_after_inference=None):
+    async with model_residency.hold(DEEPSEEK_OCR_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'release_after_inference': model_lease.release_after_inference,
+            'predict_options': read_deepseek_predict_options()
+        }
+
+        try:
+            response_body = await deepseek_ocr_transport.post_image(image_bytes, fields, DEEPSEEK_OCR_API_TIMEOUT)
+            return json.loads(response_body.decode('utf-8') or '{}')
+        except UpstreamHTTPError as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise RuntimeError(format_deepseek_ocr_http_error(error.status_code, error.read_text())) from None
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+
+async def stream_deepseek_ocr(image_bytes, release_after_inference=None):
+    async with model_residency.hold(DEEPSEEK_OCR_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'release_after_inference': model_lease.release_after_inference,
+            'stream': True,
+            'predict_options': read_deepseek_predict_options()
         }
-    }).encode('utf-8')
-    request = urllib.request.Request(DEEPSEEK_OCR_API_URL, data=payload, headers={'Content-Type': 'application/json'})
+
+        try:
+            async with deepseek_ocr_transport.open_image_stream(
+                image_bytes,
+                fields,
+                DEEPSEEK_OCR_API_TIMEOUT,
+                'application/x-ndjson, text/event-stream'
+            ) as response:
+                content_type = response.headers.get('content-type', '')
+                if 'ndjson' not in content_type and 'event-stream' not in content_type:
+                    # stream을 지원하지 않는 컨테이너는 전체 응답을 한 번에 돌려준다.
+                    yield json.loads((await response.aread()).decode('utf-8') or '{}')
+                    return
+
+                async for response_line in iter_upstream_lines(response):
+                    stream_chunk = read_deepseek_stream_line(response_line)
+                    if stream_chunk:
+                        yield stream_chunk
+        except UpstreamHTTPError as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise RuntimeError(format_deepseek_ocr_http_error(error.status_code, error.read_text())) from None
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+
+def read_deepseek_stream_line(response_line):
+    if response_line.startswith('data:'):
+        response_line = response_line[len('data:'):]
+
+    stripped_line = response_line.strip()
+    if not stripped_line or stripped_line == '[DONE]' or stripped_line.startswith(('event:', 'id:', ':')):
+        return None
 
     try:
-        with urllib.request.urlopen(request, timeout=DEEPSEEK_OCR_API_TIMEOUT) as response:
-            return json.loads(response.read().decode('utf-8') or '{}')
-    except urllib.error.HTTPError as error:
-        error_body = error.read().decode('utf-8', errors='replace')
-        release_deepseek_ocr()
-        raise RuntimeError(format_deepseek_ocr_http_error(error.code, error_body)) from None
-    except Exception:
-        release_deepseek_ocr()
-        raise
+        stream_chunk = json.loads(stripped_line)
+    except json.JSONDecodeError:
+        return {'text': response_line.lstrip(' ') + '\n'}
+
+    if not isinstance(stream_chunk, dict):
+        return None
+
+    if stream_chunk.get('error') or stream_chunk.get('detail'):
+        raise RuntimeError(f"HTTP 502: {stream_chunk.get('error') or stream_chunk.get('detail')}")
+
+    return stream_chunk
 
 
 def format_deepseek_ocr_http_error(status_code, error_body):
@@ -145,116 +378,118 @@ def get_deepseek_error_status_code(error):
     return 500
 
 
-def release_deepseek_ocr():
-    release_request = urllib.request.Request(DEEPSEEK_OCR_RELEASE_URL, data=b'{}', headers={'Content-Type': 'application/json'}, method='POST')
-
-    try:
-        with urllib.request.urlopen(release_request, timeout=DEEPSEEK_OCR_API_TIMEOUT) as response:
-            response.read()
-        return True
-    except Exception:
-        return False
+async def release_deepseek_ocr(endpoints=None):
+    return await deepseek_ocr_endpoints.release(DEEPSEEK_OCR_API_TIMEOUT, endpoints)
 
 
 def extract_deepseek_boxes(deepseek_ocr_response, image_width, image_height):
     generated_text = deepseek_ocr_response.get('text', '') if isinstance(deepseek_ocr_response, dict) else ''
     deepseek_boxes = []
-    ref_matches = list(DEEPSEEK_REF_DET_PATTERN.finditer(generated_text))
-
-    for match_index, ref_match in enumerate(ref_matches):
-        box_label = normalize_deepseek_label(ref_match.group(1))
-        coordinate_boxes = parse_deepseek_coordinate_text(ref_match.group(2))
-        rec_content = extract_deepseek_rec_content(generated_text, ref_matches, match_index)
-        rec_text = normalize_deepseek_rec_text(rec_content)
-        rec_html = extract_deepseek_table_html(rec_content) if box_label == 'table' else ''
-
-        for coordinate_box in coordinate_boxes:
-            pixel_bbox = scale_deepseek_bbox(coordinate_box, image_width, image_height)
-            if not pixel_bbox:
-                continue
-
-            deepseek_box = {
-                'id': f"deepseek-{len(deepseek_boxes) + 1}",
-                'type': box_label,
-                'text': rec_text,
-                'confidence': 1.0,
-                'bbox': pixel_bbox
-            }
-
-            if rec_html:
-                deepseek_box['html'] = rec_html
-
-            deepseek_boxes.append(deepseek_box)
+    ref_blocks = list(iter_deepseek_ref_blocks(generated_text))
+
+    for block_index, ref_block in enumerate(ref_blocks):
+        content_end = ref_blocks[block_index + 1].start if block_index + 1 < len(ref_blocks) else len(generated_text)
+        deepseek_boxes.extend(build_deepseek_ref_boxes(
+            ref_block,
+            generated_text[ref_block.end:content_end].strip(),
+            image_width,
+            image_height,
+            len(deepseek_boxes)
+        ))
 
     return deepseek_boxes
 
 
-def normalize_deepseek_label(label_text):
-    normalized_label = re.sub(r'\s+', ' ', str(label_text or '')).strip()
-    return normalized_label or 'bbox'
-
-
-def extract_deepseek_rec_content(generated_text, ref_matches, match_index):
-    content_start = ref_matches[match_index].end()
-    content_end = ref_matches[match_index + 1].start() if match_index + 1 < len(ref_matches) else len(generated_text)
-    return generated_text[content_start:content_end].strip()
-
-
-def extract_deepseek_table_html(rec_content):
-    table_match = DEEPSEEK_TABLE_PATTERN.search(rec_content or '')
-    if not table_match:
-        return ''
-
-    return table_match.group(0).strip()
-
-
-def normalize_deepseek_rec_text(rec_content):
-    rec_text = str(rec_content or '').strip()
-    if not rec_text:
-        return ''
-
-    rec_text = re.sub(r'!\[[^\]]*\]\([^)]+\)', ' ', rec_text)
-    rec_text = re.sub(r'<br\s*/?>', '\n', rec_text, flags=re.IGNORECASE)
-    rec_text = re.sub(r'</(td|th)>', ' ', rec_text, flags=re.IGNORECASE)
-    rec_text = re.sub(r'</tr>', '\n', rec_text, flags=re.IGNORECASE)
-    rec_text = DEEPSEEK_HTML_TAG_PATTERN.sub(' ', rec_text)
-    rec_text = html.unescape(rec_text)
-    rec_text = re.sub(r'^\s{0,3}#{1,6}\s*', '', rec_text, flags=re.MULTILINE)
-    rec_text = re.sub(r'[ \t]+', ' ', rec_text)
-    rec_text = re.sub(r'\n\s+', '\n', rec_text)
-    rec_text = re.sub(r'\n{3,}', '\n\n', rec_text)
-    return rec_text.strip()
-
-
-def parse_deepseek_coordinate_text(coordinate_text):
-    try:
-        coordinates = ast.literal_eval(coordinate_text.strip())
-    except (SyntaxError, ValueError):
-        return []
-
-    return flatten_deepseek_coordinate_boxes(coordinates)
-
+def build_deepseek_ref_boxes(ref_block, rec_content, image_width, image_height, box_offset=0):
+    box_label, coordinate_boxes, rec_text, rec_html = parse_deepseek_ref_block(ref_block, rec_content)
+    deepseek_boxes = []
 
-def flatten_deepseek_coordinate_boxes(coordinates):
-    if is_coordinate_box(coordinates):
-        return [coordinates]
+    for coordinate_box in coordinate_boxes:
+        pixel_bbox = scale_deepseek_bbox(coordinate_box, image_width, image_height)
+        if not pixel_bbox:
+            continue
+
+        deepseek_box = {
+            'id': f"deepseek-{box_offset + len(deepseek_boxes) + 1}",
+            'type': box_label,
+            'text': rec_text,
+            'confidence': 1.0,
+            'bbox': pixel_bbox
+        }
 
-    if not isinstance(coordinates, (list, tuple)):
-        return []
+        if rec_html:
+            deepseek_box['html'] = rec_html
 
-    coordinate_boxes = []
-    for coordinate_group in coordinates:
-        coordinate_boxes.extend(flatten_deepseek_coordinate_boxes(coordinate_group))
+        deepseek_boxes.append(deepseek_box)
 
-    return coordinate_boxes
+    return deepseek_boxes
 
 
-def is_coordinate_box(coordinates):
-    return (
-        isinstance(coordinates, (list, tuple))
-        and len(coordinates) == 4
-        and all(isinstance(coordinate, (int, float)) for coordinate in coordinates)
-    )
+class DeepSeekStreamParser:
+    def __init__(self, image_width, image_height):
+        self.image_width = image_width
+        self.image_height = image_height
+        # 긴 응답을 문자열에 계속 이어 붙이면 매번 전체를 복사하므로 조각으로 모았다가 필요할 때만 합친다.
+        self.text_chunks = []
+        # 마지막으로 완성된 ref 블록 뒤의 text만 scanner에 남긴다. 대기 중인 블록의 본문이 여기서 시작한다.
+        self.unparsed_chunks = []
+        self.unparsed_end = ''
+        self.pending_block = None
+        self.box_count = 0
+
+    @property
+    def generated_text(self):
+        return ''.join(self.text_chunks)
+
+    def feed(self, text_delta):
+        if not text_delta:
+            return []
+
+        self.text_chunks.append(text_delta)
+        self.unparsed_chunks.append(text_delta)
+        # 블록은 <|/det|>로 끝나므로 닫는 태그가 새로 들어왔을 때만 남은 text를 합쳐 찾는다.
+        boundary_text = self.unparsed_end + text_delta
+        self.unparsed_end = boundary_text[-(len(DEEPSEEK_DET_CLOSE) - 1):]
+        if DEEPSEEK_DET_CLOSE not in boundary_text:
+            return []
+
+        unparsed_text = ''.join(self.unparsed_chunks)
+        scan_position = 0
+        completed_boxes = []
+
+        # 다음 <|ref|> 블록이 완성되어야 이전 블록의 본문 범위가 확정된다.
+        for ref_block in iter_deepseek_ref_blocks(unparsed_text):
+            if self.pending_block is not None:
+                completed_boxes.extend(self.close_pending_block(unparsed_text[scan_position:ref_block.start]))
+
+            self.pending_block = ref_block
+            scan_position = ref_block.end
+
+        if scan_position:
+            self.unparsed_chunks = [unparsed_text[scan_position:]]
+        return completed_boxes
+
+    def finish(self):
+        if self.pending_block is None:
+            return []
+
+        return self.close_pending_block(''.join(self.unparsed_chunks))
+
+    def close_pending_block(self, block_content):
+        pending_block = self.pending_block
+        self.pending_block = None
+        rec_content = block_content.strip()
+        deepseek_boxes = build_deepseek_ref_boxes(
+            pending_block,
+            rec_content,
+            self.image_width,
+            self.image_height,
+            self.box_count
+        )
+        self.box_count += len(deepseek_boxes)
+        # box 수는 block마다가 아니라 stream이 끝날 때 한 번 기록한다.
+        with measure_stage('boxes'):
+            return convert_labeling_boxes(deepseek_boxes, self.image_width, self.image_height, 'deepseek')
 
 
 def scale_deepseek_bbox(coordinate_box, image_width, image_height):
@@ -280,7 +515,7 @@ def scale_deepseek_bbox(coordinate_box, image_width, image_height):
 
 def read_deepseek_error(error):
     try:
-        error_body = error.read().decode('utf-8')
+        error_body = error.body.decode('utf-8')
     except Exception:
         return 'DeepSeek OCR 처리에 실패했습니다.'
 
@@ -293,3 +528,13 @@ def read_deepseek_error(error):
         return error_body
 
     return error_payload.get('detail') or error_payload.get('error') or error_body
+
+
+deepseek_ocr_endpoints = register_endpoint_pool(DEEPSEEK_OCR_MODEL_NAME, DEEPSEEK_OCR_API_URL, DEEPSEEK_OCR_RELEASE_URL)
+deepseek_ocr_transport = register_upstream_transport(DEEPSEEK_OCR_MODEL_NAME, deepseek_ocr_endpoints, DEEPSEEK_OCR_TRANSPORT)
+register_admission_queue(
+    DEEPSEEK_OCR_MODEL_NAME,
+    DEEPSEEK_OCR_CONCURRENCY * max(1, len(deepseek_ocr_endpoints.endpoints)),
+    DEEPSEEK_OCR_MAX_QUEUE
+)
+model_residency.register(DEEPSEEK_OCR_MODEL_NAME, release_deepseek_ocr, DEEPSEEK_OCR_IDLE_TTL, DEEPSEEK_OCR_GPU, endpoint_pool=deepseek_ocr_endpoints)
@@ -1,34 +1,93 @@
-import base64
 import json
-import urllib.request
+
 from config import (
     DOCLAYOUT_API_TIMEOUT,
     DOCLAYOUT_API_URL,
+    DOCLAYOUT_BATCH_MODE,
+    DOCLAYOUT_BATCH_SIZE,
+    DOCLAYOUT_BATCH_WAIT_MS,
+    DOCLAYOUT_CONCURRENCY,
     DOCLAYOUT_CONFIDENCE,
+    DOCLAYOUT_GPU,
+    DOCLAYOUT_IDLE_TTL,
     DOCLAYOUT_IMAGE_SIZE,
     DOCLAYOUT_IOU,
     DOCLAYOUT_MAX_DET,
+    DOCLAYOUT_MAX_QUEUE,
+    DOCLAYOUT_RELEASE_URL,
+    DOCLAYOUT_TRANSPORT,
 )
+from services.utils.admission import register_admission_queue
+from services.utils.batching import read_batch_results, register_micro_batch_dispatcher
+from services.utils.endpoints import register_endpoint_pool
+from services.utils.residency import model_residency
+from services.utils.transport import register_upstream_transport
+
+DOCLAYOUT_MODEL_NAME = 'doclayout-yolo'
+
+
+def read_doclayout_predict_options():
+    return {
+        'imgsz': DOCLAYOUT_IMAGE_SIZE,
+        'conf': DOCLAYOUT_CONFIDENCE,
+        'iou': DOCLAYOUT_IOU,
+        'max_det': DOCLAYOUT_MAX_DET
+    }
+
 
+async def request_doclayout(image_bytes, release_after_inference=None):
+    return await doclayout_dispatcher.submit(image_bytes, release_after_inference)
 
-def request_doclayout(image_bytes, release_after_inference=True):
-    byte_img = base64.b64encode(image_bytes).decode('utf-8')
-    payload = json.dumps({
-        'byte_img': byte_img,
-        'release_after_inference': release_after_inference,
-        'predict_options': {
-            'imgsz': DOCLAYOUT_IMAGE_SIZE,
-            'conf': DOCLAYOUT_CONFIDENCE,
-            'iou': DOCLAYOUT_IOU,
-            'max_det': DOCLAYOUT_MAX_DET
+
+async def request_single_doclayout(image_bytes, release_after_inference=None):
+    async with model_residency.hold(DOCLAYOUT_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'release_after_inference': model_lease.release_after_inference,
+            'predict_options': read_doclayout_predict_options()
         }
-    }).encode('utf-8')
 
-    request = urllib.request.Request(
-        DOCLAYOUT_API_URL,
-        data=payload,
-        headers={'Content-Type': 'application/json'}
-    )
+        try:
+            response_body = await doclayout_transport.post_image(image_bytes, fields, DOCLAYOUT_API_TIMEOUT)
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+        return json.loads(response_body.decode('utf-8'))
 
-    with urllib.request.urlopen(request, timeout=DOCLAYOUT_API_TIMEOUT) as response:
-        return json.loads(response.read().decode('utf-8'))
+
+async def request_doclayout_batch(image_bytes_list, release_after_inference=None):
+    async with model_residency.hold(DOCLAYOUT_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'release_after_inference': model_lease.release_after_inference,
+            'predict_options': read_doclayout_predict_options()
+        }
+
+        try:
+            response_body = await doclayout_transport.post_images(image_bytes_list, fields, DOCLAYOUT_API_TIMEOUT)
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+        return read_batch_results(json.loads(response_body.decode('utf-8')), len(image_bytes_list))
+
+
+async def release_doclayout(endpoints=None):
+    return await doclayout_endpoints.release(DOCLAYOUT_API_TIMEOUT, endpoints)
+
+
+doclayout_endpoints = register_endpoint_pool(DOCLAYOUT_MODEL_NAME, DOCLAYOUT_API_URL, DOCLAYOUT_RELEASE_URL)
+doclayout_transport = register_upstream_transport(DOCLAYOUT_MODEL_NAME, doclayout_endpoints, DOCLAYOUT_TRANSPORT)
+register_admission_queue(
+    DOCLAYOUT_MODEL_NAME,
+    DOCLAYOUT_CONCURRENCY * max(1, len(doclayout_endpoints.endpoints)),
+    DOCLAYOUT_MAX_QUEUE
+)
+model_residency.register(DOCLAYOUT_MODEL_NAME, release_doclayout, DOCLAYOUT_IDLE_TTL, DOCLAYOUT_GPU, endpoint_pool=doclayout_endpoints)
+doclayout_dispatcher = register_micro_batch_dispatcher(
+    DOCLAYOUT_MODEL_NAME,
+    request_single_doclayout,
+    request_doclayout_batch,
+    DOCLAYOUT_BATCH_SIZE,
+    DOCLAYOUT_BATCH_WAIT_MS,
+    DOCLAYOUT_BATCH_MODE
+)
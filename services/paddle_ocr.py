@@ -1,36 +1,51 @@
-import base64
 import json
-import urllib.error
-import urllib.request
-from pathlib import Path
 
+import numpy as np
 from fastapi import APIRouter, Request
 
-from config import PADDLE_OCR_API_TIMEOUT, PADDLE_OCR_API_URL, PADDLE_OCR_RELEASE_URL, UPLOAD_DIR
-from utils.labeling_boxes import build_labeling_boxes, read_image_size
-from utils.ocr_result_files import read_raw_ocr_response, saved_temporary_raw_ocr_response
+from config import (
+    PADDLE_OCR_API_TIMEOUT,
+    PADDLE_OCR_API_URL,
+    PADDLE_OCR_BATCH_MODE,
+    PADDLE_OCR_BATCH_SIZE,
+    PADDLE_OCR_BATCH_WAIT_MS,
+    PADDLE_OCR_CONCURRENCY,
+    PADDLE_OCR_GPU,
+    PADDLE_OCR_IDLE_TTL,
+    PADDLE_OCR_MAX_QUEUE,
+    PADDLE_OCR_PREPROCESS_MAX_SIDE,
+    PADDLE_OCR_RELEASE_URL,
+    PADDLE_OCR_TRANSPORT,
+)
+from services.utils.admission import ADMISSION_PRIORITY_INTERACTIVE, admit, register_admission_queue
+from services.utils.batching import read_batch_results, register_micro_batch_dispatcher
+from services.utils.endpoints import register_endpoint_pool
+from services.utils.residency import model_residency
+from services.utils.transport import register_upstream_transport
+from services.utils.upstream import UpstreamHTTPError
+from utils.image_preprocess import image_preprocessor, plan_image_preprocess
+from utils.image_probe import probe_image
+from utils.labeling_boxes import build_text_labeling_boxes, read_labeling_bbox_array
+from utils.ocr_result_files import archive_raw_ocr_response
 from utils.responses import json_response
+from utils.result_cache import hash_image_bytes, is_cache_bypass_requested, read_cached_model_response
+from utils.result_store import record_labeling_result
+from utils.uploads import read_labeling_upload
 
 paddle_ocr_router = APIRouter()
+PADDLE_OCR_MODEL_NAME = 'paddle-ocr'
 
 
 @paddle_ocr_router.post('/api/labeling/paddle_ocr')
 async def extract_paddle_ocr_for_labeling(request: Request):
-    form = await request.form()
-
-    if 'image' not in form:
-        return json_response({'success': False, 'error': '이미지가 필요합니다.'}, status_code=400)
-
-    uploaded_image = form['image']
-    if uploaded_image.filename == '':
-        return json_response({'success': False, 'error': '이미지가 선택되지 않았습니다.'}, status_code=400)
-
-    image_bytes = await uploaded_image.read()
-    if not image_bytes:
-        return json_response({'success': False, 'error': '빈 이미지 파일입니다.'}, status_code=400)
-
-    image_filename = Path(uploaded_image.filename).name
-    paddle_labeling_result = extract_paddle_labeling_result(image_filename, image_bytes)
+    uploaded_image = await read_labeling_upload(request)
+    paddle_labeling_result = await extract_paddle_labeling_result(
+        uploaded_image.filename,
+        uploaded_image.image_bytes,
+        bypass_cache=is_cache_bypass_requested(uploaded_image.fields),
+        image_probe=uploaded_image.image_probe,
+        image_hash=uploaded_image.image_hash
+    )
 
     return json_response({
         'success': True,
@@ -38,22 +53,52 @@ async def extract_paddle_ocr_for_labeling(request: Request):
     })
 
 
-def extract_paddle_labeling_result(image_filename, image_bytes, release_after_inference=True):
-    image_width, image_height = read_image_size(image_bytes)
-    paddle_ocr_response = request_paddle_ocr(image_bytes, release_after_inference=release_after_inference)
-
-    with saved_temporary_raw_ocr_response(UPLOAD_DIR, 'paddle_ocr_', paddle_ocr_response) as raw_response_path:
-        return build_paddle_labeling_result_from_raw_file(image_filename, image_width, image_height, raw_response_path)
-
-
-def build_paddle_labeling_result_from_raw_file(image_filename, image_width, image_height, raw_response_path):
-    paddle_ocr_response = read_raw_ocr_response(raw_response_path)
-    return build_paddle_labeling_result(image_filename, image_width, image_height, paddle_ocr_response)
-
-
-def build_paddle_labeling_result(image_filename, image_width, image_height, paddle_ocr_response):
-    paddle_boxes = extract_paddle_boxes(paddle_ocr_response)
-    labeling_boxes = build_labeling_boxes(paddle_boxes, image_width, image_height, 'paddle')
+async def extract_paddle_labeling_result(
+    image_filename,
+    image_bytes,
+    release_after_inference=None,
+    bypass_cache=False,
+    priority=ADMISSION_PRIORITY_INTERACTIVE,
+    image_probe=None,
+    image_hash=None
+):
+    image_probe = image_probe or probe_image(image_bytes)
+    image_hash = image_hash or hash_image_bytes(image_bytes)
+    image_width, image_height = image_probe.display_size
+    preprocess_plan = plan_image_preprocess(image_probe, PADDLE_OCR_PREPROCESS_MAX_SIDE)
+    paddle_ocr_response = await read_cached_model_response(
+        PADDLE_OCR_MODEL_NAME,
+        image_bytes,
+        preprocess_plan.build_model_options(read_paddle_predict_options()),
+        lambda: request_preprocessed_paddle_ocr(image_bytes, preprocess_plan, release_after_inference, priority),
+        bypass_cache=bypass_cache,
+        image_hash=image_hash
+    )
+
+    archive_raw_ocr_response('paddle_ocr', image_filename, paddle_ocr_response)
+    paddle_labeling_result = build_paddle_labeling_result(
+        image_filename,
+        image_width,
+        image_height,
+        paddle_ocr_response,
+        preprocess_plan.bbox_scale
+    )
+    record_labeling_result(PADDLE_OCR_MODEL_NAME, image_filename, image_bytes, paddle_labeling_result, image_hash=image_hash)
+    return paddle_labeling_result
+
+
+def build_paddle_labeling_result(image_filename, image_width, image_height, paddle_ocr_response, bbox_scale=None):
+    bbox_array, valid_mask, texts, confidences = extract_paddle_box_columns(paddle_ocr_response)
+    labeling_boxes = build_text_labeling_boxes(
+        bbox_array,
+        valid_mask,
+        texts,
+        confidences,
+        image_width,
+        image_height,
+        'paddle',
+        bbox_scale
+    )
 
     return {
         'displayType': 'bbox_overlay',
@@ -66,26 +111,57 @@ def build_paddle_labeling_result(image_filename, image_width, image_height, padd
     }
 
 
-def request_paddle_ocr(image_bytes, release_after_inference=True):
-    byte_img = base64.b64encode(image_bytes).decode('utf-8')
-    payload = json.dumps({
-        'byte_img': byte_img,
-        'predict_options': {},
-        'release_after_inference': release_after_inference
-    }).encode('utf-8')
+def read_paddle_predict_options():
+    return {}
 
-    request = urllib.request.Request(PADDLE_OCR_API_URL, data=payload, headers={'Content-Type': 'application/json'})
 
-    try:
-        with urllib.request.urlopen(request, timeout=PADDLE_OCR_API_TIMEOUT) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except urllib.error.HTTPError as error:
-        error_body = error.read().decode('utf-8', errors='replace')
-        release_paddle_ocr()
-        raise RuntimeError(format_paddle_ocr_http_error(error.code, error_body)) from None
-    except Exception:
-        release_paddle_ocr()
-        raise
+async def request_preprocessed_paddle_ocr(
+    image_bytes,
+    preprocess_plan,
+    release_after_inference=None,
+    priority=ADMISSION_PRIORITY_INTERACTIVE
+):
+    async with admit(PADDLE_OCR_MODEL_NAME, priority):
+        model_image_bytes = await image_preprocessor.preprocess(image_bytes, preprocess_plan)
+        return await request_paddle_ocr(model_image_bytes, release_after_inference=release_after_inference)
+
+
+async def request_paddle_ocr(image_bytes, release_after_inference=None):
+    return await paddle_ocr_dispatcher.submit(image_bytes, release_after_inference)
+
+
+async def request_single_paddle_ocr(image_bytes, release_after_inference=None):
+    async with model_residency.hold(PADDLE_OCR_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'predict_options': read_paddle_predict_options(),
+            'release_after_inference': model_lease.release_after_inference
+        }
+
+        try:
+            response_body = await paddle_ocr_transport.post_image(image_bytes, fields, PADDLE_OCR_API_TIMEOUT)
+            return json.loads(response_body.decode('utf-8'))
+        except UpstreamHTTPError as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise RuntimeError(format_paddle_ocr_http_error(error.status_code, error.read_text())) from None
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+
+async def request_paddle_ocr_batch(image_bytes_list, release_after_inference=None):
+    async with model_residency.hold(PADDLE_OCR_MODEL_NAME, release_after_inference) as model_lease:
+        fields = {
+            'predict_options': read_paddle_predict_options(),
+            'release_after_inference': model_lease.release_after_inference
+        }
+
+        try:
+            response_body = await paddle_ocr_transport.post_images(image_bytes_list, fields, PADDLE_OCR_API_TIMEOUT)
+        except Exception as error:
+            await model_residency.release_after_error(model_lease, error)
+            raise
+
+        return read_batch_results(json.loads(response_body.decode('utf-8')), len(image_bytes_list))
 
 
 def format_paddle_ocr_http_error(status_code, error_body):
@@ -102,35 +178,62 @@ def format_paddle_ocr_http_error(status_code, error_body):
     return f'HTTP {status_code}'
 
 
-def release_paddle_ocr():
-    release_request = urllib.request.Request(PADDLE_OCR_RELEASE_URL, data=b'{}', headers={'Content-Type': 'application/json'}, method='POST')
-
-    try:
-        with urllib.request.urlopen(release_request, timeout=PADDLE_OCR_API_TIMEOUT) as response:
-            response.read()
-        return True
-    except Exception:
-        return False
+async def release_paddle_ocr(endpoints=None):
+    return await paddle_ocr_endpoints.release(PADDLE_OCR_API_TIMEOUT, endpoints)
 
 
-def extract_paddle_boxes(paddle_ocr_response):
-    paddle_boxes = []
+def extract_paddle_box_columns(paddle_ocr_response):
+    bbox_arrays = []
+    valid_masks = []
+    texts = []
+    confidences = []
 
     for ocr_page in paddle_ocr_response:
         ocr_result = ocr_page.get('res', ocr_page)
         rec_texts = ocr_result.get('rec_texts', [])
         rec_scores = ocr_result.get('rec_scores', [])
-        rec_boxes = ocr_result.get('rec_boxes', [])
-
-        for text_index, text in enumerate(rec_texts):
-            if not text or not text.strip():
-                continue
-
-            paddle_boxes.append({
-                'type': 'text',
-                'text': text,
-                'confidence': float(rec_scores[text_index]) if text_index < len(rec_scores) else 1.0,
-                'bbox': rec_boxes[text_index] if text_index < len(rec_boxes) else None
-            })
-
-    return paddle_boxes
+        rec_boxes = ocr_result.get('rec_boxes')
+        if rec_boxes is None:
+            rec_boxes = ocr_result.get('rec_polys', [])
+
+        text_indexes = [text_index for text_index, text in enumerate(rec_texts) if text and text.strip()]
+        if not text_indexes:
+            continue
+
+        # 페이지의 box 전체를 한 번에 배열로 바꾼 뒤 빈 텍스트를 뺀 행만 고른다.
+        # rec_boxes보다 텍스트가 많으면 끝에 붙인 빈 행을 가리켜 box를 만들지 않는다.
+        page_bbox_array, page_valid_mask = read_labeling_bbox_array(rec_boxes)
+        page_bbox_array = np.vstack([page_bbox_array, np.zeros((1, 4))])
+        page_valid_mask = np.append(page_valid_mask, False)
+        box_indexes = np.minimum(text_indexes, len(page_bbox_array) - 1)
+
+        bbox_arrays.append(page_bbox_array[box_indexes])
+        valid_masks.append(page_valid_mask[box_indexes])
+        texts.extend(rec_texts[text_index] for text_index in text_indexes)
+        confidences.extend(
+            float(rec_scores[text_index]) if text_index < len(rec_scores) else 1.0
+            for text_index in text_indexes
+        )
+
+    if not bbox_arrays:
+        return np.empty((0, 4), dtype=np.float64), np.zeros(0, dtype=bool), texts, confidences
+
+    return np.concatenate(bbox_arrays), np.concatenate(valid_masks), texts, confidences
+
+
+paddle_ocr_endpoints = register_endpoint_pool(PADDLE_OCR_MODEL_NAME, PADDLE_OCR_API_URL, PADDLE_OCR_RELEASE_URL)
+paddle_ocr_transport = register_upstream_transport(PADDLE_OCR_MODEL_NAME, paddle_ocr_endpoints, PADDLE_OCR_TRANSPORT)
+register_admission_queue(
+    PADDLE_OCR_MODEL_NAME,
+    PADDLE_OCR_CONCURRENCY * max(1, len(paddle_ocr_endpoints.endpoints)),
+    PADDLE_OCR_MAX_QUEUE
+)
+model_residency.register(PADDLE_OCR_MODEL_NAME, release_paddle_ocr, PADDLE_OCR_IDLE_TTL, PADDLE_OCR_GPU, endpoint_pool=paddle_ocr_endpoints)
+paddle_ocr_dispatcher = register_micro_batch_dispatcher(
+    PADDLE_OCR_MODEL_NAME,
+    request_single_paddle_ocr,
+    request_paddle_ocr_batch,
+    PADDLE_OCR_BATCH_SIZE,
+    PADDLE_OCR_BATCH_WAIT_MS,
+    PADDLE_OCR_BATCH_MODE
+)
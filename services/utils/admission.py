@@ -0,0 +1,317 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+
+from config import ADMISSION_ENABLED
+from services.utils.residency import model_residency
+from services.utils.upstream import UpstreamDeadlineError
+from utils.metrics import measure_stage
+from utils.request_deadline import read_remaining_seconds
+from utils.shared_state import SHARED_STATE_POLL_INTERVAL, shared_state
+
+ADMISSION_PRIORITY_INTERACTIVE = 0
+ADMISSION_PRIORITY_BULK = 1
+ADMISSION_PRIORITY_NAMES = {
+    ADMISSION_PRIORITY_INTERACTIVE: 'interactive',
+    ADMISSION_PRIORITY_BULK: 'bulk'
+}
+DEFAULT_SERVICE_SECONDS = 5.0
+SERVICE_TIME_EWMA_WEIGHT = 0.2
+
+admission_queues = {}
+shared_slot_watch_task = None
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, model_name, queue_length, retry_after):
+        super().__init__(f'{model_name} 요청이 많습니다. {retry_after}초 뒤에 다시 시도해 주세요.')
+        self.model_name = model_name
+        self.queue_length = queue_length
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    def __init__(self, admission_queue, priority, sequence):
+        self.admission_queue = admission_queue
+        self.priority = priority
+        self.sequence = sequence
+        self.granted_future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.released = False
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    @property
+    def is_granted(self):
+        return self.started_at is not None
+
+    def read_position(self):
+        return self.admission_queue.read_position(self)
+
+    async def wait(self):
+        try:
+            await self.granted_future
+        except asyncio.CancelledError:
+            self.release()
+            # 대기열에서 빠진 요청은 GPU에 닿기 전이므로 한 건의 추론 시간을 통째로 아낀 것으로 센다.
+            model_residency.record_cancelled(self.admission_queue.model_name, 'admission')
+            raise
+
+    def release(self):
+        self.admission_queue.release(self)
+
+
+class ModelAdmissionQueue:
+    def __init__(self, model_name, concurrency, max_queue):
+        self.model_name = model_name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.running = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.service_seconds = None
+        self.shared_running = 0
+        self.pump_task = None
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected': 0,
+            'completed': 0,
+            'waitSeconds': 0.0,
+            'longestQueue': 0
+        }
+
+    def count_waiting(self, priority):
+        return sum(1 for ticket in self.waiting if ticket.priority == priority)
+
+    def is_full(self, priority):
+        # bulk 작업은 자체 동시 실행 수로 이미 제한되어 있으므로 거절하지 않고 기다리게 한다.
+        return priority == ADMISSION_PRIORITY_INTERACTIVE and self.count_waiting(priority) >= self.max_queue
+
+    def is_saturated(self):
+        # 다른 worker의 사용 수는 자리를 잡거나 감시 task가 읽을 때 갱신한 값을 쓴다.
+        if self.running >= self.concurrency:
+            return True
+
+        return shared_state is not None and self.shared_running >= self.concurrency
+
+    def check(self, priority=ADMISSION_PRIORITY_INTERACTIVE):
+        if self.is_full(priority) and self.is_saturated():
+            self.stats['rejected'] += 1
+            raise AdmissionRejectedError(self.model_name, len(self.waiting), self.estimate_retry_after())
+
+    def enqueue(self, priority=ADMISSION_PRIORITY_INTERACTIVE):
+        ticket = AdmissionTicket(self, priority, next(self.sequence))
+        is_waiting = bool(self.waiting) or self.is_saturated()
+        if not is_waiting and shared_state is None:
+            self.grant(ticket)
+            return ticket
+
+        # worker가 여럿이면 자리가 비어 보여도 shared state에서 자리를 잡은 뒤에 들여보낸다.
+        self.check(priority)
+        heapq.heappush(self.waiting, ticket)
+        if is_waiting:
+            self.stats['queued'] += 1
+            self.stats['longestQueue'] = max(self.stats['longestQueue'], len(self.waiting))
+        self.wake()
+        return ticket
+
+    def grant(self, ticket):
+        ticket.started_at = time.monotonic()
+        ticket.granted_future.set_result(True)
+        self.running += 1
+        self.stats['admitted'] += 1
+        self.stats['waitSeconds'] += ticket.started_at - ticket.enqueued_at
+
+    def release(self, ticket):
+        if ticket.released:
+            return
+
+        ticket.released = True
+        if ticket.is_granted:
+            self.running -= 1
+            if shared_state is not None:
+                shared_state.submit(shared_state.release_slot, self.model_name)
+            self.stats['completed'] += 1
+            self.record_service_time(time.monotonic() - ticket.started_at)
+        elif ticket in self.waiting:
+            self.waiting.remove(ticket)
+            heapq.heapify(self.waiting)
+
+        self.wake()
+
+    def wake(self):
+        if shared_state is not None:
+            self.start_shared_grants()
+            return
+
+        while self.has_waiting() and self.running < self.concurrency:
+            self.grant(heapq.heappop(self.waiting))
+
+    def has_waiting(self):
+        while self.waiting and self.waiting[0].granted_future.done():
+            heapq.heappop(self.waiting)
+
+        return bool(self.waiting)
+
+    def start_shared_grants(self):
+        # 요청마다 떠 있는 context를 물려받지 않도록 빈 context에서 돈다.
+        if self.pump_task is None and self.has_waiting() and self.running < self.concurrency:
+            self.pump_task = asyncio.get_running_loop().create_task(self.grant_shared_slots(), context=contextvars.Context())
+
+    async def grant_shared_slots(self):
+        # shared state의 write lock을 기다릴 수 있으므로 event loop 밖에서 자리를 하나씩 잡아 대기열 앞에서부터 들여보낸다.
+        try:
+            while self.has_waiting() and self.running < self.concurrency:
+                is_acquired, self.shared_running = await shared_state.run(
+                    shared_state.acquire_slot,
+                    self.model_name,
+                    self.concurrency,
+                    undo=lambda slot_result: slot_result[0] and shared_state.release_slot(self.model_name)
+                )
+                if not is_acquired:
+                    # 다른 worker가 자리를 모두 쓰고 있으면 process마다 하나인 감시 task가 자리가 나는지 본다.
+                    watch_shared_slots()
+                    return
+
+                if self.has_waiting():
+                    self.grant(heapq.heappop(self.waiting))
+                else:
+                    shared_state.submit(shared_state.release_slot, self.model_name)
+        finally:
+            self.pump_task = None
+
+    def record_service_time(self, elapsed_seconds):
+        if self.service_seconds is None:
+            self.service_seconds = elapsed_seconds
+        else:
+            self.service_seconds += SERVICE_TIME_EWMA_WEIGHT * (elapsed_seconds - self.service_seconds)
+
+    def estimate_wait(self, position):
+        # 앞에 있는 요청이 concurrency만큼씩 빠져나간다고 보고 평균 처리 시간으로 계산한다.
+        if position <= 0:
+            return 0.0
+
+        service_seconds = self.service_seconds if self.service_seconds is not None else DEFAULT_SERVICE_SECONDS
+        return math.ceil(position / self.concurrency) * service_seconds
+
+    def estimate_retry_after(self):
+        return max(1, math.ceil(self.estimate_wait(len(self.waiting))))
+
+    def read_position(self, ticket):
+        if ticket.is_granted:
+            return {'position': 0, 'etaSeconds': 0.0}
+
+        position = sum(1 for waiting_ticket in self.waiting if waiting_ticket < ticket) + 1
+        return {'position': position, 'etaSeconds': round(self.estimate_wait(position), 3)}
+
+    def read_stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'maxQueue': self.max_queue,
+            'running': self.running,
+            'globalRunning': shared_state.read_running(self.model_name) if shared_state is not None else self.running,
+            'waiting': {
+                priority_name: self.count_waiting(priority)
+                for priority, priority_name in ADMISSION_PRIORITY_NAMES.items()
+            },
+            'estimatedWaitSeconds': round(self.estimate_wait(self.count_waiting(ADMISSION_PRIORITY_INTERACTIVE) + 1) if self.running >= self.concurrency else 0.0, 3),
+            'serviceSeconds': round(self.service_seconds, 4) if self.service_seconds is not None else None,
+            **self.stats,
+            'waitSeconds': round(self.stats['waitSeconds'], 3)
+        }
+
+
+def watch_shared_slots():
+    global shared_slot_watch_task
+
+    if shared_slot_watch_task is None:
+        shared_slot_watch_task = asyncio.get_running_loop().create_task(poll_shared_slots(), context=contextvars.Context())
+
+
+async def poll_shared_slots():
+    # 대기열마다 자리를 다시 잡아 보지 않고, 모든 모델의 사용 수를 한 번에 읽어 자리가 난 대기열만 깨운다.
+    global shared_slot_watch_task
+
+    try:
+        while any(admission_queue.has_waiting() for admission_queue in admission_queues.values()):
+            await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+            running_counts = await shared_state.run(shared_state.read_running_counts)
+            for model_name, admission_queue in admission_queues.items():
+                admission_queue.shared_running = running_counts.get(model_name) or 0
+                if admission_queue.shared_running < admission_queue.concurrency:
+                    admission_queue.start_shared_grants()
+    finally:
+        shared_slot_watch_task = None
+
+
+def register_admission_queue(model_name, concurrency, max_queue):
+    admission_queue = ModelAdmissionQueue(model_name, concurrency, max_queue)
+    admission_queues[model_name] = admission_queue
+    return admission_queue
+
+
+def read_admission_queue(model_name):
+    if not ADMISSION_ENABLED:
+        return None
+
+    return admission_queues.get(model_name)
+
+
+def check_admission(model_name, priority=ADMISSION_PRIORITY_INTERACTIVE):
+    admission_queue = read_admission_queue(model_name)
+    if admission_queue is not None:
+        admission_queue.check(priority)
+
+
+def enqueue_admission(model_name, priority=ADMISSION_PRIORITY_INTERACTIVE):
+    admission_queue = read_admission_queue(model_name)
+    if admission_queue is None:
+        return None
+
+    return admission_queue.enqueue(priority)
+
+
+@asynccontextmanager
+async def admit(model_name, priority=ADMISSION_PRIORITY_INTERACTIVE):
+    ticket = enqueue_admission(model_name, priority)
+    if ticket is None:
+        yield None
+        return
+
+    try:
+        if not ticket.is_granted:
+            with measure_stage('admission'):
+                await wait_admission(ticket)
+        yield ticket
+    finally:
+        ticket.release()
+
+
+async def wait_admission(ticket):
+    # 요청 deadline 안에 차례가 오지 않으면 모델에 보내 봐야 읽을 사람이 없으므로 대기열에서 뺀다.
+    remaining_seconds = read_remaining_seconds()
+    if remaining_seconds is None:
+        await ticket.wait()
+        return
+
+    try:
+        await asyncio.wait_for(ticket.wait(), remaining_seconds)
+    except asyncio.TimeoutError:
+        raise UpstreamDeadlineError(None) from None
+
+
+def read_admission_stats():
+    return {
+        'enabled': ADMISSION_ENABLED,
+        'models': {
+            model_name: admission_queue.read_stats()
+            for model_name, admission_queue in admission_queues.items()
+        }
+    }
@@ -0,0 +1,220 @@
+import asyncio
+import contextvars
+
+from services.utils.residency import model_residency
+from services.utils.upstream import UpstreamDeadlineError, UpstreamHTTPError
+from utils.metrics import measure_stage
+from utils.request_deadline import current_request_deadline, read_remaining_seconds
+
+BATCH_UNSUPPORTED_STATUS_CODES = {400, 404, 405, 415, 422}
+BATCH_MODE_AUTO = 'auto'
+BATCH_MODE_BATCH = 'batch'
+BATCH_MODE_SINGLE = 'single'
+
+micro_batch_dispatchers = {}
+
+
+class MicroBatchDispatcher:
+    def __init__(self, model_name, send_single, send_batch, max_batch_size, max_wait_seconds, batch_mode=BATCH_MODE_AUTO):
+        self.model_name = model_name
+        self.send_single = send_single
+        self.send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0.0, max_wait_seconds)
+        self.batch_mode = batch_mode
+        self.supports_batch = None if batch_mode == BATCH_MODE_AUTO else batch_mode == BATCH_MODE_BATCH
+        self.pending_items = {}
+        self.flush_handles = {}
+        self.dispatch_tasks = set()
+        self.stats = {
+            'batches': 0,
+            'batchedItems': 0,
+            'singleItems': 0,
+            'fallbacks': 0,
+            'isolatedRetries': 0,
+            'abandoned': 0,
+            'largestBatch': 0
+        }
+
+    async def submit(self, item, batch_key=None):
+        if self.max_batch_size <= 1 or self.supports_batch is False:
+            self.stats['singleItems'] += 1
+            return await self.send_single(item, batch_key)
+
+        loop = asyncio.get_running_loop()
+        result_future = loop.create_future()
+        pending_items = self.pending_items.setdefault(batch_key, [])
+        # 요청마다 deadline이 다르므로 batch에 넣을 때의 context를 같이 둔다.
+        pending_items.append((item, result_future, contextvars.copy_context()))
+
+        if len(pending_items) >= self.max_batch_size:
+            self.flush(batch_key)
+        elif len(pending_items) == 1:
+            # 처음 들어온 요청의 context를 물려받지 않도록 빈 context에서 flush한다.
+            self.flush_handles[batch_key] = loop.call_later(
+                self.max_wait_seconds,
+                self.flush,
+                batch_key,
+                context=contextvars.Context()
+            )
+
+        # dispatch는 요청 밖의 task에서 돌므로, 묶여 기다린 시간은 요청마다 여기서 batch 단계로 기록한다.
+        with measure_stage('batch'):
+            try:
+                return await asyncio.wait_for(result_future, read_remaining_seconds())
+            except asyncio.TimeoutError:
+                # 같은 batch의 다른 요청은 더 기다릴 수 있으므로, 자기 deadline이 지난 요청만 먼저 빠진다.
+                raise UpstreamDeadlineError(self.model_name) from None
+
+    def flush(self, batch_key):
+        flush_handle = self.flush_handles.pop(batch_key, None)
+        if flush_handle is not None:
+            flush_handle.cancel()
+
+        # 대기 중에 취소된 요청은 upstream으로 보내지 않는다.
+        pending_items = []
+        for pending_item in self.pending_items.pop(batch_key, []):
+            if pending_item[1].done():
+                model_residency.record_cancelled(self.model_name, 'batch')
+            else:
+                pending_items.append(pending_item)
+        if not pending_items:
+            return
+
+        # batch를 가득 채운 요청이 flush를 부르므로 그 요청의 deadline과 metrics를 물려받지 않게 한다.
+        dispatch_task = asyncio.get_running_loop().create_task(
+            self.dispatch(pending_items, batch_key),
+            context=contextvars.Context()
+        )
+        self.dispatch_tasks.add(dispatch_task)
+        dispatch_task.add_done_callback(self.dispatch_tasks.discard)
+        for _, result_future, _ in pending_items:
+            result_future.add_done_callback(lambda _: self.cancel_abandoned(dispatch_task, pending_items))
+
+    def cancel_abandoned(self, dispatch_task, pending_items):
+        # 같이 보낸 요청이 모두 취소되면 아무도 읽지 않을 추론이므로 upstream 호출을 끊는다.
+        if not dispatch_task.done() and all(result_future.cancelled() for _, result_future, _ in pending_items):
+            self.stats['abandoned'] += 1
+            dispatch_task.cancel()
+
+    async def dispatch(self, pending_items, batch_key):
+        if len(pending_items) == 1:
+            self.stats['singleItems'] += 1
+            await self.dispatch_single(pending_items[0], batch_key)
+            return
+
+        items = [item for item, _, _ in pending_items]
+        current_request_deadline.set(read_batch_deadline(pending_items))
+        try:
+            batch_results = await self.send_batch(items, batch_key)
+        except UpstreamHTTPError as error:
+            if self.supports_batch is None and error.status_code in BATCH_UNSUPPORTED_STATUS_CODES:
+                # 여러 이미지를 받지 못하는 컨테이너는 이후 요청부터 단건 호출로 처리한다.
+                self.fall_back_to_single()
+            else:
+                # 이미지 하나 때문에 batch 전체가 실패하지 않도록 단건으로 다시 보낸다.
+                self.stats['isolatedRetries'] += 1
+
+            self.stats['singleItems'] += len(pending_items)
+            single_succeeded = await asyncio.gather(*[self.dispatch_single(pending_item, batch_key) for pending_item in pending_items])
+            # batch가 한 번도 성공하지 않았는데 같은 이미지를 단건으로는 모두 처리했다면
+            # 이미지 문제가 아니라 컨테이너가 batch 형식(500 등)을 처리하지 못하는 것이다.
+            if self.supports_batch is None and all(single_succeeded):
+                self.fall_back_to_single()
+            return
+        except Exception as error:
+            self.set_exception(pending_items, error)
+            return
+
+        self.supports_batch = True
+        self.stats['batches'] += 1
+        self.stats['batchedItems'] += len(pending_items)
+        self.stats['largestBatch'] = max(self.stats['largestBatch'], len(pending_items))
+
+        for (_, result_future, _), batch_result in zip(pending_items, batch_results):
+            if not result_future.done():
+                result_future.set_result(batch_result)
+
+    def fall_back_to_single(self):
+        self.supports_batch = False
+        self.stats['fallbacks'] += 1
+
+    async def dispatch_single(self, pending_item, batch_key):
+        item, result_future, request_context = pending_item
+        try:
+            # 단건으로 보낼 때는 그 요청 자신의 deadline을 쓴다.
+            single_result = await asyncio.get_running_loop().create_task(
+                self.send_single(item, batch_key),
+                context=request_context.copy()
+            )
+        except Exception as error:
+            self.set_exception([pending_item], error)
+            return False
+
+        if not result_future.done():
+            result_future.set_result(single_result)
+        return True
+
+    def set_exception(self, pending_items, error):
+        for _, result_future, _ in pending_items:
+            if not result_future.done():
+                result_future.set_exception(error)
+
+    def read_stats(self):
+        return {
+            'maxBatchSize': self.max_batch_size,
+            'maxWaitSeconds': self.max_wait_seconds,
+            'batchMode': self.batch_mode,
+            'supportsBatch': self.supports_batch,
+            'pending': sum(len(pending_items) for pending_items in self.pending_items.values()),
+            **self.stats
+        }
+
+
+def register_micro_batch_dispatcher(model_name, send_single, send_batch, max_batch_size, max_wait_ms, batch_mode):
+    micro_batch_dispatcher = MicroBatchDispatcher(
+        model_name,
+        send_single,
+        send_batch,
+        max_batch_size,
+        max_wait_ms / 1000.0,
+        normalize_batch_mode(batch_mode)
+    )
+    micro_batch_dispatchers[model_name] = micro_batch_dispatcher
+    return micro_batch_dispatcher
+
+
+def normalize_batch_mode(batch_mode):
+    normalized_mode = str(batch_mode or BATCH_MODE_AUTO).strip().lower()
+    if normalized_mode in [BATCH_MODE_BATCH, BATCH_MODE_SINGLE]:
+        return normalized_mode
+
+    return BATCH_MODE_AUTO
+
+
+def read_batch_deadline(pending_items):
+    # 먼저 온 요청의 짧은 deadline이 batch 전체를 끊지 않도록, 아직 기다리는 요청 중 가장 늦은 deadline을 쓴다.
+    request_deadlines = [
+        request_context.get(current_request_deadline)
+        for _, result_future, request_context in pending_items
+        if not result_future.done()
+    ]
+    if not request_deadlines or None in request_deadlines:
+        return None
+
+    return max(request_deadlines)
+
+
+def read_batch_results(batch_response, expected_count):
+    batch_results = batch_response.get('results') if isinstance(batch_response, dict) else None
+    if not isinstance(batch_results, list) or len(batch_results) != expected_count:
+        raise RuntimeError(f'HTTP 502: batch response must contain {expected_count} results')
+
+    return batch_results
+
+
+def read_micro_batch_stats():
+    return {
+        model_name: micro_batch_dispatcher.read_stats()
+        for model_name, micro_batch_dispatcher in micro_batch_dispatchers.items()
+    }
@@ -0,0 +1,170 @@
+import ast
+import html
+import json
+import re
+
+DEEPSEEK_REF_OPEN = '<|ref|>'
+DEEPSEEK_REF_CLOSE = '<|/ref|>'
+DEEPSEEK_DET_OPEN = '<|det|>'
+DEEPSEEK_DET_CLOSE = '<|/det|>'
+DEEPSEEK_TABLE_PATTERN = re.compile(r'<table\b.*?</table>', re.DOTALL | re.IGNORECASE)
+DEEPSEEK_WHITESPACE_PATTERN = re.compile(r'\s*')
+DEEPSEEK_IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\([^)]+\)')
+DEEPSEEK_LINE_BREAK_TAG_PATTERN = re.compile(r'<br\s*/?>|</tr>', re.IGNORECASE)
+DEEPSEEK_HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+DEEPSEEK_NESTED_TAG_PATTERN = re.compile(r'<[^>]*<')
+DEEPSEEK_HEADING_PATTERN = re.compile(r'^\s{0,3}#{1,6}\s*', re.MULTILINE)
+DEEPSEEK_SPACE_RUN_PATTERN = re.compile(r'\t[ \t]*| [ \t]+')
+DEEPSEEK_LINE_INDENT_PATTERN = re.compile(r'\n\s+')
+DEEPSEEK_COORDINATE_CHARACTERS = frozenset('0123456789.-eE[], \t\r\n')
+
+
+class DeepSeekRefBlock:
+    __slots__ = ('label_text', 'coordinate_text', 'start', 'end')
+
+    def __init__(self, label_text, coordinate_text, start, end):
+        self.label_text = label_text
+        self.coordinate_text = coordinate_text
+        self.start = start
+        self.end = end
+
+
+def find_deepseek_ref_block(generated_text, position=0):
+    # <|ref|>label<|/ref|> <|det|>coords<|/det|> 블록을 정규식 backtracking 없이 찾는다.
+    # 닫는 ref 뒤에 det가 바로 오지 않으면 다음 닫는 ref까지 label을 늘려 본다.
+    while True:
+        block_start = generated_text.find(DEEPSEEK_REF_OPEN, position)
+        if block_start < 0:
+            return None
+
+        label_start = block_start + len(DEEPSEEK_REF_OPEN)
+        label_end = generated_text.find(DEEPSEEK_REF_CLOSE, label_start)
+
+        while label_end >= 0:
+            det_start = DEEPSEEK_WHITESPACE_PATTERN.match(generated_text, label_end + len(DEEPSEEK_REF_CLOSE)).end()
+            if generated_text.startswith(DEEPSEEK_DET_OPEN, det_start):
+                coordinate_start = det_start + len(DEEPSEEK_DET_OPEN)
+                coordinate_end = generated_text.find(DEEPSEEK_DET_CLOSE, coordinate_start)
+                if coordinate_end < 0:
+                    break
+
+                return DeepSeekRefBlock(
+                    generated_text[label_start:label_end],
+                    generated_text[coordinate_start:coordinate_end],
+                    block_start,
+                    coordinate_end + len(DEEPSEEK_DET_CLOSE)
+                )
+
+            label_end = generated_text.find(DEEPSEEK_REF_CLOSE, label_end + 1)
+
+        position = block_start + 1
+
+
+def iter_deepseek_ref_blocks(generated_text, position=0):
+    ref_block = find_deepseek_ref_block(generated_text, position)
+    while ref_block is not None:
+        yield ref_block
+        ref_block = find_deepseek_ref_block(generated_text, ref_block.end)
+
+
+def parse_deepseek_ref_block(ref_block, rec_content):
+    box_label = normalize_deepseek_label(ref_block.label_text)
+    coordinate_boxes = parse_deepseek_coordinate_text(ref_block.coordinate_text)
+    rec_text = normalize_deepseek_rec_text(rec_content)
+    rec_html = extract_deepseek_table_html(rec_content) if box_label == 'table' else ''
+    return box_label, coordinate_boxes, rec_text, rec_html
+
+
+def normalize_deepseek_label(label_text):
+    normalized_label = ' '.join(str(label_text or '').split())
+    return normalized_label or 'bbox'
+
+
+def extract_deepseek_table_html(rec_content):
+    table_match = DEEPSEEK_TABLE_PATTERN.search(rec_content or '')
+    if not table_match:
+        return ''
+
+    return table_match.group(0).strip()
+
+
+def normalize_deepseek_rec_text(rec_content):
+    rec_text = str(rec_content or '').strip()
+    if not rec_text:
+        return ''
+
+    if '![' in rec_text:
+        rec_text = DEEPSEEK_IMAGE_PATTERN.sub(' ', rec_text)
+
+    if '<' in rec_text:
+        rec_text = replace_deepseek_tags(rec_text)
+
+    rec_text = html.unescape(rec_text)
+
+    if '#' in rec_text:
+        rec_text = DEEPSEEK_HEADING_PATTERN.sub('', rec_text)
+
+    rec_text = DEEPSEEK_SPACE_RUN_PATTERN.sub(' ', rec_text)
+    # 줄바꿈 뒤 공백이 모두 사라지므로 3개 이상 이어진 줄바꿈은 따로 줄이지 않아도 남지 않는다.
+    rec_text = DEEPSEEK_LINE_INDENT_PATTERN.sub('\n', rec_text)
+    return rec_text.strip()
+
+
+def replace_deepseek_tags(rec_text):
+    if DEEPSEEK_NESTED_TAG_PATTERN.search(rec_text):
+        # 닫히지 않은 '<' 뒤에 태그가 오면 치환 순서에 따라 결과가 달라지므로 단계별로 치환한다.
+        rec_text = re.sub(r'<br\s*/?>', '\n', rec_text, flags=re.IGNORECASE)
+        rec_text = re.sub(r'</(td|th)>', ' ', rec_text, flags=re.IGNORECASE)
+        rec_text = re.sub(r'</tr>', '\n', rec_text, flags=re.IGNORECASE)
+        return DEEPSEEK_HTML_TAG_PATTERN.sub(' ', rec_text)
+
+    # 태그끼리 겹치지 않으면 br/tr는 줄바꿈, td/th를 포함한 나머지 태그는 공백으로 두 번에 치환할 수 있다.
+    rec_text = DEEPSEEK_LINE_BREAK_TAG_PATTERN.sub('\n', rec_text)
+    return DEEPSEEK_HTML_TAG_PATTERN.sub(' ', rec_text)
+
+
+def parse_deepseek_coordinate_text(coordinate_text):
+    stripped_text = coordinate_text.strip()
+    coordinates = None
+
+    if DEEPSEEK_COORDINATE_CHARACTERS.issuperset(stripped_text):
+        # 숫자 배열만 있는 일반적인 응답은 JSON parser로 읽고, 그 외 표기는 literal_eval로 처리한다.
+        try:
+            coordinates = json.loads(stripped_text)
+        except (ValueError, RecursionError):
+            coordinates = None
+
+    if coordinates is None:
+        try:
+            coordinates = ast.literal_eval(stripped_text)
+        except (SyntaxError, ValueError):
+            return []
+
+    return flatten_deepseek_coordinate_boxes(coordinates)
+
+
+def flatten_deepseek_coordinate_boxes(coordinates):
+    if is_coordinate_box(coordinates):
+        return [coordinates]
+
+    if not isinstance(coordinates, (list, tuple)):
+        return []
+
+    coordinate_boxes = []
+    for coordinate_group in coordinates:
+        coordinate_boxes.extend(flatten_deepseek_coordinate_boxes(coordinate_group))
+
+    return coordinate_boxes
+
+
+def is_coordinate_box(coordinates):
+    if not isinstance(coordinates, (list, tuple)) or len(coordinates) != 4:
+        return False
+
+    x1, y1, x2, y2 = coordinates
+    return (
+        isinstance(x1, (int, float))
+        and isinstance(y1, (int, float))
+        and isinstance(x2, (int, float))
+        and isinstance(y2, (int, float))
+    )
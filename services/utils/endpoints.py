@@ -0,0 +1,290 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+
+from config import (
+    UPSTREAM_EJECT_FAILURES,
+    UPSTREAM_EJECT_SECONDS,
+    UPSTREAM_HEALTH_INTERVAL,
+    UPSTREAM_HEALTH_TIMEOUT,
+)
+from services.utils.upstream import (
+    UpstreamConnectionError,
+    UpstreamDeadlineError,
+    UpstreamHTTPError,
+    probe_upstream,
+    release_upstream_model,
+)
+from services.utils.residency import current_model_lease
+
+ENDPOINT_STATE_HEALTHY = 'healthy'
+ENDPOINT_STATE_EJECTED = 'ejected'
+ENDPOINT_STATE_HALF_OPEN = 'half-open'
+ENDPOINT_URL_SEPARATOR_PATTERN = re.compile(r'[\s,]+')
+LATENCY_EWMA_WEIGHT = 0.2
+MAX_EJECT_MULTIPLIER = 8
+
+endpoint_pools = {}
+health_check_task = None
+
+
+class ModelEndpoint:
+    def __init__(self, api_url, release_url=None, health_url=None):
+        self.api_url = api_url
+        self.release_url = release_url
+        self.health_url = health_url
+        self.state = ENDPOINT_STATE_HEALTHY
+        self.transport_mode = None
+        self.loaded = False
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_multiplier = 1
+        self.latency_ewma = None
+        self.last_error = None
+        self.stats = {
+            'requests': 0,
+            'failures': 0,
+            'ejections': 0,
+            'seconds': 0.0
+        }
+
+    def is_available(self, now):
+        if self.state == ENDPOINT_STATE_HEALTHY:
+            return True
+
+        # eject 시간이 지나면 요청 하나만 시험 삼아 보내 본다.
+        return self.state == ENDPOINT_STATE_EJECTED and now >= self.ejected_until
+
+    def record_success(self, elapsed_seconds=None):
+        if elapsed_seconds is not None:
+            self.stats['seconds'] += elapsed_seconds
+            if self.latency_ewma is None:
+                self.latency_ewma = elapsed_seconds
+            else:
+                self.latency_ewma += LATENCY_EWMA_WEIGHT * (elapsed_seconds - self.latency_ewma)
+
+        self.consecutive_failures = 0
+        self.eject_multiplier = 1
+        self.state = ENDPOINT_STATE_HEALTHY
+
+    def record_failure(self, reason):
+        self.stats['failures'] += 1
+        self.consecutive_failures += 1
+        self.last_error = reason
+
+        if self.state == ENDPOINT_STATE_HALF_OPEN:
+            # 시험 요청도 실패하면 eject 시간을 늘려서 다시 뺀다.
+            self.eject_multiplier = min(self.eject_multiplier * 2, MAX_EJECT_MULTIPLIER)
+            self.eject()
+        elif self.state == ENDPOINT_STATE_HEALTHY and self.consecutive_failures >= UPSTREAM_EJECT_FAILURES:
+            self.eject()
+
+    def eject(self):
+        # 다시 뜬 컨테이너는 다른 버전일 수 있으므로 돌아오면 전송 방식을 다시 확인한다.
+        self.transport_mode = None
+        self.state = ENDPOINT_STATE_EJECTED
+        self.ejected_until = time.monotonic() + UPSTREAM_EJECT_SECONDS * self.eject_multiplier
+        self.stats['ejections'] += 1
+
+    def read_stats(self):
+        return {
+            'apiUrl': self.api_url,
+            'releaseUrl': self.release_url,
+            'state': self.state,
+            'loaded': self.loaded,
+            'inFlight': self.in_flight,
+            'consecutiveFailures': self.consecutive_failures,
+            'ejectedForSeconds': round(max(0.0, self.ejected_until - time.monotonic()), 3) if self.state == ENDPOINT_STATE_EJECTED else 0.0,
+            **self.stats,
+            'seconds': round(self.stats['seconds'], 3),
+            'averageSeconds': round(self.stats['seconds'] / self.stats['requests'], 4) if self.stats['requests'] else 0.0,
+            'latencyEwmaSeconds': round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            'lastError': self.last_error
+        }
+
+
+class ModelEndpointPool:
+    def __init__(self, model_name, endpoints):
+        self.model_name = model_name
+        self.endpoints = endpoints
+        self.next_index = 0
+
+    def select(self, excluded_endpoint=None):
+        now = time.monotonic()
+        available_endpoints = [
+            endpoint
+            for endpoint in self.endpoints
+            if endpoint.is_available(now) and endpoint is not excluded_endpoint
+        ]
+
+        if not available_endpoints:
+            # 모든 replica가 빠졌으면 요청을 거절하지 않고 가장 먼저 돌아올 replica로 보낸다.
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+
+        # 진행 중 요청이 가장 적은 replica를 고르고, 같으면 돌아가면서 고른다.
+        endpoint_count = len(self.endpoints)
+        self.next_index = (self.next_index + 1) % endpoint_count
+        _, _, selected_endpoint = min(
+            (endpoint.in_flight, (endpoint_index - self.next_index) % endpoint_count, endpoint)
+            for endpoint_index, endpoint in enumerate(self.endpoints)
+            if endpoint in available_endpoints
+        )
+        return selected_endpoint
+
+    @asynccontextmanager
+    async def lease(self, excluded_endpoint=None):
+        if not self.endpoints:
+            raise UpstreamConnectionError(None, 'API URL is not configured.')
+
+        endpoint = self.select(excluded_endpoint)
+        if endpoint.state == ENDPOINT_STATE_EJECTED:
+            endpoint.state = ENDPOINT_STATE_HALF_OPEN
+
+        endpoint.in_flight += 1
+        endpoint.stats['requests'] += 1
+        # 요청을 받은 replica는 모델을 올리므로, 나중에 내릴 replica로 기억해 둔다.
+        endpoint.loaded = True
+        model_lease = current_model_lease.get()
+        if model_lease is not None and model_lease.model_name == self.model_name and endpoint not in model_lease.endpoints:
+            model_lease.endpoints.append(endpoint)
+        started_at = time.monotonic()
+
+        try:
+            yield endpoint
+        except UpstreamDeadlineError:
+            # 요청 deadline이 먼저 끝난 것은 replica 탓이 아니다.
+            raise
+        except UpstreamConnectionError as error:
+            endpoint.record_failure(error.reason)
+            raise
+        except UpstreamHTTPError as error:
+            # 4xx는 replica가 정상적으로 응답한 것이므로 5xx만 장애로 센다.
+            if error.status_code >= 500:
+                endpoint.record_failure(f'HTTP {error.status_code}')
+            else:
+                endpoint.record_success(time.monotonic() - started_at)
+            raise
+        except BaseException:
+            if endpoint.state == ENDPOINT_STATE_HALF_OPEN:
+                endpoint.state = ENDPOINT_STATE_EJECTED
+            raise
+        else:
+            endpoint.record_success(time.monotonic() - started_at)
+        finally:
+            endpoint.in_flight -= 1
+
+    async def release(self, read_timeout, endpoints=None):
+        # endpoints를 주지 않으면 모델을 올린 replica를 모두 내린다. 요청을 받지 않은 replica에는 보내지 않는다.
+        if not any(endpoint.release_url for endpoint in self.endpoints):
+            return False
+
+        release_endpoints = [
+            endpoint
+            for endpoint in (self.endpoints if endpoints is None else endpoints)
+            if endpoint.release_url and endpoint.loaded
+        ]
+        release_results = await asyncio.gather(*[
+            release_upstream_model(endpoint.release_url, read_timeout)
+            for endpoint in release_endpoints
+        ])
+        for endpoint, is_released in zip(release_endpoints, release_results):
+            if is_released:
+                endpoint.loaded = False
+
+        return all(release_results)
+
+    def has_loaded_endpoints(self):
+        return any(endpoint.loaded for endpoint in self.endpoints)
+
+    async def check_health(self):
+        await asyncio.gather(*[
+            check_endpoint_health(endpoint)
+            for endpoint in self.endpoints
+            if endpoint.health_url and endpoint.in_flight == 0
+        ])
+
+    def read_stats(self):
+        return {
+            'replicas': len(self.endpoints),
+            'healthy': sum(1 for endpoint in self.endpoints if endpoint.state == ENDPOINT_STATE_HEALTHY),
+            'endpoints': [endpoint.read_stats() for endpoint in self.endpoints]
+        }
+
+
+async def check_endpoint_health(endpoint):
+    try:
+        status_code = await probe_upstream(endpoint.health_url, UPSTREAM_HEALTH_TIMEOUT)
+    except UpstreamConnectionError as error:
+        endpoint.record_failure(f'health: {error.reason}')
+        return
+
+    if status_code >= 500:
+        endpoint.record_failure(f'health: HTTP {status_code}')
+    elif endpoint.state != ENDPOINT_STATE_HEALTHY or endpoint.consecutive_failures:
+        # health endpoint가 없는 컨테이너(404/405)도 응답은 했으므로 살아 있는 것으로 본다.
+        endpoint.record_success()
+
+
+def read_endpoint_urls(raw_urls):
+    return [api_url for api_url in ENDPOINT_URL_SEPARATOR_PATTERN.split(str(raw_urls or '').strip()) if api_url]
+
+
+def build_sibling_url(api_url, path_name):
+    return api_url.rsplit('/', 1)[0] + f'/{path_name}'
+
+
+def register_endpoint_pool(model_name, raw_api_urls, raw_release_urls=None, use_release=True):
+    api_urls = read_endpoint_urls(raw_api_urls)
+    release_urls = read_endpoint_urls(raw_release_urls)
+    if use_release and release_urls and len(release_urls) != len(api_urls):
+        # 어느 replica의 release URL인지 알 수 없으므로 조용히 버리지 않고 시작할 때 멈춘다.
+        raise ValueError(
+            f'{model_name} release URL은 API URL과 같은 수만큼 줘야 합니다. '
+            f'(API URL {len(api_urls)}개, release URL {len(release_urls)}개)'
+        )
+    endpoints = []
+
+    for endpoint_index, api_url in enumerate(api_urls):
+        release_url = None
+        if use_release:
+            # release URL을 주지 않았으면 각 API URL 옆의 /release를 쓴다.
+            release_url = release_urls[endpoint_index] if release_urls else build_sibling_url(api_url, 'release')
+
+        endpoints.append(ModelEndpoint(api_url, release_url, build_sibling_url(api_url, 'health')))
+
+    endpoint_pool = ModelEndpointPool(model_name, endpoints)
+    endpoint_pools[model_name] = endpoint_pool
+    return endpoint_pool
+
+
+async def run_endpoint_health_checks():
+    while True:
+        await asyncio.sleep(UPSTREAM_HEALTH_INTERVAL)
+        await asyncio.gather(*[endpoint_pool.check_health() for endpoint_pool in endpoint_pools.values()])
+
+
+def start_endpoint_health_checks():
+    global health_check_task
+
+    if UPSTREAM_HEALTH_INTERVAL > 0 and health_check_task is None:
+        health_check_task = asyncio.get_running_loop().create_task(run_endpoint_health_checks())
+
+
+async def stop_endpoint_health_checks():
+    global health_check_task
+
+    if health_check_task is None:
+        return
+
+    health_check_task.cancel()
+    await asyncio.gather(health_check_task, return_exceptions=True)
+    health_check_task = None
+
+
+def read_endpoint_pool_stats():
+    return {
+        model_name: endpoint_pool.read_stats()
+        for model_name, endpoint_pool in endpoint_pools.items()
+    }
@@ -0,0 +1,492 @@
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from config import GPU_RESIDENCY_ENABLED, GPU_RESIDENCY_MAX_CONSECUTIVE
+from services.utils.upstream import UpstreamDeadlineError, UpstreamHTTPError
+from utils.metrics import record_cancelled_inference
+from utils.request_deadline import read_remaining_seconds
+from utils.shared_state import SHARED_STATE_POLL_INTERVAL, shared_state
+
+# 모델을 쓰는 동안의 lease. endpoint pool이 요청을 보낸 replica를 여기에 남겨, 오류가 나면 그 replica만 내린다.
+current_model_lease = contextvars.ContextVar('current_model_lease', default=None)
+
+
+class ModelLease:
+    def __init__(self, model_name, release_after_inference, is_cold):
+        self.model_name = model_name
+        self.release_after_inference = release_after_inference
+        self.is_cold = is_cold
+        self.endpoints = []
+
+
+class ResidentModel:
+    def __init__(self, model_name, release_model, idle_ttl, gpu_group, endpoint_pool=None):
+        self.model_name = model_name
+        self.release_model = release_model
+        self.endpoint_pool = endpoint_pool
+        self.idle_ttl = idle_ttl
+        self.gpu_group = gpu_group
+        self.loaded = False
+        self.in_flight = 0
+        self.idle_task = None
+        self.stats = {
+            'requests': 0,
+            'loads': 0,
+            'releases': 0,
+            'releaseReasons': {},
+            'coldRequests': 0,
+            'coldSeconds': 0.0,
+            'warmRequests': 0,
+            'warmSeconds': 0.0,
+            'waitSeconds': 0.0,
+            'cancelled': {},
+            'savedSeconds': 0.0
+        }
+
+    def estimate_inference_seconds(self, is_cold):
+        # 처음 load하는 요청은 cold 평균, 이미 올라온 모델은 warm 평균으로 보고, 한쪽 기록이 없으면 다른 쪽을 쓴다.
+        cold_average = self.stats['coldSeconds'] / self.stats['coldRequests'] if self.stats['coldRequests'] else None
+        warm_average = self.stats['warmSeconds'] / self.stats['warmRequests'] if self.stats['warmRequests'] else None
+        if is_cold:
+            return cold_average if cold_average is not None else warm_average or 0.0
+
+        return warm_average if warm_average is not None else cold_average or 0.0
+
+    def read_stats(self):
+        average_cold_seconds = self.stats['coldSeconds'] / self.stats['coldRequests'] if self.stats['coldRequests'] else 0.0
+        average_warm_seconds = self.stats['warmSeconds'] / self.stats['warmRequests'] if self.stats['warmRequests'] else 0.0
+        estimated_load_seconds = max(0.0, average_cold_seconds - average_warm_seconds) * self.stats['coldRequests']
+
+        return {
+            'gpu': self.gpu_group,
+            'loaded': self.loaded,
+            'inFlight': self.in_flight,
+            'idleTtl': self.idle_ttl,
+            **self.stats,
+            'releaseReasons': dict(self.stats['releaseReasons']),
+            'cancelled': dict(self.stats['cancelled']),
+            'savedSeconds': round(self.stats['savedSeconds'], 3),
+            'averageColdSeconds': average_cold_seconds,
+            'averageWarmSeconds': average_warm_seconds,
+            'estimatedLoadSeconds': estimated_load_seconds
+        }
+
+
+class GpuGroup:
+    def __init__(self, gpu_name):
+        self.gpu_name = gpu_name
+        self.owner = None
+        self.next_model = None
+        self.switching = False
+        self.consecutive_grants = 0
+        self.switches = 0
+        self.waiters = OrderedDict()
+
+    def count_waiting(self, model_name=None):
+        if model_name is not None:
+            return len(self.waiters.get(model_name, ()))
+
+        return sum(len(model_waiters) for model_waiters in self.waiters.values())
+
+    def has_other_waiters(self, model_name):
+        return any(waiting_model != model_name and model_waiters for waiting_model, model_waiters in self.waiters.items())
+
+
+class ModelResidencyManager:
+    def __init__(self, enabled=True, max_consecutive=16):
+        self.enabled = enabled
+        self.max_consecutive = max_consecutive
+        self.models = {}
+        self.gpu_groups = {}
+
+    def register(self, model_name, release_model, idle_ttl, gpu_group='0', endpoint_pool=None):
+        self.models[model_name] = ResidentModel(model_name, release_model, idle_ttl, str(gpu_group), endpoint_pool)
+        self.gpu_groups.setdefault(str(gpu_group), GpuGroup(str(gpu_group)))
+
+    @asynccontextmanager
+    async def hold(self, model_name, release_after_inference=None):
+        resident_model = self.models[model_name]
+
+        if not self.enabled:
+            resident_model.stats['requests'] += 1
+            model_lease = ModelLease(model_name, True if release_after_inference is None else release_after_inference, True)
+            lease_token = current_model_lease.set(model_lease)
+            try:
+                yield model_lease
+            finally:
+                current_model_lease.reset(lease_token)
+            return
+
+        waited_at = time.monotonic()
+        try:
+            model_lease = await self.acquire(resident_model, bool(release_after_inference))
+        except (asyncio.CancelledError, UpstreamDeadlineError):
+            self.record_cancelled(model_name, 'queued', is_cold=not resident_model.loaded)
+            raise
+        started_at = time.monotonic()
+        resident_model.stats['waitSeconds'] += started_at - waited_at
+        cancelled_phase = None
+        lease_token = current_model_lease.set(model_lease)
+
+        try:
+            yield model_lease
+        except asyncio.CancelledError:
+            cancelled_phase = 'inference'
+            raise
+        except UpstreamDeadlineError:
+            # deadline으로 끊은 호출도 모델 오류가 아니므로 모델을 내리지 않고 취소처럼 다룬다.
+            cancelled_phase = 'deadline'
+            raise
+        finally:
+            current_model_lease.reset(lease_token)
+            elapsed_seconds = time.monotonic() - started_at
+            release_reason = None
+            if cancelled_phase is not None:
+                # 중간에 끊은 시간은 평균 처리 시간에 넣지 않고, 평균에서 이미 쓴 시간을 뺀 만큼을 아낀 것으로 센다.
+                self.record_cancelled(model_name, cancelled_phase, elapsed_seconds, model_lease.is_cold)
+                if model_lease.release_after_inference and resident_model.loaded and self.is_last_user(resident_model):
+                    # 모델 컨테이너가 추론과 함께 inline release도 건너뛰었을 수 있으므로 다른 사용자가 없을 때만 직접 내린다.
+                    release_reason = 'cancelled'
+            else:
+                if model_lease.is_cold:
+                    resident_model.stats['coldRequests'] += 1
+                    resident_model.stats['coldSeconds'] += elapsed_seconds
+                else:
+                    resident_model.stats['warmRequests'] += 1
+                    resident_model.stats['warmSeconds'] += elapsed_seconds
+
+                if model_lease.release_after_inference and resident_model.loaded:
+                    self.mark_released(resident_model, 'inline')
+
+            self.finish(resident_model, release_reason)
+
+    async def acquire(self, resident_model, release_after_inference):
+        gpu_group = self.gpu_groups[resident_model.gpu_group]
+
+        while not self.can_enter(gpu_group, resident_model):
+            waiter = asyncio.get_running_loop().create_future()
+            gpu_group.waiters.setdefault(resident_model.model_name, deque()).append(waiter)
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                model_waiters = gpu_group.waiters.get(resident_model.model_name)
+                if model_waiters and waiter in model_waiters:
+                    model_waiters.remove(waiter)
+                self.wake(gpu_group)
+                raise
+
+        is_cold = not resident_model.loaded
+        release_model_name = None
+        if shared_state is not None:
+            is_cold, release_model_name = await self.enter_shared_gpu(gpu_group, resident_model)
+
+        if gpu_group.owner != resident_model.model_name or release_model_name is not None:
+            try:
+                await self.switch_owner(gpu_group, resident_model, release_model_name)
+            except BaseException:
+                if shared_state is not None:
+                    shared_state.submit(shared_state.leave_gpu, resident_model.model_name)
+                raise
+
+        self.cancel_idle_release(resident_model)
+        gpu_group.consecutive_grants += 1
+        resident_model.in_flight += 1
+        resident_model.stats['requests'] += 1
+
+        if is_cold:
+            resident_model.loaded = True
+            resident_model.stats['loads'] += 1
+
+        return ModelLease(resident_model.model_name, release_after_inference, is_cold)
+
+    def can_enter(self, gpu_group, resident_model):
+        if gpu_group.switching:
+            return False
+
+        if gpu_group.owner == resident_model.model_name:
+            # 다른 모델이 기다리는 중이면 같은 모델만 계속 잡고 있지 않도록 연속 허용 횟수를 제한한다.
+            return not (
+                gpu_group.has_other_waiters(resident_model.model_name)
+                and gpu_group.consecutive_grants >= self.max_consecutive
+            )
+
+        owner_model = self.models.get(gpu_group.owner)
+        if owner_model is not None and owner_model.in_flight > 0:
+            return False
+
+        if gpu_group.next_model is not None:
+            return gpu_group.next_model == resident_model.model_name
+
+        return not gpu_group.has_other_waiters(resident_model.model_name)
+
+    async def enter_shared_gpu(self, gpu_group, resident_model):
+        # 다른 worker가 같은 GPU에서 다른 모델로 추론 중이면 끝날 때까지 기다린다.
+        # 기다리는 동안에는 이 worker의 다른 요청도 GPU를 바꾸지 못하도록 switching으로 막고,
+        # 요청 deadline이 지나면 더 기다리지 않는다.
+        shared_entry = await self.try_enter_shared_gpu(gpu_group, resident_model)
+        if shared_entry is not None:
+            return shared_entry
+
+        gpu_group.switching = True
+        try:
+            while shared_entry is None:
+                remaining_seconds = read_remaining_seconds()
+                if remaining_seconds is not None and remaining_seconds <= 0:
+                    raise UpstreamDeadlineError(resident_model.model_name)
+
+                poll_seconds = SHARED_STATE_POLL_INTERVAL if remaining_seconds is None else min(SHARED_STATE_POLL_INTERVAL, remaining_seconds)
+                await asyncio.sleep(poll_seconds)
+                shared_entry = await self.try_enter_shared_gpu(gpu_group, resident_model)
+        finally:
+            gpu_group.switching = False
+            if shared_entry is None:
+                # 다른 worker가 이미 떠난 대기 기록 때문에 GPU를 양보하지 않도록 지운다.
+                shared_state.submit(shared_state.stop_waiting_gpu, gpu_group.gpu_name)
+                self.wake(gpu_group)
+
+        return shared_entry
+
+    async def try_enter_shared_gpu(self, gpu_group, resident_model):
+        def undo_shared_entry(shared_entry):
+            if shared_entry is None:
+                shared_state.stop_waiting_gpu(gpu_group.gpu_name)
+                return
+            shared_state.leave_gpu(resident_model.model_name)
+            if shared_entry[1] is not None:
+                shared_state.finish_switch(gpu_group.gpu_name)
+
+        return await shared_state.run(
+            shared_state.enter_gpu,
+            gpu_group.gpu_name,
+            resident_model.model_name,
+            self.max_consecutive,
+            undo=undo_shared_entry
+        )
+
+    async def switch_owner(self, gpu_group, resident_model, release_model_name=None):
+        previous_model = self.models.get(gpu_group.owner)
+        gpu_group.switching = True
+
+        try:
+            if shared_state is None:
+                if previous_model is not None:
+                    self.cancel_idle_release(previous_model)
+                    if previous_model.loaded:
+                        await self.release_resident(previous_model, 'switch')
+                    gpu_group.switches += 1
+            else:
+                # 여러 worker가 함께 쓸 때는 shared state가 실제로 올라와 있다고 알려 준 모델만 내린다.
+                if previous_model is not None and previous_model is not resident_model:
+                    self.cancel_idle_release(previous_model)
+                    previous_model.loaded = False
+                if release_model_name is not None:
+                    release_model = self.models[release_model_name]
+                    self.cancel_idle_release(release_model)
+                    await self.release_resident(release_model, 'switch')
+                    gpu_group.switches += 1
+
+            gpu_group.owner = resident_model.model_name
+            gpu_group.consecutive_grants = 0
+        finally:
+            if shared_state is not None and release_model_name is not None:
+                shared_state.submit(shared_state.finish_switch, gpu_group.gpu_name)
+            gpu_group.switching = False
+            gpu_group.next_model = None
+            self.wake(gpu_group)
+
+    def is_last_user(self, resident_model):
+        gpu_group = self.gpu_groups[resident_model.gpu_group]
+        return resident_model.in_flight == 1 and not gpu_group.count_waiting(resident_model.model_name)
+
+    def finish(self, resident_model, release_reason=None):
+        gpu_group = self.gpu_groups[resident_model.gpu_group]
+        resident_model.in_flight -= 1
+        if shared_state is not None:
+            shared_state.submit(shared_state.leave_gpu, resident_model.model_name)
+
+        if resident_model.in_flight == 0 and resident_model.loaded:
+            if release_reason is None:
+                self.schedule_idle_release(resident_model)
+            else:
+                self.schedule_idle_release(resident_model, 0, release_reason)
+
+        self.wake(gpu_group)
+
+    def wake(self, gpu_group):
+        if gpu_group.switching:
+            return
+
+        owner_model = self.models.get(gpu_group.owner)
+        owner_waiting = gpu_group.count_waiting(gpu_group.owner) if owner_model is not None else 0
+
+        if owner_waiting and not (
+            gpu_group.has_other_waiters(gpu_group.owner)
+            and gpu_group.consecutive_grants >= self.max_consecutive
+        ):
+            self.resolve_waiters(gpu_group, gpu_group.owner)
+            return
+
+        if owner_model is not None and owner_model.in_flight > 0:
+            return
+
+        for waiting_model, model_waiters in gpu_group.waiters.items():
+            if waiting_model != gpu_group.owner and model_waiters:
+                # 같은 모델로 대기 중인 요청을 한 번에 깨워서 모델 전환 한 번으로 함께 처리한다.
+                gpu_group.next_model = waiting_model
+                self.resolve_waiters(gpu_group, waiting_model)
+                return
+
+        if owner_waiting:
+            self.resolve_waiters(gpu_group, gpu_group.owner)
+
+    def resolve_waiters(self, gpu_group, model_name):
+        model_waiters = gpu_group.waiters.pop(model_name, deque())
+        for waiter in model_waiters:
+            if not waiter.done():
+                waiter.set_result(True)
+
+    def schedule_idle_release(self, resident_model, idle_ttl=None, reason='idle'):
+        # 취소된 요청의 finally에서도 불리므로 기다리지 않고 task로 띄운다.
+        # 마지막 요청의 deadline과 metrics를 물려받지 않도록 빈 context에서 돈다.
+        self.cancel_idle_release(resident_model)
+        idle_ttl = resident_model.idle_ttl if idle_ttl is None else idle_ttl
+        resident_model.idle_task = asyncio.get_running_loop().create_task(
+            self.release_when_idle(resident_model, idle_ttl, reason),
+            context=contextvars.Context()
+        )
+
+    def cancel_idle_release(self, resident_model):
+        idle_task = resident_model.idle_task
+        resident_model.idle_task = None
+        if idle_task is not None and not idle_task.done() and idle_task is not asyncio.current_task():
+            idle_task.cancel()
+
+    async def release_when_idle(self, resident_model, idle_ttl, reason='idle'):
+        if idle_ttl > 0:
+            await asyncio.sleep(idle_ttl)
+
+        gpu_group = self.gpu_groups[resident_model.gpu_group]
+        if resident_model.in_flight > 0 or not resident_model.loaded or gpu_group.switching:
+            return
+
+        gpu_group.switching = True
+        try:
+            await self.release_shared_resident(resident_model, reason)
+            if gpu_group.owner == resident_model.model_name:
+                gpu_group.owner = None
+        finally:
+            gpu_group.switching = False
+            resident_model.idle_task = None
+            self.wake(gpu_group)
+
+    async def release(self, model_name, reason, endpoints=None):
+        # 추론 중에 오류로 내릴 때는 실패한 요청이 아직 자리를 잡고 있으므로 다른 worker의 사용만 확인한다.
+        resident_model = self.models[model_name]
+        return await self.release_shared_resident(resident_model, reason, other_workers_only=True, endpoints=endpoints)
+
+    async def release_after_error(self, model_lease, error):
+        """추론이 실패한 요청의 lease로 모델을 내릴지 정하고, 내릴 때만 내린다.
+
+        이미지 하나가 잘못된 4xx와 deadline은 모델 문제가 아니므로 내리지 않고, 같은 모델을 쓰는 다른 요청이
+        남아 있으면 그 요청까지 다시 올리게 되므로 마지막 사용자일 때만 내린다.
+        """
+        if isinstance(error, UpstreamDeadlineError):
+            return False
+        if isinstance(error, UpstreamHTTPError) and 400 <= error.status_code < 500:
+            return False
+
+        resident_model = self.models[model_lease.model_name]
+        # residency를 끄면 사용 중인 요청 수를 세지 않으므로 모델 컨테이너의 inline release에 맡긴다.
+        if not self.enabled or not resident_model.loaded or not self.is_last_user(resident_model):
+            return False
+
+        return await self.release(model_lease.model_name, 'error', model_lease.endpoints)
+
+    async def release_shared_resident(self, resident_model, reason, other_workers_only=False, endpoints=None):
+        if shared_state is None:
+            return await self.release_resident(resident_model, reason, endpoints)
+
+        # 다른 worker가 아직 이 모델로 추론 중이거나 이미 다른 모델로 바뀌었으면 그쪽에 맡긴다.
+        is_releasing = await shared_state.run(
+            shared_state.begin_release,
+            resident_model.gpu_group,
+            resident_model.model_name,
+            other_workers_only,
+            undo=lambda began_release: began_release and shared_state.finish_release(resident_model.gpu_group, resident_model.model_name)
+        )
+        if not is_releasing:
+            resident_model.loaded = False
+            return False
+
+        try:
+            return await self.release_resident(resident_model, reason, endpoints)
+        finally:
+            shared_state.submit(shared_state.finish_release, resident_model.gpu_group, resident_model.model_name)
+
+    async def release_resident(self, resident_model, reason, endpoints=None):
+        # endpoints를 주면 그 replica만 내리고, 다른 replica에 아직 올라와 있으면 상주 상태는 그대로 둔다.
+        is_released = await resident_model.release_model(endpoints)
+        endpoint_pool = resident_model.endpoint_pool
+        if endpoints and endpoint_pool is not None and endpoint_pool.has_loaded_endpoints():
+            self.record_release(resident_model, reason)
+        else:
+            self.mark_released(resident_model, reason)
+        return is_released
+
+    def record_cancelled(self, model_name, phase, elapsed_seconds=0.0, is_cold=False):
+        resident_model = self.models.get(model_name)
+        if resident_model is None:
+            return
+
+        saved_seconds = max(0.0, resident_model.estimate_inference_seconds(is_cold) - elapsed_seconds)
+        cancelled = resident_model.stats['cancelled']
+        cancelled[phase] = cancelled.get(phase, 0) + 1
+        resident_model.stats['savedSeconds'] += saved_seconds
+        record_cancelled_inference(model_name, phase, saved_seconds)
+
+    def mark_released(self, resident_model, reason):
+        resident_model.loaded = False
+        if shared_state is not None:
+            shared_state.submit(shared_state.mark_unloaded, resident_model.gpu_group, resident_model.model_name)
+        self.record_release(resident_model, reason)
+
+    def record_release(self, resident_model, reason):
+        resident_model.stats['releases'] += 1
+        release_reasons = resident_model.stats['releaseReasons']
+        release_reasons[reason] = release_reasons.get(reason, 0) + 1
+
+    async def release_all(self):
+        for resident_model in self.models.values():
+            self.cancel_idle_release(resident_model)
+            if self.enabled and resident_model.loaded and resident_model.in_flight == 0:
+                await self.release_shared_resident(resident_model, 'shutdown')
+
+    def read_stats(self):
+        return {
+            'enabled': self.enabled,
+            'maxConsecutive': self.max_consecutive,
+            'gpus': {
+                gpu_name: {
+                    'owner': gpu_group.owner,
+                    'switching': gpu_group.switching,
+                    'switches': gpu_group.switches,
+                    'waiting': {
+                        model_name: len(model_waiters)
+                        for model_name, model_waiters in gpu_group.waiters.items()
+                        if model_waiters
+                    }
+                }
+                for gpu_name, gpu_group in self.gpu_groups.items()
+            },
+            'models': {
+                model_name: resident_model.read_stats()
+                for model_name, resident_model in self.models.items()
+            }
+        }
+
+
+model_residency = ModelResidencyManager(GPU_RESIDENCY_ENABLED, GPU_RESIDENCY_MAX_CONSECUTIVE)
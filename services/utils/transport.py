@@ -0,0 +1,258 @@
+import base64
+import json
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+
+from config import UPSTREAM_HEALTH_TIMEOUT
+from services.utils.upstream import (
+    UpstreamConnectionError,
+    build_upstream_timeout,
+    get_upstream_client,
+    open_upstream_stream,
+    post_upstream,
+)
+
+TRANSPORT_MODE_AUTO = 'auto'
+TRANSPORT_MODE_JSON = 'json'
+TRANSPORT_MODE_MULTIPART = 'multipart'
+TRANSPORT_MODE_RAW = 'raw'
+UPSTREAM_OPTIONS_HEADER = 'X-Inference-Options'
+UPSTREAM_TRANSPORTS_HEADER = 'X-Inference-Transports'
+
+upstream_transports = {}
+
+
+class MultipartBody:
+    def __init__(self, parts, boundary=None):
+        self.boundary = boundary or f'labeling-{uuid.uuid4().hex}'
+        self.chunks = build_multipart_chunks(self.boundary, parts)
+        self.content_length = sum(len(chunk) for chunk in self.chunks)
+
+    def read_headers(self):
+        return {
+            'Content-Type': f'multipart/form-data; boundary={self.boundary}',
+            'Content-Length': str(self.content_length)
+        }
+
+    async def __aiter__(self):
+        # 이미지 bytes를 이어 붙이지 않고 part 단위로 그대로 흘려보낸다.
+        for chunk in self.chunks:
+            yield chunk
+
+
+def build_multipart_chunks(boundary, parts):
+    chunks = []
+    for part in parts:
+        chunks.append(f'--{boundary}\r\n'.encode('utf-8') + build_part_header(part) + b'\r\n')
+
+        part_value = part.get('value', b'')
+        if isinstance(part_value, (bytes, bytearray, memoryview)):
+            chunks.append(part_value)
+        else:
+            chunks.append(str(part_value).encode('utf-8'))
+
+        chunks.append(b'\r\n')
+
+    chunks.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return chunks
+
+
+def build_part_header(part):
+    disposition = f'Content-Disposition: form-data; name="{part.get("name")}"'
+    if part.get('filename'):
+        disposition = f'{disposition}; filename="{part.get("filename")}"'
+
+    headers = [disposition]
+    if part.get('content_type'):
+        headers.append(f'Content-Type: {part.get("content_type")}')
+
+    return ('\r\n'.join(headers) + '\r\n').encode('utf-8')
+
+
+class RawBody:
+    # httpx는 bytes가 아닌 content를 iterable로 읽으므로, 업로드 memoryview를 bytes로 복사하지 않고 한 chunk로 보낸다.
+    def __init__(self, content):
+        self.content = content
+        self.content_length = len(content)
+
+    async def __aiter__(self):
+        yield self.content
+
+
+class UpstreamTransport:
+    def __init__(self, model_name, endpoint_pool, transport_mode=TRANSPORT_MODE_AUTO):
+        self.model_name = model_name
+        self.endpoint_pool = endpoint_pool
+        self.transport_mode = transport_mode
+        self.stats = {
+            TRANSPORT_MODE_JSON: 0,
+            TRANSPORT_MODE_MULTIPART: 0,
+            TRANSPORT_MODE_RAW: 0,
+            'probes': 0,
+            'retries': 0
+        }
+
+    async def read_endpoint_mode(self, endpoint):
+        # 방식을 정해 두지 않았으면 replica마다 health 응답이 알려 준 방식을 쓰고, 알려 주지 않는 컨테이너에는 JSON을 보낸다.
+        if self.transport_mode != TRANSPORT_MODE_AUTO:
+            return self.transport_mode
+
+        if endpoint.transport_mode is None and endpoint.health_url:
+            self.stats['probes'] += 1
+            endpoint_transports = await read_upstream_transports(endpoint.health_url, UPSTREAM_HEALTH_TIMEOUT)
+            if endpoint_transports is not None:
+                endpoint.transport_mode = TRANSPORT_MODE_MULTIPART if TRANSPORT_MODE_MULTIPART in endpoint_transports else TRANSPORT_MODE_JSON
+
+        return endpoint.transport_mode or TRANSPORT_MODE_JSON
+
+    async def post_image(self, image_bytes, fields, read_timeout):
+        return await self.post_images([image_bytes], fields, read_timeout, is_batch=False)
+
+    async def post_images(self, image_bytes_list, fields, read_timeout, is_batch=True):
+        leased_endpoint = None
+
+        try:
+            async with self.endpoint_pool.lease() as endpoint:
+                leased_endpoint = endpoint
+                return await self.post_to_endpoint(endpoint, image_bytes_list, fields, read_timeout, is_batch)
+        except UpstreamConnectionError as error:
+            if not error.is_connect_error or len(self.endpoint_pool.endpoints) < 2:
+                raise
+
+        # 연결하지 못한 replica는 빼고 한 번만 다른 replica로 다시 보낸다.
+        self.stats['retries'] += 1
+        async with self.endpoint_pool.lease(leased_endpoint) as endpoint:
+            return await self.post_to_endpoint(endpoint, image_bytes_list, fields, read_timeout, is_batch)
+
+    async def post_to_endpoint(self, endpoint, image_bytes_list, fields, read_timeout, is_batch):
+        transport_mode = await self.read_endpoint_mode(endpoint)
+        content, headers = build_transport_request(transport_mode, image_bytes_list, fields, is_batch)
+        self.stats[read_request_body_mode(transport_mode, is_batch)] += 1
+        return await post_upstream(endpoint.api_url, read_timeout, content=content, headers=headers)
+
+    @asynccontextmanager
+    async def open_image_stream(self, image_bytes, fields, read_timeout, accept):
+        # stream이 끝날 때까지 replica의 진행 중 요청으로 센다.
+        async with self.endpoint_pool.lease() as endpoint:
+            transport_mode = await self.read_endpoint_mode(endpoint)
+            content, headers = build_transport_request(transport_mode, [image_bytes], fields, False)
+            self.stats[transport_mode] += 1
+
+            async with open_upstream_stream(
+                endpoint.api_url,
+                read_timeout,
+                content=content,
+                headers={**headers, 'Accept': accept}
+            ) as response:
+                yield response
+
+    def read_stats(self):
+        return {
+            'transportMode': self.transport_mode,
+            'endpointModes': {
+                endpoint.api_url: endpoint.transport_mode
+                for endpoint in self.endpoint_pool.endpoints
+            },
+            'requests': {
+                TRANSPORT_MODE_JSON: self.stats[TRANSPORT_MODE_JSON],
+                TRANSPORT_MODE_MULTIPART: self.stats[TRANSPORT_MODE_MULTIPART],
+                TRANSPORT_MODE_RAW: self.stats[TRANSPORT_MODE_RAW]
+            },
+            'probes': self.stats['probes'],
+            'retries': self.stats['retries']
+        }
+
+
+async def read_upstream_transports(health_url, read_timeout):
+    """health 응답의 X-Inference-Transports header(또는 JSON의 transports)에서 컨테이너가 받는 전송 방식을 읽는다.
+
+    알려 주지 않으면 빈 set을, 연결하지 못하면 다음 요청에서 다시 확인하도록 None을 돌려준다.
+    """
+    try:
+        response = await get_upstream_client(health_url).get(health_url, timeout=build_upstream_timeout(read_timeout))
+    except httpx.TransportError:
+        return None
+
+    endpoint_transports = response.headers.get(UPSTREAM_TRANSPORTS_HEADER)
+    if endpoint_transports is None and response.status_code < 400:
+        try:
+            health_body = response.json()
+        except ValueError:
+            health_body = None
+        if isinstance(health_body, dict):
+            endpoint_transports = health_body.get('transports')
+
+    if isinstance(endpoint_transports, str):
+        endpoint_transports = endpoint_transports.split(',')
+    if not isinstance(endpoint_transports, list):
+        return set()
+
+    return {str(endpoint_transport).strip().lower() for endpoint_transport in endpoint_transports}
+
+
+def build_transport_request(transport_mode, image_bytes_list, fields, is_batch):
+    if transport_mode == TRANSPORT_MODE_JSON:
+        if is_batch:
+            image_field = {'byte_imgs': [base64.b64encode(image_bytes).decode('utf-8') for image_bytes in image_bytes_list]}
+        else:
+            image_field = {'byte_img': base64.b64encode(image_bytes_list[0]).decode('utf-8')}
+
+        return json.dumps({**image_field, **fields}).encode('utf-8'), {'Content-Type': 'application/json'}
+
+    if read_request_body_mode(transport_mode, is_batch) == TRANSPORT_MODE_RAW:
+        raw_body = RawBody(image_bytes_list[0])
+        return raw_body, {
+            'Content-Type': 'application/octet-stream',
+            'Content-Length': str(raw_body.content_length),
+            UPSTREAM_OPTIONS_HEADER: json.dumps(fields)
+        }
+
+    image_field_name = 'images' if is_batch else 'image'
+    multipart_body = MultipartBody([
+        {
+            'name': 'options',
+            'content_type': 'application/json',
+            'value': json.dumps(fields)
+        },
+        *[
+            {
+                'name': image_field_name,
+                'filename': f'image-{image_index + 1}',
+                'content_type': 'application/octet-stream',
+                'value': image_bytes
+            }
+            for image_index, image_bytes in enumerate(image_bytes_list)
+        ]
+    ])
+    return multipart_body, multipart_body.read_headers()
+
+
+def read_request_body_mode(transport_mode, is_batch):
+    # raw 전송은 이미지 한 장만 담을 수 있으므로 batch는 multipart로 보낸다.
+    if transport_mode == TRANSPORT_MODE_RAW and is_batch:
+        return TRANSPORT_MODE_MULTIPART
+
+    return transport_mode
+
+
+def register_upstream_transport(model_name, endpoint_pool, transport_mode):
+    upstream_transport = UpstreamTransport(model_name, endpoint_pool, normalize_transport_mode(transport_mode))
+    upstream_transports[model_name] = upstream_transport
+    return upstream_transport
+
+
+def normalize_transport_mode(transport_mode):
+    normalized_mode = str(transport_mode or TRANSPORT_MODE_AUTO).strip().lower()
+    if normalized_mode in [TRANSPORT_MODE_JSON, TRANSPORT_MODE_MULTIPART, TRANSPORT_MODE_RAW]:
+        return normalized_mode
+
+    return TRANSPORT_MODE_AUTO
+
+
+def read_upstream_transport_stats():
+    return {
+        model_name: upstream_transport.read_stats()
+        for model_name, upstream_transport in upstream_transports.items()
+    }
@@ -0,0 +1,226 @@
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+)
+from utils.metrics import measure_stage, record_upstream_call
+from utils.request_deadline import REQUEST_TIMEOUT_HEADER, clamp_timeout, current_request_deadline
+
+upstream_clients = {}
+# stream 응답을 읽는 쪽도 read timeout이 deadline 때문에 줄었는지 알 수 있도록 response.extensions에 남긴다.
+DEADLINE_BOUND_EXTENSION = 'labeling_deadline_bound'
+
+
+class UpstreamHTTPError(Exception):
+    def __init__(self, api_url, status_code, body):
+        super().__init__(f'HTTP {status_code}')
+        self.api_url = api_url
+        self.status_code = status_code
+        self.body = body or b''
+
+    def read_text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+
+class UpstreamConnectionError(Exception):
+    status_code = 502
+
+    def __init__(self, api_url, reason, is_connect_error=False):
+        super().__init__(reason)
+        self.api_url = api_url
+        self.reason = reason
+        # 연결 자체가 안 된 경우는 요청이 모델에 닿지 않았으므로 다른 replica로 다시 보내도 된다.
+        self.is_connect_error = is_connect_error
+
+
+class UpstreamDeadlineError(UpstreamConnectionError):
+    # 요청 deadline이 지나서 끊은 경우다. replica 장애가 아니므로 endpoint pool에서 실패로 세지 않는다.
+    status_code = 504
+
+    def __init__(self, api_url):
+        super().__init__(api_url, 'request deadline exceeded')
+
+
+def read_upstream_origin(api_url):
+    url_parts = urlsplit(str(api_url or ''))
+    return f'{url_parts.scheme}://{url_parts.netloc}'
+
+
+def get_upstream_client(api_url):
+    upstream_origin = read_upstream_origin(api_url)
+    upstream_client = upstream_clients.get(upstream_origin)
+
+    if upstream_client is None or upstream_client.is_closed:
+        upstream_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+            ),
+            timeout=build_upstream_timeout(None)
+        )
+        upstream_clients[upstream_origin] = upstream_client
+
+    return upstream_client
+
+
+def build_upstream_timeout(read_timeout):
+    return httpx.Timeout(read_timeout, connect=UPSTREAM_CONNECT_TIMEOUT)
+
+
+def read_deadline_timeout(api_url, read_timeout, headers):
+    # 요청 deadline이 있으면 read timeout을 남은 시간으로 줄이고, 모델 컨테이너도 알 수 있게 header로 넘긴다.
+    upstream_timeout, is_deadline_bound = clamp_timeout(read_timeout)
+    if not is_deadline_bound:
+        return upstream_timeout, headers, False
+    if upstream_timeout <= 0:
+        record_upstream_call(api_url, 'deadline')
+        raise UpstreamDeadlineError(api_url)
+
+    return upstream_timeout, {**(headers or {}), REQUEST_TIMEOUT_HEADER: f'{upstream_timeout:.3f}'}, True
+
+
+async def post_upstream(api_url, read_timeout, content=b'', headers=None, stage_name='upstream'):
+    if not str(api_url or '').strip():
+        raise UpstreamConnectionError(api_url, 'API URL is not configured.')
+
+    upstream_client = get_upstream_client(api_url)
+    read_timeout, headers, is_deadline_bound = read_deadline_timeout(api_url, read_timeout, headers)
+
+    with measure_stage(stage_name):
+        try:
+            response = await upstream_client.post(
+                api_url,
+                content=content,
+                headers=headers,
+                timeout=build_upstream_timeout(read_timeout)
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as error:
+            record_upstream_call(api_url, 'error')
+            raise UpstreamConnectionError(api_url, str(error) or type(error).__name__, is_connect_error=True) from None
+        except httpx.TimeoutException as error:
+            if is_deadline_bound:
+                record_upstream_call(api_url, 'deadline')
+                raise UpstreamDeadlineError(api_url) from None
+            record_upstream_call(api_url, 'timeout')
+            raise UpstreamConnectionError(api_url, f'timed out ({type(error).__name__})') from None
+        except httpx.TransportError as error:
+            record_upstream_call(api_url, 'error')
+            raise UpstreamConnectionError(api_url, str(error) or type(error).__name__) from None
+
+    record_upstream_call(api_url, response.status_code, read_content_size(content), len(response.content))
+    if response.status_code >= 400:
+        raise UpstreamHTTPError(api_url, response.status_code, response.content)
+
+    return response.content
+
+
+def read_content_size(content):
+    # MultipartBody는 chunk를 합치지 않고 Content-Length만 계산해 둔다.
+    content_length = getattr(content, 'content_length', None)
+    if content_length is not None:
+        return content_length
+
+    return len(content) if isinstance(content, (bytes, bytearray, memoryview, str)) else None
+
+
+async def post_upstream_json(api_url, payload, read_timeout, stage_name='upstream'):
+    return await post_upstream(
+        api_url,
+        read_timeout,
+        content=payload,
+        headers={'Content-Type': 'application/json'},
+        stage_name=stage_name
+    )
+
+
+@asynccontextmanager
+async def open_upstream_stream(api_url, read_timeout, content=b'', headers=None):
+    if not str(api_url or '').strip():
+        raise UpstreamConnectionError(api_url, 'API URL is not configured.')
+
+    upstream_client = get_upstream_client(api_url)
+    read_timeout, headers, is_deadline_bound = read_deadline_timeout(api_url, read_timeout, headers)
+    upstream_request = upstream_client.build_request(
+        'POST',
+        api_url,
+        content=content,
+        headers=headers,
+        timeout=build_upstream_timeout(read_timeout)
+    )
+
+    with measure_stage('upstream'):
+        try:
+            response = await upstream_client.send(upstream_request, stream=True)
+        except httpx.TimeoutException as error:
+            if is_deadline_bound:
+                record_upstream_call(api_url, 'deadline')
+                raise UpstreamDeadlineError(api_url) from None
+            record_upstream_call(api_url, 'timeout')
+            raise UpstreamConnectionError(api_url, f'timed out ({type(error).__name__})') from None
+        except httpx.TransportError as error:
+            record_upstream_call(api_url, 'error')
+            raise UpstreamConnectionError(api_url, str(error) or type(error).__name__) from None
+
+    # stream 응답 크기는 끝까지 읽어야 알 수 있으므로 status만 센다.
+    record_upstream_call(api_url, response.status_code, read_content_size(content))
+    response.extensions[DEADLINE_BOUND_EXTENSION] = is_deadline_bound
+
+    try:
+        if response.status_code >= 400:
+            raise UpstreamHTTPError(api_url, response.status_code, await response.aread())
+
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def iter_upstream_lines(response):
+    try:
+        async for response_line in response.aiter_lines():
+            yield response_line
+    except httpx.TimeoutException as error:
+        if response.extensions.get(DEADLINE_BOUND_EXTENSION):
+            raise UpstreamDeadlineError(str(response.request.url)) from None
+        raise UpstreamConnectionError(str(response.request.url), f'timed out ({type(error).__name__})') from None
+    except httpx.TransportError as error:
+        raise UpstreamConnectionError(str(response.request.url), str(error) or type(error).__name__) from None
+
+
+async def probe_upstream(health_url, read_timeout):
+    upstream_client = get_upstream_client(health_url)
+
+    try:
+        response = await upstream_client.get(health_url, timeout=build_upstream_timeout(read_timeout))
+    except httpx.TimeoutException as error:
+        raise UpstreamConnectionError(health_url, f'timed out ({type(error).__name__})') from None
+    except httpx.TransportError as error:
+        raise UpstreamConnectionError(health_url, str(error) or type(error).__name__) from None
+
+    return response.status_code
+
+
+async def release_upstream_model(release_url, read_timeout):
+    # release는 다음 요청을 위한 정리이므로 지금 요청의 deadline이 지났어도 보낸다.
+    deadline_token = current_request_deadline.set(None)
+    try:
+        await post_upstream_json(release_url, b'{}', read_timeout, stage_name='release')
+        return True
+    except Exception:
+        return False
+    finally:
+        current_request_deadline.reset(deadline_token)
+
+
+async def close_upstream_clients():
+    open_clients = list(upstream_clients.values())
+    upstream_clients.clear()
+
+    for upstream_client in open_clients:
+        await upstream_client.aclose()
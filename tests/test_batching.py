@@ -0,0 +1,267 @@
+import asyncio
+import base64
+import time
+
+import httpx
+
+from benchmarks.fake_models import FAKE_CORRUPT_IMAGE_PREFIX, create_fake_model_app
+from services import paddle_ocr
+from services.utils import upstream
+from services.utils.batching import BATCH_MODE_AUTO, BATCH_MODE_SINGLE, MicroBatchDispatcher, read_batch_results
+from services.utils.endpoints import ModelEndpoint
+from services.utils.residency import model_residency
+from services.utils.upstream import UpstreamDeadlineError, UpstreamHTTPError
+from utils.metrics import RequestMetrics, current_request_metrics
+from utils.request_deadline import current_request_deadline
+
+FAKE_MODEL_URL = 'http://fake-models'
+
+
+class FakePaddleContainer:
+    """benchmarks.fake_models의 Paddle OCR endpoint를 byte_img/byte_imgs JSON 계약으로 부른다."""
+
+    def __init__(self, **app_options):
+        self.fake_app = create_fake_model_app(latency_seconds=0.01, batch_latency_seconds=0.0, seed=1, **app_options)
+        self.batch_deadlines = []
+        self.batch_metrics = []
+
+    @property
+    def request_counts(self):
+        return self.fake_app.state.request_counts
+
+    async def post(self, payload):
+        transport = httpx.ASGITransport(app=self.fake_app)
+        async with httpx.AsyncClient(transport=transport, base_url=FAKE_MODEL_URL) as client:
+            response = await client.post('/paddle-ocr/inference', json=payload)
+
+        if response.status_code >= 400:
+            raise UpstreamHTTPError(f'{FAKE_MODEL_URL}/paddle-ocr/inference', response.status_code, response.content)
+        return response.json()
+
+    async def send_single(self, image_bytes, batch_key):
+        return await self.post({'byte_img': base64.b64encode(image_bytes).decode('ascii')})
+
+    async def send_batch(self, image_bytes_list, batch_key):
+        self.batch_deadlines.append(current_request_deadline.get())
+        self.batch_metrics.append(current_request_metrics.get())
+        batch_response = await self.post({
+            'byte_imgs': [base64.b64encode(image_bytes).decode('ascii') for image_bytes in image_bytes_list]
+        })
+        return read_batch_results(batch_response, len(image_bytes_list))
+
+    def build_dispatcher(self, max_batch_size=8, batch_mode=BATCH_MODE_AUTO):
+        return MicroBatchDispatcher('paddle-ocr', self.send_single, self.send_batch, max_batch_size, 0.02, batch_mode)
+
+
+async def submit_all(dispatcher, images):
+    return await asyncio.gather(*[dispatcher.submit(image_bytes) for image_bytes in images], return_exceptions=True)
+
+
+def test_concurrent_requests_share_one_batch():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher()
+
+    results = asyncio.run(submit_all(dispatcher, [f'image-{index}'.encode() for index in range(5)]))
+
+    assert all(isinstance(result, list) and result[0]['res']['rec_texts'] for result in results)
+    assert container.request_counts['paddle-ocr'] == 1
+    assert dispatcher.stats['batches'] == 1
+    assert dispatcher.stats['batchedItems'] == 5
+    assert dispatcher.supports_batch is True
+
+
+def test_full_batch_is_sent_without_waiting():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher(max_batch_size=4)
+
+    results = asyncio.run(submit_all(dispatcher, [f'image-{index}'.encode() for index in range(10)]))
+
+    assert not any(isinstance(result, Exception) for result in results)
+    assert container.request_counts['paddle-ocr'] == 3
+    assert dispatcher.stats['largestBatch'] == 4
+
+
+def test_corrupt_image_fails_only_its_own_request():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher()
+
+    async def run():
+        await submit_all(dispatcher, [b'image-a', b'image-b'])
+        return await submit_all(dispatcher, [b'image-c', FAKE_CORRUPT_IMAGE_PREFIX + b'-d', b'image-e'])
+
+    results = asyncio.run(run())
+
+    assert isinstance(results[1], UpstreamHTTPError)
+    assert results[1].status_code == 500
+    assert isinstance(results[0], list) and isinstance(results[2], list)
+    assert dispatcher.stats['isolatedRetries'] == 1
+    # 이미지 하나의 실패로 batch 형식을 포기하지 않는다.
+    assert dispatcher.supports_batch is True
+
+
+def test_auto_mode_falls_back_when_container_rejects_batches():
+    container = FakePaddleContainer(accept_batch=False)
+    dispatcher = container.build_dispatcher()
+
+    async def run():
+        first_results = await submit_all(dispatcher, [b'image-a', b'image-b'])
+        second_results = await submit_all(dispatcher, [b'image-c', b'image-d'])
+        return first_results + second_results
+
+    results = asyncio.run(run())
+
+    assert not any(isinstance(result, Exception) for result in results)
+    assert dispatcher.supports_batch is False
+    assert dispatcher.stats['fallbacks'] == 1
+    # 거절된 batch 1번, 단건 재시도 2번, fallback 뒤 단건 2번
+    assert container.request_counts['paddle-ocr'] == 5
+
+
+def test_auto_mode_falls_back_when_batch_field_fails_with_500():
+    container = FakePaddleContainer(accept_batch=False, batch_reject_status=500)
+    dispatcher = container.build_dispatcher()
+
+    async def run():
+        first_results = await submit_all(dispatcher, [b'image-a', b'image-b', b'image-c'])
+        second_results = await submit_all(dispatcher, [b'image-d', b'image-e', b'image-f'])
+        return first_results + second_results
+
+    results = asyncio.run(run())
+
+    assert not any(isinstance(result, Exception) for result in results)
+    assert dispatcher.supports_batch is False
+    assert dispatcher.stats['fallbacks'] == 1
+    # 두 번째 묶음은 batch 형식을 다시 시도하지 않고 바로 단건으로 보낸다.
+    assert container.request_counts['paddle-ocr'] == 1 + 3 + 3
+
+
+def test_unconfirmed_batch_with_corrupt_image_keeps_trying_batches():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher()
+
+    results = asyncio.run(submit_all(dispatcher, [b'image-a', FAKE_CORRUPT_IMAGE_PREFIX + b'-b']))
+
+    assert isinstance(results[0], list)
+    assert isinstance(results[1], UpstreamHTTPError)
+    assert dispatcher.supports_batch is None
+    assert dispatcher.stats['fallbacks'] == 0
+
+
+def test_single_mode_never_sends_batches():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher(batch_mode=BATCH_MODE_SINGLE)
+
+    results = asyncio.run(submit_all(dispatcher, [f'image-{index}'.encode() for index in range(3)]))
+
+    assert not any(isinstance(result, Exception) for result in results)
+    assert container.request_counts['paddle-ocr'] == 3
+    assert dispatcher.stats['batches'] == 0
+
+
+def test_short_deadline_does_not_cut_the_whole_batch():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher()
+
+    async def submit_with_deadline(image_bytes, timeout_seconds):
+        current_request_deadline.set(time.monotonic() + timeout_seconds)
+        return await dispatcher.submit(image_bytes)
+
+    async def run():
+        # 처음 들어온 요청의 deadline은 batch 대기 시간(20ms)보다 짧다.
+        return await asyncio.gather(
+            submit_with_deadline(b'image-a', 0.005),
+            submit_with_deadline(b'image-b', 30.0),
+            submit_with_deadline(b'image-c', 60.0),
+            return_exceptions=True
+        )
+
+    started_at = time.monotonic()
+    results = asyncio.run(run())
+
+    assert isinstance(results[0], UpstreamDeadlineError)
+    assert isinstance(results[1], list) and isinstance(results[2], list)
+    # 남은 두 요청 중 가장 늦은 deadline으로 batch를 보낸다.
+    assert len(container.batch_deadlines) == 1
+    assert container.batch_deadlines[0] - started_at > 59
+
+
+def test_batch_time_is_recorded_for_every_member():
+    container = FakePaddleContainer()
+    dispatcher = container.build_dispatcher()
+    request_metrics_list = [RequestMetrics({}) for _ in range(3)]
+
+    async def submit_with_metrics(image_bytes, request_metrics):
+        current_request_metrics.set(request_metrics)
+        return await dispatcher.submit(image_bytes)
+
+    async def run():
+        return await asyncio.gather(*[
+            submit_with_metrics(f'image-{index}'.encode(), request_metrics)
+            for index, request_metrics in enumerate(request_metrics_list)
+        ])
+
+    asyncio.run(run())
+
+    # batch 호출은 처음 들어온 요청의 metrics에 붙지 않고, 묶인 요청마다 batch 시간이 남는다.
+    assert container.batch_metrics == [None]
+    assert all(request_metrics.stage_durations.get('batch', 0) > 0 for request_metrics in request_metrics_list)
+
+
+def point_paddle_ocr_at_fake_models(monkeypatch):
+    """실제 paddle_ocr_dispatcher와 UpstreamTransport는 그대로 두고 replica 주소만 fake model 서버로 바꾼다."""
+    fake_app = create_fake_model_app(latency_seconds=0.01, batch_latency_seconds=0.0, seed=1)
+    fake_endpoint = ModelEndpoint(
+        f'{FAKE_MODEL_URL}/paddle-ocr/inference',
+        f'{FAKE_MODEL_URL}/paddle-ocr/release',
+        f'{FAKE_MODEL_URL}/paddle-ocr/health'
+    )
+    monkeypatch.setattr(paddle_ocr.paddle_ocr_endpoints, 'endpoints', [fake_endpoint])
+    monkeypatch.setattr(paddle_ocr.paddle_ocr_dispatcher, 'supports_batch', None)
+    monkeypatch.setattr(model_residency, 'enabled', True)
+    return fake_app
+
+
+async def submit_to_paddle_ocr(fake_app, image_groups):
+    upstream.upstream_clients[FAKE_MODEL_URL] = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_app))
+    try:
+        results = []
+        for images in image_groups:
+            results.extend(await submit_all(paddle_ocr.paddle_ocr_dispatcher, images))
+        # 종료 때의 release는 세지 않도록 정리하기 전에 요청 수를 남긴다.
+        return results, dict(fake_app.state.request_counts)
+    finally:
+        await model_residency.release_all()
+        await upstream.close_upstream_clients()
+
+
+def test_paddle_ocr_dispatcher_sends_one_multipart_batch_to_the_model_server(monkeypatch):
+    fake_app = point_paddle_ocr_at_fake_models(monkeypatch)
+
+    results, request_counts = asyncio.run(submit_to_paddle_ocr(
+        fake_app,
+        [[f'image-{index}'.encode() for index in range(5)]]
+    ))
+
+    assert all(isinstance(result, list) and result[0]['res']['rec_texts'] for result in results)
+    # health 응답이 multipart를 알려 주므로 다섯 장을 images field 하나의 multipart 요청으로 보낸다.
+    assert request_counts['paddle-ocr'] == 1
+    assert request_counts['body:multipart/form-data'] == 1
+    assert 'body:application/json' not in request_counts
+    assert paddle_ocr.paddle_ocr_dispatcher.supports_batch is True
+
+
+def test_paddle_ocr_batch_failure_releases_the_model_and_fails_only_the_corrupt_image(monkeypatch):
+    fake_app = point_paddle_ocr_at_fake_models(monkeypatch)
+
+    results, request_counts = asyncio.run(submit_to_paddle_ocr(
+        fake_app,
+        [[b'image-a', b'image-b'], [b'image-c', FAKE_CORRUPT_IMAGE_PREFIX + b'-d', b'image-e']]
+    ))
+
+    assert isinstance(results[0], list) and isinstance(results[1], list)
+    assert isinstance(results[2], list) and isinstance(results[4], list)
+    assert isinstance(results[3], RuntimeError)
+    assert str(results[3]).startswith('HTTP 500')
+    # 500으로 실패한 batch는 모델을 내리고, 이미지 하나의 실패로 batch 형식을 포기하지 않는다.
+    assert request_counts['paddle-ocr/release'] >= 1
+    assert paddle_ocr.paddle_ocr_dispatcher.supports_batch is True
@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+from services import bulk_jobs
+from services.bulk_jobs import BULK_JOB_COMPLETED, BULK_JOB_RUNNING, BulkJob
+from utils.shared_state import SharedStateStore
+
+
+def test_resumed_job_counts_failures_from_this_run_only(tmp_path, monkeypatch):
+    input_folder = tmp_path / 'input'
+    output_folder = tmp_path / 'output'
+    input_folder.mkdir()
+    output_folder.mkdir()
+    for image_name in ['done.png', 'retry.png', 'broken.png']:
+        (input_folder / image_name).write_bytes(image_name.encode())
+    (output_folder / 'done.png.json').write_text('{}', encoding='utf-8')
+
+    async def extract_labeling_result(image_filename, image_bytes, priority=None, image_hash=None):
+        if image_filename == 'broken.png':
+            raise ValueError('broken image')
+        return {'filename': image_filename}
+
+    shared_state = SharedStateStore(tmp_path / 'state')
+    monkeypatch.setattr(bulk_jobs, 'shared_state', shared_state)
+    monkeypatch.setattr(bulk_jobs, 'BULK_JOB_STATE_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setitem(bulk_jobs.bulk_job_extractors, 'paddle_ocr', extract_labeling_result)
+
+    bulk_job = BulkJob.from_checkpoint({
+        'jobId': 'resume-test',
+        'model': 'paddle_ocr',
+        'inputFolder': str(input_folder),
+        'outputFolder': str(output_folder),
+        'images': ['done.png', 'retry.png', 'broken.png'],
+        'concurrency': 1,
+        'status': BULK_JOB_RUNNING,
+        'failed': 2,
+        'failures': [{'image': 'retry.png', 'error': 'timeout'}, {'image': 'broken.png', 'error': 'broken image'}]
+    })
+
+    async def resume_job():
+        bulk_job_task = await bulk_job.start()
+        await bulk_job_task
+        return await shared_state.run(shared_state.read_claim_owner, bulk_job.claim_name)
+
+    try:
+        assert asyncio.run(resume_job()) is None
+    finally:
+        shared_state.close()
+
+    bulk_job_status = bulk_job.to_status()
+    assert bulk_job_status['status'] == BULK_JOB_COMPLETED
+    assert (bulk_job_status['succeeded'], bulk_job_status['failed'], bulk_job_status['skipped']) == (1, 1, 1)
+    assert bulk_job_status['recentFailures'] == [{'image': 'broken.png', 'error': 'broken image'}]
+    checkpoint = json.loads((tmp_path / 'jobs' / 'resume-test.json').read_text(encoding='utf-8'))
+    assert checkpoint['failed'] == len(checkpoint['failures'])
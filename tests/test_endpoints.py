@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from services.utils import endpoints
+from services.utils.endpoints import register_endpoint_pool
+from services.utils.residency import ModelResidencyManager
+from services.utils.upstream import UpstreamHTTPError
+
+
+def test_release_url_count_must_match_api_urls():
+    with pytest.raises(ValueError):
+        register_endpoint_pool('test-model', 'http://a/inference,http://b/inference', 'http://a/release')
+
+
+def test_error_release_only_unloads_the_replica_that_served_the_request(monkeypatch):
+    released_urls = []
+
+    async def release_upstream_model(release_url, read_timeout):
+        released_urls.append(release_url)
+        return True
+
+    monkeypatch.setattr(endpoints, 'release_upstream_model', release_upstream_model)
+    endpoint_pool = register_endpoint_pool('test-model', 'http://a/inference,http://b/inference')
+
+    async def release_model(endpoints=None):
+        return await endpoint_pool.release(1.0, endpoints)
+
+    async def fail_on_one_replica():
+        model_residency = ModelResidencyManager()
+        model_residency.register('test-model', release_model, idle_ttl=60, endpoint_pool=endpoint_pool)
+
+        async with model_residency.hold('test-model', False):
+            async with endpoint_pool.lease():
+                pass
+        async with model_residency.hold('test-model', False) as model_lease:
+            async with endpoint_pool.lease() as failed_endpoint:
+                pass
+            assert model_lease.endpoints == [failed_endpoint]
+            await model_residency.release_after_error(model_lease, UpstreamHTTPError(failed_endpoint.api_url, 500, b''))
+
+        assert released_urls == [failed_endpoint.release_url]
+        assert model_residency.models['test-model'].loaded
+
+        await model_residency.release_all()
+        assert len(released_urls) == 2
+        assert not model_residency.models['test-model'].loaded
+
+    asyncio.run(fail_on_one_replica())
@@ -0,0 +1,47 @@
+import asyncio
+
+from services.utils.residency import ModelResidencyManager
+from services.utils.upstream import UpstreamHTTPError
+
+
+def build_residency_manager(released_models):
+    async def release_model(endpoints=None):
+        released_models.append('paddle-ocr')
+        return True
+
+    model_residency = ModelResidencyManager()
+    model_residency.register('paddle-ocr', release_model, idle_ttl=60)
+    return model_residency
+
+
+def test_error_release_waits_for_the_last_user():
+    released_models = []
+
+    async def fail_while_another_request_runs():
+        model_residency = build_residency_manager(released_models)
+        server_error = UpstreamHTTPError('http://paddle', 500, b'')
+        other_started = asyncio.Event()
+        finish_other = asyncio.Event()
+
+        async def other_request():
+            async with model_residency.hold('paddle-ocr', False):
+                other_started.set()
+                await finish_other.wait()
+
+        other_task = asyncio.create_task(other_request())
+        await other_started.wait()
+        async with model_residency.hold('paddle-ocr', False) as model_lease:
+            assert not await model_residency.release_after_error(model_lease, server_error)
+        finish_other.set()
+        await other_task
+
+        async with model_residency.hold('paddle-ocr', False) as model_lease:
+            assert not await model_residency.release_after_error(model_lease, UpstreamHTTPError('http://paddle', 400, b''))
+        async with model_residency.hold('paddle-ocr', False) as model_lease:
+            assert await model_residency.release_after_error(model_lease, server_error)
+
+        for resident_model in model_residency.models.values():
+            model_residency.cancel_idle_release(resident_model)
+
+    asyncio.run(fail_while_another_request_runs())
+    assert released_models == ['paddle-ocr']
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from utils.request_deadline import current_request_deadline
+from utils.result_cache import ResultCache
+
+
+def build_memory_cache(tmp_path):
+    return ResultCache(tmp_path, 16, 1024 * 1024, 0, 0)
+
+
+def test_follower_recomputes_when_leader_deadline_expires(tmp_path):
+    result_cache = build_memory_cache(tmp_path)
+    compute_calls = []
+
+    async def compute_result():
+        compute_calls.append(current_request_deadline.get())
+        await asyncio.sleep(0.03)
+        request_deadline = current_request_deadline.get()
+        if request_deadline is not None and request_deadline <= time.monotonic():
+            raise TimeoutError('request deadline exceeded')
+        return {'text': '청구서'}
+
+    async def read_with_deadline(timeout_seconds, started_delay):
+        await asyncio.sleep(started_delay)
+        current_request_deadline.set(time.monotonic() + timeout_seconds)
+        return await result_cache.get_or_compute('same-key', compute_result)
+
+    async def run():
+        return await asyncio.gather(
+            read_with_deadline(0.01, 0.0),
+            read_with_deadline(30.0, 0.001),
+            return_exceptions=True
+        )
+
+    leader_result, follower_result = asyncio.run(run())
+
+    assert isinstance(leader_result, TimeoutError)
+    assert follower_result == {'text': '청구서'}
+    assert len(compute_calls) == 2
+    assert result_cache.stats['collapsed'] == 1
+
+
+def test_follower_shares_leader_failure_within_its_own_deadline(tmp_path):
+    result_cache = build_memory_cache(tmp_path)
+    compute_calls = []
+
+    async def compute_result():
+        compute_calls.append(None)
+        await asyncio.sleep(0.01)
+        raise RuntimeError('HTTP 500')
+
+    async def run():
+        return await asyncio.gather(
+            result_cache.get_or_compute('same-key', compute_result),
+            result_cache.get_or_compute('same-key', compute_result),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(compute_calls) == 1
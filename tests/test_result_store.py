@@ -0,0 +1,43 @@
+from utils.result_store import LabelingResultStore, read_box_rows
+
+
+def build_labeling_result(image_filename, labeling_boxes, image_info=None):
+    return {
+        'displayType': 'bbox_overlay',
+        'image': image_info if image_info is not None else {'filename': image_filename, 'width': 100, 'height': 100},
+        'boxes': labeling_boxes
+    }
+
+
+def test_box_without_valid_bbox_is_stored_as_text_only():
+    box_rows = read_box_rows(build_labeling_result('a.png', [
+        {'id': 'short', 'text': '세 값', 'bbox': [1, 2, 3]},
+        {'id': 'nan', 'text': 'nan', 'bbox': [float('nan'), 1, 2, 3]},
+        {'id': 'flipped', 'text': '뒤집힘', 'bbox': [50, 60, 10, 20]},
+        '상자가 아닌 값'
+    ]))
+
+    assert [box_row[0] for box_row in box_rows] == ['short', 'nan', 'flipped']
+    assert box_rows[0][4:] == (None, None, None, None)
+    assert box_rows[1][4:] == (None, None, None, None)
+    assert box_rows[2][4:] == (10.0, 20.0, 50.0, 60.0)
+
+
+def test_bad_record_does_not_roll_back_its_batch(tmp_path):
+    result_store = LabelingResultStore(tmp_path, retention_days=0, queue_size=1)
+    connection = result_store.connect()
+    try:
+        result_store.write_records(connection, [
+            ('paddle-ocr', 'a.png', 'a' * 64, None, build_labeling_result('a.png', [{'id': 'a', 'text': '청구서', 'bbox': [1, 2, 30, 40]}])),
+            ('paddle-ocr', 'b.png', 'b' * 64, None, build_labeling_result('b.png', [], image_info='image')),
+            ('paddle-ocr', 'c.png', 'c' * 64, None, build_labeling_result('c.png', [{'id': {'nested': 1}, 'text': '영수증'}])),
+            ('paddle-ocr', 'd.png', 'd' * 64, None, build_labeling_result('d.png', [{'id': 'd', 'text': '청구서 합계', 'bbox': [1, 2, 3]}]))
+        ])
+
+        assert result_store.stats['stored'] == 2
+        assert result_store.stats['failed'] == 2
+        search_result = result_store.search(text='청구서')
+        assert sorted(search_hit['imageHash'] for search_hit in search_result['boxes']) == ['a' * 64, 'd' * 64]
+        assert result_store.read_results('c' * 64) == []
+    finally:
+        connection.close()
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from utils.shared_state import SharedStateStore
+
+
+def test_waiting_model_gets_gpu_after_max_consecutive(tmp_path):
+    shared_state = SharedStateStore(tmp_path)
+    try:
+        assert shared_state.enter_gpu('0', 'paddle-ocr', 2) == (True, None)
+        assert shared_state.enter_gpu('0', 'deepseek-ocr', 2) is None
+
+        assert shared_state.enter_gpu('0', 'paddle-ocr', 2) == (False, None)
+        assert shared_state.enter_gpu('0', 'paddle-ocr', 2) == (False, None)
+        assert shared_state.enter_gpu('0', 'paddle-ocr', 2) is None
+
+        for _ in range(3):
+            shared_state.leave_gpu('paddle-ocr')
+        assert shared_state.enter_gpu('0', 'deepseek-ocr', 2) == (True, 'paddle-ocr')
+    finally:
+        shared_state.close()
+
+
+def test_cancelled_slot_acquire_is_undone(tmp_path):
+    shared_state = SharedStateStore(tmp_path)
+
+    async def cancel_acquire():
+        # 앞선 쓰기가 thread를 잡고 있어 acquire가 끝나기 전에 취소되게 한다.
+        shared_state.submit(time.sleep, 0.1)
+        acquire_task = asyncio.create_task(shared_state.run(
+            shared_state.acquire_slot,
+            'paddle-ocr',
+            1,
+            undo=lambda slot_result: slot_result[0] and shared_state.release_slot('paddle-ocr')
+        ))
+        await asyncio.sleep(0)
+        acquire_task.cancel()
+        await asyncio.gather(acquire_task, return_exceptions=True)
+        for _ in range(100):
+            if not await shared_state.run(shared_state.read_running, 'paddle-ocr'):
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+    try:
+        assert asyncio.run(cancel_acquire())
+    finally:
+        shared_state.close()
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+import httpx
+
+from benchmarks.fake_models import create_fake_model_app
+from services.utils import upstream
+from services.utils.endpoints import register_endpoint_pool
+from services.utils.transport import (
+    TRANSPORT_MODE_JSON,
+    TRANSPORT_MODE_MULTIPART,
+    UpstreamTransport,
+)
+
+BINARY_MODEL_URL = 'http://binary-models'
+JSON_MODEL_URL = 'http://json-models'
+
+
+def test_each_replica_gets_the_transport_its_health_response_advertises():
+    binary_app = create_fake_model_app(latency_seconds=0.0, seed=1)
+    json_app = create_fake_model_app(latency_seconds=0.0, accept_binary=False, seed=1)
+    endpoint_pool = register_endpoint_pool(
+        'transport-test',
+        f'{BINARY_MODEL_URL}/paddle-ocr/inference,{JSON_MODEL_URL}/paddle-ocr/inference'
+    )
+    upstream_transport = UpstreamTransport('transport-test', endpoint_pool)
+
+    async def post_to_both_replicas():
+        upstream.upstream_clients[BINARY_MODEL_URL] = httpx.AsyncClient(transport=httpx.ASGITransport(app=binary_app))
+        upstream.upstream_clients[JSON_MODEL_URL] = httpx.AsyncClient(transport=httpx.ASGITransport(app=json_app))
+        try:
+            response_bodies = await asyncio.gather(*[
+                upstream_transport.post_image(f'image-{index}'.encode(), {'release_after_inference': False}, 5)
+                for index in range(4)
+            ])
+        finally:
+            await upstream.close_upstream_clients()
+        return [json.loads(response_body) for response_body in response_bodies]
+
+    paddle_results = asyncio.run(post_to_both_replicas())
+
+    assert all(paddle_result[0]['res']['rec_texts'] for paddle_result in paddle_results)
+    assert {endpoint.api_url: endpoint.transport_mode for endpoint in endpoint_pool.endpoints} == {
+        f'{BINARY_MODEL_URL}/paddle-ocr/inference': TRANSPORT_MODE_MULTIPART,
+        f'{JSON_MODEL_URL}/paddle-ocr/inference': TRANSPORT_MODE_JSON
+    }
+    assert 'body:multipart/form-data' not in json_app.state.request_counts
+    assert json_app.state.request_counts['body:application/json'] == 2
+    assert binary_app.state.request_counts['body:multipart/form-data'] == 2
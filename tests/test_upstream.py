@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.utils.upstream import (
+    DEADLINE_BOUND_EXTENSION,
+    UpstreamConnectionError,
+    UpstreamDeadlineError,
+    iter_upstream_lines,
+)
+
+
+class StalledStream(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b'{"text": "first"}\n'
+        raise httpx.ReadTimeout('stalled')
+
+
+def build_stalled_response(is_deadline_bound):
+    response = httpx.Response(
+        200,
+        request=httpx.Request('POST', 'http://deepseek/inference'),
+        stream=StalledStream()
+    )
+    response.extensions[DEADLINE_BOUND_EXTENSION] = is_deadline_bound
+    return response
+
+
+async def read_lines(response):
+    return [response_line async for response_line in iter_upstream_lines(response)]
+
+
+def test_stream_read_timeout_is_a_deadline_error_when_the_deadline_shortened_it():
+    with pytest.raises(UpstreamDeadlineError):
+        asyncio.run(read_lines(build_stalled_response(True)))
+
+    with pytest.raises(UpstreamConnectionError) as error_info:
+        asyncio.run(read_lines(build_stalled_response(False)))
+    assert error_info.type is UpstreamConnectionError
@@ -0,0 +1,222 @@
+import numpy as np
+
+from config import BOX_FUSION_IOU_THRESHOLD, BOX_FUSION_REGION_COVERAGE
+from utils.metrics import measure_stage
+
+MIN_GRID_CELL_SIZE = 8.0
+
+
+class BoxGridIndex:
+    # bbox를 고정 크기 격자 칸에 나눠 담아, 겹칠 수 있는 후보만 꺼내 본다.
+    def __init__(self, bbox_array, cell_size=None):
+        self.bbox_array = bbox_array
+        self.cell_size = cell_size or read_grid_cell_size(bbox_array)
+        self.cells = {}
+
+        cell_ranges = np.floor(bbox_array / self.cell_size).astype(np.int64).tolist()
+        for box_index, (cell_x1, cell_y1, cell_x2, cell_y2) in enumerate(cell_ranges):
+            for cell_x in range(cell_x1, cell_x2 + 1):
+                for cell_y in range(cell_y1, cell_y2 + 1):
+                    self.cells.setdefault((cell_x, cell_y), []).append(box_index)
+
+    def query(self, bbox):
+        cell_x1, cell_y1, cell_x2, cell_y2 = [int(coordinate // self.cell_size) for coordinate in bbox]
+        candidate_indexes = set()
+        for cell_x in range(cell_x1, cell_x2 + 1):
+            for cell_y in range(cell_y1, cell_y2 + 1):
+                candidate_indexes.update(self.cells.get((cell_x, cell_y), ()))
+
+        return np.fromiter(candidate_indexes, dtype=np.int64, count=len(candidate_indexes))
+
+
+def read_grid_cell_size(bbox_array):
+    # 칸을 box 크기의 중앙값 정도로 잡으면 box 하나가 들어가는 칸 수와 칸마다 담기는 box 수가 모두 작다.
+    if len(bbox_array) == 0:
+        return MIN_GRID_CELL_SIZE
+
+    box_sides = np.maximum(bbox_array[:, 2] - bbox_array[:, 0], bbox_array[:, 3] - bbox_array[:, 1])
+    return max(MIN_GRID_CELL_SIZE, float(np.median(box_sides)))
+
+
+def read_box_array(labeling_boxes):
+    if not labeling_boxes:
+        return np.empty((0, 4), dtype=np.float64)
+
+    return np.asarray([labeling_box['bbox'] for labeling_box in labeling_boxes], dtype=np.float64)
+
+
+def compute_box_areas(bbox_array):
+    return np.maximum(0.0, bbox_array[:, 2] - bbox_array[:, 0]) * np.maximum(0.0, bbox_array[:, 3] - bbox_array[:, 1])
+
+
+def compute_intersections(bbox, candidate_array):
+    overlap_width = np.minimum(bbox[2], candidate_array[:, 2]) - np.maximum(bbox[0], candidate_array[:, 0])
+    overlap_height = np.minimum(bbox[3], candidate_array[:, 3]) - np.maximum(bbox[1], candidate_array[:, 1])
+    return np.maximum(0.0, overlap_width) * np.maximum(0.0, overlap_height)
+
+
+def suppress_duplicate_boxes(bbox_array, source_ids, scores, iou_threshold=BOX_FUSION_IOU_THRESHOLD):
+    # 다른 모델이 같은 글자 줄을 찾은 box만 지운다. 같은 모델 안의 box는 서로 지우지 않는다.
+    box_count = len(bbox_array)
+    kept_mask = np.ones(box_count, dtype=bool)
+    duplicates = []
+    if box_count == 0:
+        return kept_mask, duplicates
+
+    # source 우선순위가 높은(작은) box부터, 같으면 score가 높은 box부터 남긴다.
+    box_order = np.lexsort((-scores, source_ids))
+    box_ranks = np.empty(box_count, dtype=np.int64)
+    box_ranks[box_order] = np.arange(box_count)
+    box_areas = compute_box_areas(bbox_array)
+    grid_index = BoxGridIndex(bbox_array)
+
+    for box_index in box_order.tolist():
+        if not kept_mask[box_index]:
+            continue
+
+        candidate_indexes = grid_index.query(bbox_array[box_index])
+        candidate_indexes = candidate_indexes[
+            kept_mask[candidate_indexes]
+            & (box_ranks[candidate_indexes] > box_ranks[box_index])
+            & (source_ids[candidate_indexes] != source_ids[box_index])
+        ]
+        if len(candidate_indexes) == 0:
+            continue
+
+        intersections = compute_intersections(bbox_array[box_index], bbox_array[candidate_indexes])
+        unions = box_areas[box_index] + box_areas[candidate_indexes] - intersections
+        ious = np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+        for duplicate_index, iou in zip(candidate_indexes[ious >= iou_threshold].tolist(), ious[ious >= iou_threshold].tolist()):
+            kept_mask[duplicate_index] = False
+            duplicates.append((duplicate_index, box_index, iou))
+
+    return kept_mask, duplicates
+
+
+def assign_boxes_to_regions(line_array, region_array, min_coverage=BOX_FUSION_REGION_COVERAGE):
+    # 글자 줄 면적 중 region 안에 들어간 비율이 가장 큰 region에 넣는다.
+    region_indexes = np.full(len(line_array), -1, dtype=np.int64)
+    if len(line_array) == 0 or len(region_array) == 0:
+        return region_indexes
+
+    line_areas = compute_box_areas(line_array)
+    region_areas = compute_box_areas(region_array)
+    grid_index = BoxGridIndex(region_array)
+
+    for line_index, line_bbox in enumerate(line_array):
+        candidate_indexes = grid_index.query(line_bbox)
+        if len(candidate_indexes) == 0 or line_areas[line_index] <= 0:
+            continue
+
+        coverages = compute_intersections(line_bbox, region_array[candidate_indexes]) / line_areas[line_index]
+        # 겹친 비율이 같으면 더 작은 region(예: 표 안의 cell 영역)을 고른다.
+        best_position = np.lexsort((region_areas[candidate_indexes], -coverages))[0]
+        if coverages[best_position] >= min_coverage:
+            region_indexes[line_index] = candidate_indexes[best_position]
+
+    return region_indexes
+
+
+def order_boxes_by_xy_cut(bbox_array, box_indexes=None):
+    # 빈 가로줄로 위아래를 먼저 나누고, 나눌 수 없으면 빈 세로줄로 좌우 단을 나눈다.
+    if box_indexes is None:
+        box_indexes = np.arange(len(bbox_array))
+
+    ordered_indexes = []
+    pending_groups = [np.asarray(box_indexes, dtype=np.int64)]
+    while pending_groups:
+        group_indexes = pending_groups.pop()
+        if len(group_indexes) <= 1:
+            ordered_indexes.extend(group_indexes.tolist())
+            continue
+
+        group_boxes = bbox_array[group_indexes]
+        split_groups = split_by_projection_gap(group_boxes[:, 1], group_boxes[:, 3])
+        if len(split_groups) == 1:
+            split_groups = split_by_projection_gap(group_boxes[:, 0], group_boxes[:, 2])
+
+        if len(split_groups) == 1:
+            # 서로 겹쳐 더 나눌 수 없으면 위쪽, 왼쪽 순서로 둔다.
+            ordered_indexes.extend(group_indexes[np.lexsort((group_boxes[:, 0], group_boxes[:, 1]))].tolist())
+            continue
+
+        # stack이므로 마지막에 처리할 group부터 넣는다.
+        pending_groups.extend(group_indexes[split_group] for split_group in reversed(split_groups))
+
+    return ordered_indexes
+
+
+def split_by_projection_gap(starts, ends):
+    start_order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[start_order]
+    running_ends = np.maximum.accumulate(ends[start_order])
+    gap_positions = np.flatnonzero(sorted_starts[1:] >= running_ends[:-1]) + 1
+    return np.split(start_order, gap_positions)
+
+
+def fuse_labeling_boxes(region_boxes, line_box_groups, iou_threshold=BOX_FUSION_IOU_THRESHOLD):
+    """layout region과 여러 OCR 모델의 글자 줄을 합쳐 중복 제거, region 배정, 읽기 순서를 만든다.
+
+    line_box_groups는 (모델 이름, labeling box 목록)을 우선순위 순서로 담는다.
+    """
+    with measure_stage('fusion'):
+        line_boxes = [labeling_box for _, labeling_boxes in line_box_groups for labeling_box in labeling_boxes]
+        line_sources = [source_name for source_name, labeling_boxes in line_box_groups for _ in labeling_boxes]
+        line_array = read_box_array(line_boxes)
+        region_array = read_box_array(region_boxes)
+
+        source_ids = np.asarray(
+            [source_index for source_index, (_, labeling_boxes) in enumerate(line_box_groups) for _ in labeling_boxes],
+            dtype=np.int64
+        )
+        scores = np.asarray([float(labeling_box.get('confidence') or 0.0) for labeling_box in line_boxes], dtype=np.float64)
+        kept_mask, duplicates = suppress_duplicate_boxes(line_array, source_ids, scores, iou_threshold)
+        kept_indexes = np.flatnonzero(kept_mask)
+
+        region_indexes = np.full(len(line_boxes), -1, dtype=np.int64)
+        region_indexes[kept_indexes] = assign_boxes_to_regions(line_array[kept_indexes], region_array)
+
+        # region과 어느 region에도 들어가지 않은 글자 줄을 같은 흐름에서 순서를 정한다.
+        unassigned_indexes = kept_indexes[region_indexes[kept_indexes] < 0]
+        flow_array = np.concatenate([region_array, line_array[unassigned_indexes]])
+        region_count = len(region_boxes)
+        fused_regions = []
+        reading_order = []
+
+        for flow_index in order_boxes_by_xy_cut(flow_array):
+            if flow_index >= region_count:
+                line_index = int(unassigned_indexes[flow_index - region_count])
+                reading_order.append(line_boxes[line_index]['id'])
+                continue
+
+            region_line_indexes = np.flatnonzero(region_indexes == flow_index)
+            ordered_line_ids = [
+                line_boxes[line_index]['id']
+                for line_index in order_boxes_by_xy_cut(line_array, region_line_indexes)
+            ]
+            reading_order.extend(ordered_line_ids)
+            region_box = region_boxes[flow_index]
+            fused_regions.append({
+                'id': region_box['id'],
+                'type': region_box.get('type'),
+                'bbox': region_box['bbox'],
+                'order': len(fused_regions) + 1,
+                'lineIds': ordered_line_ids
+            })
+
+        return {
+            'regions': fused_regions,
+            'readingOrder': reading_order,
+            'unassignedLineIds': [line_boxes[line_index]['id'] for line_index in unassigned_indexes.tolist()],
+            'duplicates': [
+                {
+                    'id': line_boxes[duplicate_index]['id'],
+                    'source': line_sources[duplicate_index],
+                    'duplicateOf': line_boxes[kept_index]['id'],
+                    'iou': round(iou, 4)
+                }
+                for duplicate_index, kept_index, iou in duplicates
+            ],
+            'lineCount': len(kept_indexes),
+            'regionCount': region_count
+        }
@@ -0,0 +1,258 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from config import (
+    DOCUMENT_MAX_PAGES,
+    DOCUMENT_RENDER_DPI,
+    DOCUMENT_RENDER_MAX_SIDE,
+    DOCUMENT_RENDER_WORKERS,
+    IMAGE_MAX_PIXELS,
+    UPLOAD_DIR,
+)
+from utils.image_probe import ImageProbe, check_image_pixels
+from utils.metrics import measure_stage
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+DOCUMENT_KIND_PDF = 'pdf'
+DOCUMENT_KIND_TIFF = 'tiff'
+PDF_POINTS_PER_INCH = 72
+DOCUMENT_TEMP_DIR = UPLOAD_DIR / 'documents'
+
+
+class DocumentError(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def read_document_kind(document_bytes):
+    header = bytes(document_bytes[:8])
+    if header.startswith(b'%PDF-'):
+        return DOCUMENT_KIND_PDF
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return DOCUMENT_KIND_TIFF
+
+    return None
+
+
+def read_document_page_count(document_path, document_kind):
+    # process pool worker에서 실행된다. PDF는 page tree만, TIFF는 IFD 목록만 읽는다.
+    if document_kind == DOCUMENT_KIND_PDF:
+        pdf_document = pypdfium2.PdfDocument(document_path)
+        try:
+            return len(pdf_document)
+        finally:
+            pdf_document.close()
+
+    with PILImage.open(document_path) as tiff_image:
+        return getattr(tiff_image, 'n_frames', 1)
+
+
+def render_document_page(document_path, document_kind, page_index, render_dpi, max_side):
+    # process pool worker에서 실행된다. 문서 전체 대신 경로만 받아 필요한 page 하나만 그린다.
+    PILImage.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS or None
+
+    if document_kind == DOCUMENT_KIND_PDF:
+        pdf_document = pypdfium2.PdfDocument(document_path)
+        try:
+            pdf_page = pdf_document[page_index]
+            try:
+                page_width, page_height = pdf_page.get_size()
+                render_scale = render_dpi / PDF_POINTS_PER_INCH
+                if max_side > 0:
+                    render_scale = min(render_scale, max_side / max(page_width, page_height, 1))
+                page_image = pdf_page.render(scale=render_scale).to_pil()
+            finally:
+                pdf_page.close()
+        finally:
+            pdf_document.close()
+    else:
+        with PILImage.open(document_path) as tiff_image:
+            tiff_image.seek(page_index)
+            page_image = ImageOps.exif_transpose(tiff_image)
+            page_image.load()
+        if max_side > 0 and max(page_image.size) > max_side:
+            page_image.thumbnail((max_side, max_side), PILImage.LANCZOS)
+
+    if page_image.mode not in ('RGB', 'L'):
+        page_image = page_image.convert('RGB')
+
+    # OCR 품질을 위해 손실 없는 PNG로 보내되, 압축은 가장 빠른 단계로 한다.
+    output = BytesIO()
+    page_image.save(output, 'PNG', compress_level=1)
+    return output.getvalue(), page_image.width, page_image.height
+
+
+def write_document_file(document_bytes, document_kind):
+    DOCUMENT_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    file_descriptor, document_path = tempfile.mkstemp(suffix=f'.{document_kind}', dir=DOCUMENT_TEMP_DIR)
+    with os.fdopen(file_descriptor, 'wb') as document_file:
+        document_file.write(document_bytes)
+
+    return document_path
+
+
+def discard_document_file(write_task):
+    if not write_task.cancelled() and write_task.exception() is None:
+        os.unlink(write_task.result())
+
+
+class DocumentPage:
+    def __init__(self, page_number, image_bytes, width, height, render_seconds):
+        self.page_number = page_number
+        self.image_bytes = image_bytes
+        self.image_probe = ImageProbe('PNG', width, height)
+        self.render_seconds = render_seconds
+
+
+class DocumentRasterizer:
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self.executor = None
+        self.stats = {
+            'documents': 0,
+            'pages': 0,
+            'failures': 0,
+            'seconds': 0.0
+        }
+
+    def read_executor(self):
+        if self.executor is None:
+            # uvicorn event loop thread를 fork로 복사하지 않도록 spawn으로 worker를 띄운다.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+
+        return self.executor
+
+    async def open_document(self, document_bytes, document_filename):
+        document_kind = read_document_kind(document_bytes)
+        if document_kind is None:
+            raise DocumentError('PDF 또는 TIFF 문서가 필요합니다.', status_code=415)
+        if document_kind == DOCUMENT_KIND_PDF and pypdfium2 is None:
+            raise DocumentError('PDF를 처리하려면 서버에 pypdfium2를 설치해야 합니다.', status_code=415)
+
+        # worker마다 문서 bytes를 pickle로 넘기지 않도록 임시 파일에 한 번만 쓴다.
+        write_task = asyncio.ensure_future(asyncio.to_thread(write_document_file, document_bytes, document_kind))
+        try:
+            document_path = await asyncio.shield(write_task)
+        except asyncio.CancelledError:
+            # 취소돼도 thread는 파일을 끝까지 쓰므로, 다 쓴 뒤에 지운다.
+            write_task.add_done_callback(discard_document_file)
+            raise
+
+        try:
+            page_count = await asyncio.get_running_loop().run_in_executor(
+                self.read_executor(),
+                read_document_page_count,
+                document_path,
+                document_kind
+            )
+        except asyncio.CancelledError:
+            # client가 끊겨 handler가 취소되면 응답이 만들어지지 않으므로 여기서 임시 파일을 지운다.
+            os.unlink(document_path)
+            raise
+        except Exception:
+            os.unlink(document_path)
+            self.stats['failures'] += 1
+            raise DocumentError('문서를 읽을 수 없습니다.') from None
+
+        self.stats['documents'] += 1
+        return OpenedDocument(self, document_path, document_kind, document_filename, page_count)
+
+    async def render_page(self, opened_document, page_index):
+        started_at = time.perf_counter()
+        try:
+            with measure_stage('render'):
+                image_bytes, page_width, page_height = await asyncio.get_running_loop().run_in_executor(
+                    self.read_executor(),
+                    render_document_page,
+                    opened_document.document_path,
+                    opened_document.document_kind,
+                    page_index,
+                    DOCUMENT_RENDER_DPI,
+                    DOCUMENT_RENDER_MAX_SIDE
+                )
+        except Exception:
+            self.stats['failures'] += 1
+            raise
+
+        render_seconds = time.perf_counter() - started_at
+        self.stats['pages'] += 1
+        self.stats['seconds'] += render_seconds
+        document_page = DocumentPage(page_index + 1, image_bytes, page_width, page_height, render_seconds)
+        check_image_pixels(document_page.image_probe)
+        return document_page
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def read_stats(self):
+        return {
+            'workers': self.max_workers,
+            'pdf': pypdfium2 is not None,
+            'renderDpi': DOCUMENT_RENDER_DPI,
+            'maxSide': DOCUMENT_RENDER_MAX_SIDE,
+            **self.stats,
+            'seconds': round(self.stats['seconds'], 3)
+        }
+
+
+class OpenedDocument:
+    def __init__(self, rasterizer, document_path, document_kind, document_filename, page_count):
+        self.rasterizer = rasterizer
+        self.document_path = document_path
+        self.document_kind = document_kind
+        self.document_filename = document_filename
+        self.page_count = page_count
+
+    def render_page(self, page_index):
+        return self.rasterizer.render_page(self, page_index)
+
+    def close(self):
+        try:
+            os.unlink(self.document_path)
+        except FileNotFoundError:
+            pass
+
+
+def read_page_indexes(raw_pages, page_count):
+    # '1-3,7'처럼 1부터 세는 page 번호와 범위를 받는다. 비어 있으면 전체 page다.
+    if raw_pages is None or not str(raw_pages).strip():
+        page_indexes = list(range(page_count))
+    else:
+        page_indexes = []
+        for page_range in str(raw_pages).split(','):
+            range_start, _, range_end = page_range.strip().partition('-')
+            try:
+                first_page = int(range_start)
+                last_page = int(range_end) if range_end.strip() else first_page
+            except ValueError:
+                raise DocumentError(f'pages 형식이 올바르지 않습니다: {page_range.strip()}') from None
+            if first_page < 1 or last_page < first_page or last_page > page_count:
+                raise DocumentError(f'pages는 1~{page_count} 범위여야 합니다: {page_range.strip()}')
+            page_indexes.extend(range(first_page - 1, last_page))
+        page_indexes = list(dict.fromkeys(page_indexes))
+
+    if DOCUMENT_MAX_PAGES > 0 and len(page_indexes) > DOCUMENT_MAX_PAGES:
+        raise DocumentError(f'한 번에 처리할 수 있는 page 수를 넘었습니다. ({len(page_indexes)}, 최대 {DOCUMENT_MAX_PAGES})', status_code=413)
+
+    return page_indexes
+
+
+document_rasterizer = DocumentRasterizer(DOCUMENT_RENDER_WORKERS)
@@ -0,0 +1,167 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from config import (
+    IMAGE_MAX_PIXELS,
+    IMAGE_PREPROCESS_ENABLED,
+    IMAGE_PREPROCESS_GRAYSCALE,
+    IMAGE_PREPROCESS_JPEG_QUALITY,
+    IMAGE_PREPROCESS_WORKERS,
+)
+from utils.metrics import measure_stage
+
+EXIF_ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImagePreprocessPlan:
+    def __init__(self, image_probe, target_width, target_height, grayscale=False, jpeg_quality=IMAGE_PREPROCESS_JPEG_QUALITY):
+        self.source_width, self.source_height = image_probe.display_size
+        self.target_width = target_width
+        self.target_height = target_height
+        self.grayscale = grayscale
+        self.jpeg_quality = jpeg_quality
+
+    @property
+    def is_resized(self):
+        return (self.target_width, self.target_height) != (self.source_width, self.source_height)
+
+    @property
+    def needs_encode(self):
+        return self.is_resized or self.grayscale
+
+    @property
+    def bbox_scale(self):
+        # 모델이 돌려준 pixel 좌표를 원본(EXIF 회전 후) 좌표로 되돌리는 배율이다.
+        if not self.is_resized:
+            return None
+
+        return self.source_width / self.target_width, self.source_height / self.target_height
+
+    def build_model_options(self, model_options):
+        # 전처리한 이미지의 응답은 원본 응답과 다르므로 cache key에 전처리 조건을 넣는다.
+        if not self.needs_encode:
+            return model_options
+
+        return {
+            **model_options,
+            'preprocess': {
+                'width': self.target_width,
+                'height': self.target_height,
+                'grayscale': self.grayscale,
+                'quality': self.jpeg_quality
+            }
+        }
+
+
+def plan_image_preprocess(image_probe, max_side):
+    display_width, display_height = image_probe.display_size
+    if not IMAGE_PREPROCESS_ENABLED:
+        return ImagePreprocessPlan(image_probe, display_width, display_height)
+
+    target_width, target_height = display_width, display_height
+    if max_side > 0 and max(display_width, display_height) > max_side:
+        resize_ratio = max_side / max(display_width, display_height)
+        target_width = max(1, round(display_width * resize_ratio))
+        target_height = max(1, round(display_height * resize_ratio))
+
+    return ImagePreprocessPlan(image_probe, target_width, target_height, grayscale=IMAGE_PREPROCESS_GRAYSCALE)
+
+
+def encode_preprocessed_image(image_bytes, target_width, target_height, grayscale, jpeg_quality):
+    # process pool worker에서 실행된다. PIL 객체 대신 bytes만 주고받는다.
+    PILImage.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS or None
+    image_mode = 'L' if grayscale else 'RGB'
+
+    with PILImage.open(BytesIO(image_bytes)) as source_image:
+        # JPEG는 draft로 DCT 단계에서 1/2~1/8로 줄여 읽어 decode 비용을 크게 아낀다.
+        orientation = source_image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if orientation in ROTATED_ORIENTATIONS:
+            source_image.draft(image_mode, (target_height, target_width))
+        else:
+            source_image.draft(image_mode, (target_width, target_height))
+
+        image = ImageOps.exif_transpose(source_image)
+        if image.mode != image_mode:
+            image = image.convert(image_mode)
+        if image.size != (target_width, target_height):
+            image = image.resize((target_width, target_height), PILImage.LANCZOS, reducing_gap=3.0)
+
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=jpeg_quality)
+        return output.getvalue()
+
+
+class ImagePreprocessor:
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self.executor = None
+        self.stats = {
+            'images': 0,
+            'skipped': 0,
+            'failures': 0,
+            'sourceBytes': 0,
+            'outputBytes': 0,
+            'seconds': 0.0
+        }
+
+    def read_executor(self):
+        if self.executor is None:
+            # uvicorn event loop thread를 fork로 복사하지 않도록 spawn으로 worker를 띄운다.
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+
+        return self.executor
+
+    async def preprocess(self, image_bytes, preprocess_plan):
+        if not preprocess_plan.needs_encode:
+            self.stats['skipped'] += 1
+            return image_bytes
+
+        started_at = time.perf_counter()
+        try:
+            with measure_stage('preprocess'):
+                processed_bytes = await asyncio.get_running_loop().run_in_executor(
+                    self.read_executor(),
+                    encode_preprocessed_image,
+                    bytes(image_bytes),
+                    preprocess_plan.target_width,
+                    preprocess_plan.target_height,
+                    preprocess_plan.grayscale,
+                    preprocess_plan.jpeg_quality
+                )
+        except Exception:
+            self.stats['failures'] += 1
+            raise
+
+        self.stats['images'] += 1
+        self.stats['sourceBytes'] += len(image_bytes)
+        self.stats['outputBytes'] += len(processed_bytes)
+        self.stats['seconds'] += time.perf_counter() - started_at
+        return processed_bytes
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def read_stats(self):
+        return {
+            'enabled': IMAGE_PREPROCESS_ENABLED,
+            'workers': self.max_workers,
+            'grayscale': IMAGE_PREPROCESS_GRAYSCALE,
+            'jpegQuality': IMAGE_PREPROCESS_JPEG_QUALITY,
+            **self.stats,
+            'seconds': round(self.stats['seconds'], 3)
+        }
+
+
+image_preprocessor = ImagePreprocessor(IMAGE_PREPROCESS_WORKERS)
@@ -0,0 +1,268 @@
+import struct
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from config import IMAGE_MAX_PIXELS
+from utils.metrics import measure_stage
+
+EXIF_ORIENTATION_TAG = 0x0112
+TIFF_WIDTH_TAG = 0x0100
+TIFF_HEIGHT_TAG = 0x0101
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+class ImageProbeError(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImageProbe:
+    def __init__(self, image_format, width, height, orientation=1):
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.orientation = orientation if orientation in range(1, 9) else 1
+
+    @property
+    def is_rotated(self):
+        return self.orientation in ROTATED_ORIENTATIONS
+
+    @property
+    def display_size(self):
+        # EXIF orientation 5~8은 90도 회전이므로 모델과 화면이 보는 가로/세로가 바뀐다.
+        if self.is_rotated:
+            return self.height, self.width
+
+        return self.width, self.height
+
+    def to_dict(self):
+        display_width, display_height = self.display_size
+        return {
+            'format': self.format,
+            'width': display_width,
+            'height': display_height,
+            'storedWidth': self.width,
+            'storedHeight': self.height,
+            'orientation': self.orientation,
+            'rotated': self.is_rotated
+        }
+
+
+def probe_image(image_bytes):
+    with measure_stage('probe'):
+        return read_image_probe(image_bytes)
+
+
+def read_image_probe(image_bytes):
+    # 픽셀을 decode하지 않고 header만 읽어 크기와 orientation을 확인한다.
+    image_probe = read_header_probe(image_bytes)
+    if image_probe is None:
+        image_probe = probe_with_pil(image_bytes)
+
+    check_image_pixels(image_probe)
+    return image_probe
+
+
+def read_header_probe(image_bytes):
+    # 포맷별 header parser만 쓰므로 업로드 앞부분만 받은 상태에서도 크기를 읽을 수 있으면 돌려준다.
+    header = bytes(image_bytes[:32])
+
+    try:
+        if header.startswith(b'\x89PNG\r\n\x1a\n'):
+            return probe_png(image_bytes)
+        if header.startswith(b'\xff\xd8'):
+            return probe_jpeg(image_bytes)
+        if header[:4] in (b'II*\x00', b'MM\x00*'):
+            return probe_tiff(image_bytes)
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+            return probe_webp(image_bytes)
+        if header.startswith(b'BM'):
+            return probe_bmp(image_bytes)
+    except (struct.error, IndexError, ValueError):
+        return None
+
+    return None
+
+
+def check_image_pixels(image_probe):
+    if image_probe.width <= 0 or image_probe.height <= 0:
+        raise ImageProbeError('이미지 크기를 읽을 수 없습니다.')
+
+    if IMAGE_MAX_PIXELS > 0 and image_probe.width * image_probe.height > IMAGE_MAX_PIXELS:
+        raise ImageProbeError(
+            f'이미지가 너무 큽니다. ({image_probe.width}x{image_probe.height}, 최대 {IMAGE_MAX_PIXELS} pixels)',
+            status_code=413
+        )
+
+
+def probe_png(image_bytes):
+    if bytes(image_bytes[12:16]) != b'IHDR':
+        return None
+
+    width, height = struct.unpack('>II', image_bytes[16:24])
+    return ImageProbe('PNG', width, height, read_png_orientation(image_bytes))
+
+
+def read_png_orientation(image_bytes):
+    # eXIf chunk는 IDAT 앞에만 올 수 있으므로 chunk header만 따라가다 IDAT에서 멈춘다.
+    position = 8
+    data_length = len(image_bytes)
+
+    while position + 8 <= data_length:
+        chunk_length = struct.unpack('>I', image_bytes[position:position + 4])[0]
+        chunk_type = bytes(image_bytes[position + 4:position + 8])
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        if chunk_type == b'eXIf':
+            exif_bytes = bytes(image_bytes[position + 8:position + 8 + chunk_length])
+            return read_tiff_tags(exif_bytes).get(EXIF_ORIENTATION_TAG, 1)
+
+        position += 12 + chunk_length
+
+    return 1
+
+
+def probe_jpeg(image_bytes):
+    orientation = 1
+    position = 2
+    data_length = len(image_bytes)
+
+    while position + 4 <= data_length:
+        if image_bytes[position] != 0xFF:
+            return None
+
+        marker = image_bytes[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+
+        if marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+            continue
+
+        if marker in (0xD9, 0xDA):
+            return None
+
+        segment_length = struct.unpack('>H', image_bytes[position + 2:position + 4])[0]
+        segment_start = position + 4
+
+        if marker == 0xE1 and bytes(image_bytes[segment_start:segment_start + 6]) == b'Exif\x00\x00':
+            exif_bytes = bytes(image_bytes[segment_start + 6:position + 2 + segment_length])
+            orientation = read_tiff_tags(exif_bytes).get(EXIF_ORIENTATION_TAG, 1)
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', image_bytes[segment_start + 1:segment_start + 5])
+            return ImageProbe('JPEG', width, height, orientation)
+
+        position += 2 + segment_length
+
+    return None
+
+
+def probe_tiff(image_bytes):
+    if bytes(image_bytes[2:4]) not in (b'*\x00', b'\x00*'):
+        return None
+
+    tiff_tags = read_tiff_tags(bytes(image_bytes[:65536]) if len(image_bytes) > 65536 else bytes(image_bytes))
+    if TIFF_WIDTH_TAG not in tiff_tags or TIFF_HEIGHT_TAG not in tiff_tags:
+        return None
+
+    return ImageProbe('TIFF', tiff_tags[TIFF_WIDTH_TAG], tiff_tags[TIFF_HEIGHT_TAG], tiff_tags.get(EXIF_ORIENTATION_TAG, 1))
+
+
+def read_tiff_tags(tiff_bytes):
+    if tiff_bytes[:2] == b'II':
+        byte_order = '<'
+    elif tiff_bytes[:2] == b'MM':
+        byte_order = '>'
+    else:
+        return {}
+
+    ifd_offset = struct.unpack(f'{byte_order}I', tiff_bytes[4:8])[0]
+    entry_count = struct.unpack(f'{byte_order}H', tiff_bytes[ifd_offset:ifd_offset + 2])[0]
+    tiff_tags = {}
+
+    for entry_index in range(entry_count):
+        entry_start = ifd_offset + 2 + entry_index * 12
+        tag, value_type = struct.unpack(f'{byte_order}HH', tiff_bytes[entry_start:entry_start + 4])
+        if tag not in (TIFF_WIDTH_TAG, TIFF_HEIGHT_TAG, EXIF_ORIENTATION_TAG):
+            continue
+
+        # SHORT/LONG 값 하나는 entry의 value 칸에 바로 들어 있다.
+        if value_type == 3:
+            tiff_tags[tag] = struct.unpack(f'{byte_order}H', tiff_bytes[entry_start + 8:entry_start + 10])[0]
+        elif value_type == 4:
+            tiff_tags[tag] = struct.unpack(f'{byte_order}I', tiff_bytes[entry_start + 8:entry_start + 12])[0]
+
+    return tiff_tags
+
+
+def probe_webp(image_bytes):
+    chunk_type = bytes(image_bytes[12:16])
+
+    if chunk_type == b'VP8 ':
+        if bytes(image_bytes[23:26]) != b'\x9d\x01\x2a':
+            return None
+        width, height = struct.unpack('<HH', image_bytes[26:30])
+        return ImageProbe('WEBP', width & 0x3FFF, height & 0x3FFF)
+
+    if chunk_type == b'VP8L':
+        if image_bytes[20] != 0x2F:
+            return None
+        size_bits = struct.unpack('<I', image_bytes[21:25])[0]
+        return ImageProbe('WEBP', (size_bits & 0x3FFF) + 1, ((size_bits >> 14) & 0x3FFF) + 1)
+
+    if chunk_type == b'VP8X':
+        width = int.from_bytes(image_bytes[24:27], 'little') + 1
+        height = int.from_bytes(image_bytes[27:30], 'little') + 1
+        orientation = read_webp_orientation(image_bytes) if image_bytes[20] & 0x08 else 1
+        return ImageProbe('WEBP', width, height, orientation)
+
+    return None
+
+
+def read_webp_orientation(image_bytes):
+    # EXIF chunk는 보통 이미지 데이터 뒤에 있어서 RIFF chunk header만 건너뛰며 찾는다.
+    position = 12
+    data_length = len(image_bytes)
+
+    while position + 8 <= data_length:
+        chunk_type = bytes(image_bytes[position:position + 4])
+        chunk_length = struct.unpack('<I', image_bytes[position + 4:position + 8])[0]
+        if chunk_type == b'EXIF':
+            exif_bytes = bytes(image_bytes[position + 8:position + 8 + chunk_length])
+            if exif_bytes.startswith(b'Exif\x00\x00'):
+                exif_bytes = exif_bytes[6:]
+            return read_tiff_tags(exif_bytes).get(EXIF_ORIENTATION_TAG, 1)
+
+        position += 8 + chunk_length + (chunk_length & 1)
+
+    return 1
+
+
+def probe_bmp(image_bytes):
+    header_size = struct.unpack('<I', image_bytes[14:18])[0]
+    if header_size == 12:
+        width, height = struct.unpack('<HH', image_bytes[18:22])
+    elif header_size >= 40:
+        width, height = struct.unpack('<ii', image_bytes[18:26])
+    else:
+        return None
+
+    # 음수 height는 위에서 아래로 저장된 BMP를 뜻한다.
+    return ImageProbe('BMP', width, abs(height))
+
+
+def probe_with_pil(image_bytes):
+    # PIL.Image.open도 header만 읽지만, decompression bomb 검사는 probe 기준으로 다시 한다.
+    try:
+        with PILImage.open(BytesIO(image_bytes)) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            return ImageProbe(image.format or 'UNKNOWN', image.width, image.height, orientation)
+    except PILImage.DecompressionBombError:
+        raise ImageProbeError('이미지가 너무 큽니다.', status_code=413) from None
+    except Exception:
+        raise ImageProbeError('이미지 형식을 읽을 수 없습니다.') from None
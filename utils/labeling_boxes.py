@@ -1,10 +1,14 @@
-from io import BytesIO
-from PIL import Image as PILImage
+import numpy as np
+
+from utils.image_probe import probe_image
+from utils.metrics import measure_stage, record_box_count
+
+NUMERIC_ARRAY_KINDS = 'biuf'
 
 
 def read_image_size(image_bytes):
-    with PILImage.open(BytesIO(image_bytes)) as image:
-        return image.size
+    # 모델 컨테이너와 브라우저는 EXIF orientation을 적용한 이미지를 보므로 회전 후 크기를 쓴다.
+    return probe_image(image_bytes).display_size
 
 
 def normalize_labeling_bbox(raw_bbox):
@@ -23,29 +27,86 @@ def normalize_labeling_bbox(raw_bbox):
     return None
 
 
-def build_labeling_boxes(source_boxes, image_width, image_height, box_id_prefix):
-    labeling_boxes = []
+def read_labeling_bbox_array(raw_bboxes):
+    # bbox 목록을 (N, 4) 배열과 읽을 수 있는 행 mask로 바꾼다.
+    # 모든 bbox가 같은 모양의 숫자 배열이면 한 번에 변환하고, 섞여 있으면 행마다 읽는다.
+    if raw_bboxes is None or len(raw_bboxes) == 0:
+        return np.empty((0, 4), dtype=np.float64), np.zeros(0, dtype=bool)
+
+    try:
+        source_array = np.asarray(raw_bboxes)
+    except (TypeError, ValueError):
+        source_array = None
+
+    if source_array is not None and source_array.dtype.kind in NUMERIC_ARRAY_KINDS:
+        source_array = source_array.astype(np.float64, copy=False)
+
+        if source_array.ndim == 2 and source_array.shape[1] == 4:
+            return source_array, np.ones(len(source_array), dtype=bool)
+
+        if source_array.ndim == 3 and source_array.shape[1] >= 4 and source_array.shape[2] >= 2:
+            x_points = source_array[:, :, 0]
+            y_points = source_array[:, :, 1]
+            bbox_array = np.stack([
+                x_points.min(axis=1),
+                y_points.min(axis=1),
+                x_points.max(axis=1),
+                y_points.max(axis=1)
+            ], axis=1)
+            return bbox_array, np.ones(len(bbox_array), dtype=bool)
+
+    bbox_array = np.zeros((len(raw_bboxes), 4), dtype=np.float64)
+    valid_mask = np.zeros(len(raw_bboxes), dtype=bool)
+    for bbox_index, raw_bbox in enumerate(raw_bboxes):
+        normalized_bbox = normalize_labeling_bbox(raw_bbox)
+        if normalized_bbox:
+            bbox_array[bbox_index] = normalized_bbox
+            valid_mask[bbox_index] = True
+
+    return bbox_array, valid_mask
+
+
+def clamp_labeling_bbox_array(bbox_array, valid_mask, image_width, image_height):
+    # fmin/fmax는 NaN을 무시하므로 Python의 min/max로 자르던 결과와 같고, 0.0을 더해 -0.0을 0.0으로 맞춘다.
+    clamped_array = np.empty_like(bbox_array)
+    clamped_array[:, 0::2] = np.fmax(0.0, np.fmin(float(image_width), bbox_array[:, 0::2])) + 0.0
+    clamped_array[:, 1::2] = np.fmax(0.0, np.fmin(float(image_height), bbox_array[:, 1::2])) + 0.0
+    kept_mask = valid_mask & (clamped_array[:, 2] > clamped_array[:, 0]) & (clamped_array[:, 3] > clamped_array[:, 1])
+    return clamped_array, kept_mask
 
-    for box_index, source_box in enumerate(source_boxes):
-        normalized_bbox = normalize_labeling_bbox(source_box.get('bbox'))
-        if not normalized_bbox:
-            continue
 
-        x1, y1, x2, y2 = normalized_bbox
-        x1 = max(0.0, min(float(image_width), x1))
-        x2 = max(0.0, min(float(image_width), x2))
-        y1 = max(0.0, min(float(image_height), y1))
-        y2 = max(0.0, min(float(image_height), y2))
+def project_labeling_bbox_array(bbox_array, bbox_scale=None):
+    # 줄인 이미지에서 나온 좌표를 원본 이미지 좌표로 되돌린다.
+    if bbox_scale is None:
+        return bbox_array
 
-        if x2 <= x1 or y2 <= y1:
-            continue
+    scale_x, scale_y = bbox_scale
+    return bbox_array * np.array([scale_x, scale_y, scale_x, scale_y])
 
+
+def build_labeling_boxes(source_boxes, image_width, image_height, box_id_prefix, bbox_scale=None):
+    with measure_stage('boxes'):
+        labeling_boxes = convert_labeling_boxes(source_boxes, image_width, image_height, box_id_prefix, bbox_scale)
+
+    record_box_count(len(labeling_boxes))
+    return labeling_boxes
+
+
+def convert_labeling_boxes(source_boxes, image_width, image_height, box_id_prefix, bbox_scale=None):
+    bbox_array, valid_mask = read_labeling_bbox_array([source_box.get('bbox') for source_box in source_boxes])
+    bbox_array = project_labeling_bbox_array(bbox_array, bbox_scale)
+    clamped_array, kept_mask = clamp_labeling_bbox_array(bbox_array, valid_mask, image_width, image_height)
+    kept_indexes = np.flatnonzero(kept_mask).tolist()
+    labeling_boxes = []
+
+    for box_index, labeling_bbox in zip(kept_indexes, clamped_array[kept_indexes].tolist()):
+        source_box = source_boxes[box_index]
         labeling_box = {
             'id': source_box.get('id') or f'{box_id_prefix}-{box_index + 1}',
             'type': source_box.get('type') or source_box.get('kind') or 'text',
             'text': source_box.get('text') if source_box.get('text') is not None else source_box.get('label', ''),
             'confidence': source_box.get('confidence', 1.0),
-            'bbox': [x1, y1, x2, y2]
+            'bbox': labeling_bbox
         }
 
         if source_box.get('html'):
@@ -54,3 +115,24 @@ def build_labeling_boxes(source_boxes, image_width, image_height, box_id_prefix)
         labeling_boxes.append(labeling_box)
 
     return labeling_boxes
+
+
+def build_text_labeling_boxes(bbox_array, valid_mask, texts, confidences, image_width, image_height, box_id_prefix, bbox_scale=None):
+    # OCR 결과처럼 text/confidence 열로 들어온 box는 중간 dict 없이 남는 box만 만든다.
+    with measure_stage('boxes'):
+        bbox_array = project_labeling_bbox_array(bbox_array, bbox_scale)
+        clamped_array, kept_mask = clamp_labeling_bbox_array(bbox_array, valid_mask, image_width, image_height)
+        kept_indexes = np.flatnonzero(kept_mask).tolist()
+        labeling_boxes = [
+            {
+                'id': f'{box_id_prefix}-{box_index + 1}',
+                'type': 'text',
+                'text': texts[box_index],
+                'confidence': confidences[box_index],
+                'bbox': labeling_bbox
+            }
+            for box_index, labeling_bbox in zip(kept_indexes, clamped_array[kept_indexes].tolist())
+        ]
+
+    record_box_count(len(labeling_boxes))
+    return labeling_boxes
@@ -0,0 +1,467 @@
+import asyncio
+import bisect
+import os
+import time
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+
+from config import METRICS_ENABLED, SERVER_TIMING_ENABLED, SHARED_STATE_SYNC_INTERVAL
+from utils.shared_state import shared_state
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))
+BOX_COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+BACKGROUND_ROUTE = 'background'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+EVENT_LOOP_LAG_INTERVAL = 0.25
+
+current_request_metrics = ContextVar('current_request_metrics', default=None)
+event_loop_monitor_task = None
+metrics_sync_task = None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # 값이 속한 bucket 하나만 올리고, 누적 값은 출력할 때 계산한다.
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def format_lines(self, metric_name, labels):
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += bucket_count
+            yield f'{metric_name}_bucket{format_labels({**labels, "le": format_number(bucket)})} {cumulative_count}'
+
+        yield f'{metric_name}_bucket{format_labels({**labels, "le": "+Inf"})} {self.count}'
+        yield f'{metric_name}_sum{format_labels(labels)} {format_number(self.total)}'
+        yield f'{metric_name}_count{format_labels(labels)} {self.count}'
+
+    def snapshot(self):
+        return [self.bucket_counts, self.total, self.count]
+
+    def merge(self, histogram_snapshot):
+        bucket_counts, total, count = histogram_snapshot
+        self.bucket_counts = [own_count + other_count for own_count, other_count in zip(self.bucket_counts, bucket_counts)]
+        self.total += total
+        self.count += count
+
+
+class MetricFamily:
+    def __init__(self, name, metric_type, description, label_names, buckets=None):
+        self.name = name
+        self.metric_type = metric_type
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, label_values, value):
+        histogram = self.values.get(label_values)
+        if histogram is None:
+            histogram = self.values[label_values] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def increment(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set(self, label_values, value):
+        self.values[label_values] = value
+
+    def snapshot(self):
+        if self.metric_type == 'histogram':
+            return [[list(label_values), histogram.snapshot()] for label_values, histogram in self.values.items()]
+
+        return [[list(label_values), metric_value] for label_values, metric_value in self.values.items()]
+
+    def merge(self, family_snapshot):
+        # 여러 worker의 값을 더한다. gauge도 더하므로 resident memory는 worker 전체 합이 된다.
+        for label_values, metric_value in family_snapshot:
+            label_values = tuple(label_values)
+            if self.metric_type == 'histogram':
+                histogram = self.values.get(label_values)
+                if histogram is None:
+                    histogram = self.values[label_values] = Histogram(self.buckets)
+                histogram.merge(metric_value)
+            else:
+                self.increment(label_values, metric_value)
+
+    def copy_empty(self):
+        return MetricFamily(self.name, self.metric_type, self.description, self.label_names, self.buckets)
+
+    def format_lines(self):
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} {self.metric_type}'
+
+        for label_values, metric_value in sorted(self.values.items()):
+            labels = dict(zip(self.label_names, label_values))
+            if self.metric_type == 'histogram':
+                yield from metric_value.format_lines(self.name, labels)
+            else:
+                yield f'{self.name}{format_labels(labels)} {format_number(metric_value)}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}
+
+    def histogram(self, name, description, label_names, buckets):
+        return self.register(MetricFamily(name, 'histogram', description, label_names, buckets))
+
+    def counter(self, name, description, label_names):
+        return self.register(MetricFamily(name, 'counter', description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return self.register(MetricFamily(name, 'gauge', description, label_names))
+
+    def register(self, metric_family):
+        self.families[metric_family.name] = metric_family
+        return metric_family
+
+    def snapshot(self):
+        return {metric_name: metric_family.snapshot() for metric_name, metric_family in self.families.items()}
+
+    def merge_snapshots(self, registry_snapshots):
+        # 같은 이름과 label 정의로 빈 registry를 만들고 worker마다 써 둔 값을 차례로 더한다.
+        merged_registry = MetricsRegistry()
+        for metric_family in self.families.values():
+            merged_registry.register(metric_family.copy_empty())
+
+        for registry_snapshot in registry_snapshots:
+            for metric_name, family_snapshot in registry_snapshot.items():
+                merged_family = merged_registry.families.get(metric_name)
+                if merged_family is not None:
+                    merged_family.merge(family_snapshot)
+
+        return merged_registry
+
+    def render(self):
+        metric_lines = []
+        for metric_family in self.families.values():
+            metric_lines.extend(metric_family.format_lines())
+
+        return '\n'.join(metric_lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+request_seconds = metrics_registry.histogram(
+    'labeling_request_seconds',
+    'HTTP 요청 처리 시간 (응답 header를 보낼 때까지)',
+    ('route', 'method', 'status'),
+    SECONDS_BUCKETS
+)
+stage_seconds = metrics_registry.histogram(
+    'labeling_stage_seconds',
+    '요청 처리 단계별 시간',
+    ('route', 'stage'),
+    SECONDS_BUCKETS
+)
+upstream_requests = metrics_registry.counter(
+    'labeling_upstream_requests_total',
+    '모델 컨테이너 호출 수 (status는 HTTP status code 또는 error)',
+    ('upstream', 'status')
+)
+upstream_request_bytes = metrics_registry.histogram(
+    'labeling_upstream_request_bytes',
+    '모델 컨테이너로 보낸 요청 body 크기',
+    ('upstream',),
+    BYTES_BUCKETS
+)
+upstream_response_bytes = metrics_registry.histogram(
+    'labeling_upstream_response_bytes',
+    '모델 컨테이너 응답 body 크기',
+    ('upstream',),
+    BYTES_BUCKETS
+)
+response_bytes = metrics_registry.histogram(
+    'labeling_response_bytes',
+    'JSON 응답 body 크기',
+    ('route',),
+    BYTES_BUCKETS
+)
+box_counts = metrics_registry.histogram(
+    'labeling_boxes',
+    '응답 하나에 담긴 labeling box 수',
+    ('route',),
+    BOX_COUNT_BUCKETS
+)
+client_disconnects = metrics_registry.counter(
+    'labeling_client_disconnects_total',
+    '응답을 보내기 전에 client가 연결을 끊어 취소한 요청 수',
+    ('route',)
+)
+cancelled_inferences = metrics_registry.counter(
+    'labeling_cancelled_inferences_total',
+    '취소된 모델 호출 수 (phase는 취소된 시점: admission, batch, queued, inference)',
+    ('model', 'phase')
+)
+gpu_seconds_saved = metrics_registry.counter(
+    'labeling_gpu_seconds_saved_total',
+    '취소로 돌리지 않은 추론 시간 추정치 (모델별 평균 처리 시간에서 이미 쓴 시간을 뺀 값)',
+    ('model',)
+)
+template_lookups = metrics_registry.counter(
+    'labeling_keyvalue_template_lookups_total',
+    'key-value 양식 fingerprint 조회 수 (result는 hits, misses, learning, verified)',
+    ('model', 'result')
+)
+event_loop_lag_seconds = metrics_registry.histogram(
+    'labeling_event_loop_lag_seconds',
+    f'event loop가 {EVENT_LOOP_LAG_INTERVAL}초 sleep 뒤 늦게 깨어난 시간',
+    (),
+    SECONDS_BUCKETS
+)
+resident_memory_bytes = metrics_registry.gauge(
+    'process_resident_memory_bytes',
+    '게이트웨이 process의 resident memory 크기'
+)
+
+
+class RequestMetrics:
+    def __init__(self, scope):
+        self.scope = scope
+        self.stage_durations = {}
+
+    @property
+    def route(self):
+        # routing이 끝나야 scope에 route가 들어오므로 기록할 때마다 읽는다.
+        return read_route_name(self.scope)
+
+    def record_stage(self, stage_name, elapsed_seconds):
+        self.stage_durations[stage_name] = self.stage_durations.get(stage_name, 0.0) + elapsed_seconds
+
+    def build_server_timing(self, total_seconds):
+        server_timings = [
+            f'{stage_name};dur={elapsed_seconds * 1000:.2f}'
+            for stage_name, elapsed_seconds in self.stage_durations.items()
+        ]
+        server_timings.append(f'total;dur={total_seconds * 1000:.2f}')
+        return ', '.join(server_timings).encode('latin-1')
+
+
+class measure_stage:
+    # with 문 하나로 단계 시간을 histogram과 현재 요청의 Server-Timing에 함께 기록한다.
+    __slots__ = ('stage_name', 'started_at')
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if METRICS_ENABLED:
+            record_stage(self.stage_name, time.perf_counter() - self.started_at)
+        return False
+
+
+def record_stage(stage_name, elapsed_seconds):
+    request_metrics = current_request_metrics.get()
+    if request_metrics is None:
+        stage_seconds.observe((BACKGROUND_ROUTE, stage_name), elapsed_seconds)
+        return
+
+    request_metrics.record_stage(stage_name, elapsed_seconds)
+    stage_seconds.observe((request_metrics.route, stage_name), elapsed_seconds)
+
+
+def record_upstream_call(api_url, status, request_size=None, response_size=None):
+    if not METRICS_ENABLED:
+        return
+
+    upstream_name = read_upstream_name(api_url)
+    upstream_requests.increment((upstream_name, str(status)))
+    if request_size is not None:
+        upstream_request_bytes.observe((upstream_name,), request_size)
+    if response_size is not None:
+        upstream_response_bytes.observe((upstream_name,), response_size)
+
+
+def record_box_count(box_count):
+    if not METRICS_ENABLED:
+        return
+
+    request_metrics = current_request_metrics.get()
+    box_counts.observe((request_metrics.route if request_metrics else BACKGROUND_ROUTE,), box_count)
+
+
+def record_client_disconnect(scope):
+    if METRICS_ENABLED:
+        client_disconnects.increment((read_route_name(scope),))
+
+
+def record_cancelled_inference(model_name, phase, saved_seconds):
+    if not METRICS_ENABLED:
+        return
+
+    cancelled_inferences.increment((model_name, phase))
+    gpu_seconds_saved.increment((model_name,), saved_seconds)
+
+
+def record_template_lookup(model_name, lookup_result):
+    if METRICS_ENABLED:
+        template_lookups.increment((model_name, lookup_result))
+
+
+def record_response_size(response_size):
+    request_metrics = current_request_metrics.get()
+    if METRICS_ENABLED and request_metrics is not None:
+        response_bytes.observe((request_metrics.route,), response_size)
+
+
+def read_upstream_name(api_url):
+    # host:port/path 단위로 묶어 replica와 inference/release 호출을 구분한다.
+    url_parts = urlsplit(str(api_url or ''))
+    return f'{url_parts.netloc}{url_parts.path}' or 'unknown'
+
+
+def read_route_name(scope):
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+class MetricsMiddleware:
+    # BaseHTTPMiddleware는 요청마다 task와 stream을 더 만들므로 ASGI send만 감싼다.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        request_metrics = RequestMetrics(scope)
+        context_token = current_request_metrics.set(request_metrics)
+        started_at = time.perf_counter()
+        response_status = 500
+
+        async def send_with_metrics(message):
+            nonlocal response_status
+
+            if message['type'] == 'http.response.start':
+                response_status = message['status']
+                total_seconds = time.perf_counter() - started_at
+                request_seconds.observe((request_metrics.route, scope['method'], str(response_status)), total_seconds)
+                if SERVER_TIMING_ENABLED:
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'server-timing', request_metrics.build_server_timing(total_seconds))
+                    ]
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_request_metrics.reset(context_token)
+
+
+async def monitor_event_loop_lag():
+    # CPU 작업이 event loop를 막으면 sleep이 예정보다 늦게 끝나므로 그 차이를 잰다.
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag_seconds.observe((), max(0.0, time.perf_counter() - started_at - EVENT_LOOP_LAG_INTERVAL))
+
+
+def start_event_loop_monitor():
+    global event_loop_monitor_task
+
+    if METRICS_ENABLED and event_loop_monitor_task is None:
+        event_loop_monitor_task = asyncio.get_running_loop().create_task(monitor_event_loop_lag())
+
+
+async def stop_event_loop_monitor():
+    global event_loop_monitor_task
+
+    if event_loop_monitor_task is None:
+        return
+
+    event_loop_monitor_task.cancel()
+    await asyncio.gather(event_loop_monitor_task, return_exceptions=True)
+    event_loop_monitor_task = None
+
+
+async def sync_shared_metrics():
+    # /metrics를 어느 worker가 받더라도 다른 worker의 최근 값을 합칠 수 있도록 주기적으로 써 둔다.
+    while True:
+        await asyncio.sleep(SHARED_STATE_SYNC_INTERVAL)
+        # snapshot은 event loop에서 떠 두고, write lock을 기다릴 수 있는 SQLite 쓰기만 shared state thread로 넘긴다.
+        update_resident_memory()
+        await shared_state.run(shared_state.write_metrics, metrics_registry.snapshot())
+
+
+def write_shared_metrics():
+    update_resident_memory()
+    shared_state.write_metrics(metrics_registry.snapshot())
+
+
+def start_metrics_sync():
+    global metrics_sync_task
+
+    if METRICS_ENABLED and shared_state is not None and metrics_sync_task is None:
+        write_shared_metrics()
+        metrics_sync_task = asyncio.get_running_loop().create_task(sync_shared_metrics())
+
+
+async def stop_metrics_sync():
+    global metrics_sync_task
+
+    if metrics_sync_task is None:
+        return
+
+    metrics_sync_task.cancel()
+    await asyncio.gather(metrics_sync_task, return_exceptions=True)
+    metrics_sync_task = None
+    # 종료하는 동안 마지막으로 센 값도 남겨 둔다. worker가 끝나면 master가 그 pid의 값을 지운다.
+    write_shared_metrics()
+
+
+def read_resident_memory_bytes():
+    # Linux에서만 /proc로 읽고, 다른 OS에서는 값을 내보내지 않는다.
+    try:
+        with open('/proc/self/statm', 'rb') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    label_pairs = ','.join(f'{label_name}="{escape_label_value(label_value)}"' for label_name, label_value in labels.items())
+    return '{' + label_pairs + '}'
+
+
+def escape_label_value(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(metric_value):
+    if isinstance(metric_value, float) and metric_value.is_integer():
+        return str(int(metric_value))
+    return repr(metric_value) if isinstance(metric_value, float) else str(metric_value)
+
+
+def update_resident_memory():
+    resident_memory = read_resident_memory_bytes()
+    if resident_memory is not None:
+        resident_memory_bytes.set((), resident_memory)
+
+
+def render_metrics():
+    if shared_state is None or not METRICS_ENABLED:
+        update_resident_memory()
+        return metrics_registry.render()
+
+    # 요청을 받은 worker는 자기 값을 먼저 써 두고 모든 worker의 값을 합쳐 내보낸다.
+    write_shared_metrics()
+    return metrics_registry.merge_snapshots(shared_state.read_metrics()).render()
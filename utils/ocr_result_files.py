@@ -1,28 +1,172 @@
+import fcntl
+import gzip
 import json
-import tempfile
-from contextlib import contextmanager
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
+from config import (
+    RAW_RESPONSE_ARCHIVE_DIR,
+    RAW_RESPONSE_ARCHIVE_ENABLED,
+    RAW_RESPONSE_ARCHIVE_MAX_BYTES,
+    RAW_RESPONSE_ARCHIVE_QUEUE_SIZE,
+    RAW_RESPONSE_ARCHIVE_RETENTION_DAYS,
+)
 
-def save_raw_ocr_response(result_path, raw_ocr_response):
-    result_path = Path(result_path)
-    result_path.parent.mkdir(parents=True, exist_ok=True)
-    result_path.write_text(json.dumps(raw_ocr_response, ensure_ascii=False, indent=2), encoding='utf-8')
-    return str(result_path)
+RAW_RESPONSE_ARCHIVE_SUFFIX = '.jsonl.gz'
+RAW_RESPONSE_ARCHIVE_BATCH_SIZE = 64
+RAW_RESPONSE_RETENTION_INTERVAL = 600
 
 
-def read_raw_ocr_response(result_path):
-    raw_response_text = Path(result_path).read_text(encoding='utf-8')
-    if not raw_response_text:
-        return {}
+class RawResponseArchive:
+    def __init__(self, archive_dir, retention_days, max_bytes, queue_size, enabled=False):
+        self.archive_dir = Path(archive_dir)
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.pending_records = queue.Queue(maxsize=queue_size)
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.last_retention_at = 0.0
+        self.stats = {'archived': 0, 'dropped': 0, 'failed': 0, 'removedFiles': 0}
 
-    return json.loads(raw_response_text)
+    def archive(self, model_name, image_filename, raw_ocr_response):
+        if not self.enabled:
+            return False
 
+        self.start_worker()
+        archive_record = {
+            'archivedAt': datetime.now(timezone.utc).isoformat(),
+            'model': model_name,
+            'filename': image_filename,
+            'response': raw_ocr_response
+        }
 
-@contextmanager
-def saved_temporary_raw_ocr_response(workspace_path, folder_prefix, raw_ocr_response):
-    Path(workspace_path).mkdir(parents=True, exist_ok=True)
-    with tempfile.TemporaryDirectory(prefix=folder_prefix, dir=workspace_path) as temporary_folder:
-        result_path = Path(temporary_folder) / 'raw_response.json'
-        save_raw_ocr_response(result_path, raw_ocr_response)
-        yield result_path
+        try:
+            self.pending_records.put_nowait(archive_record)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def start_worker(self):
+        with self.worker_lock:
+            if self.worker is not None and self.worker.is_alive():
+                return
+
+            self.worker = threading.Thread(target=self.run_worker, name='raw-response-archive', daemon=True)
+            self.worker.start()
+
+    def run_worker(self):
+        while True:
+            archive_record = self.pending_records.get()
+            if archive_record is None:
+                return
+
+            archive_records = [archive_record]
+            while len(archive_records) < RAW_RESPONSE_ARCHIVE_BATCH_SIZE:
+                try:
+                    archive_record = self.pending_records.get_nowait()
+                except queue.Empty:
+                    break
+
+                if archive_record is None:
+                    self.write_records(archive_records)
+                    return
+                archive_records.append(archive_record)
+
+            self.write_records(archive_records)
+
+    def write_records(self, archive_records):
+        records_by_path = {}
+        for archive_record in archive_records:
+            archive_path = self.read_archive_path(archive_record['model'], archive_record['archivedAt'])
+            records_by_path.setdefault(archive_path, []).append(archive_record)
+
+        for archive_path, path_records in records_by_path.items():
+            try:
+                archive_path.parent.mkdir(parents=True, exist_ok=True)
+                archive_lines = b''.join(
+                    json.dumps(archive_record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                    for archive_record in path_records
+                )
+                # gzip member를 이어 붙이므로 파일 전체를 다시 쓰지 않고 append 할 수 있다.
+                # worker 여러 개가 같은 파일에 쓰므로 member 하나를 다 압축한 뒤 file lock을 잡고 한 번에 붙인다.
+                compressed_member = gzip.compress(archive_lines, compresslevel=6)
+                with open(archive_path, 'ab') as archive_file:
+                    fcntl.flock(archive_file, fcntl.LOCK_EX)
+                    archive_file.write(compressed_member)
+                self.stats['archived'] += len(path_records)
+            except (OSError, TypeError, ValueError):
+                self.stats['failed'] += len(path_records)
+
+        if time.monotonic() - self.last_retention_at >= RAW_RESPONSE_RETENTION_INTERVAL:
+            self.apply_retention()
+
+    def read_archive_path(self, model_name, archived_at):
+        archive_date = archived_at[:10].replace('-', '')
+        return self.archive_dir / f'{model_name}_{archive_date}{RAW_RESPONSE_ARCHIVE_SUFFIX}'
+
+    def apply_retention(self):
+        self.last_retention_at = time.monotonic()
+        archive_files = []
+        for archive_path in self.archive_dir.glob(f'*{RAW_RESPONSE_ARCHIVE_SUFFIX}'):
+            try:
+                file_stat = archive_path.stat()
+            except OSError:
+                continue
+            archive_files.append((file_stat.st_mtime, file_stat.st_size, archive_path))
+
+        archive_files.sort()
+        total_size = sum(file_size for _, file_size, _ in archive_files)
+        expire_before = time.time() - self.retention_days * 24 * 60 * 60
+
+        for modified_at, file_size, archive_path in archive_files:
+            is_expired = self.retention_days > 0 and modified_at < expire_before
+            is_over_size = self.max_bytes > 0 and total_size > self.max_bytes
+            if not is_expired and not is_over_size:
+                continue
+
+            try:
+                archive_path.unlink()
+            except OSError:
+                continue
+
+            total_size -= file_size
+            self.stats['removedFiles'] += 1
+
+    def close(self, timeout=5.0):
+        with self.worker_lock:
+            worker = self.worker
+            self.worker = None
+
+        if worker is None or not worker.is_alive():
+            return
+
+        try:
+            self.pending_records.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        worker.join(timeout)
+
+    def read_stats(self):
+        return {
+            'enabled': self.enabled,
+            'queued': self.pending_records.qsize(),
+            **self.stats
+        }
+
+
+raw_response_archive = RawResponseArchive(
+    RAW_RESPONSE_ARCHIVE_DIR,
+    RAW_RESPONSE_ARCHIVE_RETENTION_DAYS,
+    RAW_RESPONSE_ARCHIVE_MAX_BYTES,
+    RAW_RESPONSE_ARCHIVE_QUEUE_SIZE,
+    enabled=RAW_RESPONSE_ARCHIVE_ENABLED
+)
+
+
+def archive_raw_ocr_response(model_name, image_filename, raw_ocr_response):
+    return raw_response_archive.archive(model_name, image_filename, raw_ocr_response)
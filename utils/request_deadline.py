@@ -0,0 +1,133 @@
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+
+from config import CLIENT_DISCONNECT_CANCEL_ENABLED, REQUEST_DEADLINE_SECONDS
+from utils.metrics import record_client_disconnect
+
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
+REQUEST_DEADLINE_HEADER = 'X-Request-Deadline'
+
+# time.monotonic() 기준으로 현재 요청이 끝나야 하는 시각. 백그라운드 작업에는 없다.
+current_request_deadline = ContextVar('current_request_deadline', default=None)
+
+
+def read_request_deadline(scope):
+    # X-Request-Timeout은 남은 초, X-Request-Deadline은 unix time 초로 받고 설정값과 함께 가장 이른 시각을 쓴다.
+    now = time.monotonic()
+    deadlines = []
+    if REQUEST_DEADLINE_SECONDS > 0:
+        deadlines.append(now + REQUEST_DEADLINE_SECONDS)
+
+    headers = dict(scope.get('headers') or [])
+    request_timeout = read_header_seconds(headers.get(REQUEST_TIMEOUT_HEADER.lower().encode('latin-1')))
+    if request_timeout is not None and request_timeout > 0:
+        deadlines.append(now + request_timeout)
+
+    request_deadline = read_header_seconds(headers.get(REQUEST_DEADLINE_HEADER.lower().encode('latin-1')))
+    if request_deadline is not None and request_deadline > 0:
+        deadlines.append(now + request_deadline - time.time())
+
+    return min(deadlines) if deadlines else None
+
+
+def read_header_seconds(raw_value):
+    if not raw_value:
+        return None
+
+    try:
+        header_seconds = float(raw_value.decode('latin-1').strip())
+    except ValueError:
+        return None
+
+    return header_seconds if math.isfinite(header_seconds) else None
+
+
+def read_remaining_seconds():
+    request_deadline = current_request_deadline.get()
+    if request_deadline is None:
+        return None
+
+    return max(0.0, request_deadline - time.monotonic())
+
+
+def clamp_timeout(timeout):
+    """설정된 timeout과 요청 deadline까지 남은 시간 중 짧은 쪽과, deadline 때문에 줄었는지를 돌려준다."""
+    remaining_seconds = read_remaining_seconds()
+    if remaining_seconds is None or (timeout is not None and 0 < timeout <= remaining_seconds):
+        return timeout, False
+
+    return remaining_seconds, True
+
+
+class RequestCancellationMiddleware:
+    # 요청 deadline을 ContextVar로 넘기고, 응답을 보내기 전에 client가 끊으면 handler task를 취소해
+    # 진행 중인 모델 호출까지 함께 끊는다. StreamingResponse는 Starlette가 끊김을 직접 처리한다.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        deadline_token = current_request_deadline.set(read_request_deadline(scope))
+        try:
+            if CLIENT_DISCONNECT_CANCEL_ENABLED:
+                await self.run_until_disconnect(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            current_request_deadline.reset(deadline_token)
+
+    async def run_until_disconnect(self, scope, receive, send):
+        body_received = asyncio.Event()
+        disconnected = asyncio.Event()
+        response_started = False
+        cancelled_by_disconnect = False
+
+        async def receive_request():
+            if body_received.is_set():
+                # body를 다 받은 뒤의 receive는 watcher가 맡으므로 끊길 때까지 기다렸다가 알려 준다.
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+            elif not message.get('more_body', False):
+                body_received.set()
+            return message
+
+        async def send_response(message):
+            nonlocal response_started
+
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            nonlocal cancelled_by_disconnect
+
+            # body를 읽기 전에는 handler가 receive를 쓰므로 다 읽은 뒤부터 연결만 지켜본다.
+            await body_received.wait()
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+            disconnected.set()
+            if not response_started and not handler_task.done():
+                cancelled_by_disconnect = True
+                record_client_disconnect(scope)
+                handler_task.cancel()
+
+        handler_task = asyncio.ensure_future(self.app(scope, receive_request, send_response))
+        watcher_task = asyncio.ensure_future(watch_disconnect())
+        try:
+            await handler_task
+        except asyncio.CancelledError:
+            # client가 떠나서 취소한 경우에는 보낼 곳이 없으므로 조용히 끝낸다. 서버 종료 같은 바깥 취소는 그대로 올린다.
+            if not cancelled_by_disconnect or asyncio.current_task().cancelling():
+                raise
+        finally:
+            watcher_task.cancel()
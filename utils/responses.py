@@ -1,5 +1,21 @@
+import json
+import re
+
 from fastapi.responses import JSONResponse
 
+from utils.metrics import measure_stage, record_response_size
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson과 json 모듈은 지수 표기(1e16/1e+16)와 0.0001 미만 소수(0.00001/1e-05)를 다르게 쓴다.
+# 출력에 이런 숫자가 보이면 기존 경로로 다시 만들어 Starlette JSONResponse와 같은 bytes를 유지한다.
+# 앞 글자 조건은 정규식 대신 후보 위치에서만 확인해야 긴 응답에서도 검사가 빠르다.
+ORJSON_EXPONENT_CANDIDATE_PATTERN = re.compile(rb'e[-0-9]')
+ASCII_DIGITS = b'0123456789'
+
 
 def convert_to_json_safe(response_content):
     if isinstance(response_content, dict):
@@ -18,5 +34,68 @@ def convert_to_json_safe(response_content):
     return response_content
 
 
-def json_response(response_body, status_code=200):
-    return JSONResponse(content=convert_to_json_safe(response_body), status_code=status_code)
+def convert_json_default(response_content):
+    # NumPy scalar/array처럼 orjson이 모르는 값만 여기로 온다.
+    # float32를 orjson의 NumPy 직렬화에 맡기면 자릿수가 달라지므로 Python 값으로 바꿔 돌려준다.
+    if hasattr(response_content, 'item'):
+        return response_content.item()
+    if hasattr(response_content, 'tolist'):
+        return response_content.tolist()
+    raise TypeError(f'Type is not JSON serializable: {type(response_content).__name__}')
+
+
+def dump_json_bytes(response_content):
+    if orjson is not None:
+        try:
+            json_bytes = orjson.dumps(response_content, default=convert_json_default)
+        except (TypeError, orjson.JSONEncodeError):
+            json_bytes = None
+
+        if json_bytes is not None and not has_orjson_float_mismatch(json_bytes):
+            return json_bytes
+
+    return json.dumps(
+        convert_to_json_safe(response_content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(',', ':')
+    ).encode('utf-8')
+
+
+def has_orjson_float_mismatch(json_bytes):
+    for candidate_match in ORJSON_EXPONENT_CANDIDATE_PATTERN.finditer(json_bytes):
+        candidate_start = candidate_match.start()
+        if candidate_start > 0 and json_bytes[candidate_start - 1] in ASCII_DIGITS:
+            return True
+
+    candidate_start = json_bytes.find(b'0.0000')
+    while candidate_start >= 0:
+        if candidate_start == 0 or json_bytes[candidate_start - 1] not in ASCII_DIGITS:
+            return True
+        candidate_start = json_bytes.find(b'0.0000', candidate_start + 1)
+
+    return False
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        with measure_stage('encode'):
+            json_bytes = dump_json_bytes(content)
+
+        record_response_size(len(json_bytes))
+        return json_bytes
+
+
+def json_response(response_body, status_code=200, headers=None):
+    return FastJSONResponse(content=response_body, status_code=status_code, headers=headers)
+
+
+async def format_labeling_stream_events(labeling_events, use_event_stream=False):
+    # Accept가 text/event-stream이면 SSE, 아니면 한 줄에 event 하나인 NDJSON으로 보낸다.
+    async for labeling_event in labeling_events:
+        event_text = dump_json_bytes(labeling_event).decode('utf-8')
+        if use_event_stream:
+            yield f"event: {labeling_event['event']}\ndata: {event_text}\n\n"
+        else:
+            yield event_text + '\n'
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from config import (
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_BYTES,
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MEMORY_BYTES,
+    RESULT_CACHE_MEMORY_ENTRIES,
+    RESULT_CACHE_TTL,
+)
+from utils.metrics import measure_stage
+from utils.request_deadline import current_request_deadline
+from utils.shared_state import SHARED_STATE_POLL_INTERVAL, shared_state
+
+DISK_SIZE_COUNTER = 'result-cache-disk-bytes'
+
+
+def hash_image_bytes(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def outlives_deadline(leader_deadline):
+    if leader_deadline is None or leader_deadline > time.monotonic():
+        return False
+
+    request_deadline = current_request_deadline.get()
+    return request_deadline is None or request_deadline > leader_deadline
+
+
+def build_result_cache_key(model_name, image_hash, model_options=None):
+    options_text = json.dumps(model_options or {}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    key_source = f'{model_name}\n{image_hash}\n{options_text}'.encode('utf-8')
+    return hashlib.sha256(key_source).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, cache_dir, memory_entries, memory_bytes, disk_bytes, ttl_seconds, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.memory_items = OrderedDict()
+        self.memory_size = 0
+        self.disk_size = None
+        self.pending_results = {}
+        self.stats = {
+            'memoryHits': 0,
+            'diskHits': 0,
+            'misses': 0,
+            'collapsed': 0,
+            'sharedCollapsed': 0,
+            'bypassed': 0,
+            'stores': 0,
+            'memoryEvictions': 0,
+            'diskEvictions': 0,
+            'expired': 0
+        }
+
+    async def get_or_compute(self, cache_key, compute_result, bypass_cache=False):
+        if not self.enabled or bypass_cache:
+            self.stats['bypassed'] += 1
+            return await compute_result()
+
+        cached_result = self.read_memory(cache_key)
+        if cached_result is not None:
+            self.stats['memoryHits'] += 1
+            return cached_result
+
+        pending_entry = self.pending_results.get(cache_key)
+        if pending_entry is not None:
+            pending_result, leader_deadline = pending_entry
+            self.stats['collapsed'] += 1
+            try:
+                return await asyncio.shield(pending_result)
+            except asyncio.CancelledError:
+                if not pending_result.cancelled():
+                    raise
+                # 먼저 시작한 요청이 취소되면 대기 중이던 요청이 직접 다시 계산한다.
+                return await self.get_or_compute(cache_key, compute_result)
+            except Exception:
+                # 먼저 시작한 요청이 자기 deadline에 걸려 실패했고 이 요청은 시간이 더 남았으면 직접 다시 계산한다.
+                if not outlives_deadline(leader_deadline):
+                    raise
+                return await self.get_or_compute(cache_key, compute_result)
+
+        pending_result = asyncio.get_running_loop().create_future()
+        self.pending_results[cache_key] = (pending_result, current_request_deadline.get())
+
+        try:
+            with measure_stage('cache'):
+                cached_entry = await asyncio.to_thread(self.read_disk, cache_key)
+            if cached_entry is not None:
+                self.stats['diskHits'] += 1
+                cached_result, entry_size = cached_entry
+                self.write_memory(cache_key, cached_result, entry_size)
+            else:
+                cached_result = await self.compute_once(cache_key, compute_result)
+
+            pending_result.set_result(cached_result)
+            return cached_result
+        except asyncio.CancelledError:
+            pending_result.cancel()
+            raise
+        except Exception as error:
+            pending_result.set_exception(error)
+            # 대기 중인 요청이 없으면 future의 예외를 여기서 소비한다.
+            pending_result.exception()
+            raise
+        finally:
+            self.pending_results.pop(cache_key, None)
+
+    async def compute_once(self, cache_key, compute_result):
+        if shared_state is None or self.disk_bytes <= 0:
+            self.stats['misses'] += 1
+            cached_result = await compute_result()
+            await self.store(cache_key, cached_result)
+            return cached_result
+
+        # 여러 worker가 같은 key를 동시에 놓치면 한 worker만 계산하고 나머지는 disk에 저장될 때까지 기다린다.
+        claim_name = f'result-cache:{cache_key}'
+        while not await shared_state.run(
+            shared_state.claim,
+            claim_name,
+            undo=lambda is_claimed: is_claimed and shared_state.release_claim(claim_name)
+        ):
+            # 계산 중인 worker가 끝내거나 죽을 때까지는 write transaction 없이 disk와 claim 주인만 읽는다.
+            while True:
+                await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+                cached_entry = await asyncio.to_thread(self.read_disk, cache_key)
+                if cached_entry is not None:
+                    self.stats['sharedCollapsed'] += 1
+                    cached_result, entry_size = cached_entry
+                    self.write_memory(cache_key, cached_result, entry_size)
+                    return cached_result
+                if await shared_state.run(shared_state.read_claim_owner, claim_name) is None:
+                    break
+
+        try:
+            # claim을 잡기 직전에 다른 worker가 계산을 끝냈을 수 있으므로 disk를 한 번 더 본다.
+            cached_entry = await asyncio.to_thread(self.read_disk, cache_key)
+            if cached_entry is not None:
+                self.stats['sharedCollapsed'] += 1
+                cached_result, entry_size = cached_entry
+                self.write_memory(cache_key, cached_result, entry_size)
+                return cached_result
+
+            self.stats['misses'] += 1
+            cached_result = await compute_result()
+            await self.store(cache_key, cached_result)
+            return cached_result
+        finally:
+            shared_state.submit(shared_state.release_claim, claim_name)
+
+    async def read(self, cache_key):
+        if not self.enabled:
+            return None
+
+        cached_result = self.read_memory(cache_key)
+        if cached_result is not None:
+            self.stats['memoryHits'] += 1
+            return cached_result
+
+        with measure_stage('cache'):
+            cached_entry = await asyncio.to_thread(self.read_disk, cache_key)
+        if cached_entry is None:
+            return None
+
+        self.stats['diskHits'] += 1
+        cached_result, entry_size = cached_entry
+        self.write_memory(cache_key, cached_result, entry_size)
+        return cached_result
+
+    async def store(self, cache_key, cached_result):
+        serialized_result = json.dumps(cached_result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.write_memory(cache_key, cached_result, len(serialized_result))
+        await asyncio.to_thread(self.write_disk, cache_key, serialized_result)
+        self.stats['stores'] += 1
+
+    def read_memory(self, cache_key):
+        memory_item = self.memory_items.get(cache_key)
+        if memory_item is None:
+            return None
+
+        cached_result, entry_size, stored_at = memory_item
+        if self.is_expired(stored_at):
+            self.remove_memory(cache_key)
+            self.stats['expired'] += 1
+            return None
+
+        self.memory_items.move_to_end(cache_key)
+        return cached_result
+
+    def write_memory(self, cache_key, cached_result, entry_size):
+        if entry_size > self.memory_bytes:
+            return
+
+        self.remove_memory(cache_key)
+        self.memory_items[cache_key] = (cached_result, entry_size, time.time())
+        self.memory_size += entry_size
+
+        while len(self.memory_items) > self.memory_entries or self.memory_size > self.memory_bytes:
+            evicted_key = next(iter(self.memory_items))
+            self.remove_memory(evicted_key)
+            self.stats['memoryEvictions'] += 1
+
+    def remove_memory(self, cache_key):
+        memory_item = self.memory_items.pop(cache_key, None)
+        if memory_item is not None:
+            self.memory_size -= memory_item[1]
+
+    def read_disk_path(self, cache_key):
+        return self.cache_dir / cache_key[:2] / f'{cache_key}.json'
+
+    def read_disk(self, cache_key):
+        if self.disk_bytes <= 0:
+            return None
+
+        result_path = self.read_disk_path(cache_key)
+        try:
+            stored_at = result_path.stat().st_mtime
+            if self.is_expired(stored_at):
+                self.remove_disk_file(result_path)
+                self.stats['expired'] += 1
+                return None
+
+            serialized_result = result_path.read_bytes()
+            return json.loads(serialized_result.decode('utf-8')), len(serialized_result)
+        except (OSError, ValueError):
+            return None
+
+    def write_disk(self, cache_key, serialized_result):
+        if self.disk_bytes <= 0 or len(serialized_result) > self.disk_bytes:
+            return
+
+        result_path = self.read_disk_path(cache_key)
+        temporary_path = result_path.with_suffix(f'.{os.getpid()}.tmp')
+
+        try:
+            result_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path.write_bytes(serialized_result)
+            os.replace(temporary_path, result_path)
+        except OSError:
+            return
+
+        if self.disk_size is None:
+            self.disk_size = self.measure_disk_size()
+            if shared_state is not None:
+                shared_state.set_counter(DISK_SIZE_COUNTER, self.disk_size)
+        elif shared_state is not None:
+            # 같은 cache 디렉터리에 여러 worker가 쓰므로 크기는 worker 전체 합으로 센다.
+            self.disk_size = shared_state.add_counter(DISK_SIZE_COUNTER, len(serialized_result))
+        else:
+            self.disk_size += len(serialized_result)
+
+        if self.disk_size > self.disk_bytes:
+            self.evict_disk()
+
+    def measure_disk_size(self):
+        return sum(file_size for _, file_size, _ in self.list_disk_files())
+
+    def list_disk_files(self):
+        disk_files = []
+        for result_path in self.cache_dir.glob('*/*.json'):
+            try:
+                file_stat = result_path.stat()
+            except OSError:
+                continue
+            disk_files.append((result_path, file_stat.st_size, file_stat.st_mtime))
+
+        return disk_files
+
+    def evict_disk(self):
+        disk_files = sorted(self.list_disk_files(), key=lambda disk_file: disk_file[2])
+        self.disk_size = sum(file_size for _, file_size, _ in disk_files)
+
+        for result_path, file_size, stored_at in disk_files:
+            if self.disk_size <= self.disk_bytes and not self.is_expired(stored_at):
+                break
+
+            if self.remove_disk_file(result_path):
+                self.disk_size -= file_size
+                self.stats['diskEvictions'] += 1
+
+        if shared_state is not None:
+            shared_state.set_counter(DISK_SIZE_COUNTER, self.disk_size)
+
+    def remove_disk_file(self, result_path):
+        try:
+            result_path.unlink()
+            return True
+        except OSError:
+            return False
+
+    def is_expired(self, stored_at):
+        return self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds
+
+    def clear(self):
+        self.memory_items.clear()
+        self.memory_size = 0
+        for result_path, _, _ in self.list_disk_files():
+            self.remove_disk_file(result_path)
+        self.disk_size = 0
+        if shared_state is not None:
+            shared_state.set_counter(DISK_SIZE_COUNTER, 0)
+
+    def read_stats(self):
+        lookups = self.stats['memoryHits'] + self.stats['diskHits'] + self.stats['misses']
+        hits = self.stats['memoryHits'] + self.stats['diskHits']
+
+        return {
+            'enabled': self.enabled,
+            **self.stats,
+            'hitRate': hits / lookups if lookups else 0.0,
+            'memoryEntries': len(self.memory_items),
+            'memoryBytes': self.memory_size,
+            'diskBytes': self.disk_size,
+            'inFlight': len(self.pending_results)
+        }
+
+
+result_cache = ResultCache(
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MEMORY_ENTRIES,
+    RESULT_CACHE_MEMORY_BYTES,
+    RESULT_CACHE_DISK_BYTES,
+    RESULT_CACHE_TTL,
+    enabled=RESULT_CACHE_ENABLED
+)
+
+
+async def read_cached_model_response(model_name, image_bytes, model_options, request_model, bypass_cache=False, image_hash=None):
+    # 같은 이미지를 여러 모델에 보낼 때는 호출하는 쪽에서 hash를 한 번만 계산해 넘긴다.
+    cache_key = build_result_cache_key(model_name, image_hash or hash_image_bytes(image_bytes), model_options)
+    return await result_cache.get_or_compute(cache_key, request_model, bypass_cache=bypass_cache)
+
+
+async def read_stored_model_response(model_name, image_bytes, model_options, image_hash=None):
+    cache_key = build_result_cache_key(model_name, image_hash or hash_image_bytes(image_bytes), model_options)
+    return await result_cache.read(cache_key)
+
+
+async def store_model_response(model_name, image_bytes, model_options, model_response, image_hash=None):
+    if not result_cache.enabled:
+        return
+
+    cache_key = build_result_cache_key(model_name, image_hash or hash_image_bytes(image_bytes), model_options)
+    await result_cache.store(cache_key, model_response)
+
+
+def is_cache_bypass_requested(form):
+    return str(form.get('noCache', '')).lower() == 'true'
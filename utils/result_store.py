@@ -0,0 +1,502 @@
+import hashlib
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from config import (
+    RESULT_STORE_DIR,
+    RESULT_STORE_ENABLED,
+    RESULT_STORE_QUEUE_SIZE,
+    RESULT_STORE_RETENTION_DAYS,
+)
+from utils.responses import dump_json_bytes
+from utils.result_cache import hash_image_bytes
+
+RESULT_STORE_FILENAME = 'results.sqlite3'
+RESULT_STORE_BATCH_SIZE = 64
+RESULT_STORE_RETENTION_INTERVAL = 600
+RESULT_STORE_DELETE_BATCH_SIZE = 500
+RESULT_STORE_BUSY_TIMEOUT_MS = 10000
+RESULT_SEARCH_MAX_LIMIT = 500
+# box_area는 정수 R*Tree라서 0~1 좌표를 이 배율로 곱해 넣는다.
+REGION_SCALE = 10000
+# 영역만으로 찾을 때 최근 box id 구간부터 이 크기(limit 배수)로 보고, 모자라면 구간을 4배씩 넓힌다.
+REGION_SEARCH_WINDOW = 256
+
+# boxes가 원본이고 box_text(FTS5)와 box_area(R*Tree)는 boxes.id를 rowid로 쓰는 색인이다.
+# box_area 좌표는 page 크기로 나눈 0~1 값이라 크기가 다른 page끼리도 같은 영역으로 찾을 수 있다.
+# R*Tree는 id 순서로 읽을 수 없으므로 box id를 한 차원(seq)으로 더 넣어 최근 구간만 잘라 볼 수 있게 한다.
+RESULT_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    filename TEXT,
+    width INTEGER,
+    height INTEGER,
+    box_count INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    result BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    UNIQUE (image_hash, model)
+);
+CREATE INDEX IF NOT EXISTS results_model ON results (model);
+CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at);
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    result_id INTEGER NOT NULL,
+    box_index INTEGER NOT NULL,
+    box_id TEXT,
+    type TEXT NOT NULL,
+    text TEXT NOT NULL,
+    confidence REAL,
+    x0 REAL,
+    y0 REAL,
+    x1 REAL,
+    y1 REAL
+);
+CREATE INDEX IF NOT EXISTS boxes_result ON boxes (result_id);
+CREATE INDEX IF NOT EXISTS boxes_type ON boxes (type);
+CREATE VIRTUAL TABLE IF NOT EXISTS box_text USING fts5(
+    text,
+    content='boxes',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS box_area USING rtree_i32(id, left, right, top, bottom, first_seq, last_seq);
+CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+    DELETE FROM boxes WHERE result_id = old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS boxes_insert AFTER INSERT ON boxes BEGIN
+    INSERT INTO box_text (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS boxes_delete AFTER DELETE ON boxes BEGIN
+    INSERT INTO box_text (box_text, rowid, text) VALUES ('delete', old.id, old.text);
+    DELETE FROM box_area WHERE id = old.id;
+END;
+'''
+
+SEARCH_COLUMNS = (
+    'b.id, b.box_id, b.type, b.text, b.confidence, b.x0, b.y0, b.x1, b.y1, '
+    'r.image_hash, r.model, r.filename, r.width, r.height, r.stored_at'
+)
+
+
+class ResultSearchError(ValueError):
+    status_code = 400
+
+
+class LabelingResultStore:
+    """정규화한 labeling 결과를 이미지 hash와 모델별로 SQLite 파일 하나에 쌓아 둔다.
+
+    요청 처리 중에는 queue에 넣기만 하고, background thread가 여러 건을 transaction 하나로 쓴다.
+    같은 이미지와 모델이 다시 들어오면 결과가 바뀐 경우에만 box를 다시 쓴다.
+    """
+
+    def __init__(self, store_dir, retention_days, queue_size, enabled=True):
+        self.store_path = Path(store_dir) / RESULT_STORE_FILENAME
+        self.retention_days = retention_days
+        self.enabled = enabled
+        self.pending_records = queue.Queue(maxsize=queue_size)
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.readers = threading.local()
+        self.last_retention_at = 0.0
+        self.stats = {'stored': 0, 'unchanged': 0, 'dropped': 0, 'failed': 0, 'expired': 0}
+
+    def record(self, model_name, image_filename, image_bytes, labeling_result, image_hash=None):
+        if not self.enabled or not isinstance(labeling_result, dict):
+            return False
+
+        self.start_worker()
+        # 호출하는 쪽은 cache key를 만들 때 구한 hash를 넘긴다. 없을 때만 background thread에서 계산한다.
+        stored_record = (model_name, image_filename, image_hash, None if image_hash else image_bytes, labeling_result)
+        try:
+            self.pending_records.put_nowait(stored_record)
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def start_worker(self):
+        with self.worker_lock:
+            if self.worker is not None and self.worker.is_alive():
+                return
+
+            self.worker = threading.Thread(target=self.run_worker, name='labeling-result-store', daemon=True)
+            self.worker.start()
+
+    def connect(self):
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.store_path, isolation_level=None, check_same_thread=False)
+        connection.execute(f'PRAGMA busy_timeout = {RESULT_STORE_BUSY_TIMEOUT_MS}')
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute('PRAGMA synchronous = NORMAL')
+        connection.executescript(RESULT_STORE_SCHEMA)
+        return connection
+
+    def read_connection(self):
+        # 조회 endpoint는 threadpool에서 돌기 때문에 thread마다 읽기 connection을 따로 연다.
+        # gunicorn preload 뒤 fork된 worker는 부모의 connection을 쓰지 않는다.
+        if getattr(self.readers, 'pid', None) != os.getpid():
+            self.readers.connection = self.connect()
+            self.readers.pid = os.getpid()
+
+        return self.readers.connection
+
+    def run_worker(self):
+        connection = self.connect()
+        try:
+            while True:
+                stored_record = self.pending_records.get()
+                if stored_record is None:
+                    return
+
+                stored_records = [stored_record]
+                while len(stored_records) < RESULT_STORE_BATCH_SIZE:
+                    try:
+                        stored_record = self.pending_records.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    if stored_record is None:
+                        self.write_records(connection, stored_records)
+                        return
+                    stored_records.append(stored_record)
+
+                self.write_records(connection, stored_records)
+        finally:
+            connection.close()
+
+    def write_records(self, connection, stored_records):
+        try:
+            # 여러 worker가 같은 파일에 쓰므로 처음부터 write lock을 잡아 box id를 겹치지 않게 정한다.
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for stored_record in stored_records:
+                    # 결과 하나가 잘못돼도 같은 batch의 다른 결과는 남도록 결과마다 savepoint를 둔다.
+                    connection.execute('SAVEPOINT stored_record')
+                    try:
+                        self.write_record(connection, *stored_record)
+                    except (sqlite3.Error, AttributeError, TypeError, ValueError):
+                        connection.execute('ROLLBACK TO stored_record')
+                        self.stats['failed'] += 1
+                    connection.execute('RELEASE stored_record')
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except (sqlite3.Error, TypeError, ValueError):
+            self.stats['failed'] += len(stored_records)
+            return
+
+        if self.retention_days > 0 and time.monotonic() - self.last_retention_at >= RESULT_STORE_RETENTION_INTERVAL:
+            self.apply_retention(connection)
+
+    def write_record(self, connection, model_name, image_filename, image_hash, image_bytes, labeling_result):
+        image_hash = image_hash or hash_image_bytes(image_bytes)
+        result_bytes = dump_json_bytes(labeling_result)
+        result_digest = hashlib.blake2b(result_bytes, digest_size=16).digest()
+        stored_at = time.time()
+
+        existing_row = connection.execute(
+            'SELECT id, digest FROM results WHERE image_hash = ? AND model = ?',
+            (image_hash, model_name)
+        ).fetchone()
+        if existing_row is not None and existing_row[1] == result_digest:
+            # cache hit처럼 같은 결과가 다시 들어오면 box 색인은 그대로 두고 시간만 바꾼다.
+            connection.execute('UPDATE results SET stored_at = ? WHERE id = ?', (stored_at, existing_row[0]))
+            self.stats['unchanged'] += 1
+            return
+        if existing_row is not None:
+            connection.execute('DELETE FROM results WHERE id = ?', (existing_row[0],))
+
+        image_info = labeling_result.get('image') or {}
+        image_width, image_height = image_info.get('width'), image_info.get('height')
+        box_rows = read_box_rows(labeling_result)
+        result_id = connection.execute(
+            'INSERT INTO results (image_hash, model, filename, width, height, box_count, digest, result, stored_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                image_hash,
+                model_name,
+                image_info.get('filename') or image_filename,
+                image_width,
+                image_height,
+                len(box_rows),
+                result_digest,
+                zlib.compress(result_bytes, 6),
+                stored_at
+            )
+        ).lastrowid
+
+        first_box_id = connection.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM boxes').fetchone()[0]
+        connection.executemany(
+            'INSERT INTO boxes (id, result_id, box_index, box_id, type, text, confidence, x0, y0, x1, y1) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(first_box_id + box_index, result_id, box_index, *box_row) for box_index, box_row in enumerate(box_rows)]
+        )
+
+        if image_width and image_height:
+            connection.executemany(
+                'INSERT INTO box_area (id, left, right, top, bottom, first_seq, last_seq) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (
+                        first_box_id + box_index,
+                        math.floor(box_row[4] * REGION_SCALE / image_width),
+                        math.ceil(box_row[6] * REGION_SCALE / image_width),
+                        math.floor(box_row[5] * REGION_SCALE / image_height),
+                        math.ceil(box_row[7] * REGION_SCALE / image_height),
+                        first_box_id + box_index,
+                        first_box_id + box_index
+                    )
+                    for box_index, box_row in enumerate(box_rows)
+                    if box_row[4] is not None
+                ]
+            )
+        self.stats['stored'] += 1
+
+    def apply_retention(self, connection):
+        self.last_retention_at = time.monotonic()
+        expire_before = time.time() - self.retention_days * 24 * 60 * 60
+
+        # box가 많은 결과를 한 번에 지우면 다른 worker의 쓰기가 오래 막히므로 조금씩 나눠 지운다.
+        while True:
+            try:
+                deleted_count = connection.execute(
+                    'DELETE FROM results WHERE id IN (SELECT id FROM results WHERE stored_at < ? LIMIT ?)',
+                    (expire_before, RESULT_STORE_DELETE_BATCH_SIZE)
+                ).rowcount
+            except sqlite3.Error:
+                return
+
+            self.stats['expired'] += max(0, deleted_count)
+            if deleted_count < RESULT_STORE_DELETE_BATCH_SIZE:
+                return
+
+    def search(self, text=None, box_type=None, model_name=None, region=None, before=None, limit=50):
+        """box를 최근에 저장된 순서로 찾는다.
+
+        text는 공백으로 나눈 단어가 모두 box text의 단어 앞부분과 맞아야 하고,
+        region은 page 크기 기준 0~1 좌표 (left, top, right, bottom)이며 그 영역과 겹치는 box를 찾는다.
+        before는 이전 응답의 nextCursor로, 그보다 먼저 저장된 box부터 이어서 찾는다.
+        """
+        conditions, parameters = [], []
+        if box_type:
+            conditions.append('b.type = ?')
+            parameters.append(box_type)
+        if model_name:
+            conditions.append('r.model = ?')
+            parameters.append(model_name)
+
+        connection = self.read_connection()
+        text_query = build_text_query(text) if text else None
+        if region is not None:
+            # 단어 색인이나 type 색인이 있으면 id 역순으로 읽으면서 영역을 거른다.
+            # R*Tree로 찾을 때도 정수로 반올림한 경계에 걸친 box를 빼려고 같은 조건을 한 번 더 본다.
+            conditions.append('b.x1 >= ? * r.width AND b.x0 <= ? * r.width AND b.y1 >= ? * r.height AND b.y0 <= ? * r.height')
+            parameters.extend((region[0], region[2], region[1], region[3]))
+
+        if text_query:
+            conditions.append('box_text MATCH ?')
+            parameters.append(text_query)
+            search_rows = self.read_search_rows(
+                connection,
+                'box_text JOIN boxes b ON b.id = box_text.rowid JOIN results r ON r.id = b.result_id',
+                'box_text.rowid',
+                conditions,
+                parameters,
+                before,
+                limit
+            )
+        elif region is not None and not box_type:
+            search_rows = self.read_region_rows(connection, region, conditions, parameters, before, limit)
+        else:
+            search_rows = self.read_search_rows(
+                connection,
+                'boxes b JOIN results r ON r.id = b.result_id',
+                'b.id',
+                conditions,
+                parameters,
+                before,
+                limit
+            )
+
+        return {
+            'boxes': [build_search_hit(search_row) for search_row in search_rows],
+            'nextCursor': search_rows[-1][0] if len(search_rows) == limit else None
+        }
+
+    def read_search_rows(self, connection, source, order_column, conditions, parameters, before, limit):
+        if before is not None:
+            conditions = [*conditions, f'{order_column} < ?']
+            parameters = [*parameters, before]
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        search_sql = f'SELECT {SEARCH_COLUMNS} FROM {source} {where_clause} ORDER BY {order_column} DESC LIMIT ?'
+        try:
+            return connection.execute(search_sql, [*parameters, limit]).fetchall()
+        except sqlite3.OperationalError as error:
+            raise ResultSearchError(f'검색어를 해석할 수 없습니다: {error}') from error
+
+    def read_region_rows(self, connection, region, conditions, parameters, before, limit):
+        # 영역에 걸친 box를 모두 꺼내 정렬하면 저장된 box 수만큼 느려지므로,
+        # 가장 최근 id 구간부터 R*Tree로 찾고 limit을 못 채우면 더 오래된 구간으로 넓혀 간다.
+        upper_seq = before - 1 if before is not None else connection.execute('SELECT COALESCE(MAX(id), 0) FROM boxes').fetchone()[0]
+        window_size = limit * REGION_SEARCH_WINDOW
+        region_parameters = [round(coordinate * REGION_SCALE) for coordinate in region]
+        region_conditions = [
+            'a.right >= ? AND a.left <= ? AND a.bottom >= ? AND a.top <= ?',
+            'a.first_seq <= ? AND a.last_seq >= ?',
+            *conditions
+        ]
+
+        search_rows = []
+        while upper_seq >= 1 and len(search_rows) < limit:
+            lower_seq = max(1, upper_seq - window_size + 1)
+            search_rows.extend(self.read_search_rows(
+                connection,
+                'box_area a JOIN boxes b ON b.id = a.id JOIN results r ON r.id = b.result_id',
+                'a.id',
+                region_conditions,
+                [region_parameters[0], region_parameters[2], region_parameters[1], region_parameters[3], upper_seq, lower_seq, *parameters],
+                None,
+                limit - len(search_rows)
+            ))
+            upper_seq = lower_seq - 1
+            window_size *= 4
+
+        return search_rows
+
+    def read_results(self, image_hash, model_name=None):
+        result_sql = 'SELECT model, stored_at, result FROM results WHERE image_hash = ?'
+        parameters = [image_hash]
+        if model_name:
+            result_sql += ' AND model = ?'
+            parameters.append(model_name)
+
+        result_rows = self.read_connection().execute(f'{result_sql} ORDER BY model', parameters).fetchall()
+        return [
+            {
+                'model': stored_model,
+                'storedAt': stored_at,
+                'result': json.loads(zlib.decompress(result_blob))
+            }
+            for stored_model, stored_at, result_blob in result_rows
+        ]
+
+    def close(self, timeout=5.0):
+        with self.worker_lock:
+            worker = self.worker
+            self.worker = None
+
+        if worker is None or not worker.is_alive():
+            return
+
+        try:
+            self.pending_records.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        worker.join(timeout)
+
+    def read_stats(self):
+        model_counts = {}
+        if self.enabled and self.store_path.exists():
+            model_counts = dict(self.read_connection().execute(
+                'SELECT model, COUNT(*) FROM results GROUP BY model'
+            ).fetchall())
+
+        try:
+            store_bytes = sum(
+                store_file.stat().st_size
+                for store_file in self.store_path.parent.glob(f'{RESULT_STORE_FILENAME}*')
+            )
+        except OSError:
+            store_bytes = None
+
+        return {
+            'enabled': self.enabled,
+            'queued': self.pending_records.qsize(),
+            **self.stats,
+            'results': sum(model_counts.values()),
+            'models': model_counts,
+            'storeBytes': store_bytes
+        }
+
+
+def read_box_rows(labeling_result):
+    box_rows = []
+    for labeling_box in labeling_result.get('boxes') or ():
+        if not isinstance(labeling_box, dict):
+            continue
+
+        box_rows.append((
+            labeling_box.get('id'),
+            labeling_box.get('type') or 'text',
+            str(labeling_box.get('text') or ''),
+            labeling_box.get('confidence'),
+            *read_box_bbox(labeling_box.get('bbox'))
+        ))
+
+    # key-value 결과는 위치가 없으므로 key 이름만 text로 색인한다.
+    for key_name in labeling_result.get('keys') or ():
+        box_rows.append((None, 'key', str(key_name), None, None, None, None, None))
+
+    return box_rows
+
+
+def read_box_bbox(bbox):
+    # 좌표가 네 개의 유한한 숫자가 아니면 위치 없이 text만 색인한다. R*Tree는 left <= right여야 한다.
+    try:
+        x0, y0, x1, y1 = (float(coordinate) for coordinate in bbox[:4])
+    except (TypeError, ValueError):
+        return None, None, None, None
+
+    if not all(math.isfinite(coordinate) for coordinate in (x0, y0, x1, y1)):
+        return None, None, None, None
+
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def build_text_query(text):
+    # 입력을 FTS5 문법으로 해석하지 않도록 단어마다 따옴표로 감싸고 앞부분 일치(*)로 찾는다.
+    # 한국어는 조사가 붙어 있어서 "서울"로 "서울시에서"를 찾을 수 있어야 한다.
+    query_terms = [query_term.replace('"', '""') for query_term in str(text).split()]
+    return ' '.join(f'"{query_term}"*' for query_term in query_terms)
+
+
+def build_search_hit(search_row):
+    box_row_id, box_id, box_type, box_text, confidence, x0, y0, x1, y1, image_hash, model_name, filename, width, height, stored_at = search_row
+    return {
+        'imageHash': image_hash,
+        'model': model_name,
+        'filename': filename,
+        'image': {'width': width, 'height': height},
+        'storedAt': stored_at,
+        'box': {
+            'id': box_id,
+            'type': box_type,
+            'text': box_text,
+            'confidence': confidence,
+            'bbox': [x0, y0, x1, y1] if x0 is not None else None
+        }
+    }
+
+
+labeling_result_store = LabelingResultStore(
+    RESULT_STORE_DIR,
+    RESULT_STORE_RETENTION_DAYS,
+    RESULT_STORE_QUEUE_SIZE,
+    enabled=RESULT_STORE_ENABLED
+)
+
+
+def record_labeling_result(model_name, image_filename, image_bytes, labeling_result, image_hash=None):
+    return labeling_result_store.record(model_name, image_filename, image_bytes, labeling_result, image_hash)
@@ -0,0 +1,423 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import SHARED_STATE_DIR, SHARED_STATE_ENABLED
+
+SHARED_STATE_FILENAME = 'shared_state.sqlite3'
+# 다른 worker가 자리를 비울 때까지 다시 확인하는 간격
+SHARED_STATE_POLL_INTERVAL = 0.05
+SHARED_STATE_BUSY_TIMEOUT_MS = 5000
+
+SHARED_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS claims (
+    name TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signals (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admission_slots (
+    model TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    running INTEGER NOT NULL,
+    PRIMARY KEY (model, pid)
+);
+CREATE TABLE IF NOT EXISTS gpu_owners (
+    gpu TEXT PRIMARY KEY,
+    model TEXT,
+    loaded INTEGER NOT NULL DEFAULT 0,
+    switching_pid INTEGER
+);
+CREATE TABLE IF NOT EXISTS gpu_waiters (
+    gpu TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    grants INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS model_leases (
+    model TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    in_flight INTEGER NOT NULL,
+    PRIMARY KEY (model, pid)
+);
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    pid INTEGER PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+'''
+PROCESS_TABLES = ('claims', 'admission_slots', 'gpu_waiters', 'model_leases', 'metric_snapshots')
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class SharedStateStore:
+    """여러 worker process가 함께 보는 상태를 local SQLite(WAL) 파일 하나에 둔다.
+
+    worker마다 connection을 하나 열고, 읽고 고치는 작업은 짧은 BEGIN IMMEDIATE transaction으로 묶는다.
+    다른 worker가 write lock을 잡고 있으면 busy_timeout만큼 기다릴 수 있으므로, 요청 경로에서는 run/submit으로
+    전용 thread에서 실행한다.
+    상태는 서버가 떠 있는 동안만 의미가 있으므로 master가 시작할 때 지우고, worker가 죽으면 그 pid의 행을 지운다.
+    """
+
+    def __init__(self, state_dir):
+        self.state_path = Path(state_dir) / SHARED_STATE_FILENAME
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+
+    def connect(self):
+        # preload한 master에서 fork된 worker는 부모의 connection을 쓰면 안 되므로 pid가 바뀌면 새로 연다.
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.state_path, isolation_level=None, check_same_thread=False)
+            connection.execute(f'PRAGMA busy_timeout = {SHARED_STATE_BUSY_TIMEOUT_MS}')
+            connection.execute('PRAGMA journal_mode = WAL')
+            # 재시작하면 버리는 상태이므로 fsync를 기다리지 않는다.
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.executescript(SHARED_STATE_SCHEMA)
+            self.connection = connection
+            self.connection_pid = os.getpid()
+
+        return self.connection
+
+    def read_executor(self):
+        # thread 하나에서 차례로 실행하므로, 기다리지 않고 넘긴 쓰기도 뒤에 넘긴 transaction보다 먼저 반영된다.
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shared-state')
+            self.executor_pid = os.getpid()
+
+        return self.executor
+
+    async def run(self, method, *args, undo=None):
+        """method를 전용 thread에서 실행하고 결과를 기다린다.
+
+        기다리던 task가 취소돼도 이미 넘긴 transaction은 끝까지 실행되므로, undo가 있으면 그 결과로 되돌린다.
+        """
+        state_future = asyncio.get_running_loop().run_in_executor(self.read_executor(), method, *args)
+        try:
+            return await asyncio.shield(state_future)
+        except asyncio.CancelledError:
+            if undo is not None:
+                state_future.add_done_callback(lambda finished_future: self.undo_finished_call(finished_future, undo))
+            raise
+
+    def undo_finished_call(self, finished_future, undo):
+        if not finished_future.cancelled() and finished_future.exception() is None:
+            self.submit(undo, finished_future.result())
+
+    def submit(self, method, *args):
+        # 결과를 기다리지 않는 쓰기(자리 반납 등)는 넘기기만 한다.
+        return self.read_executor().submit(method, *args)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            else:
+                connection.execute('COMMIT')
+
+    def close(self):
+        # 아직 넘기지 못한 쓰기를 마저 반영한 뒤 닫는다.
+        if self.executor is not None and self.executor_pid == os.getpid():
+            self.executor.shutdown(wait=True)
+        self.executor = None
+
+        with self.lock:
+            if self.connection is not None and self.connection_pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+
+    def reset(self):
+        self.close()
+        with self.lock:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.unlink(f'{self.state_path}{suffix}')
+                except FileNotFoundError:
+                    pass
+
+    def clear_process(self, pid):
+        with self.transaction() as connection:
+            self.delete_process_rows(connection, pid)
+
+    def delete_process_rows(self, connection, pid):
+        for table_name in PROCESS_TABLES:
+            connection.execute(f'DELETE FROM {table_name} WHERE pid = ?', (pid,))
+        connection.execute('UPDATE gpu_owners SET switching_pid = NULL WHERE switching_pid = ?', (pid,))
+
+    def purge_dead_processes(self, connection):
+        # child_exit hook 없이 죽은 worker(SIGKILL 등)가 잡고 있던 자리를 정리한다.
+        process_ids = set()
+        for table_name in PROCESS_TABLES:
+            process_ids.update(pid for pid, in connection.execute(f'SELECT DISTINCT pid FROM {table_name}'))
+        process_ids.update(
+            pid for pid, in connection.execute('SELECT switching_pid FROM gpu_owners WHERE switching_pid IS NOT NULL')
+        )
+
+        dead_process_ids = [pid for pid in process_ids if not is_process_alive(pid)]
+        for pid in dead_process_ids:
+            self.delete_process_rows(connection, pid)
+
+        return bool(dead_process_ids)
+
+    # claim: 이름 하나를 한 worker만 잡는다 (배치 작업 실행, 같은 cache key 계산).
+
+    def claim(self, name):
+        with self.transaction() as connection:
+            owner_row = connection.execute('SELECT pid FROM claims WHERE name = ?', (name,)).fetchone()
+            if owner_row is not None and owner_row[0] != os.getpid() and is_process_alive(owner_row[0]):
+                return False
+
+            connection.execute('INSERT OR REPLACE INTO claims (name, pid) VALUES (?, ?)', (name, os.getpid()))
+            return True
+
+    def release_claim(self, name):
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM claims WHERE name = ? AND pid = ?', (name, os.getpid()))
+
+    def read_claim_owner(self, name):
+        with self.lock:
+            owner_row = self.connect().execute('SELECT pid FROM claims WHERE name = ?', (name,)).fetchone()
+
+        if owner_row is None or not is_process_alive(owner_row[0]):
+            return None
+        return owner_row[0]
+
+    # signal: 다른 worker가 잡은 작업에 멈추라고 알린다.
+
+    def send_signal(self, name):
+        with self.transaction() as connection:
+            connection.execute('INSERT OR IGNORE INTO signals (name) VALUES (?)', (name,))
+
+    def consume_signal(self, name):
+        with self.transaction() as connection:
+            return connection.execute('DELETE FROM signals WHERE name = ?', (name,)).rowcount > 0
+
+    # counter: worker 전체에서 하나로 세는 값
+
+    def add_counter(self, name, amount):
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                (name, amount)
+            )
+            return connection.execute('SELECT value FROM counters WHERE name = ?', (name,)).fetchone()[0]
+
+    def set_counter(self, name, value):
+        with self.transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)', (name, value))
+
+    # admission slot: 모델별 동시 실행 수를 worker 전체 기준으로 센다.
+
+    def acquire_slot(self, model_name, limit):
+        # 자리를 잡았는지와 함께 모든 worker의 사용 수를 돌려준다.
+        with self.transaction() as connection:
+            running = self.count_running(connection, model_name)
+            if running >= limit and self.purge_dead_processes(connection):
+                running = self.count_running(connection, model_name)
+            if running >= limit:
+                return False, running
+
+            connection.execute(
+                'INSERT INTO admission_slots (model, pid, running) VALUES (?, ?, 1) '
+                'ON CONFLICT(model, pid) DO UPDATE SET running = running + 1',
+                (model_name, os.getpid())
+            )
+            return True, running + 1
+
+    def release_slot(self, model_name):
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE admission_slots SET running = running - 1 WHERE model = ? AND pid = ? AND running > 0',
+                (model_name, os.getpid())
+            )
+
+    def read_running(self, model_name):
+        with self.lock:
+            return self.count_running(self.connect(), model_name)
+
+    def read_running_counts(self):
+        with self.lock:
+            return dict(self.connect().execute('SELECT model, SUM(running) FROM admission_slots GROUP BY model').fetchall())
+
+    def count_running(self, connection, model_name):
+        return connection.execute('SELECT COALESCE(SUM(running), 0) FROM admission_slots WHERE model = ?', (model_name,)).fetchone()[0]
+
+    # GPU owner: GPU마다 올라와 있는 모델 하나를 worker 전체 기준으로 정한다.
+
+    def enter_gpu(self, gpu_name, model_name, max_consecutive=0):
+        """모델이 GPU를 쓸 수 있으면 (cold 여부, 먼저 내려야 할 모델 이름)을, 다른 worker가 쓰는 중이면 None을 돌려준다.
+
+        들어가지 못한 모델은 GPU마다 하나인 대기 기록에 이름을 올린다. 다른 모델이 기다리는 동안에는 지금 모델을
+        max_consecutive번까지만 더 들여보내, 한 worker가 같은 모델을 계속 보내도 기다리는 worker가 차례를 받는다.
+        """
+        with self.transaction() as connection:
+            owner_model, is_loaded, switching_pid = self.read_gpu_owner(connection, gpu_name)
+            waiting_model, waiting_grants = self.read_gpu_waiter(connection, gpu_name)
+            if switching_pid is not None and switching_pid != os.getpid():
+                if is_process_alive(switching_pid):
+                    self.wait_gpu(connection, gpu_name, model_name)
+                    return None
+                switching_pid = None
+
+            if waiting_model not in (None, model_name):
+                if owner_model != model_name or waiting_grants >= max_consecutive:
+                    return None
+                connection.execute('UPDATE gpu_waiters SET grants = grants + 1 WHERE gpu = ?', (gpu_name,))
+
+            if owner_model is not None and owner_model != model_name and self.count_in_flight(connection, owner_model):
+                if not self.purge_dead_processes(connection) or self.count_in_flight(connection, owner_model):
+                    self.wait_gpu(connection, gpu_name, model_name)
+                    return None
+
+            if waiting_model == model_name:
+                connection.execute('DELETE FROM gpu_waiters WHERE gpu = ?', (gpu_name,))
+            release_model_name = owner_model if owner_model not in (None, model_name) and is_loaded else None
+            is_cold = owner_model != model_name or not is_loaded
+            connection.execute(
+                'INSERT OR REPLACE INTO gpu_owners (gpu, model, loaded, switching_pid) VALUES (?, ?, 1, ?)',
+                (gpu_name, model_name, os.getpid() if release_model_name else switching_pid)
+            )
+            connection.execute(
+                'INSERT INTO model_leases (model, pid, in_flight) VALUES (?, ?, 1) '
+                'ON CONFLICT(model, pid) DO UPDATE SET in_flight = in_flight + 1',
+                (model_name, os.getpid())
+            )
+            return is_cold, release_model_name
+
+    def wait_gpu(self, connection, gpu_name, model_name):
+        # 먼저 기다리기 시작한 모델이 다음 차례를 갖는다.
+        connection.execute(
+            'INSERT OR IGNORE INTO gpu_waiters (gpu, model, pid, grants) VALUES (?, ?, ?, 0)',
+            (gpu_name, model_name, os.getpid())
+        )
+
+    def stop_waiting_gpu(self, gpu_name):
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM gpu_waiters WHERE gpu = ? AND pid = ?', (gpu_name, os.getpid()))
+
+    def read_gpu_waiter(self, connection, gpu_name):
+        waiter_row = connection.execute('SELECT model, pid, grants FROM gpu_waiters WHERE gpu = ?', (gpu_name,)).fetchone()
+        if waiter_row is None:
+            return None, 0
+        if waiter_row[1] != os.getpid() and not is_process_alive(waiter_row[1]):
+            connection.execute('DELETE FROM gpu_waiters WHERE gpu = ?', (gpu_name,))
+            return None, 0
+
+        return waiter_row[0], waiter_row[2]
+
+    def finish_switch(self, gpu_name):
+        with self.transaction() as connection:
+            connection.execute('UPDATE gpu_owners SET switching_pid = NULL WHERE gpu = ? AND switching_pid = ?', (gpu_name, os.getpid()))
+
+    def leave_gpu(self, model_name):
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE model_leases SET in_flight = in_flight - 1 WHERE model = ? AND pid = ? AND in_flight > 0',
+                (model_name, os.getpid())
+            )
+
+    def mark_unloaded(self, gpu_name, model_name):
+        with self.transaction() as connection:
+            connection.execute('UPDATE gpu_owners SET loaded = 0 WHERE gpu = ? AND model = ?', (gpu_name, model_name))
+
+    def begin_release(self, gpu_name, model_name, other_workers_only=False):
+        # 다른 worker가 아직 이 모델로 추론 중이거나 이미 다른 모델로 바뀌었으면 내리지 않는다.
+        # 오류로 내릴 때는 실패한 요청 자신도 아직 자리를 잡고 있으므로 이 worker의 사용 수는 세지 않는다.
+        with self.transaction() as connection:
+            owner_model, is_loaded, switching_pid = self.read_gpu_owner(connection, gpu_name)
+            if owner_model != model_name or not is_loaded:
+                return False
+            if switching_pid is not None and switching_pid != os.getpid() and is_process_alive(switching_pid):
+                return False
+            if self.count_in_flight(connection, model_name, os.getpid() if other_workers_only else None):
+                return False
+
+            connection.execute('UPDATE gpu_owners SET switching_pid = ? WHERE gpu = ?', (os.getpid(), gpu_name))
+            return True
+
+    def finish_release(self, gpu_name, model_name):
+        with self.transaction() as connection:
+            connection.execute(
+                'UPDATE gpu_owners SET model = NULL, loaded = 0, switching_pid = NULL WHERE gpu = ? AND model = ? AND switching_pid = ?',
+                (gpu_name, model_name, os.getpid())
+            )
+
+    def read_gpu_owner(self, connection, gpu_name):
+        owner_row = connection.execute('SELECT model, loaded, switching_pid FROM gpu_owners WHERE gpu = ?', (gpu_name,)).fetchone()
+        return owner_row or (None, 0, None)
+
+    def count_in_flight(self, connection, model_name, excluded_pid=None):
+        return connection.execute(
+            'SELECT COALESCE(SUM(in_flight), 0) FROM model_leases WHERE model = ? AND pid IS NOT ?',
+            (model_name, excluded_pid)
+        ).fetchone()[0]
+
+    # metrics: worker마다 자기 값을 써 두고 /metrics를 받은 worker가 합친다.
+
+    def write_metrics(self, metric_snapshot):
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO metric_snapshots (pid, updated_at, payload) VALUES (?, ?, ?)',
+                (os.getpid(), time.time(), json.dumps(metric_snapshot, separators=(',', ':')))
+            )
+
+    def read_metrics(self):
+        with self.lock:
+            snapshot_rows = self.connect().execute('SELECT payload FROM metric_snapshots').fetchall()
+
+        return [json.loads(payload) for payload, in snapshot_rows]
+
+    def read_stats(self):
+        with self.lock:
+            connection = self.connect()
+            return {
+                'enabled': True,
+                'pid': os.getpid(),
+                'path': str(self.state_path),
+                'workers': [pid for pid, in connection.execute('SELECT pid FROM metric_snapshots ORDER BY pid')],
+                'gpus': {
+                    gpu_name: {'owner': owner_model, 'loaded': bool(is_loaded), 'switchingPid': switching_pid}
+                    for gpu_name, owner_model, is_loaded, switching_pid in connection.execute('SELECT gpu, model, loaded, switching_pid FROM gpu_owners')
+                },
+                'gpuWaiters': {
+                    gpu_name: {'model': model_name, 'pid': pid, 'grants': grants}
+                    for gpu_name, model_name, pid, grants in connection.execute('SELECT gpu, model, pid, grants FROM gpu_waiters')
+                },
+                'inFlight': dict(connection.execute('SELECT model, SUM(in_flight) FROM model_leases GROUP BY model').fetchall()),
+                'admissionRunning': dict(connection.execute('SELECT model, SUM(running) FROM admission_slots GROUP BY model').fetchall()),
+                'claims': connection.execute('SELECT COUNT(*) FROM claims').fetchone()[0]
+            }
+
+
+# worker가 하나면 process 안의 상태만으로 충분하므로 만들지 않는다.
+shared_state = SharedStateStore(SHARED_STATE_DIR) if SHARED_STATE_ENABLED else None
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+from config import (
+    IMAGE_MAX_PIXELS,
+    KEYVALUE_TEMPLATE_DIR,
+    KEYVALUE_TEMPLATE_ENABLED,
+    KEYVALUE_TEMPLATE_MAX_TEMPLATES,
+    KEYVALUE_TEMPLATE_MIN_SAMPLES,
+    KEYVALUE_TEMPLATE_SIMILARITY,
+    KEYVALUE_TEMPLATE_VERIFY_INTERVAL,
+)
+from utils.metrics import measure_stage, record_template_lookup
+
+TEMPLATE_INDEX_FILENAME = 'templates.sqlite3'
+# 내용 영역을 FINGERPRINT_SIZE x FINGERPRINT_SIZE로 줄인 뒤 가로선/세로선 분포를 잰다.
+FINGERPRINT_SIZE = 256
+# 이 길이(내용 영역 너비/높이의 1/8) 이상 이어진 어두운 pixel만 양식의 선으로 본다. 글자는 단어 사이가 끊겨서 빠진다.
+FINGERPRINT_LINE_LENGTH = FINGERPRINT_SIZE // 8
+# scan마다 선이 몇 pixel씩 밀려도 겹치도록 분포를 gaussian으로 번지게 한다.
+FINGERPRINT_BLUR = 2.0
+# 원본을 이 정도 크기로만 decode해서 내용 영역을 찾는다.
+FINGERPRINT_DECODE_SIDE = 1024
+# 같은 양식이라도 scan 여백 때문에 비율이 조금 달라질 수 있다.
+TEMPLATE_ASPECT_TOLERANCE = 0.05
+
+TEMPLATE_INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    fingerprint BLOB NOT NULL,
+    aspect_ratio REAL NOT NULL,
+    payload TEXT NOT NULL,
+    samples INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS templates_model ON templates (model);
+'''
+
+
+class TemplateFingerprint:
+    def __init__(self, vector, aspect_ratio):
+        self.vector = vector
+        self.aspect_ratio = aspect_ratio
+
+    @classmethod
+    def from_bytes(cls, fingerprint_bytes, aspect_ratio):
+        vector = np.frombuffer(fingerprint_bytes, dtype=np.int8).astype(np.float32)
+        return cls(vector / (np.linalg.norm(vector) or 1.0), aspect_ratio)
+
+    def to_bytes(self):
+        # 단위 vector라 성분이 -1~1이므로 int8로 줄여 저장해도 유사도 차이는 0.01 아래다.
+        return np.round(self.vector * 127).astype(np.int8).tobytes()
+
+    def similarity(self, other_fingerprint):
+        return float(self.vector @ other_fingerprint.vector)
+
+    def has_close_aspect(self, other_fingerprint):
+        return abs(self.aspect_ratio - other_fingerprint.aspect_ratio) <= TEMPLATE_ASPECT_TOLERANCE * other_fingerprint.aspect_ratio
+
+
+def compute_template_fingerprint(image_bytes):
+    """양식의 가로선/세로선이 어느 높이와 위치에 있는지를 vector 하나로 만든다.
+
+    scan마다 다른 여백과 배율은 어두운 내용 영역으로 잘라 맞추고, 칸에 채운 글자는 짧게 끊기므로 선에서 빠진다.
+    같은 양식의 두 문서는 cosine 유사도가 0.9 위, 다른 양식은 0.5 아래로 나온다 (benchmarks/keyvalue_template.py).
+    """
+    PILImage.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS or None
+    with PILImage.open(BytesIO(image_bytes)) as source_image:
+        # JPEG는 draft로 작게 decode해서 큰 scan도 빠르게 줄인다.
+        source_image.draft('L', (FINGERPRINT_DECODE_SIDE, FINGERPRINT_DECODE_SIDE))
+        image = ImageOps.exif_transpose(source_image).convert('L')
+        if max(image.size) > FINGERPRINT_DECODE_SIDE:
+            image.thumbnail((FINGERPRINT_DECODE_SIDE, FINGERPRINT_DECODE_SIDE), PILImage.BOX)
+        aspect_ratio = image.width / max(1, image.height)
+        content_image = image.crop(find_content_box(np.asarray(image))).resize((FINGERPRINT_SIZE, FINGERPRINT_SIZE), PILImage.BOX)
+
+    darkness = 255 - np.asarray(content_image, dtype=np.float32)
+    # 창 안의 가장 밝은 pixel이 어두우면 창 길이만큼 선이 이어진 것이다.
+    row_profile = sliding_window_view(darkness, FINGERPRINT_LINE_LENGTH, axis=1).min(axis=-1).mean(axis=1)
+    column_profile = sliding_window_view(darkness, FINGERPRINT_LINE_LENGTH, axis=0).min(axis=-1).mean(axis=0)
+    vector = np.concatenate([normalize_profile(row_profile), normalize_profile(column_profile)])
+    return TemplateFingerprint(vector / (np.linalg.norm(vector) or 1.0), aspect_ratio)
+
+
+def find_content_box(pixels, dark_level=128, min_dark_share=0.05):
+    # 어두운 pixel이 한 줄의 5% 이상인 첫 줄과 마지막 줄까지를 내용 영역으로 본다. 가는 선도 놓치지 않도록 decode 크기에서 잰다.
+    dark_pixels = pixels < dark_level
+    content_rows = np.flatnonzero(dark_pixels.mean(axis=1) > min_dark_share)
+    content_columns = np.flatnonzero(dark_pixels.mean(axis=0) > min_dark_share)
+    if len(content_rows) < 2 or len(content_columns) < 2:
+        return 0, 0, pixels.shape[1], pixels.shape[0]
+
+    return content_columns[0], content_rows[0], content_columns[-1] + 1, content_rows[-1] + 1
+
+
+def normalize_profile(profile):
+    kernel_offsets = np.arange(-3 * FINGERPRINT_BLUR, 3 * FINGERPRINT_BLUR + 1)
+    kernel = np.exp(-0.5 * (kernel_offsets / FINGERPRINT_BLUR) ** 2)
+    profile = np.convolve(profile, kernel / kernel.sum(), mode='same')
+    profile = profile - profile.mean()
+    return profile / (np.linalg.norm(profile) or 1.0)
+
+
+class KeyValueTemplate:
+    def __init__(self, template_id, model_name, fingerprint, payload, samples=1, hits=0, updated_at=None):
+        self.template_id = template_id
+        self.model_name = model_name
+        self.fingerprint = fingerprint
+        self.payload = payload
+        self.samples = samples
+        self.hits = hits
+        self.updated_at = updated_at or time.time()
+
+    @classmethod
+    def from_row(cls, template_row):
+        template_id, model_name, fingerprint_bytes, aspect_ratio, payload_text, samples, hits, updated_at = template_row
+        fingerprint = TemplateFingerprint.from_bytes(fingerprint_bytes, aspect_ratio)
+        return cls(template_id, model_name, fingerprint, json.loads(payload_text), samples, hits, updated_at)
+
+    @property
+    def keys(self):
+        return self.payload.get('keys')
+
+
+class ModelTemplates:
+    # 양식이 수천 개여도 한 번의 행렬 곱으로 모두와 비교하도록 fingerprint를 행렬 하나로 쌓아 둔다.
+    def __init__(self, templates):
+        self.templates = templates
+        self.vectors = np.stack([template.fingerprint.vector for template in templates])
+        self.aspect_ratios = np.array([template.fingerprint.aspect_ratio for template in templates])
+
+    def __len__(self):
+        return len(self.templates)
+
+    def find_closest(self, fingerprint):
+        similarities = self.vectors @ fingerprint.vector
+        similarities[np.abs(self.aspect_ratios - fingerprint.aspect_ratio) > TEMPLATE_ASPECT_TOLERANCE * self.aspect_ratios] = -1.0
+        best_index = int(similarities.argmax())
+        return self.templates[best_index], float(similarities[best_index])
+
+
+class TemplateIndex:
+    """key-value 모델이 양식별로 돌려준 key 목록을 fingerprint와 함께 SQLite 파일에 모아 둔다.
+
+    같은 모델에서 비슷한 fingerprint가 min_samples번 같은 key 목록을 돌려준 양식만 믿고,
+    그 뒤로 들어오는 같은 양식은 모델을 부르지 않고 저장된 key 목록으로 응답한다.
+    verify_interval번째 hit마다 모델을 다시 불러 key 목록이 바뀌지 않았는지 확인한다.
+    """
+
+    def __init__(self, index_dir, similarity, min_samples, verify_interval, max_templates, enabled=True):
+        self.index_path = Path(index_dir) / TEMPLATE_INDEX_FILENAME
+        self.similarity = similarity
+        self.min_samples = max(1, min_samples)
+        self.verify_interval = verify_interval
+        self.max_templates = max_templates
+        self.enabled = enabled
+        self.templates = None
+        self.data_version = None
+        self.connection = None
+        self.connection_pid = None
+        self.lock = threading.Lock()
+        self.stats = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'learning': 0,
+            'verified': 0,
+            'mismatches': 0,
+            'learned': 0,
+            'evicted': 0,
+            'failures': 0,
+            'fingerprintSeconds': 0.0
+        }
+
+    def connect(self):
+        # gunicorn preload 뒤 fork된 worker는 부모의 connection을 쓰지 않고 새로 연다.
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.index_path, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA busy_timeout = 5000')
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.executescript(TEMPLATE_INDEX_SCHEMA)
+            self.connection = connection
+            self.connection_pid = os.getpid()
+            self.templates = None
+
+        return self.connection
+
+    def load_templates(self):
+        # 다른 worker가 양식을 추가하거나 고치면 data_version이 바뀌므로 그때만 다시 읽는다.
+        connection = self.connect()
+        data_version = connection.execute('PRAGMA data_version').fetchone()[0]
+        if self.templates is None or data_version != self.data_version:
+            template_rows = connection.execute(
+                'SELECT id, model, fingerprint, aspect_ratio, payload, samples, hits, updated_at FROM templates'
+            ).fetchall()
+            model_templates = {}
+            for template_row in template_rows:
+                template = KeyValueTemplate.from_row(template_row)
+                model_templates.setdefault(template.model_name, []).append(template)
+            self.templates = {
+                model_name: ModelTemplates(templates)
+                for model_name, templates in model_templates.items()
+            }
+            self.data_version = data_version
+
+        return self.templates
+
+    def find_template(self, model_name, fingerprint):
+        with self.lock:
+            model_templates = self.load_templates().get(model_name)
+
+        if model_templates is None:
+            return None, 0.0
+
+        best_template, best_similarity = model_templates.find_closest(fingerprint)
+        if best_similarity < self.similarity:
+            return None, best_similarity
+        return best_template, best_similarity
+
+    async def get_or_extract(self, model_name, image_bytes, extract_keys, bypass_template=False):
+        if not self.enabled:
+            return await extract_keys()
+
+        started_at = time.perf_counter()
+        try:
+            with measure_stage('template'):
+                fingerprint = await asyncio.to_thread(compute_template_fingerprint, image_bytes)
+                matched_template, similarity = await asyncio.to_thread(self.find_template, model_name, fingerprint)
+        except Exception:
+            # fingerprint를 만들 수 없는 이미지는 양식 확인 없이 모델로 보낸다.
+            self.stats['failures'] += 1
+            return await extract_keys()
+        finally:
+            self.stats['fingerprintSeconds'] += time.perf_counter() - started_at
+
+        self.stats['lookups'] += 1
+        lookup_result = self.read_lookup_result(matched_template, bypass_template)
+        self.stats[lookup_result] += 1
+        record_template_lookup(model_name, lookup_result)
+
+        if lookup_result == 'hits':
+            matched_template.hits += 1
+            return {
+                **matched_template.payload,
+                'template': {
+                    'id': matched_template.template_id,
+                    'similarity': round(similarity, 4),
+                    'samples': matched_template.samples
+                }
+            }
+
+        keyvalue_response = await extract_keys()
+        await asyncio.to_thread(self.learn, model_name, fingerprint, matched_template, keyvalue_response)
+        return keyvalue_response
+
+    def read_lookup_result(self, matched_template, bypass_template):
+        if matched_template is None:
+            return 'misses'
+        if bypass_template or matched_template.samples < self.min_samples:
+            return 'learning'
+        if self.verify_interval > 0 and (matched_template.hits + 1) % self.verify_interval == 0:
+            matched_template.hits += 1
+            return 'verified'
+        return 'hits'
+
+    def learn(self, model_name, fingerprint, matched_template, keyvalue_response):
+        # raw 값처럼 문서마다 다른 내용은 양식에 남기지 않는다.
+        if not isinstance(keyvalue_response, dict) or not isinstance(keyvalue_response.get('keys'), list):
+            return
+        template_payload = {name: value for name, value in keyvalue_response.items() if name not in ('raw', 'template')}
+
+        if matched_template is None:
+            # 같은 양식이 동시에 여러 장 들어왔으면 먼저 저장된 양식에 합친다.
+            matched_template, _ = self.find_template(model_name, fingerprint)
+
+        with self.lock:
+            connection = self.connect()
+            if matched_template is None:
+                connection.execute(
+                    'INSERT INTO templates (model, fingerprint, aspect_ratio, payload, samples, updated_at) VALUES (?, ?, ?, ?, 1, ?)',
+                    (model_name, fingerprint.to_bytes(), fingerprint.aspect_ratio, dump_payload(template_payload), time.time())
+                )
+                self.stats['learned'] += 1
+                self.evict_templates(connection)
+            elif matched_template.keys == template_payload['keys']:
+                matched_template.samples += 1
+                connection.execute(
+                    'UPDATE templates SET samples = samples + 1, hits = ?, updated_at = ? WHERE id = ?',
+                    (matched_template.hits, time.time(), matched_template.template_id)
+                )
+            else:
+                # 같은 양식인데 key 목록이 달라졌으면 새 응답으로 바꾸고 처음부터 다시 확인한다.
+                self.stats['mismatches'] += 1
+                matched_template.payload = template_payload
+                matched_template.samples = 1
+                connection.execute(
+                    'UPDATE templates SET payload = ?, samples = 1, updated_at = ? WHERE id = ?',
+                    (dump_payload(template_payload), time.time(), matched_template.template_id)
+                )
+            self.templates = None
+
+    def evict_templates(self, connection):
+        if self.max_templates <= 0:
+            return
+
+        # 가장 적게 쓰였고 오래된 양식부터 지운다.
+        evicted_count = connection.execute(
+            'DELETE FROM templates WHERE id IN ('
+            'SELECT id FROM templates ORDER BY hits + samples ASC, updated_at ASC '
+            'LIMIT MAX(0, (SELECT COUNT(*) FROM templates) - ?))',
+            (self.max_templates,)
+        ).rowcount
+        self.stats['evicted'] += max(0, evicted_count)
+
+    def clear(self):
+        with self.lock:
+            self.connect().execute('DELETE FROM templates')
+            self.templates = None
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.connection_pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+            self.templates = None
+
+    def read_stats(self):
+        if self.enabled:
+            with self.lock:
+                templates = self.load_templates()
+        else:
+            templates = {}
+
+        return {
+            'enabled': self.enabled,
+            'similarity': self.similarity,
+            'minSamples': self.min_samples,
+            'verifyInterval': self.verify_interval,
+            **self.stats,
+            'hitRate': self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0,
+            'fingerprintSeconds': round(self.stats['fingerprintSeconds'], 3),
+            'templates': {
+                model_name: {
+                    'count': len(model_templates),
+                    'trusted': sum(1 for template in model_templates.templates if template.samples >= self.min_samples)
+                }
+                for model_name, model_templates in templates.items()
+            }
+        }
+
+
+def dump_payload(template_payload):
+    return json.dumps(template_payload, ensure_ascii=False, separators=(',', ':'))
+
+
+keyvalue_template_index = TemplateIndex(
+    KEYVALUE_TEMPLATE_DIR,
+    KEYVALUE_TEMPLATE_SIMILARITY,
+    KEYVALUE_TEMPLATE_MIN_SAMPLES,
+    KEYVALUE_TEMPLATE_VERIFY_INTERVAL,
+    KEYVALUE_TEMPLATE_MAX_TEMPLATES,
+    enabled=KEYVALUE_TEMPLATE_ENABLED
+)
@@ -0,0 +1,207 @@
+import hashlib
+from pathlib import Path
+
+from config import UPLOAD_MAX_BYTES, UPLOAD_MAX_FIELD_BYTES
+from utils.image_probe import check_image_pixels, probe_image, read_header_probe
+from utils.metrics import measure_stage
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart 0.0.12 이하는 multipart라는 이름으로 설치된다.
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# 이미지 part 말고 boundary, part header, 짧은 form field가 차지할 수 있는 body 크기
+UPLOAD_FORM_OVERHEAD_BYTES = 1024 * 1024
+# 이 정도 받으면 대부분 포맷의 header가 들어 있어 pixel 수를 먼저 확인할 수 있다.
+UPLOAD_PROBE_BYTES = 64 * 1024
+
+
+class UploadRejectedError(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadedImage:
+    def __init__(self, filename, image_bytes, image_hash, fields):
+        self.filename = filename
+        self.image_bytes = image_bytes
+        self.image_hash = image_hash
+        self.fields = fields
+        self.image_probe = None
+
+
+class MultipartUploadReader:
+    # request.form()은 파일 part를 임시 파일에 모았다가 read()로 다시 복사하므로,
+    # body를 받는 대로 parser에 넣어 크기 제한, hash, header 확인을 같이 한다.
+    def __init__(
+        self,
+        boundary,
+        image_field_name='image',
+        max_bytes=UPLOAD_MAX_BYTES,
+        max_field_bytes=UPLOAD_MAX_FIELD_BYTES
+    ):
+        self.image_field_name = image_field_name
+        self.max_bytes = max_bytes
+        self.max_field_bytes = max_field_bytes
+        self.max_body_bytes = max_bytes + UPLOAD_FORM_OVERHEAD_BYTES if max_bytes > 0 else 0
+        self.body_size = 0
+        self.fields = {}
+        self.image_filename = None
+        # client가 보낸 Content-Length만 믿고 미리 잡아 두지 않고, 실제로 받은 만큼만 늘린다.
+        self.image_buffer = bytearray()
+        self.image_size = 0
+        self.image_hasher = hashlib.sha256()
+        self.header_checked = False
+
+        self.part_headers = {}
+        self.part_name = None
+        self.part_filename = None
+        self.part_value = None
+        self.is_image_part = False
+        self.header_field = bytearray()
+        self.header_value = bytearray()
+        self.parser = MultipartParser(boundary, {
+            'on_part_begin': self.on_part_begin,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished
+        })
+
+    def write(self, body_chunk):
+        self.body_size += len(body_chunk)
+        if self.max_body_bytes and self.body_size > self.max_body_bytes:
+            raise build_upload_size_error(self.max_bytes)
+
+        try:
+            self.parser.write(body_chunk)
+        except MultipartParseError as error:
+            raise build_upload_format_error() from error
+
+    def finish(self):
+        try:
+            self.parser.finalize()
+        except MultipartParseError as error:
+            raise build_upload_format_error() from error
+
+        if self.image_filename is None:
+            raise UploadRejectedError('이미지가 필요합니다.')
+        if self.image_filename == '':
+            raise UploadRejectedError('이미지가 선택되지 않았습니다.')
+        if self.image_size == 0:
+            raise UploadRejectedError('빈 이미지 파일입니다.')
+
+        self.check_image_header()
+        # 이후 probe, cache, upstream 전송은 모두 이 buffer를 읽기 전용 memoryview로 함께 쓴다.
+        image_bytes = memoryview(self.image_buffer)[:self.image_size].toreadonly()
+        return UploadedImage(Path(self.image_filename).name, image_bytes, self.image_hasher.hexdigest(), self.fields)
+
+    def on_part_begin(self):
+        self.part_headers = {}
+        self.part_name = None
+        self.part_filename = None
+        self.part_value = None
+        self.is_image_part = False
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.part_headers[bytes(self.header_field).lower()] = bytes(self.header_value)
+        self.header_field.clear()
+        self.header_value.clear()
+
+    def on_headers_finished(self):
+        _, disposition_options = parse_options_header(self.part_headers.get(b'content-disposition', b''))
+        self.part_name = disposition_options.get(b'name', b'').decode('utf-8', errors='replace')
+        raw_filename = disposition_options.get(b'filename')
+        self.part_filename = None if raw_filename is None else raw_filename.decode('utf-8', errors='replace')
+
+        if self.part_filename is None:
+            self.part_value = bytearray()
+        elif self.part_name == self.image_field_name and self.image_filename is None:
+            self.image_filename = self.part_filename
+            self.is_image_part = True
+
+    def on_part_data(self, data, start, end):
+        if self.part_value is not None:
+            self.part_value += data[start:end]
+            if len(self.part_value) > self.max_field_bytes:
+                raise UploadRejectedError(f'form field가 너무 깁니다. ({self.part_name}, 최대 {self.max_field_bytes} bytes)', status_code=413)
+            return
+
+        # 이미지 part가 여러 개면 첫 번째만 쓰고 나머지 파일 part는 body 크기 제한 안에서 버린다.
+        if not self.is_image_part:
+            return
+
+        image_chunk = memoryview(data)[start:end]
+        next_size = self.image_size + len(image_chunk)
+        if self.max_bytes > 0 and next_size > self.max_bytes:
+            raise build_upload_size_error(self.max_bytes)
+
+        self.image_buffer += image_chunk
+        self.image_size = next_size
+        self.image_hasher.update(image_chunk)
+        if not self.header_checked and self.image_size >= UPLOAD_PROBE_BYTES:
+            self.check_image_header()
+
+    def on_part_end(self):
+        if self.part_value is not None:
+            self.fields.setdefault(self.part_name, bytes(self.part_value).decode('utf-8', errors='replace'))
+        elif self.is_image_part:
+            self.check_image_header()
+
+    def check_image_header(self):
+        # 전체를 다 받기 전에 header의 pixel 수로 decompression bomb를 거절한다.
+        if self.header_checked:
+            return
+
+        self.header_checked = True
+        header_probe = read_header_probe(bytes(self.image_buffer[:min(self.image_size, UPLOAD_PROBE_BYTES)]))
+        if header_probe is not None:
+            check_image_pixels(header_probe)
+
+
+def build_upload_size_error(max_bytes):
+    return UploadRejectedError(f'업로드 파일이 너무 큽니다. (최대 {max_bytes} bytes)', status_code=413)
+
+
+def build_upload_format_error():
+    return UploadRejectedError('multipart 본문 형식이 올바르지 않습니다.')
+
+
+async def read_labeling_upload(request, image_field_name='image', max_bytes=UPLOAD_MAX_BYTES, probe=True):
+    """multipart 업로드를 stream으로 읽어 이미지 bytes, sha256, header probe와 text field를 돌려준다.
+
+    여러 page 문서처럼 이미지 header로 읽을 수 없는 업로드는 probe=False로 받는다.
+    """
+    content_type, content_options = parse_options_header(request.headers.get('content-type', ''))
+    boundary = content_options.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise UploadRejectedError('이미지가 필요합니다.')
+
+    content_length = request.headers.get('content-length', '')
+    if max_bytes > 0 and content_length.isdigit() and int(content_length) > max_bytes + UPLOAD_FORM_OVERHEAD_BYTES:
+        # body를 받기 시작하기 전에 Content-Length만 보고 거절한다.
+        raise build_upload_size_error(max_bytes)
+
+    upload_reader = MultipartUploadReader(boundary, image_field_name, max_bytes=max_bytes)
+
+    with measure_stage('form'):
+        async for body_chunk in request.stream():
+            upload_reader.write(body_chunk)
+
+        uploaded_image = upload_reader.finish()
+
+    if probe:
+        uploaded_image.image_probe = probe_image(uploaded_image.image_bytes)
+    return uploaded_image